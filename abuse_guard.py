@@ -0,0 +1,144 @@
+"""
+Защита от злоупотреблений: ограничение частоты апдейтов
+
+/start, /restart и кнопки меню заново создают сессию и отправляют целые
+сообщения, поэтому скрипт, который шлет апдейты без остановки, быстро
+съедает процессор и лимиты Bot API. AbuseGuard проверяет каждый апдейт
+до обработчиков (см. PriorityUpdateProcessor в priority.py), и лишние
+отбрасываются молча: без трассы, без места в очереди и без вызовов Bot API.
+
+У каждого пользователя корзина токенов (ABUSE_USER_RATE в секунду, запас
+ABUSE_USER_BURST), у каждого группового чата - своя (ABUSE_CHAT_*).
+Корзина хранится одним числом - моментом, к которому она восполнится
+(GCRA): апдейт проходит, если этот момент не дальше запаса от текущего.
+Числа лежат в двух словарях-поколениях (у групповых чатов id
+отрицательные и с пользователями не пересекаются). Раз в поколение -
+время полного восполнения самой медленной корзины - старый словарь
+выбрасывается целиком, а текущий становится старым. Выброшенные корзины к
+этому моменту уже полные, поэтому устаревшие записи удаляются без обхода
+и без потери точности.
+
+Пользователь, у которого за поколение отброшено ABUSE_BAN_STRIKES
+апдейтов, банится на ABUSE_BAN_DURATION секунд: его апдейты отбрасываются
+сразу. Администраторы (ADMIN_USER_IDS) не ограничиваются.
+"""
+
+import logging
+import time
+from typing import Callable, Dict, Iterable, Optional
+
+from config import (
+    ABUSE_USER_RATE, ABUSE_USER_BURST, ABUSE_CHAT_RATE, ABUSE_CHAT_BURST, ABUSE_BAN_STRIKES, ABUSE_BAN_DURATION,
+    ADMIN_USER_IDS
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AbuseGuard:
+    """Корзины токенов пользователей и групповых чатов с временными банами"""
+
+    def __init__(self, user_rate: float = ABUSE_USER_RATE, user_burst: int = ABUSE_USER_BURST,
+                 chat_rate: float = ABUSE_CHAT_RATE, chat_burst: int = ABUSE_CHAT_BURST,
+                 ban_strikes: int = ABUSE_BAN_STRIKES, ban_duration: float = ABUSE_BAN_DURATION,
+                 exempt: Iterable[int] = ADMIN_USER_IDS, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            user_rate: Апдейтов в секунду от пользователя
+            user_burst: Сколько апдейтов пользователь может прислать разом
+            chat_rate: Апдейтов в секунду в групповом чате (0 - без ограничения)
+            chat_burst: Запас группового чата
+            ban_strikes: Отброшенных апдейтов за поколение до бана (0 - без банов)
+            ban_duration: Длительность бана, секунды
+            exempt: Пользователи без ограничений
+            clock: Монотонные часы, секунды
+        """
+        self.user_interval = 1 / user_rate
+        # На сколько момент восполнения может опережать текущий, чтобы апдейт прошел
+        self.user_tolerance = (user_burst - 1) * self.user_interval
+        self.chat_interval = 1 / chat_rate if chat_rate > 0 else 0.0
+        self.chat_tolerance = (chat_burst - 1) * self.chat_interval
+        self.ban_strikes = ban_strikes
+        self.ban_duration = ban_duration
+        self.exempt = frozenset(exempt)
+        self.clock = clock
+        # За поколение полностью восполняется любая корзина
+        self.generation = max(self.user_tolerance + self.user_interval, self.chat_tolerance + self.chat_interval)
+        self._current: Dict[int, float] = {}
+        self._previous: Dict[int, float] = {}
+        self._strikes: Dict[int, int] = {}
+        self._banned: Dict[int, float] = {}
+        self._rotate_at = clock() + self.generation
+        self.dropped = 0
+        self.bans = 0
+
+    def allow(self, user_id: int, chat_id: Optional[int] = None) -> bool:
+        """
+        Пропустить ли апдейт (пропущенный списывает токены)
+
+        Args:
+            user_id: Отправитель апдейта
+            chat_id: Чат апдейта (None или личный чат - только корзина пользователя)
+        """
+        now = self.clock()
+        if now >= self._rotate_at:
+            self._rotate(now)
+        if self._banned and user_id in self._banned:
+            if now < self._banned[user_id]:
+                self.dropped += 1
+                return False
+            del self._banned[user_id]
+        if user_id in self.exempt:
+            return True
+
+        current = self._current
+        tat = current.get(user_id)
+        if tat is None:
+            tat = self._previous.get(user_id, now)
+        if tat < now:
+            tat = now
+        if tat - now > self.user_tolerance:
+            self._strike(user_id, now)
+            return False
+        if chat_id is not None and chat_id != user_id and self.chat_interval:
+            chat_tat = current.get(chat_id)
+            if chat_tat is None:
+                chat_tat = self._previous.get(chat_id, now)
+            if chat_tat < now:
+                chat_tat = now
+            if chat_tat - now > self.chat_tolerance:
+                # Занятой чат - не вина пользователя: без штрафа
+                self.dropped += 1
+                return False
+            current[chat_id] = chat_tat + self.chat_interval
+        current[user_id] = tat + self.user_interval
+        return True
+
+    def _strike(self, user_id: int, now: float):
+        self.dropped += 1
+        strikes = self._strikes.get(user_id, 0) + 1
+        if not self.ban_strikes or strikes < self.ban_strikes:
+            self._strikes[user_id] = strikes
+            return
+        self._strikes.pop(user_id, None)
+        self._banned[user_id] = now + self.ban_duration
+        self.bans += 1
+        logger.warning(f"User {user_id} banned for {self.ban_duration:g}s after {strikes} throttled updates")
+
+    def _rotate(self, now: float):
+        # Корзины, не тронутые целое поколение, уже полные - выбрасываются вместе со словарем
+        self._previous = self._current
+        self._current = {}
+        self._strikes.clear()
+        if self._banned:
+            self._banned = {user_id: until for user_id, until in self._banned.items() if until > now}
+        self._rotate_at = now + self.generation
+
+    def stats(self) -> Dict[str, int]:
+        """Число корзин и банов, отброшенные апдейты с запуска"""
+        return {
+            'buckets': len(self._current.keys() | self._previous.keys()),
+            'banned': len(self._banned),
+            'bans': self.bans,
+            'dropped': self.dropped,
+        }
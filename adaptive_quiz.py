@@ -0,0 +1,103 @@
+"""
+Адаптивный режим викторины: досрочное завершение
+
+Часто после нескольких ответов отрыв лидера уже больше, чем любое другое
+животное может набрать на оставшихся вопросах. В таком случае результат
+математически определен, и оставшиеся вопросы (а это запросы edit_text
+к Bot API) можно не показывать.
+
+Границы считаются один раз при запуске: для каждой пары животных (B, L)
+и каждого числа отвеченных вопросов k хранится максимум, на который B
+может сократить разрыв с L на вопросах k..N-1. Сумма по вопросам от
+max(w_B - w_L) точнее, чем отдельные максимумы, так как оба животных
+получают баллы из одного и того же варианта ответа.
+"""
+
+from typing import Dict, Any, List, Optional, Sequence
+
+from quiz_data import QUIZ_QUESTIONS, ANIMALS
+
+
+def remaining_gain_bounds(questions: Sequence[Dict[str, Any]],
+                          animal_keys: Sequence[str]) -> List[List[List[int]]]:
+    """
+    Границы сокращения разрыва на оставшихся вопросах
+
+    Args:
+        questions: Вопросы в формате QUIZ_QUESTIONS
+        animal_keys: Ключи животных в фиксированном порядке
+
+    Returns:
+        bounds[k][b][l] - на сколько животное b может максимально
+        сократить разрыв с животным l на вопросах k..N-1
+    """
+    num_animals = len(animal_keys)
+    animal_index = {key: i for i, key in enumerate(animal_keys)}
+
+    bounds = [[[0] * num_animals for _ in range(num_animals)]]
+    for question in reversed(questions):
+        option_weights = []
+        for option in question['options']:
+            row = [0] * num_animals
+            for animal, weight in option['weight'].items():
+                row[animal_index[animal]] = weight
+            option_weights.append(row)
+
+        following = bounds[0]
+        current = [[following[b][l] + max(row[b] - row[l] for row in option_weights)
+                    for l in range(num_animals)]
+                   for b in range(num_animals)]
+        bounds.insert(0, current)
+    return bounds
+
+
+class EarlyTermination:
+    """Проверка того, что победитель уже не может измениться"""
+
+    def __init__(self, questions: Sequence[Dict[str, Any]] = QUIZ_QUESTIONS,
+                 animals: Dict[str, Dict[str, Any]] = ANIMALS):
+        self.questions = questions
+        self.animal_keys = list(animals)
+        self.animal_index = {key: i for i, key in enumerate(self.animal_keys)}
+        self.bounds = remaining_gain_bounds(questions, self.animal_keys)
+
+    def decided_winner(self, answers: Dict[int, int]) -> Optional[str]:
+        """
+        Победитель, если он уже определен независимо от оставшихся ответов
+
+        Учитывается и правило разрешения ничьих: при равенстве баллов бот
+        выбирает животное, которое встретилось в ответах раньше.
+
+        Args:
+            answers: Ответы пользователя {номер вопроса: номер варианта}
+
+        Returns:
+            Ключ животного или None, если результат еще может измениться
+        """
+        answered = len(answers)
+        if answered == 0 or any(question_id not in answers for question_id in range(answered)):
+            # Досрочное завершение рассчитано на ответы по порядку
+            return None
+
+        scores = {}
+        for question_id in range(answered):
+            option = self.questions[question_id]['options'][answers[question_id]]
+            for animal, weight in option['weight'].items():
+                scores[animal] = scores.get(animal, 0) + weight
+
+        leader = max(scores, key=scores.get)
+        seen_order = {animal: i for i, animal in enumerate(scores)}
+        bounds = self.bounds[answered]
+        leader_index = self.animal_index[leader]
+
+        for animal, index in self.animal_index.items():
+            if animal == leader:
+                continue
+            lead = scores[leader] - scores.get(animal, 0)
+            bound = bounds[index][leader_index]
+            if lead < bound:
+                return None
+            if lead == bound and seen_order.get(animal, len(seen_order)) < seen_order[leader]:
+                # При ничьей победит животное, встретившееся раньше лидера
+                return None
+        return leader
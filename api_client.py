@@ -0,0 +1,280 @@
+"""
+HTTP-клиент для Bot API
+
+Бот использует два пула соединений: один для getUpdates (один долгий
+запрос за раз), другой для остальных вызовов. Соединения переиспользуются
+(keep-alive), HTTP/2 включается через BOT_API_HTTP2, таймаут чтения можно
+задать отдельно для каждого метода (BOT_API_METHOD_TIMEOUTS).
+
+Временные ошибки (сетевые, таймауты, 5xx) повторяются с экспоненциальной
+задержкой и случайным разбросом. Запрос, который не ушел на сервер (ошибка
+соединения, пул занят), повторяется всегда, остальные - только для
+методов, повтор которых не создаст второе сообщение (get*, edit*, delete*,
+set*).
+
+Если заметная доля последних вызовов завершилась ошибкой, размыкается
+предохранитель: на BOT_API_BREAKER_COOLDOWN секунд необязательные отправки
+(напоминания, рассылки, загрузка карточек - код внутри non_essential())
+отклоняются сразу исключением CircuitOpen, и ответы пользователям не
+конкурируют с ними за деградировавший API. После паузы первый вызов
+проверяет API: успех замыкает предохранитель, ошибка размыкает снова.
+Обязательные вызовы идут и при разомкнутом предохранителе; если среди них
+ошибок снова мало, он замыкается, не дожидаясь конца паузы.
+
+Несколько ботов одного процесса (quiz_host.py) делят пул обычных вызовов
+(SharedRequest) и его предохранитель: API у них общий.
+"""
+
+import asyncio
+import contextvars
+import logging
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, Optional, Tuple
+
+import httpx
+from telegram.error import NetworkError
+from telegram.request import HTTPXRequest
+
+from tracing import current_trace_id, span
+from config import (
+    BOT_API_POOL_SIZE, BOT_API_POOL_TIMEOUT, BOT_API_CONNECT_TIMEOUT, BOT_API_READ_TIMEOUT,
+    BOT_API_WRITE_TIMEOUT, BOT_API_KEEPALIVE_EXPIRY, BOT_API_HTTP2, BOT_API_METHOD_TIMEOUTS,
+    BOT_API_RETRIES, BOT_API_BREAKER_THRESHOLD, BOT_API_BREAKER_COOLDOWN
+)
+
+logger = logging.getLogger(__name__)
+
+# Методы, повтор которых после таймаута не создаст второе сообщение
+IDEMPOTENT_PREFIXES = ('get', 'edit', 'delete', 'set')
+# Ошибки httpx, при которых запрос точно не дошел до сервера
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# Задержка перед повтором: случайная в [0, min(BACKOFF_MAX, BACKOFF_BASE * 2^попытка)]
+BACKOFF_BASE = 0.2
+BACKOFF_MAX = 2.0
+# Предохранитель оценивает долю ошибок по стольким последним вызовам (но не меньше чем по MIN_CALLS)
+BREAKER_WINDOW = 50
+BREAKER_MIN_CALLS = 10
+
+_essential: contextvars.ContextVar[bool] = contextvars.ContextVar('essential', default=True)
+
+
+@contextmanager
+def non_essential() -> Iterator[None]:
+    """Вызовы Bot API внутри блока отклоняются, пока предохранитель разомкнут"""
+    token = _essential.set(False)
+    try:
+        yield
+    finally:
+        _essential.reset(token)
+
+
+class CircuitOpen(NetworkError):
+    """Необязательный вызов отклонен: API деградировал"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Bot API is degraded, non-essential request shed (retry in {retry_after:.0f}s)")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Предохранитель по доле ошибок среди последних вызовов"""
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, threshold: float = BOT_API_BREAKER_THRESHOLD, cooldown: float = BOT_API_BREAKER_COOLDOWN,
+                 window: int = BREAKER_WINDOW, min_calls: int = BREAKER_MIN_CALLS):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.min_calls = min_calls
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._failures = 0
+
+    def retry_after(self) -> float:
+        """Сколько секунд осталось до проверки API"""
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def allow(self, essential: bool) -> bool:
+        """Можно ли выполнить вызов"""
+        if self.state == self.OPEN and not self.retry_after():
+            self.state = self.HALF_OPEN
+            logger.info("Bot API circuit half-open: probing")
+        return essential or self.state == self.CLOSED
+
+    def record(self, ok: bool):
+        """Учитывает результат вызова"""
+        if self.state == self.HALF_OPEN:
+            if ok:
+                self._close()
+            else:
+                self._open()
+            return
+        if len(self._outcomes) == self._outcomes.maxlen:
+            self._failures -= not self._outcomes[0]
+        self._outcomes.append(ok)
+        self._failures += not ok
+        if len(self._outcomes) < self.min_calls:
+            return
+        failing = self._failures >= self.threshold * len(self._outcomes)
+        if self.state == self.CLOSED and failing:
+            self._open()
+        elif self.state == self.OPEN and not failing:
+            # Обязательные вызовы идут и при разомкнутом предохранителе: API восстановился раньше паузы
+            self._close()
+
+    def _open(self):
+        if self.state == self.CLOSED:
+            logger.warning(f"Bot API circuit open: {self._failures}/{len(self._outcomes)} recent calls failed, "
+                           f"shedding non-essential sends for {self.cooldown:.0f}s")
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        # Решение о восстановлении принимается только по вызовам после размыкания
+        self._outcomes.clear()
+        self._failures = 0
+
+    def _close(self):
+        self.state = self.CLOSED
+        self._outcomes.clear()
+        self._failures = 0
+        logger.info("Bot API circuit closed")
+
+
+class ResilientRequest(HTTPXRequest):
+    """HTTPXRequest с таймаутами по методам, повторами и предохранителем"""
+
+    def __init__(self, connection_pool_size: int = BOT_API_POOL_SIZE, retries: int = BOT_API_RETRIES,
+                 method_timeouts: Optional[Dict[str, float]] = None, breaker: Optional[CircuitBreaker] = None,
+                 **kwargs):
+        """
+        Args:
+            connection_pool_size: Размер пула соединений
+            retries: Сколько раз повторять временную ошибку
+            method_timeouts: Таймаут чтения по методам Bot API
+            breaker: Предохранитель (по умолчанию свой)
+            kwargs: Параметры HTTPXRequest (по умолчанию из config.py)
+        """
+        super().__init__(**request_kwargs(connection_pool_size, **kwargs))
+        self.retries = retries
+        self.method_timeouts = BOT_API_METHOD_TIMEOUTS if method_timeouts is None else method_timeouts
+        self.breaker = breaker or CircuitBreaker()
+        self.retried = 0
+        self.shed = 0
+
+    async def do_request(self, url: str, method: str, request_data=None, read_timeout=HTTPXRequest.DEFAULT_NONE,
+                         write_timeout=HTTPXRequest.DEFAULT_NONE, connect_timeout=HTTPXRequest.DEFAULT_NONE,
+                         pool_timeout=HTTPXRequest.DEFAULT_NONE) -> Tuple[int, bytes]:
+        api_method = url.rsplit('/', 1)[-1]
+        if not self.breaker.allow(_essential.get()):
+            self.shed += 1
+            raise CircuitOpen(self.breaker.retry_after())
+        if read_timeout is HTTPXRequest.DEFAULT_NONE and api_method in self.method_timeouts:
+            read_timeout = self.method_timeouts[api_method]
+        with span('api', method=api_method) as attrs:
+            status, payload = await self._request_with_retries(
+                api_method, attrs, url, method, request_data, read_timeout, write_timeout, connect_timeout,
+                pool_timeout
+            )
+        return status, payload
+
+    async def _request_with_retries(self, api_method: str, attrs: Dict, url: str, method: str, request_data,
+                                    read_timeout, write_timeout, connect_timeout, pool_timeout) -> Tuple[int, bytes]:
+        idempotent = api_method.startswith(IDEMPOTENT_PREFIXES)
+        attempt = 0
+        while True:
+            attrs['attempts'] = attempt + 1
+            try:
+                status, payload = await super().do_request(
+                    url, method, request_data, read_timeout, write_timeout, connect_timeout, pool_timeout
+                )
+            except NetworkError as e:
+                # TimedOut - подкласс NetworkError
+                self.breaker.record(False)
+                attrs['error'] = str(e)
+                not_sent = isinstance(e.__cause__, NOT_SENT_ERRORS)
+                if attempt >= self.retries or not (not_sent or idempotent):
+                    raise
+                logger.debug(f"{api_method} failed ({e}), retry {attempt + 1}")
+            else:
+                attrs['status'] = status
+                ok = status < 500
+                self.breaker.record(ok and status != 429)
+                if attempt and status == 400 and b'message is not modified' in payload:
+                    # Предыдущая попытка правки дошла до сервера, хотя ответ потерялся
+                    return 200, b'{"ok":true,"result":true}'
+                if ok or attempt >= self.retries or not idempotent:
+                    return status, payload
+                logger.debug(f"{api_method} returned {status}, retry {attempt + 1}")
+            self.retried += 1
+            await asyncio.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+            attempt += 1
+
+
+class SharedRequest(ResilientRequest):
+    """ResilientRequest для нескольких ботов: пул закрывается, когда его отпустит последний бот"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.users = 0
+
+    async def initialize(self):
+        self.users += 1
+        await super().initialize()
+
+    async def shutdown(self):
+        self.users = max(0, self.users - 1)
+        if not self.users:
+            await super().shutdown()
+
+
+async def _add_trace_header(request: httpx.Request):
+    # Идентификатор трассы апдейта (см. tracing.py) в каждом вызове Bot API
+    trace_id = current_trace_id()
+    if trace_id:
+        request.headers['X-Trace-Id'] = trace_id
+
+
+def request_kwargs(connection_pool_size: int, **overrides) -> Dict:
+    """Параметры HTTPXRequest из config.py: пул с keep-alive, таймауты, версия HTTP"""
+    http_version = '1.1'
+    if BOT_API_HTTP2:
+        try:
+            import h2  # noqa: F401
+            http_version = '2'
+        except ImportError:
+            logger.warning("BOT_API_HTTP2 is set but h2 is not installed (pip install httpx[http2]), using HTTP/1.1")
+    kwargs = dict(
+        connection_pool_size=connection_pool_size,
+        read_timeout=BOT_API_READ_TIMEOUT,
+        write_timeout=BOT_API_WRITE_TIMEOUT,
+        connect_timeout=BOT_API_CONNECT_TIMEOUT,
+        pool_timeout=BOT_API_POOL_TIMEOUT,
+        http_version=http_version,
+        httpx_kwargs={
+            'limits': httpx.Limits(
+                max_connections=connection_pool_size,
+                max_keepalive_connections=connection_pool_size,
+                keepalive_expiry=BOT_API_KEEPALIVE_EXPIRY,
+            ),
+            'event_hooks': {'request': [_add_trace_header]},
+        },
+    )
+    kwargs.update(overrides)
+    return kwargs
+
+
+def build_requests(shared: Optional[ResilientRequest] = None) -> Tuple[ResilientRequest, HTTPXRequest]:
+    """
+    Клиенты для Application
+
+    Args:
+        shared: Общий клиент обычных вызовов нескольких ботов (SharedRequest)
+
+    Returns:
+        Клиент для обычных вызовов и отдельный клиент для getUpdates (Updater
+        сам повторяет getUpdates после ошибок, поэтому повторов там нет)
+    """
+    return shared or ResilientRequest(), HTTPXRequest(**request_kwargs(1))
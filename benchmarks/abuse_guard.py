@@ -0,0 +1,215 @@
+"""
+Бенчмарк защиты от злоупотреблений
+
+Сначала стоимость проверки AbuseGuard: пропущенный апдейт (пользователи
+по кругу из --buckets, как при обычной нагрузке), отброшенный по корзине и
+отброшенный у забаненного, а также проверка в PriorityUpdateProcessor
+целиком (effective_user и effective_chat апдейта PTB и allow).
+
+Затем бот на локальном фейковом Bot API: один скрипт присылает разом
+--flood апдейтов /start и «Начать викторину», и одновременно --users
+обычных пользователей проходят викторину. Печатается процессорное время
+процесса, вызовы Bot API на апдейты скрипта и время прохождения викторины
+обычными пользователями - с защитой и без нее.
+
+    python benchmarks/abuse_guard.py --flood 5000 --users 100
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Модули бота должны находиться раньше одноименных бенчмарков
+sys.path[0:0] = [ROOT, os.path.dirname(os.path.abspath(__file__))]
+
+from fake_bot_api import FakeBotAPI, callback_update, command_update  # noqa: E402
+
+FLOODER_ID = 999999
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float('nan')
+
+
+def per_call(function, calls: int) -> float:
+    """Лучшее из трех измерений, наносекунд на вызов"""
+    best = float('inf')
+    for _ in range(3):
+        started = time.perf_counter()
+        function(calls)
+        best = min(best, time.perf_counter() - started)
+    return best / calls * 1e9
+
+
+def check_overhead(buckets: int, calls: int):
+    from telegram import Update
+    from abuse_guard import AbuseGuard
+
+    guard = AbuseGuard(exempt=())
+    user_ids = list(range(1, buckets + 1))
+    cycles = max(1, calls // buckets)
+
+    def allowed(_):
+        allow = guard.allow
+        for _ in range(cycles):
+            for user_id in user_ids:
+                allow(user_id, user_id)
+
+    allowed_ns = per_call(allowed, cycles * buckets)
+
+    throttled_guard = AbuseGuard(exempt=(), ban_strikes=0)
+
+    def throttled(n):
+        allow = throttled_guard.allow
+        for _ in range(n):
+            allow(1, 1)
+
+    banned_guard = AbuseGuard(exempt=(), ban_strikes=1)
+
+    def banned(n):
+        allow = banned_guard.allow
+        for _ in range(n):
+            allow(1, 1)
+
+    # Проверка в PriorityUpdateProcessor: effective_user и effective_chat апдейта (PTB их кеширует) и allow
+    updates = [Update.de_json(callback_update(i, user_id, 'answer_0_0'), None) for i, user_id in
+               enumerate(user_ids[:min(buckets, 20000)], 1)]
+    for update in updates:
+        update.effective_user, update.effective_chat
+    processor_guard = AbuseGuard(exempt=())
+
+    def processor(_):
+        allow = processor_guard.allow
+        for _ in range(cycles):
+            for update in updates:
+                user = update.effective_user
+                chat = update.effective_chat
+                allow(user.id, chat and chat.id)
+
+    # effective_user процессор читал и без защиты
+    def baseline(_):
+        for _ in range(cycles):
+            for update in updates:
+                update.effective_user
+
+    cycles_total = cycles * len(updates)
+    check_ns = per_call(processor, cycles_total) - per_call(baseline, cycles_total)
+    print(f"AbuseGuard.allow, {buckets} users in turn: allowed {allowed_ns:.0f} ns, "
+          f"throttled {per_call(throttled, calls):.0f} ns, banned {per_call(banned, calls):.0f} ns per update")
+    print(f"added to the update processor (effective_chat and allow): {check_ns:.0f} ns per allowed update, "
+          f"{guard.stats()['buckets']} buckets tracked")
+
+
+async def run_flood(api: FakeBotAPI, guarded: bool, flood: int, users: int) -> Dict[str, object]:
+    from telegram import Update
+    import bot as bot_module
+
+    bot_module.user_data.clear()
+    quiz_bot = bot_module.QuizBot()
+    if not guarded:
+        quiz_bot.update_processor.guard = None
+    application = quiz_bot.application
+    questions = len(quiz_bot.content.current.questions)
+    await application.initialize()
+    await quiz_bot.post_init(application)
+    await application.start()
+    first_call = len(api.calls)
+
+    updates = []
+    for i in range(flood):
+        updates.append(command_update(0, FLOODER_ID, '/start') if i % 2 == 0 else
+                       callback_update(0, FLOODER_ID, 'menu_start_quiz'))
+    # Обычные пользователи идут вперемешку с потоком апдейтов скрипта
+    step = max(1, flood // max(1, users * (questions + 2)))
+    position = 0
+    for user_id in range(1, users + 1):
+        for data in [None, 'menu_start_quiz'] + [f"answer_{q}_{user_id % 4}" for q in range(questions)]:
+            update = command_update(0, user_id, '/start') if data is None else callback_update(0, user_id, data)
+            position += step
+            updates.insert(min(position, len(updates)), update)
+    for update_id, data in enumerate(updates, 1):
+        data['update_id'] = update_id
+    parsed = [Update.de_json(data, application.bot) for data in updates]
+
+    cpu_started, started = time.process_time(), time.perf_counter()
+    for update in parsed:
+        application.update_queue.put_nowait(update)
+
+    def finished():
+        return [call for call in api.calls[first_call:] if call['method'] == 'editMessageText'
+                and 'Викторина завершена' in call['params'].get('text', '')
+                and int(call['params']['chat_id']) != FLOODER_ID]
+
+    while len(finished()) < users:
+        await asyncio.sleep(0.01)
+    completed = [call['time'] - started for call in finished()]
+    while application.update_queue.qsize() or quiz_bot.update_processor._tails:
+        await asyncio.sleep(0.01)
+    elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+    guard = quiz_bot.guard.stats() if guarded else None
+
+    await application.stop()
+    await quiz_bot.post_shutdown(application)
+    await application.shutdown()
+
+    flood_calls = sum(1 for call in api.calls[first_call:] if str(call['params'].get('chat_id')) == str(FLOODER_ID))
+    return {'elapsed': elapsed, 'cpu': cpu, 'flood_calls': flood_calls, 'completed': completed, 'guard': guard}
+
+
+async def run(args, workdir: str):
+    api = FakeBotAPI(latency=args.latency).start()
+    os.environ.update(
+        BOT_TOKEN='123456:FAKE-TOKEN-FOR-BENCHMARKS',
+        BOT_API_BASE_URL=api.base_url,
+        CONTENT_SNAPSHOT_PATH=os.path.join(workdir, 'quiz_content.snapshot'),
+        SESSION_SNAPSHOT_PATH='',
+        EVENT_JOURNAL_DIR='',
+        REMINDER_DELAY='0',
+        INLINE_MEDIA_CACHE_PATH='',
+        TRACE_DUMP_DIR='',
+        FUNNEL_STATS_DIR='',
+        RESULT_CARD='false',
+        ADMIN_USER_IDS='',
+    )
+    os.chdir(workdir)
+    import logging
+    import bot  # noqa: F401 (настраивает логирование)
+    logging.getLogger().setLevel(logging.ERROR)
+
+    check_overhead(args.buckets, args.calls)
+    print(f"\n{args.flood} updates from one script, {args.users} users take the quiz, "
+          f"API latency {args.latency * 1000:.0f} ms")
+    try:
+        for guarded in (True, False):
+            result = await run_flood(api, guarded, args.flood, args.users)
+            print(f"{'with guard' if guarded else 'no guard  '}: all updates in {result['elapsed']:.1f}s, "
+                  f"CPU {result['cpu']:.1f}s, {result['flood_calls']} Bot API calls for the script, "
+                  f"quiz done p50 {percentile(result['completed'], 0.5):.1f}s, "
+                  f"p95 {percentile(result['completed'], 0.95):.1f}s")
+            if result['guard']:
+                print(f"  dropped {result['guard']['dropped']}, bans {result['guard']['bans']}")
+    finally:
+        api.stop()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Стоимость и действие защиты от злоупотреблений")
+    parser.add_argument('--buckets', type=int, default=100000, help="пользователей в проверке стоимости")
+    parser.add_argument('--calls', type=int, default=1000000)
+    parser.add_argument('--flood', type=int, default=5000, help="апдейтов от скрипта")
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.02, help="задержка фейкового API, секунды")
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as workdir:
+        asyncio.run(run(args, workdir))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
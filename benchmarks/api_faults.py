@@ -0,0 +1,134 @@
+"""
+Бенчмарк клиента Bot API под внедренными сбоями
+
+Фейковый Bot API проходит фазы: норма, нестабильность (часть ответов 502
+и обрывов соединения), сбой (почти все вызовы с ошибкой), восстановление.
+В каждой фазе одновременно идут обязательные вызовы (editMessageText -
+ответы пользователям) и необязательные (sendMessage внутри non_essential() -
+напоминания). Сравниваются HTTPXRequest с настройками по умолчанию и
+ResilientRequest (api_client.py): доля успешных вызовов, отклоненные
+предохранителем, средняя задержка.
+
+    python benchmarks/api_faults.py --calls 300
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from collections import Counter
+from typing import Dict, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Модули бота должны находиться раньше одноименных бенчмарков
+sys.path[0:0] = [ROOT, os.path.dirname(os.path.abspath(__file__))]
+
+from fake_bot_api import FakeBotAPI, DROP_CONNECTION  # noqa: E402
+
+# Фаза: (доля ответов 502, доля обрывов соединения)
+PHASES = [
+    ('healthy', 0.0, 0.0),
+    ('flaky', 0.15, 0.05),
+    ('outage', 0.8, 0.1),
+    ('recovered', 0.0, 0.0),
+]
+
+
+class FaultyAPI(FakeBotAPI):
+    """Фейковый Bot API, который отвечает ошибками с заданной вероятностью"""
+
+    def __init__(self):
+        super().__init__()
+        self.error_rate = 0.0
+        self.drop_rate = 0.0
+        self._rng = random.Random(1)
+
+    def handle(self, method, params):
+        if method != 'getMe':
+            roll = self._rng.random()
+            if roll < self.drop_rate:
+                return DROP_CONNECTION
+            if roll < self.drop_rate + self.error_rate:
+                return 502, {'ok': False, 'error_code': 502, 'description': 'Bad Gateway'}
+        return super().handle(method, params)
+
+
+async def worker(call, count: int, outcomes: Counter, latencies: list):
+    from api_client import CircuitOpen
+    for _ in range(count):
+        started = time.perf_counter()
+        try:
+            await call()
+            outcomes['ok'] += 1
+        except CircuitOpen:
+            outcomes['shed'] += 1
+            # Как напоминания и рассылки: отклоненная отправка откладывается
+            await asyncio.sleep(0.05)
+        except Exception:
+            outcomes['failed'] += 1
+        latencies.append(time.perf_counter() - started)
+
+
+async def run_phase(bot, calls: int, concurrency: int) -> Dict[str, Tuple[Counter, float]]:
+    from api_client import non_essential
+
+    async def essential():
+        await bot.edit_message_text(chat_id=1, message_id=1, text='question')
+
+    async def optional():
+        with non_essential():
+            await bot.send_message(chat_id=1, text='reminder')
+
+    report = {}
+    tasks = []
+    for name, call in (('essential', essential), ('optional', optional)):
+        outcomes, latencies = Counter(), []
+        report[name] = (outcomes, latencies)
+        tasks += [worker(call, calls // concurrency, outcomes, latencies) for _ in range(concurrency)]
+    await asyncio.gather(*tasks)
+    return {name: (outcomes, sum(latencies) / max(1, len(latencies))) for name, (outcomes, latencies) in report.items()}
+
+
+async def run(calls: int, concurrency: int):
+    os.environ.setdefault('BOT_TOKEN', '123456:FAKE-TOKEN-FOR-BENCHMARKS')
+    from telegram import Bot
+    from telegram.request import HTTPXRequest
+    from api_client import ResilientRequest
+
+    for client in ('default', 'resilient'):
+        api = FaultyAPI().start()
+        request = HTTPXRequest() if client == 'default' else ResilientRequest()
+        bot = Bot(os.environ['BOT_TOKEN'], base_url=api.base_url, request=request)
+        print(f"{client} client")
+        async with bot:
+            for phase, error_rate, drop_rate in PHASES:
+                api.error_rate, api.drop_rate = error_rate, drop_rate
+                started = time.perf_counter()
+                report = await run_phase(bot, calls, concurrency)
+                elapsed = time.perf_counter() - started
+                line = [f"  {phase:<10} {elapsed:5.1f}s"]
+                for name, (outcomes, latency) in report.items():
+                    total = sum(outcomes.values())
+                    line.append(f"{name}: {outcomes['ok'] / total:6.1%} ok, {outcomes['shed']:>4} shed, "
+                                f"{latency * 1000:6.1f} ms")
+                print(' | '.join(line))
+        if client == 'resilient':
+            print(f"  retries: {request.retried}, shed: {request.shed}, breaker: {request.breaker.state}")
+        api.stop()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Клиент Bot API под внедренными сбоями")
+    parser.add_argument('--calls', type=int, default=300, help="вызовов каждого вида на фазу")
+    parser.add_argument('--concurrency', type=int, default=10)
+    args = parser.parse_args(argv)
+    import logging
+    logging.basicConfig(level=logging.WARNING, format='%(name)s - %(levelname)s - %(message)s')
+    asyncio.run(run(args.calls, args.concurrency))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
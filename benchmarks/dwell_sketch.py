@@ -0,0 +1,81 @@
+"""
+Бенчмарк скетча квантилей времени на вопрос
+
+Времена ответов (логнормальное распределение с длинным хвостом брошенных
+и возвращенных викторин) добавляются в QuantileSketch. Печатаются
+квантили скетча рядом с точными по отсортированному массиву, размер
+скетча против сырых значений, скорость добавления и слияние скетчей
+нескольких процессов (должно давать те же квантили, что один скетч).
+
+    python benchmarks/dwell_sketch.py --values 1000000 --workers 4
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Модули бота должны находиться раньше одноименных бенчмарков
+sys.path[0:0] = [ROOT, os.path.dirname(os.path.abspath(__file__))]
+
+from funnel import QuantileSketch  # noqa: E402
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+def dwell_times(count: int, seed: int):
+    rng = random.Random(seed)
+    for _ in range(count):
+        if rng.random() < 0.02:
+            # Ушел и вернулся по напоминанию
+            yield rng.uniform(600, 86400)
+        else:
+            yield rng.lognormvariate(1.5, 0.8)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Точность и стоимость скетча квантилей")
+    parser.add_argument('--values', type=int, default=1_000_000)
+    parser.add_argument('--workers', type=int, default=4, help="на сколько скетчей делятся значения при слиянии")
+    parser.add_argument('--accuracy', type=float, default=0.01)
+    args = parser.parse_args(argv)
+
+    values = list(dwell_times(args.values, seed=1))
+    sketch = QuantileSketch(args.accuracy)
+    started = time.perf_counter()
+    for value in values:
+        sketch.add(value)
+    added = time.perf_counter() - started
+
+    parts = [QuantileSketch(args.accuracy) for _ in range(args.workers)]
+    for i, value in enumerate(values):
+        parts[i % args.workers].add(value)
+    started = time.perf_counter()
+    merged = QuantileSketch(args.accuracy)
+    for part in parts:
+        merged.merge(QuantileSketch.from_dict(json.loads(json.dumps(part.to_dict()))))
+    merge_time = time.perf_counter() - started
+
+    exact = sorted(values)
+    print(f"{args.values} dwell times, relative accuracy {args.accuracy:.1%}")
+    print(f"  add: {added / args.values * 1e6:.2f} us/value")
+    print(f"  sketch: {len(sketch.bins)} bins, {len(json.dumps(sketch.to_dict())) / 1024:.1f} KiB JSON; "
+          f"raw values: {len(values) * 8 / 1024 / 1024:.1f} MiB as float64")
+    print(f"  merge of {args.workers} serialized sketches: {merge_time * 1000:.1f} ms")
+    worst = 0.0
+    for q in QUANTILES:
+        true = exact[int(q * (len(exact) - 1))]
+        estimate = sketch.quantile(q)
+        error = abs(estimate - true) / true
+        worst = max(worst, error, abs(merged.quantile(q) - true) / true)
+        print(f"  p{q * 100:g}: exact {true:9.2f} s  sketch {estimate:9.2f} s  merged {merged.quantile(q):9.2f} s  "
+              f"error {error:.2%}")
+    print(f"  worst relative error {worst:.2%}")
+    return 0 if worst <= args.accuracy * 1.01 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
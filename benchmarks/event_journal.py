@@ -0,0 +1,77 @@
+"""
+Бенчмарк журнала событий: стоимость записи события в обработчике и
+скорость разбора журнала (journal_replay.py)
+
+    python benchmarks/event_journal.py --users 200000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_journal import EventJournal, iter_events, list_segments  # noqa: E402
+from journal_replay import journal_stats, rebuild_sessions  # noqa: E402
+from quiz_data import QUIZ_QUESTIONS, ANIMALS  # noqa: E402
+
+
+async def write_journal(journal: EventJournal, users: int) -> float:
+    """Пишет прохождения викторины; возвращает среднее время записи события в мкс"""
+    rng = random.Random(1)
+    animals = list(ANIMALS)
+    journal.start()
+    spent = 0.0
+    events = 0
+    for user_id in range(1, users + 1):
+        answered = rng.randrange(1, len(QUIZ_QUESTIONS) + 1)
+        started = time.perf_counter()
+        journal.quiz_started(user_id, 'd73708f45ac6d6a9')
+        for question_id in range(answered):
+            journal.answer_given(user_id, question_id, rng.randrange(len(QUIZ_QUESTIONS[question_id]['options'])))
+        if answered == len(QUIZ_QUESTIONS):
+            journal.result_computed(user_id, rng.choice(animals))
+        spent += time.perf_counter() - started
+        events += answered + 1 + (answered == len(QUIZ_QUESTIONS))
+        if user_id % 1000 == 0:
+            # Обработчики отдают управление циклу событий
+            await asyncio.sleep(0)
+    await journal.stop()
+    return spent / events * 1e6
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк журнала событий")
+    parser.add_argument('--users', type=int, default=200_000)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        journal = EventJournal(workdir, segment_bytes=16 << 20)
+        record_us = asyncio.run(write_journal(journal, args.users))
+        segments = list_segments(workdir)
+        size = sum(os.path.getsize(path) for path in segments)
+
+        started = time.perf_counter()
+        events = sum(1 for _ in iter_events(segments))
+        read = time.perf_counter() - started
+        started = time.perf_counter()
+        journal_stats(iter_events(segments))
+        stats = time.perf_counter() - started
+        started = time.perf_counter()
+        rebuild_sessions(iter_events(segments))
+        sessions = time.perf_counter() - started
+
+    print(f"{events} events in {len(segments)} segments, {size / 1e6:.1f} MB ({size / events:.1f} bytes/event)")
+    print(f"  record in handler  {record_us:>8.2f} us/event")
+    print(f"  read               {events / read * 60 / 1e6:>8.1f} M events/min")
+    print(f"  stats              {events / stats * 60 / 1e6:>8.1f} M events/min")
+    print(f"  rebuild sessions   {events / sessions * 60 / 1e6:>8.1f} M events/min")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""
+Бенчмарк выгрузки сессий
+
+Создается база сессий SQLite на --rows пользователей (часть завершила
+викторину, часть оставила отзывы), и выгрузка запускается так же, как ее
+запускает /export: отдельным процессом export.py. Печатается скорость
+и размер файла для CSV и JSON Lines с gzip, пиковая память процесса
+выгрузки на 1/10 строк и на всех строках (не должна расти) и задержка
+цикла событий «живого бота» во время выгрузки - отдельным процессом и,
+для сравнения, в потоке того же процесса.
+
+    python benchmarks/export.py --rows 1000000
+    python benchmarks/export.py --rows 10000000 --formats csv   # 10 млн строк, ~3 ГБ на диске
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Модули бота должны находиться раньше одноименных бенчмарков
+sys.path[0:0] = [ROOT, os.path.dirname(os.path.abspath(__file__))]
+
+from conversation import DONE, QUIZ  # noqa: E402
+from quiz_data import ANIMALS  # noqa: E402
+
+EXPORT = os.path.join(ROOT, 'export.py')
+
+
+def sessions(rows: int, seed: int):
+    rng = random.Random(seed)
+    animals = list(ANIMALS)
+    started = datetime(2026, 1, 1)
+    for user_id in range(1, rows + 1):
+        start = started + timedelta(seconds=user_id * 25)
+        session = {'current_question': 10, 'answers': {str(q): rng.randrange(4) for q in range(10)},
+                   'start_time': start.isoformat(), 'state': DONE, 'content_version': 'd73708f45ac6d6a9'}
+        if rng.random() < 0.2:
+            session['state'] = QUIZ
+            session['current_question'] = rng.randrange(10)
+        else:
+            session['result_animal'] = rng.choice(animals)
+            session['completion_time'] = (start + timedelta(seconds=90)).isoformat()
+        if rng.random() < 0.05:
+            session['feedback'] = [{'text': 'Спасибо, очень понравилось, а "жираф" - лучший!',
+                                    'timestamp': (start + timedelta(seconds=120)).isoformat()}]
+        yield user_id, json.dumps(session, ensure_ascii=False, separators=(',', ':'))
+
+
+def build_database(path: str, rows: int):
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("CREATE TABLE sessions (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+    with connection:
+        connection.executemany("INSERT INTO sessions (user_id, data) VALUES (?, ?)", sessions(rows, seed=1))
+    connection.execute("PRAGMA user_version = 1")
+    connection.close()
+
+
+def export_command(kind: str, fmt: str, output: str, *extra: str):
+    return [sys.executable, EXPORT, kind, '--format', fmt, '--gzip', '--output', output, *extra]
+
+
+def run_export(env, *command) -> float:
+    started = time.perf_counter()
+    subprocess.run(list(command), env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def peak_rss_mib() -> float:
+    # Максимум по всем завершившимся дочерним процессам (в КиБ на Linux)
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+
+async def loop_lag(work) -> float:
+    """Наибольшая задержка тика цикла событий (5 мс) за время работы work"""
+    lag = 0.0
+    task = asyncio.ensure_future(work())
+    while not task.done():
+        expected = time.perf_counter() + 0.005
+        await asyncio.sleep(0.005)
+        lag = max(lag, time.perf_counter() - expected)
+    await task
+    return lag
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Выгрузка сессий отдельным процессом")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--formats', nargs='+', default=['csv', 'jsonl'])
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, 'sessions.db')
+        started = time.perf_counter()
+        build_database(db_path, args.rows)
+        print(f"{args.rows} sessions, {os.path.getsize(db_path) / 1024 / 1024:.0f} MiB database "
+              f"built in {time.perf_counter() - started:.1f}s")
+        env = dict(os.environ, SESSION_DB_PATH=db_path)
+
+        small = os.path.join(workdir, 'small.csv.gz')
+        run_export(env, *export_command('results', 'csv', small, '--until', '2026-01-03T21:26:40'))
+        print(f"peak memory of export: {peak_rss_mib():.0f} MiB for ~{min(args.rows, 7000)} rows")
+
+        for fmt in args.formats:
+            output = os.path.join(workdir, f"sessions.{fmt}.gz")
+            elapsed = run_export(env, *export_command('sessions', fmt, output))
+            print(f"sessions {fmt}+gzip: {args.rows / elapsed:,.0f} rows/s ({elapsed:.1f}s), "
+                  f"{os.path.getsize(output) / 1024 / 1024:.0f} MiB file, peak memory {peak_rss_mib():.0f} MiB")
+        output = os.path.join(workdir, 'tigers.csv.gz')
+        elapsed = run_export(env, *export_command('results', 'csv', output, '--animal', 'tiger',
+                                                  '--since', '2026-02-01'))
+        print(f"results --animal tiger --since 2026-02-01: {elapsed:.1f}s")
+
+        # Задержка цикла событий бота, пока идет выгрузка
+        async def in_process():
+            process = await asyncio.create_subprocess_exec(*export_command('sessions', 'csv', output), env=env,
+                                                           stdout=asyncio.subprocess.DEVNULL,
+                                                           stderr=asyncio.subprocess.DEVNULL)
+            await process.wait()
+
+        async def in_thread():
+            os.environ['SESSION_DB_PATH'] = db_path
+            import export
+            from session_store import SessionStore
+            store = SessionStore(db_path)
+
+            def work():
+                rows = export.store_rows(store, export.SESSIONS, export.Filters())
+                export.export(rows, export.SESSIONS, output, export.CSV, compress=True)
+
+            await asyncio.get_running_loop().run_in_executor(None, work)
+            store.close()
+
+        print(f"event loop lag while exporting: separate process {asyncio.run(loop_lag(in_process)) * 1000:.0f} ms, "
+              f"thread of the bot process {asyncio.run(loop_lag(in_thread)) * 1000:.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
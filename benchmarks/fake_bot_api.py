@@ -0,0 +1,305 @@
+"""
+Локальный фейковый Bot API для бенчмарков и нагрузочных тестов
+
+Отвечает на методы Bot API так, как это делает Telegram, но без сети:
+getUpdates отдает апдейты из очереди (с long polling), send*/edit*
+возвращают правдоподобные объекты Message, все вызовы записываются.
+Бот подключается к нему через BOT_API_BASE_URL:
+
+    api = FakeBotAPI().start()
+    env BOT_API_BASE_URL=api.base_url python bot.py
+
+У каждого токена может быть своя очередь апдейтов (push_update(..., token=...)),
+тогда несколько ботов работают с одним сервером. connections - сколько
+TCP-соединений открыли клиенты.
+
+Или отдельным процессом (счетчики вызовов: GET /_stats):
+
+    python benchmarks/fake_bot_api.py --port 8081 --latency 0.005
+"""
+
+import argparse
+import itertools
+import json
+import queue
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional
+from urllib.parse import parse_qsl
+
+BOT_USER = {
+    'id': 100000001,
+    'is_bot': True,
+    'first_name': 'Fake Zoo Bot',
+    'username': 'moszooprojectbot',
+    'can_join_groups': True,
+    'can_read_all_group_messages': False,
+    'supports_inline_queries': True,
+}
+
+
+# handle() возвращает это значение, чтобы сервер закрыл соединение без ответа (обрыв связи)
+DROP_CONNECTION = object()
+
+
+def user_object(user_id: int) -> Dict[str, Any]:
+    return {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}", 'username': f"user{user_id}"}
+
+
+def message_object(message_id: int, chat_id: int, text: str, user_id: Optional[int] = None) -> Dict[str, Any]:
+    """Объект Message; без user_id сообщение считается отправленным ботом"""
+    message = {
+        'message_id': message_id,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group'},
+        'from': user_object(user_id) if user_id is not None else BOT_USER,
+        'text': text,
+    }
+    if user_id is not None and text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return message
+
+
+def command_update(update_id: int, user_id: int, text: str, chat_id: Optional[int] = None,
+                   message_id: int = 1) -> Dict[str, Any]:
+    """Апдейт с текстовым сообщением (например, '/start') от пользователя"""
+    return {'update_id': update_id, 'message': message_object(message_id, chat_id or user_id, text, user_id)}
+
+
+def callback_update(update_id: int, user_id: int, data: str, chat_id: Optional[int] = None,
+                    message_id: int = 1) -> Dict[str, Any]:
+    """Апдейт с нажатием inline-кнопки под сообщением бота"""
+    return {'update_id': update_id, 'callback_query': {
+        'id': str(update_id),
+        'from': user_object(user_id),
+        'chat_instance': str(chat_id or user_id),
+        'message': message_object(message_id, chat_id or user_id, 'question'),
+        'data': data,
+    }}
+
+
+def inline_query_update(update_id: int, user_id: int, query: str = '') -> Dict[str, Any]:
+    """Апдейт с inline-запросом (пользователь набрал @бота в чате)"""
+    return {'update_id': update_id, 'inline_query': {
+        'id': str(update_id),
+        'from': user_object(user_id),
+        'query': query,
+        'offset': '',
+    }}
+
+
+def parse_body(content_type: str, body: bytes) -> Dict[str, Any]:
+    """Параметры запроса: form-urlencoded, multipart или JSON"""
+    if not body:
+        return {}
+    if content_type.startswith('application/json'):
+        return json.loads(body)
+    if content_type.startswith('multipart/form-data'):
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + body
+        )
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            payload = part.get_payload(decode=True)
+            params[name] = payload if part.get_filename() else payload.decode('utf-8')
+        return params
+    return dict(parse_qsl(body.decode('utf-8')))
+
+
+class _Server(ThreadingHTTPServer):
+    # Очередь listen() по умолчанию (5) переполняется при пачке соединений из пула бота
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class FakeBotAPI:
+    """Фейковый сервер Bot API в фоновом потоке"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0):
+        self.latency = latency
+        self.calls: List[Dict[str, Any]] = []
+        self._updates: 'queue.Queue[Dict[str, Any]]' = queue.Queue()
+        self._token_updates: Dict[str, 'queue.Queue[Dict[str, Any]]'] = {}
+        # Токен запроса, который обрабатывает текущий поток сервера
+        self._request = threading.local()
+        self.connections = 0
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), self._make_handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def start(self) -> 'FakeBotAPI':
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    # Апдейты
+
+    def push_update(self, update: Dict[str, Any], token: Optional[str] = None) -> Dict[str, Any]:
+        """Ставит апдейт в очередь getUpdates (с token - в очередь только этого бота)"""
+        if token is None:
+            self._updates.put(update)
+        else:
+            with self._lock:
+                updates = self._token_updates.setdefault(token, queue.Queue())
+            updates.put(update)
+        return update
+
+    def push_command(self, user_id: int, text: str, chat_id: Optional[int] = None,
+                     token: Optional[str] = None) -> Dict[str, Any]:
+        """Апдейт с текстовым сообщением (например, '/start') от пользователя"""
+        return self.push_update(command_update(next(self._update_ids), user_id, text, chat_id,
+                                               message_id=next(self._message_ids)), token)
+
+    def push_callback(self, user_id: int, data: str, chat_id: Optional[int] = None,
+                      message_id: int = 1, token: Optional[str] = None) -> Dict[str, Any]:
+        """Апдейт с нажатием inline-кнопки"""
+        return self.push_update(callback_update(next(self._update_ids), user_id, data, chat_id, message_id), token)
+
+    def push_inline_query(self, user_id: int, query: str = '') -> Dict[str, Any]:
+        """Апдейт с inline-запросом"""
+        return self.push_update(inline_query_update(next(self._update_ids), user_id, query))
+
+    # Вызовы
+
+    def stats(self) -> Dict[str, int]:
+        """Число вызовов по методам"""
+        counts: Dict[str, int] = {}
+        with self._lock:
+            for call in self.calls:
+                counts[call['method']] = counts.get(call['method'], 0) + 1
+        return counts
+
+    def calls_of(self, method: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [call for call in self.calls if call['method'] == method]
+
+    def wait_for(self, method: str, count: int = 1, timeout: float = 10.0) -> List[Dict[str, Any]]:
+        """Ждет, пока бот вызовет метод нужное число раз"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            calls = self.calls_of(method)
+            if len(calls) >= count:
+                return calls
+            time.sleep(0.001)
+        raise TimeoutError(f"{method} was called {len(self.calls_of(method))} times, expected {count}")
+
+    def handle(self, method: str, params: Dict[str, Any]) -> Any:
+        """Результат метода Bot API (переопределяется в нагрузочных тестах)"""
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            return self._get_updates(params)
+        if method in ('sendMessage', 'editMessageText', 'sendPhoto', 'sendDocument', 'editMessageMedia',
+                      'editMessageCaption', 'editMessageReplyMarkup'):
+            chat_id = int(params.get('chat_id', 0) or 0)
+            message = message_object(next(self._message_ids), chat_id, params.get('text') or params.get('caption', ''))
+            if method == 'sendPhoto':
+                message['photo'] = [{'file_id': f"photo-{message['message_id']}",
+                                     'file_unique_id': f"u{message['message_id']}", 'width': 800, 'height': 1000}]
+            if method == 'sendDocument':
+                message['document'] = {'file_id': f"document-{message['message_id']}",
+                                       'file_unique_id': f"d{message['message_id']}"}
+            return message
+        return True
+
+    def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        timeout = float(params.get('timeout', 0) or 0)
+        limit = int(params.get('limit', 100) or 100)
+        token = getattr(self._request, 'token', None)
+        deadline = time.monotonic() + max(timeout, 0.001)
+        updates = []
+        while not updates:
+            # Очередь токена может появиться, пока идет long polling
+            with self._lock:
+                source = self._token_updates.get(token, self._updates)
+            try:
+                updates.append(source.get(timeout=max(0.001, min(0.05, deadline - time.monotonic()))))
+            except queue.Empty:
+                if time.monotonic() >= deadline:
+                    return updates
+        try:
+            while len(updates) < limit:
+                updates.append(source.get_nowait())
+        except queue.Empty:
+            pass
+        return updates
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with api._lock:
+                    api.connections += 1
+
+            def do_POST(self):
+                prefix, _, method = self.path.rpartition('/')
+                if method == '_stats':
+                    self._reply(200, api.stats())
+                    return
+                # /bot<токен>/<метод>
+                token = prefix.rsplit('/', 1)[-1][3:]
+                api._request.token = token
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+                params = parse_body(self.headers.get('Content-Type', ''), body)
+                with api._lock:
+                    api.calls.append({'method': method, 'params': params, 'time': time.perf_counter(), 'token': token})
+                if api.latency and method != 'getUpdates':
+                    time.sleep(api.latency)
+                result = api.handle(method, params)
+                if result is DROP_CONNECTION:
+                    self.close_connection = True
+                    return
+                if isinstance(result, tuple):
+                    # (HTTP-статус, тело ответа) для внедрения ошибок
+                    status, payload = result
+                else:
+                    status, payload = 200, {'ok': True, 'result': result}
+                self._reply(status, payload)
+
+            def _reply(self, status: int, payload: Any):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальный фейковый Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа, секунды")
+    args = parser.parse_args()
+
+    fake_api = FakeBotAPI(args.host, args.port, args.latency)
+    print(f"Fake Bot API on {fake_api.base_url}", flush=True)
+    try:
+        fake_api._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,179 @@
+"""
+Нагрузочный тест групповой викторины
+
+Бот работает на локальном фейковом Bot API. В групповом чате начинается
+викторина, и на каждый вопрос сотни участников отвечают почти разом
+(нажатия в пределах --burst секунд, часть участников меняет ответ).
+Печатается число нажатий и правок общего сообщения по вопросам,
+наименьший интервал между правками, задержка подтверждения нажатия
+(answerCallbackQuery) и итоговое сообщение. Для сравнения тот же тест
+идет без интервала между правками (--refresh 0): сообщение правится,
+как только предыдущая правка завершилась.
+
+    python benchmarks/group_quiz.py --members 300 --refresh 1 --question-time 3
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Модули бота должны находиться раньше одноименных бенчмарков
+sys.path[0:0] = [ROOT, os.path.dirname(os.path.abspath(__file__))]
+
+from fake_bot_api import FakeBotAPI, callback_update, command_update  # noqa: E402
+
+CHAT_ID = -1001234567
+HOST_ID = 1
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float('nan')
+
+
+async def run_quiz(api: FakeBotAPI, members: int, refresh: float, question_time: float, burst: float,
+                   change_share: float, questions_limit: int):
+    from telegram import Update
+    import bot as bot_module
+
+    quiz_bot = bot_module.QuizBot()
+    quiz_bot.group_quizzes.refresh_interval = refresh
+    quiz_bot.group_quizzes.question_time = question_time
+    application = quiz_bot.application
+    await application.initialize()
+    await quiz_bot.post_init(application)
+    await application.start()
+    first_call = len(api.calls)
+
+    update_ids = iter(range(1, 10 ** 9))
+
+    def push(data):
+        application.update_queue.put_nowait(Update.de_json(data, application.bot))
+
+    push(command_update(next(update_ids), HOST_ID, '/groupquiz', chat_id=CHAT_ID))
+    while CHAT_ID not in quiz_bot.group_quizzes.active or quiz_bot.group_quizzes.active[CHAT_ID].message_id is None:
+        await asyncio.sleep(0.01)
+    quiz = quiz_bot.group_quizzes.active[CHAT_ID]
+    questions = min(len(quiz.content.questions), questions_limit)
+
+    rng = random.Random(1)
+    pushed_at = {}
+    taps_per_question = []
+    started = time.perf_counter()
+    for q in range(questions):
+        options = len(quiz.content.questions[q]['options'])
+        taps = [(rng.uniform(0, burst), user_id, rng.randrange(options)) for user_id in range(2, members + 2)]
+        taps += [(rng.uniform(0, burst * 1.5), user_id, rng.randrange(options))
+                 for user_id in rng.sample(range(2, members + 2), int(members * change_share))]
+        taps.sort()
+        taps_per_question.append(len(taps))
+        question_started = time.perf_counter()
+        for offset, user_id, option in taps:
+            delay = question_started + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            update_id = next(update_ids)
+            pushed_at[str(update_id)] = time.perf_counter()
+            push(callback_update(update_id, user_id, f'group_{q}_{option}', chat_id=CHAT_ID,
+                                 message_id=quiz.message_id))
+        if q + 1 < questions:
+            # Вопрос закрывается по таймеру, ведущий ничего не нажимает
+            while quiz.question == q:
+                await asyncio.sleep(0.01)
+        else:
+            await asyncio.sleep(burst)
+            push(callback_update(next(update_ids), HOST_ID, 'groupnext', chat_id=CHAT_ID, message_id=quiz.message_id))
+            while len(quiz.content.questions) > questions and quiz.question < questions:
+                await asyncio.sleep(0.01)
+            # Оставшиеся вопросы закрываются сразу: в итог попадают ответы на первые questions
+            while not quiz.finished:
+                quiz.close_question()
+                await asyncio.sleep(0.01)
+    while CHAT_ID in quiz_bot.group_quizzes.active:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+
+    await application.stop()
+    await quiz_bot.post_shutdown(application)
+    await application.shutdown()
+
+    calls = api.calls[first_call:]
+    edits = [call for call in calls if call['method'] == 'editMessageText'
+             and str(call['params'].get('chat_id')) == str(CHAT_ID)]
+    answers = [call for call in calls if call['method'] == 'answerCallbackQuery'
+               and call['params'].get('callback_query_id') in pushed_at]
+    latencies = [call['time'] - pushed_at[call['params']['callback_query_id']] for call in answers]
+    gaps = [b['time'] - a['time'] for a, b in zip(edits, edits[1:])]
+    window = max((sum(1 for other in edits if 0 <= other['time'] - edit['time'] < 60) for edit in edits), default=0)
+    return {
+        'taps': sum(taps_per_question),
+        'questions': questions,
+        'edits': len(edits),
+        'answered': len(answers),
+        'min_gap': min(gaps) if gaps else float('nan'),
+        'per_minute': window,
+        'latency_p50': percentile(latencies, 0.5),
+        'latency_p99': percentile(latencies, 0.99),
+        'elapsed': elapsed,
+        'final': edits[-1]['params']['text'] if edits else '',
+    }
+
+
+async def run(args, workdir: str):
+    api = FakeBotAPI(latency=args.latency).start()
+    os.environ.update(
+        BOT_TOKEN='123456:FAKE-TOKEN-FOR-BENCHMARKS',
+        BOT_API_BASE_URL=api.base_url,
+        CONTENT_SNAPSHOT_PATH=os.path.join(workdir, 'quiz_content.snapshot'),
+        SESSION_SNAPSHOT_PATH='',
+        EVENT_JOURNAL_DIR='',
+        REMINDER_DELAY='0',
+        INLINE_MEDIA_CACHE_PATH='',
+        TRACE_DUMP_DIR='',
+        FUNNEL_STATS_DIR='',
+    )
+    os.chdir(workdir)
+    import logging
+    import bot  # noqa: F401 (настраивает логирование)
+    logging.getLogger().setLevel(logging.ERROR)
+
+    print(f"{args.members} members, {args.questions} questions open {args.question_time:g} s, taps within "
+          f"{args.burst:g} s, {args.change:.0%} change their answer, API latency {args.latency * 1000:.0f} ms")
+    try:
+        for refresh in (args.refresh, 0.0):
+            result = await run_quiz(api, args.members, refresh, args.question_time, args.burst, args.change,
+                                    args.questions)
+            print(f"refresh {refresh:g} s: {result['taps']} taps -> {result['edits']} edits "
+                  f"({result['edits'] / result['questions']:.1f} per question), min gap {result['min_gap']:.2f} s, "
+                  f"max {result['per_minute']} edits per 60 s")
+            print(f"  {result['answered']} taps acknowledged, p50 {result['latency_p50'] * 1000:.0f} ms, "
+                  f"p99 {result['latency_p99'] * 1000:.0f} ms")
+        print()
+        print('\n'.join(result['final'].splitlines()[:8]))
+    finally:
+        api.stop()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Групповая викторина под нагрузкой")
+    parser.add_argument('--members', type=int, default=300)
+    parser.add_argument('--questions', type=int, default=4, help="на сколько вопросов отвечают участники")
+    parser.add_argument('--refresh', type=float, default=1.0, help="интервал между правками сообщения, секунды")
+    parser.add_argument('--question-time', type=float, default=3.0)
+    parser.add_argument('--burst', type=float, default=1.0, help="за сколько секунд отвечают все участники")
+    parser.add_argument('--change', type=float, default=0.1, help="доля участников, меняющих ответ")
+    parser.add_argument('--latency', type=float, default=0.02, help="задержка фейкового API, секунды")
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as workdir:
+        asyncio.run(run(args, workdir))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
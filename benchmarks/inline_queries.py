@@ -0,0 +1,109 @@
+"""
+Бенчмарк inline-режима: пропускная способность ответов на inline-запросы
+
+1. Сборка ответа: готовый ответ из кеша InlineShare против сборки
+   ответа на каждый запрос.
+2. Всплеск inline-запросов через Application на локальном фейковом
+   Bot API: от разбора апдейта до вызова answerInlineQuery. Перед этим
+   карточки животных загружаются в служебный чат (рендеринг Pillow и
+   sendPhoto), чтобы ответы шли с file_id.
+
+    python benchmarks/inline_queries.py --queries 5000 --users 1000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Модули бота должны находиться раньше одноименных бенчмарков
+sys.path[0:0] = [ROOT, os.path.dirname(os.path.abspath(__file__))]
+
+from conversation import DONE  # noqa: E402
+from fake_bot_api import FakeBotAPI, inline_query_update  # noqa: E402
+
+
+async def run(queries: int, users: int, concurrency: int, workdir: str):
+    api = FakeBotAPI().start()
+    os.environ.update(
+        BOT_TOKEN='123456:FAKE-TOKEN-FOR-BENCHMARKS',
+        BOT_API_BASE_URL=api.base_url,
+        CONTENT_SNAPSHOT_PATH=os.path.join(workdir, 'quiz_content.snapshot'),
+        SESSION_SNAPSHOT_PATH='',
+        EVENT_JOURNAL_DIR='',
+        REMINDER_DELAY='0',
+        INLINE_MEDIA_CHAT_ID='-1001',
+        INLINE_MEDIA_CACHE_PATH=os.path.join(workdir, 'inline_media.json'),
+    )
+    os.chdir(workdir)
+    import logging
+    from telegram import Update
+    import bot as bot_module
+
+    logging.getLogger().setLevel(logging.WARNING)
+    quiz_bot = bot_module.QuizBot()
+    application = quiz_bot.application
+    content = quiz_bot.content.current
+    animal_keys = list(content.animals)
+    rng = random.Random(1)
+    for user_id in range(1, users + 1):
+        bot_module.user_data[user_id] = {
+            'current_question': len(content.questions), 'answers': {}, 'state': DONE,
+            'result_animal': rng.choice(animal_keys), 'content_version': content.version,
+        }
+
+    # 1. Сборка ответа
+    share = quiz_bot.inline_share
+    picks = [rng.choice(animal_keys) for _ in range(queries)]
+    started = time.perf_counter()
+    for animal_key in picks:
+        share.build_results(content.animals[animal_key], animal_key, 'moszooprojectbot')
+    built = time.perf_counter() - started
+    started = time.perf_counter()
+    for animal_key in picks:
+        share.results_for(content, animal_key, 'moszooprojectbot')
+    cached = time.perf_counter() - started
+    print(f"Results for {queries} queries ({len(animal_keys)} animals)")
+    print(f"  build per query  {built / queries * 1e6:>8.2f} us")
+    print(f"  cached           {cached / queries * 1e6:>8.2f} us")
+
+    # 2. Всплеск запросов через Application
+    await application.initialize()
+    try:
+        started = time.perf_counter()
+        await share.upload_cards(application.bot, content, quiz_bot.image_generator)
+        print(f"Cards uploaded: {len(share.file_ids)} in {time.perf_counter() - started:.2f}s")
+
+        updates = [Update.de_json(inline_query_update(i, rng.randint(1, users)), application.bot)
+                   for i in range(1, queries + 1)]
+        started = time.perf_counter()
+        for i in range(0, queries, concurrency):
+            await asyncio.gather(*(application.process_update(update) for update in updates[i:i + concurrency]))
+        elapsed = time.perf_counter() - started
+    finally:
+        await application.shutdown()
+        api.stop()
+
+    answers = api.calls_of('answerInlineQuery')
+    with_card = sum('photo_file_id' in str(call['params'].get('results')) for call in answers)
+    print(f"Inline queries: {len(answers)} answered ({with_card} with card) in {elapsed:.2f}s, "
+          f"{queries / elapsed:.0f} queries/s")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк inline-режима")
+    parser.add_argument('--queries', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=64, help="одновременных запросов")
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as workdir:
+        asyncio.run(run(args.queries, args.users, args.concurrency, workdir))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
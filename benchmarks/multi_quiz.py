@@ -0,0 +1,174 @@
+"""
+Бенчмарк нескольких викторин в одном процессе
+
+--quizzes викторин (у каждой свой бот и свой файл контента) запускаются на
+локальном фейковом Bot API двумя способами: процесс bot.py на каждую
+викторину и один процесс quiz_host.py. В каждую викторину приходит
+--users пользователей, которые проходят ее целиком. Печатается память
+процессов после старта и после нагрузки (RSS и PSS - общие страницы
+делятся между процессами), процессорное время на старт, на обработку
+апдейтов и в простое, и число TCP-соединений с Bot API.
+
+    python benchmarks/multi_quiz.py --quizzes 4 --users 300
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Модули бота должны находиться раньше одноименных бенчмарков
+sys.path[0:0] = [ROOT, os.path.dirname(os.path.abspath(__file__))]
+
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from quiz_content import builtin_content  # noqa: E402
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def token(quiz: int) -> str:
+    return f"{100000 + quiz}:FAKE-QUIZ-{quiz}"
+
+
+def write_contents(workdir: str, quizzes: int) -> List[str]:
+    """Файлы контента викторин: вопросы того же объема, но свои"""
+    data = builtin_content()
+    paths = []
+    for quiz in range(quizzes):
+        content = dict(data, questions=[dict(question, question=f"[{quiz}] {question['question']}")
+                                        for question in data['questions']])
+        path = os.path.join(workdir, f"quiz{quiz}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(content, f, ensure_ascii=False)
+        paths.append(path)
+    return paths
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    # utime и stime - 14 и 15 поля, после имени процесса - 12 и 13
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def memory_mib(pid: int) -> Dict[str, float]:
+    memory = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if name in ('Rss', 'Pss'):
+                memory[name] = int(value.split()[0]) / 1024
+    return memory
+
+
+def wait_until(condition, timeout: float, what: str):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError(what)
+        time.sleep(0.01)
+
+
+def run_mode(name: str, commands, quizzes: int, users: int, idle: float, timeout: float):
+    """
+    Запускает процессы commands [(argv, cwd, env)], проводит пользователей через викторины
+
+    Returns:
+        Строка отчета
+    """
+    api = FakeBotAPI().start()
+    started = time.perf_counter()
+    processes = []
+    for argv, cwd, env in commands:
+        env = dict(env, BOT_API_BASE_URL=api.base_url)
+        processes.append(subprocess.Popen(argv, cwd=cwd, env=env,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    try:
+        tokens = {token(quiz) for quiz in range(quizzes)}
+        wait_until(lambda: tokens <= {call['token'] for call in api.calls_of('getUpdates')}, timeout, "startup")
+        ready = time.perf_counter() - started
+        startup_cpu = sum(cpu_seconds(process.pid) for process in processes)
+        started_memory = [memory_mib(process.pid) for process in processes]
+
+        # Все апдейты сразу: апдейты одного пользователя бот обрабатывает по порядку
+        questions = len(builtin_content()['questions'])
+        load_started = time.perf_counter()
+        for quiz in range(quizzes):
+            for user_id in range(1, users + 1):
+                api.push_command(user_id, '/start', token=token(quiz))
+                api.push_callback(user_id, 'menu_start_quiz', token=token(quiz))
+                for question in range(questions):
+                    api.push_callback(user_id, f"answer_{question}_{user_id % 4}", token=token(quiz))
+        expected = quizzes * users * (questions + 1)
+        wait_until(lambda: len(api.calls_of('editMessageText')) >= expected, timeout, "load")
+        load_time = time.perf_counter() - load_started
+        load_cpu = sum(cpu_seconds(process.pid) for process in processes) - startup_cpu
+        loaded_memory = [memory_mib(process.pid) for process in processes]
+
+        time.sleep(idle)
+        idle_cpu = sum(cpu_seconds(process.pid) for process in processes) - startup_cpu - load_cpu
+        results = sum('Викторина завершена' in call['params'].get('text', '')
+                      for call in api.calls_of('editMessageText'))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=30)
+        api.stop()
+
+    def total(memory, kind):
+        return sum(item[kind] for item in memory)
+
+    return (f"{name}: {len(processes)} processes, ready in {ready:.1f}s, startup CPU {startup_cpu:.1f}s\n"
+            f"  memory after start: RSS {total(started_memory, 'Rss'):.0f} MiB, "
+            f"PSS {total(started_memory, 'Pss'):.0f} MiB\n"
+            f"  {quizzes * users} quizzes completed in {load_time:.1f}s ({results} results), "
+            f"CPU {load_cpu:.1f}s ({load_cpu / expected * 1e3:.2f} ms per update)\n"
+            f"  memory after load: RSS {total(loaded_memory, 'Rss'):.0f} MiB, "
+            f"PSS {total(loaded_memory, 'Pss'):.0f} MiB\n"
+            f"  idle CPU over {idle:g}s: {idle_cpu * 1000:.0f} ms, Bot API connections: {api.connections}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Викторины отдельными процессами и в одном процессе")
+    parser.add_argument('--quizzes', type=int, default=4)
+    parser.add_argument('--users', type=int, default=300, help="пользователей на викторину")
+    parser.add_argument('--idle', type=float, default=5.0, help="сколько секунд мерить простой")
+    parser.add_argument('--timeout', type=float, default=300.0)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        contents = write_contents(workdir, args.quizzes)
+        # Пути файлов бота - относительные, у каждого процесса свой рабочий каталог
+        env = dict(os.environ, REMINDER_DELAY='0', SESSION_SNAPSHOT_PATH='', INLINE_MEDIA_CACHE_PATH='',
+                   TRACE_DUMP_DIR='', SESSION_DB_PATH='', FUNNEL_STATS_DIR='stats', EVENT_JOURNAL_DIR='journal',
+                   REFERRAL_DB_PATH='referrals.db', WINNER_TABLE_PATH='winner_table.bin',
+                   CONTENT_SNAPSHOT_PATH='quiz_content.snapshot')
+
+        separate = []
+        for quiz, content in enumerate(contents):
+            cwd = os.path.join(workdir, f"process{quiz}")
+            os.makedirs(cwd)
+            separate.append(([sys.executable, os.path.join(ROOT, 'bot.py')], cwd,
+                             dict(env, BOT_TOKEN=token(quiz), QUIZ_CONTENT_PATH=content)))
+
+        cwd = os.path.join(workdir, 'host')
+        os.makedirs(cwd)
+        config = os.path.join(cwd, 'quizzes.json')
+        with open(config, 'w', encoding='utf-8') as f:
+            json.dump([{'name': f"quiz{quiz}", 'token': token(quiz), 'content': content}
+                       for quiz, content in enumerate(contents)], f)
+        hosted = [([sys.executable, os.path.join(ROOT, 'quiz_host.py'), '--config', config], cwd, env)]
+
+        for name, commands in (("separate processes", separate), ("quiz_host.py", hosted)):
+            print(run_mode(name, commands, args.quizzes, args.users, args.idle, args.timeout), flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
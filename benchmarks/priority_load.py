@@ -0,0 +1,139 @@
+"""
+Бенчмарк приоритетов обработки под всплеском апдейтов
+
+В очередь Application разом попадают ответы на вопросы викторины,
+команды /help и отзывы (текстовые сообщения) вперемешку; бот работает на
+локальном фейковом Bot API с задержкой ответа. Сравниваются обработка по
+порядку поступления (все апдейты в одном классе, без сброса нагрузки) и
+приоритеты priority.py при той же степени параллельности: задержка от
+поступления апдейта до конца обработки по классам и число отклоненных.
+
+    python benchmarks/priority_load.py --answers 300 --help-commands 1500 --feedback 1500
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Модули бота должны находиться раньше одноименных бенчмарков
+sys.path[0:0] = [ROOT, os.path.dirname(os.path.abspath(__file__))]
+
+from conversation import QUIZ  # noqa: E402
+from fake_bot_api import FakeBotAPI, callback_update, command_update  # noqa: E402
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float('nan')
+
+
+async def run_mode(mode: str, api: FakeBotAPI, answers: int, helps: int, feedback: int) -> Dict[str, object]:
+    from telegram import Update
+    from telegram.ext import TypeHandler
+    import bot as bot_module
+    from priority import INTERACTIVE, PRIORITY_NAMES
+
+    bot_module.user_data.clear()
+    quiz_bot = bot_module.QuizBot()
+    application = quiz_bot.application
+    if mode == 'fifo':
+        # Один класс и никакого сброса: обработка по порядку поступления
+        quiz_bot.update_processor.classify = lambda update: INTERACTIVE
+        quiz_bot.load.queue_sizes = (1 << 20,) * len(PRIORITY_NAMES)
+        quiz_bot.load.lag_threshold = float('inf')
+    content = quiz_bot.content.current
+
+    rng = random.Random(1)
+    raw = []
+    for user_id in range(1, answers + 1):
+        bot_module.user_data[user_id] = {
+            'current_question': 0, 'answers': {}, 'start_time': '2026-01-01T00:00:00',
+            'state': QUIZ, 'content_version': content.version,
+        }
+        raw.append(('answer', callback_update(0, user_id, 'answer_0_0')))
+    raw += [('help', command_update(0, 100000 + i, '/help')) for i in range(helps)]
+    raw += [('feedback', command_update(0, 200000 + i, 'Очень понравилось!')) for i in range(feedback)]
+    rng.shuffle(raw)
+
+    kinds, enqueued, finished = {}, {}, {}
+
+    async def record(update, context):
+        finished[update.update_id] = time.perf_counter()
+
+    application.add_handler(TypeHandler(Update, record), group=200)
+    await application.initialize()
+    await quiz_bot.post_init(application)
+    await application.start()
+
+    updates = []
+    for update_id, (kind, data) in enumerate(raw, 1):
+        data['update_id'] = update_id
+        kinds[update_id] = kind
+        updates.append(Update.de_json(data, application.bot))
+    started = time.perf_counter()
+    for update in updates:
+        enqueued[update.update_id] = time.perf_counter()
+        application.update_queue.put_nowait(update)
+    while len(finished) + sum(quiz_bot.load.shed) < len(updates):
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    stats = quiz_bot.load.stats()
+
+    await application.stop()
+    await quiz_bot.post_shutdown(application)
+    await application.shutdown()
+
+    latencies: Dict[str, List[float]] = {'answer': [], 'help': [], 'feedback': []}
+    for update_id, done in finished.items():
+        latencies[kinds[update_id]].append(done - enqueued[update_id])
+    return {'elapsed': elapsed, 'latencies': latencies, 'stats': stats}
+
+
+async def run(answers: int, helps: int, feedback: int, latency: float, workdir: str):
+    api = FakeBotAPI(latency=latency).start()
+    os.environ.update(
+        BOT_TOKEN='123456:FAKE-TOKEN-FOR-BENCHMARKS',
+        BOT_API_BASE_URL=api.base_url,
+        CONTENT_SNAPSHOT_PATH=os.path.join(workdir, 'quiz_content.snapshot'),
+        SESSION_SNAPSHOT_PATH='',
+        EVENT_JOURNAL_DIR='',
+        REMINDER_DELAY='0',
+        INLINE_MEDIA_CACHE_PATH='',
+    )
+    os.chdir(workdir)
+    import logging
+    import bot  # noqa: F401 (настраивает логирование)
+    logging.getLogger().setLevel(logging.ERROR)
+
+    print(f"{answers} answers, {helps} /help, {feedback} feedback messages at once, API latency {latency * 1000:.0f} ms")
+    try:
+        for mode in ('fifo', 'priority'):
+            result = await run_mode(mode, api, answers, helps, feedback)
+            print(f"{mode}: {result['elapsed']:.1f}s, shed {result['stats']['shed']}")
+            for kind, values in result['latencies'].items():
+                print(f"  {kind:<9} {len(values):>5} done  p50 {percentile(values, 0.5) * 1000:7.0f} ms  "
+                      f"p95 {percentile(values, 0.95) * 1000:7.0f} ms")
+    finally:
+        api.stop()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Приоритеты обработки под всплеском апдейтов")
+    parser.add_argument('--answers', type=int, default=300)
+    parser.add_argument('--help-commands', type=int, default=1500)
+    parser.add_argument('--feedback', type=int, default=1500)
+    parser.add_argument('--latency', type=float, default=0.02, help="задержка фейкового API, секунды")
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as workdir:
+        asyncio.run(run(args.answers, args.help_commands, args.feedback, args.latency, workdir))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+Бенчмарк профилирования работающего бота
+
+Бот на локальном фейковом Bot API проходит викторину за множество
+пользователей (ответы на вопросы через очередь Application): без
+профилирования, под сэмплирующим профайлером и с включенным tracemalloc.
+Печатается пропускная способность в каждом режиме, число сэмплов, самые
+медленные обработчики и время снимка памяти.
+
+    python benchmarks/profiling_overhead.py --users 200
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Модули бота должны находиться раньше одноименных бенчмарков
+sys.path[0:0] = [ROOT, os.path.dirname(os.path.abspath(__file__))]
+
+from conversation import QUIZ  # noqa: E402
+from fake_bot_api import FakeBotAPI, callback_update  # noqa: E402
+
+
+async def run_mode(mode: str, users: int, profile_dir: str):
+    from telegram import Update
+    from telegram.ext import TypeHandler
+    import bot as bot_module
+
+    bot_module.user_data.clear()
+    quiz_bot = bot_module.QuizBot()
+    quiz_bot.profiler.output_dir = profile_dir
+    application = quiz_bot.application
+    content = quiz_bot.content.current
+    questions = len(content.questions)
+
+    finished = []
+
+    async def record(update, context):
+        finished.append(update.update_id)
+
+    application.add_handler(TypeHandler(Update, record), group=200)
+    await application.initialize()
+    await quiz_bot.post_init(application)
+    await application.start()
+
+    updates = []
+    update_id = 0
+    for user_id in range(1, users + 1):
+        bot_module.user_data[user_id] = {
+            'current_question': 0, 'answers': {}, 'start_time': '2026-01-01T00:00:00',
+            'state': QUIZ, 'content_version': content.version,
+        }
+        for question in range(questions):
+            update_id += 1
+            updates.append(Update.de_json(callback_update(update_id, user_id, f'answer_{question}_0'), application.bot))
+
+    profile = None
+    if mode == 'sampling':
+        profile = asyncio.ensure_future(quiz_bot.profiler.profile(3600))
+        await asyncio.sleep(0)
+    elif mode == 'tracemalloc':
+        await quiz_bot.profiler.memory_snapshot()
+
+    started = time.perf_counter()
+    for update in updates:
+        application.update_queue.put_nowait(update)
+    while len(finished) < len(updates):
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    extra = ''
+    if profile is not None:
+        quiz_bot.profiler.stop_profile()
+        report = await profile
+        extra = f", {report.samples} samples"
+    if mode == 'tracemalloc':
+        snapshot_started = time.perf_counter()
+        report = await quiz_bot.profiler.memory_snapshot()
+        extra = (f", snapshot {time.perf_counter() - snapshot_started:.2f} s, "
+                 f"{report.traced / 1024 / 1024:.1f} MiB traced")
+        quiz_bot.profiler.stop_memory()
+
+    await application.stop()
+    await quiz_bot.post_shutdown(application)
+    await application.shutdown()
+    print(f"  {mode:<12} {len(updates) / elapsed:7.0f} updates/s{extra}")
+
+
+async def run(users: int, latency: float, workdir: str):
+    api = FakeBotAPI(latency=latency).start()
+    os.environ.update(
+        BOT_TOKEN='123456:FAKE-TOKEN-FOR-BENCHMARKS',
+        BOT_API_BASE_URL=api.base_url,
+        CONTENT_SNAPSHOT_PATH=os.path.join(workdir, 'quiz_content.snapshot'),
+        SESSION_SNAPSHOT_PATH='',
+        EVENT_JOURNAL_DIR='',
+        REMINDER_DELAY='0',
+        INLINE_MEDIA_CACHE_PATH='',
+        TRACE_DUMP_DIR='',
+    )
+    os.chdir(workdir)
+    import logging
+    import bot  # noqa: F401 (настраивает логирование)
+    logging.getLogger().setLevel(logging.ERROR)
+
+    profile_dir = os.path.join(workdir, 'profiles')
+    print(f"{users} users answering every question, API latency {latency * 1000:.0f} ms")
+    try:
+        for mode in ('plain', 'sampling', 'tracemalloc'):
+            await run_mode(mode, users, profile_dir)
+    finally:
+        api.stop()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    handlers = sorted(name for name in os.listdir(profile_dir) if name.endswith('-handlers.txt'))
+    if handlers:
+        print()
+        with open(os.path.join(profile_dir, handlers[0]), encoding='utf-8') as f:
+            print(''.join(f.readlines()[:6]), end='')
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Стоимость профилирования работающего бота")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.005, help="задержка фейкового API, секунды")
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as workdir:
+        asyncio.run(run(args.users, args.latency, workdir))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
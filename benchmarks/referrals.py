@@ -0,0 +1,139 @@
+"""
+Бенчмарк счетчиков реферальных переходов
+
+Переходы по ссылкам (/start r<автор>-<животное>) с распределением авторов
+по Ципфу (немногие публикации приводят большую часть трафика) считаются
+двумя способами: запись UPSERT в SQLite на каждый /start и счетчики
+процесса (ReferralCounters) с записью пачками. Печатается стоимость одного
+/start в цикле событий, число транзакций и отставание статистики: сколько
+проходит от перехода до его появления в базе, если несколько процессов
+(--shards) пишут в одну базу каждые --interval секунд.
+
+    python benchmarks/referrals.py --starts 50000 --shards 4 --interval 2
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import closing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Модули бота должны находиться раньше одноименных бенчмарков
+sys.path[0:0] = [ROOT, os.path.dirname(os.path.abspath(__file__))]
+
+from quiz_data import ANIMALS  # noqa: E402
+from referrals import UPSERT, ReferralCounters, decode_payload, encode_payload  # noqa: E402
+
+
+def payloads(count: int, referrers: int, seed: int):
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, referrers + 1)]
+    authors = rng.choices(range(10 ** 9, 10 ** 9 + referrers), weights, k=count)
+    animals = rng.choices(list(ANIMALS), k=count)
+    return [(encode_payload(author, animal), rng.random() < 0.7) for author, animal in zip(authors, animals)]
+
+
+def write_per_start(path: str, starts) -> float:
+    """Прямой способ: транзакция на каждый /start"""
+    ReferralCounters(path)
+    with closing(sqlite3.connect(path, timeout=30)) as connection:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        started = time.perf_counter()
+        for payload, joined in starts:
+            referral = decode_payload(payload)
+            with connection:
+                connection.execute(UPSERT, (*referral, 1, int(joined), 0))
+        return time.perf_counter() - started
+
+
+def visible_total(path: str) -> int:
+    with closing(sqlite3.connect(path, timeout=30)) as connection:
+        return connection.execute("SELECT COALESCE(SUM(visits), 0) FROM referrals").fetchone()[0]
+
+
+async def batched(path: str, starts, shards: int, interval: float, duration: float):
+    """Счетчики процессов: переходы идут равномерно duration секунд, база опрашивается"""
+    counters = [ReferralCounters(path, interval) for _ in range(shards)]
+    writes = 0
+    for shard in counters:
+        write = shard._write
+
+        def counted(batch, write=write):
+            nonlocal writes
+            writes += 1
+            write(batch)
+        shard._write = counted
+        shard.start()
+
+    made = []
+    lags = []
+
+    async def poll():
+        # Отставание: когда в базе появилось столько переходов, сколько было сделано к моменту t
+        loop = asyncio.get_running_loop()
+        position = 0
+        while position < len(made) or made[-1][1] < len(starts):
+            total = await loop.run_in_executor(None, visible_total, path)
+            now = time.perf_counter()
+            while position < len(made) and made[position][1] <= total:
+                lags.append(now - made[position][0])
+                position += 1
+            await asyncio.sleep(0.05)
+
+    in_loop = 0.0
+    started = time.perf_counter()
+    step = max(1, len(starts) // int(duration * 100))
+    poller = None
+    for i in range(0, len(starts), step):
+        chunk_started = time.perf_counter()
+        for j, (payload, joined) in enumerate(starts[i:i + step], i):
+            counters[j % shards].visited(decode_payload(payload), joined)
+        in_loop += time.perf_counter() - chunk_started
+        made.append((time.perf_counter(), min(i + step, len(starts))))
+        if poller is None:
+            poller = asyncio.get_running_loop().create_task(poll())
+        await asyncio.sleep(max(0.0, started + duration * (i + step) / len(starts) - time.perf_counter()))
+    await poller
+    for shard in counters:
+        await shard.stop()
+    return in_loop, writes, sorted(lags)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Счетчики реферальных переходов: запись на каждый /start и пачками")
+    parser.add_argument('--starts', type=int, default=50000)
+    parser.add_argument('--referrers', type=int, default=5000)
+    parser.add_argument('--shards', type=int, default=4, help="процессов, пишущих в одну базу")
+    parser.add_argument('--interval', type=float, default=2.0, help="интервал записи счетчиков, секунды")
+    parser.add_argument('--duration', type=float, default=5.0, help="за сколько секунд приходят переходы")
+    args = parser.parse_args(argv)
+
+    starts = payloads(args.starts, args.referrers, seed=1)
+    with tempfile.TemporaryDirectory() as workdir:
+        direct_path = os.path.join(workdir, 'direct.db')
+        direct = write_per_start(direct_path, starts)
+        print(f"write per /start: {args.starts} transactions, {direct / args.starts * 1e6:.1f} us per /start "
+              f"in the event loop ({args.starts / direct:,.0f} /start per second at most)")
+
+        batched_path = os.path.join(workdir, 'batched.db')
+        in_loop, writes, lags = asyncio.run(
+            batched(batched_path, starts, args.shards, args.interval, args.duration)
+        )
+        print(f"batched, {args.shards} shards every {args.interval:g} s: {writes} transactions, "
+              f"{in_loop / args.starts * 1e6:.2f} us per /start in the event loop")
+        print(f"  visible in the store after p50 {lags[len(lags) // 2]:.2f} s, max {lags[-1]:.2f} s")
+
+        stats = ReferralCounters(batched_path).stats(limit=3)
+        same = stats == ReferralCounters(direct_path).stats(limit=3)
+        print(f"  totals {stats.total}, top referrer {stats.referrers[0]}, same as per-start writes: {same}")
+    return 0 if same else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""
+Бенчмарк планировщика напоминаний: назначение и перенос напоминаний для
+множества пользователей и извлечение наступивших
+
+    python benchmarks/reminders.py --users 500000 --answers 5
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reminders import ReminderScheduler  # noqa: E402
+
+
+async def run(users: int, answers: int):
+    async def send(user_id: int):
+        pass
+
+    scheduler = ReminderScheduler(send, delay=3600, rate=users)
+    rng = random.Random(1)
+
+    started = time.perf_counter()
+    for user_id in range(users):
+        scheduler.schedule(user_id)
+    scheduled = time.perf_counter() - started
+
+    order = [rng.randrange(users) for _ in range(users * answers)]
+    started = time.perf_counter()
+    for user_id in order:
+        scheduler.schedule(user_id)
+    rescheduled = time.perf_counter() - started
+
+    started = time.perf_counter()
+    due = scheduler.pop_due(float('inf'), users)
+    popped = time.perf_counter() - started
+    assert len(due) == users and scheduler.pending == 0
+
+    print(f"{users} users, {len(order)} answers")
+    print(f"  schedule     {scheduled / users * 1e6:>6.2f} us/user")
+    print(f"  reschedule   {rescheduled / len(order) * 1e6:>6.2f} us/answer")
+    print(f"  pop due      {popped / users * 1e6:>6.2f} us/reminder")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк планировщика напоминаний")
+    parser.add_argument('--users', type=int, default=500_000)
+    parser.add_argument('--answers', type=int, default=5, help="ответов на пользователя")
+    args = parser.parse_args(argv)
+    asyncio.run(run(args.users, args.answers))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
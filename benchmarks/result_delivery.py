@@ -0,0 +1,165 @@
+"""
+Бенчмарк доставки результата: текст сразу, карточка следом
+
+--users пользователей стоят на последнем вопросе и отвечают на него
+разом; бот работает на локальном фейковом Bot API с задержкой ответа.
+Часть пользователей (--move-on) сразу нажимает следующую кнопку меню, не
+дожидаясь карточки. Печатается время от ответа до текста результата и до
+карточки (p50/p95/max) и сколько карточек отменено. Для сравнения тот же
+тест идет с карточкой, которая рисуется и отправляется до текста.
+
+    python benchmarks/result_delivery.py --users 200 --move-on 0.2
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Модули бота должны находиться раньше одноименных бенчмарков
+sys.path[0:0] = [ROOT, os.path.dirname(os.path.abspath(__file__))]
+
+from conversation import QUIZ  # noqa: E402
+from fake_bot_api import FakeBotAPI, callback_update  # noqa: E402
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float('nan')
+
+
+def blocking_bot_class():
+    import bot as bot_module
+    from config import RESULT_PROFILE_SIZE
+
+    class BlockingQuizBot(bot_module.QuizBot):
+        """Карточка рисуется и отправляется до текста результата"""
+
+        def start_result_card(self, *args):
+            pass
+
+        async def show_results(self, update, context):
+            query = update.callback_query
+            session = self.sessions[query.from_user.id]
+            content = self.content.get(session.get('content_version'))
+            winner = content.winner_table.lookup(session['answers'])
+            profile = content.ranking.top(session['answers'], RESULT_PROFILE_SIZE)
+            await self.send_result_card(context.bot, query.message.chat_id, query.message.message_id,
+                                        query.from_user, content, winner, profile)
+            await super().show_results(update, context)
+
+    return BlockingQuizBot
+
+
+async def run_mode(api: FakeBotAPI, mode: str, users: int, move_on: float) -> Dict[str, object]:
+    from telegram import Update
+    import bot as bot_module
+
+    bot_module.user_data.clear()
+    quiz_bot = blocking_bot_class()() if mode == 'blocking' else bot_module.QuizBot()
+    application = quiz_bot.application
+    content = quiz_bot.content.current
+    last = len(content.questions) - 1
+    await application.initialize()
+    await quiz_bot.post_init(application)
+    await application.start()
+    # Шрифты и неизменная часть карточек готовы заранее, как у работающего бота
+    for animal_key in content.animals:
+        quiz_bot.image_generator.render_result_image(animal_key, content=content)
+    first_call = len(api.calls)
+
+    rng = random.Random(1)
+    leaving = set(rng.sample(range(1, users + 1), int(users * move_on)))
+    updates = []
+    for user_id in range(1, users + 1):
+        bot_module.user_data[user_id] = {
+            'current_question': last, 'answers': {q: rng.randrange(4) for q in range(last)},
+            'start_time': '2026-01-01T00:00:00', 'state': QUIZ, 'content_version': content.version,
+        }
+        updates.append(callback_update(len(updates) + 1, user_id, f"answer_{last}_{rng.randrange(4)}"))
+        if user_id in leaving:
+            updates.append(callback_update(len(updates) + 1, user_id, 'menu_guardianship'))
+
+    started = time.perf_counter()
+    for data in updates:
+        application.update_queue.put_nowait(Update.de_json(data, application.bot))
+
+    def results():
+        return [call for call in api.calls[first_call:] if call['method'] == 'editMessageText'
+                and 'Викторина завершена' in call['params'].get('text', '')]
+
+    while len(results()) < users or quiz_bot.result_cards:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.1)
+
+    await application.stop()
+    await quiz_bot.post_shutdown(application)
+    await application.shutdown()
+
+    text_at = {int(call['params']['chat_id']): call['time'] - started for call in results()}
+    card_at = {int(call['params']['chat_id']): call['time'] - started
+               for call in api.calls[first_call:] if call['method'] == 'sendPhoto'}
+    return {
+        'text': list(text_at.values()),
+        'card': list(card_at.values()),
+        'cards_for_leaving': len(leaving & card_at.keys()),
+        'leaving': len(leaving),
+    }
+
+
+async def run(args, workdir: str):
+    api = FakeBotAPI(latency=args.latency).start()
+    os.environ.update(
+        BOT_TOKEN='123456:FAKE-TOKEN-FOR-BENCHMARKS',
+        BOT_API_BASE_URL=api.base_url,
+        CONTENT_SNAPSHOT_PATH=os.path.join(workdir, 'quiz_content.snapshot'),
+        SESSION_SNAPSHOT_PATH='',
+        EVENT_JOURNAL_DIR='',
+        REMINDER_DELAY='0',
+        INLINE_MEDIA_CACHE_PATH='',
+        TRACE_DUMP_DIR='',
+        FUNNEL_STATS_DIR='',
+        RESULT_CARD='true',
+    )
+    os.chdir(workdir)
+    import logging
+    import bot  # noqa: F401 (настраивает логирование)
+    logging.getLogger().setLevel(logging.ERROR)
+
+    print(f"{args.users} users finish at once, {args.move_on:.0%} move on right away, "
+          f"API latency {args.latency * 1000:.0f} ms")
+    try:
+        for mode in ('progressive', 'blocking'):
+            result = await run_mode(api, mode, args.users, args.move_on)
+
+            def line(values):
+                return (f"p50 {percentile(values, 0.5) * 1000:6.0f} ms, p95 {percentile(values, 0.95) * 1000:6.0f} ms, "
+                        f"max {max(values, default=float('nan')) * 1000:6.0f} ms")
+
+            print(f"{mode}:")
+            print(f"  result text  {line(result['text'])}")
+            print(f"  result card  {line(result['card'])} ({len(result['card'])} cards)")
+            print(f"  moved on before the card: {result['leaving']} users, "
+                  f"{result['leaving'] - result['cards_for_leaving']} cards cancelled")
+    finally:
+        api.stop()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Текст результата сразу, карточка следом")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--move-on', type=float, default=0.2, help="доля пользователей, уходящих с экрана результата")
+    parser.add_argument('--latency', type=float, default=0.02, help="задержка фейкового API, секунды")
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as workdir:
+        asyncio.run(run(args, workdir))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
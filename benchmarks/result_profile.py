@@ -0,0 +1,121 @@
+"""
+Бенчмарк профиля совместимости
+
+Для случайных полных наборов ответов AnimalRanking выдает k лучших
+животных; первое место сверяется с таблицей победителей, повторный вызов -
+с первым (профиль детерминирован). Печатается стоимость профиля на
+пользователя рядом с подсчетом по словарю контента и полной сортировкой
+(--animals - то же на синтетическом контенте с большим числом животных),
+а также время карточки результата: первая для животного (рисуется и кешируется
+неизменная часть) и следующие (только профиль и подпись поверх кеша).
+
+    python benchmarks/result_profile.py --users 20000 --top 3
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Модули бота должны находиться раньше одноименных бенчмарков
+sys.path[0:0] = [ROOT, os.path.dirname(os.path.abspath(__file__))]
+
+
+def synthetic_content(animals: int, questions: int = 10, options: int = 4, weights: int = 8):
+    """Контент со множеством животных: каждый вариант дает баллы нескольким случайным"""
+    from quiz_content import builtin_content
+    rng = random.Random(2)
+    data = builtin_content()
+    template = next(iter(data['animals'].values()))
+    keys = [f'animal{i}' for i in range(animals)]
+    data['animals'] = {key: dict(template, name=key) for key in keys}
+    data['questions'] = [{
+        'question': f'Вопрос {q + 1}',
+        'options': [{'text': f'Вариант {o + 1}',
+                     'weight': {key: rng.randint(1, 3) for key in rng.sample(keys, min(weights, animals))}}
+                    for o in range(options)],
+    } for q in range(questions)]
+    return data
+
+
+def sorted_profile(answers, questions, k):
+    """Подсчет по словарю и полная сортировка (для сравнения)"""
+    scores = {}
+    for question_id, answer_id in answers.items():
+        for animal, weight in questions[question_id]['options'][answer_id]['weight'].items():
+            scores[animal] = scores.get(animal, 0) + weight
+    total = sum(scores.values())
+    ranked = sorted(scores.items(), key=lambda item: -item[1])[:k]
+    return [(animal, score * 100 / total) for animal, score in ranked]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Профиль совместимости и карточка результата")
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--top', type=int, default=3)
+    parser.add_argument('--cards', type=int, default=50, help="сколько карточек нарисовать")
+    parser.add_argument('--animals', type=int, default=0,
+                        help="синтетический контент с этим числом животных (0 - контент бота)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.environ.update(WINNER_TABLE_PATH=os.path.join(workdir, 'winner_table.bin'))
+        os.chdir(workdir)
+        from quiz_content import CompiledContent, builtin_content
+        content = CompiledContent(synthetic_content(args.animals) if args.animals else builtin_content())
+        questions = content.questions
+        rng = random.Random(1)
+        users = [{q: rng.randrange(len(question['options'])) for q, question in enumerate(questions)}
+                 for _ in range(args.users)]
+
+        started = time.perf_counter()
+        content.ranking.top(users[0], args.top)
+        build = time.perf_counter() - started
+
+        started = time.perf_counter()
+        profiles = [content.ranking.top(answers, args.top) for answers in users]
+        ranked = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for answers in users:
+            sorted_profile(answers, questions, args.top)
+        baseline = time.perf_counter() - started
+
+        mismatches = sum(1 for answers, profile in zip(users, profiles)
+                         if profile[0].animal != content.winner_table.lookup(answers))
+        unstable = sum(1 for answers, profile in zip(users[:1000], profiles)
+                       if content.ranking.top(answers, args.top) != profile)
+        ties = sum(1 for profile in profiles if len(profile) > 1 and profile[0].score == profile[1].score)
+
+        print(f"{args.users} users, {len(questions)} questions, {len(content.animals)} animals, top {args.top}")
+        print(f"  first call                  {build * 1000:8.2f} ms")
+        print(f"  AnimalRanking.top           {ranked / args.users * 1e6:8.2f} us/user")
+        print(f"  dict scores + full sort     {baseline / args.users * 1e6:8.2f} us/user")
+        print(f"  winner mismatches {mismatches}, unstable profiles {unstable}, tied first places {ties}")
+        print(f"  e.g. {', '.join(f'{m.animal} {m.percent:.0f}%' for m in profiles[0])}")
+
+        if args.animals:
+            # Карточки рисуются только для животных бота
+            return 1 if mismatches or unstable else 0
+        from image_generator import ResultImageGenerator
+        generator = ResultImageGenerator()
+        timings = {'cold': [], 'warm': []}
+        seen = set()
+        for answers, profile in zip(users[:args.cards], profiles):
+            animal = profile[0].animal
+            started = time.perf_counter()
+            generator.generate_result_image(animal, 'bench', profile)
+            timings['warm' if animal in seen else 'cold'].append(time.perf_counter() - started)
+            seen.add(animal)
+        for kind, values in timings.items():
+            if values:
+                print(f"  result card {kind:4}            {sum(values) / len(values) * 1000:8.2f} ms "
+                      f"({len(values)} cards, PNG encoding included)")
+    return 1 if mismatches or unstable else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+Бенчмарк масштабирования: пропускная способность от числа рабочих процессов
+
+Запускает фейковый Bot API отдельным процессом, затем для каждого числа
+рабочих процессов - приемник вебхука scale_out.py, и отправляет в вебхук
+полные прохождения викторины (старт + ответы на все вопросы) от множества
+пользователей. Пропускная способность - апдейты в секунду до получения
+фейковым API последнего editMessageText.
+
+    python benchmarks/scale_out.py --users 500 --workers 1 2 4
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+from fake_bot_api import callback_update  # noqa: E402
+from quiz_data import QUIZ_QUESTIONS  # noqa: E402
+
+FAKE_TOKEN = '123456:FAKE-TOKEN-FOR-BENCHMARKS'
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_http(url: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise TimeoutError(url)
+
+
+def api_stats(api_url: str) -> dict:
+    with urllib.request.urlopen(f"{api_url}/_stats", timeout=5) as response:
+        return json.loads(response.read())
+
+
+def quiz_updates(users: int, first_update_id: int) -> List[List[bytes]]:
+    """Апдейты полного прохождения викторины для каждого пользователя"""
+    update_id = first_update_id
+    flows = []
+    for user_id in range(1, users + 1):
+        flow = []
+        for data in ['menu_start_quiz'] + [f"answer_{q}_{user_id % len(question['options'])}"
+                                           for q, question in enumerate(QUIZ_QUESTIONS)]:
+            flow.append(json.dumps(callback_update(update_id, user_id, data)).encode())
+            update_id += 1
+        flows.append(flow)
+    return flows
+
+
+async def post_lane(port: int, path: str, flows: List[List[bytes]]):
+    """Отправляет апдейты своей группы пользователей по одному keep-alive соединению"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    for step in range(len(flows[0])):
+        for flow in flows:
+            body = flow[step]
+            writer.write(f"POST {path} HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+            status = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b''):
+                pass
+            if b' 200 ' not in status:
+                raise RuntimeError(status)
+    writer.close()
+
+
+async def post_all(port: int, groups: List[List[List[bytes]]]):
+    await asyncio.gather(*(post_lane(port, '/telegram', group) for group in groups if group))
+
+
+def run(workers: int, users: int, lanes: int, api_base: str, api_url: str) -> float:
+    port = free_port()
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(
+            os.environ,
+            BOT_TOKEN=FAKE_TOKEN,
+            BOT_API_BASE_URL=api_base,
+            SESSION_DB_PATH=os.path.join(workdir, 'sessions.db'),
+            WORKER_SOCKET_DIR=os.path.join(workdir, 'sockets'),
+            WINNER_TABLE_PATH=os.path.join(workdir, 'winner_table.bin'),
+            CONTENT_SNAPSHOT_PATH=os.path.join(workdir, 'quiz_content.snapshot'),
+            EVENT_JOURNAL_DIR=os.path.join(workdir, 'journal'),
+            FUNNEL_STATS_DIR=os.path.join(workdir, 'stats'),
+            REFERRAL_DB_PATH=os.path.join(workdir, 'referrals.db'),
+        )
+        front = subprocess.Popen([sys.executable, 'scale_out.py', '--workers', str(workers), '--port', str(port)],
+                                 cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_http(f"http://127.0.0.1:{port}/healthz")
+            flows = quiz_updates(users, first_update_id=1)
+            expected = sum(len(flow) for flow in flows)
+            before = api_stats(api_url).get('editMessageText', 0)
+
+            started = time.perf_counter()
+            groups = [flows[i::lanes] for i in range(lanes)]
+            asyncio.run(post_all(port, groups))
+            while api_stats(api_url).get('editMessageText', 0) - before < expected:
+                time.sleep(0.01)
+            elapsed = time.perf_counter() - started
+        finally:
+            front.send_signal(signal.SIGTERM)
+            front.wait(timeout=60)
+    return expected / elapsed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Пропускная способность от числа рабочих процессов")
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--lanes', type=int, default=16, help="число параллельных соединений к вебхуку")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--latency', type=float, default=0.005, help="задержка фейкового API, секунды")
+    args = parser.parse_args(argv)
+
+    api_port = free_port()
+    api = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'fake_bot_api.py'),
+                            '--port', str(api_port), '--latency', str(args.latency)],
+                           stdout=subprocess.DEVNULL)
+    api_url = f"http://127.0.0.1:{api_port}/bot{FAKE_TOKEN}"
+    try:
+        wait_http(f"{api_url}/_stats")
+        print(f"{args.users} users x {len(QUIZ_QUESTIONS) + 1} updates, API latency {args.latency * 1000:.0f} ms")
+        baseline = None
+        for workers in args.workers:
+            throughput = run(workers, args.users, args.lanes, f"http://127.0.0.1:{api_port}/bot", api_url)
+            baseline = baseline or throughput
+            print(f"workers={workers:<3} {throughput:>8.0f} updates/s  x{throughput / baseline:.2f}")
+    finally:
+        api.terminate()
+        api.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Бенчмарк снимков сессий: полный снимок и восстановление N сессий,
+дельта после изменения части сессий
+
+    python benchmarks/session_snapshot.py --sessions 1000000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conversation import DONE, QUIZ  # noqa: E402
+from session_snapshot import SessionSnapshots  # noqa: E402
+from session_store import SessionStore  # noqa: E402
+
+
+def fake_sessions(count: int, questions: int = 10, options: int = 4):
+    """Сессии в разных точках викторины, как их создает бот"""
+    rng = random.Random(1)
+    started = datetime(2026, 1, 1)
+    sessions = {}
+    for user_id in range(100000, 100000 + count):
+        answered = rng.randrange(questions + 1)
+        session = {
+            'current_question': answered,
+            'answers': {question: rng.randrange(options) for question in range(answered)},
+            'start_time': (started + timedelta(seconds=rng.randrange(10 ** 7))).isoformat(),
+            'state': DONE if answered == questions else QUIZ,
+            'content_version': 'd73708f45ac6d6a9',
+        }
+        if answered == questions:
+            session['result_animal'] = 'Амурский тигр'
+            session['completion_time'] = session['start_time']
+        sessions[user_id] = session
+    return sessions
+
+
+async def run(count: int, changed: int):
+    sessions = fake_sessions(count)
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'sessions.snapshot')
+        store = SessionStore(track_changes=True)
+        store.restore(sessions)
+        snapshots = SessionSnapshots(store, path)
+
+        started = time.perf_counter()
+        snapshots.save()
+        saved = time.perf_counter() - started
+        size = os.path.getsize(path)
+
+        for user_id in random.Random(2).sample(list(sessions), changed):
+            store[user_id]['current_question'] += 1
+        started = time.perf_counter()
+        await snapshots.save_changes()
+        delta = time.perf_counter() - started
+        delta_size = os.path.getsize(path) - size
+
+        restored = SessionStore(track_changes=True)
+        started = time.perf_counter()
+        SessionSnapshots(restored, path).restore()
+        loaded = time.perf_counter() - started
+        assert restored.take_changes(full=True)[0] == sessions
+
+    print(f"{count} sessions")
+    print(f"  full snapshot  {saved * 1000:>8.0f} ms  {size / 1e6:.1f} MB ({size / count:.1f} bytes/session)")
+    print(f"  delta ({changed})  {delta * 1000:>8.0f} ms  {delta_size / 1e3:.1f} KB")
+    print(f"  restore        {loaded * 1000:>8.0f} ms")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк снимков сессий")
+    parser.add_argument('--sessions', type=int, default=1_000_000)
+    parser.add_argument('--changed', type=int, default=10_000, help="сколько сессий изменить перед дельтой")
+    args = parser.parse_args(argv)
+    asyncio.run(run(args.sessions, args.changed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
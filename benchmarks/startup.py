@@ -0,0 +1,106 @@
+"""
+Бенчмарк холодного старта бота
+
+1. `python -X importtime -c "import bot"`: суммарное время импорта и самые
+   дорогие модули (и проверка, что Pillow не загружается при старте).
+2. Время от запуска процесса `python bot.py` до готовности принимать
+   апдейты (первый getUpdates) и до ответа на первый апдейт (/start)
+   на локальном фейковом Bot API. Первый прогон холодный (без таблицы
+   победителей и снимка контента), следующие - теплые.
+
+    python benchmarks/startup.py --runs 5
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI  # noqa: E402
+
+FAKE_TOKEN = '123456:FAKE-TOKEN-FOR-BENCHMARKS'
+
+
+def import_times() -> Tuple[float, List[Tuple[str, int]], bool]:
+    """
+    Разбирает вывод -X importtime для `import bot`
+
+    Returns:
+        Суммарное время импорта в мс, топ модулей по собственному времени
+        и признак того, что Pillow был импортирован
+    """
+    env = dict(os.environ, BOT_TOKEN=FAKE_TOKEN)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import bot'],
+                            cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    modules = []
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = [part.strip() for part in line[len('import time:'):].split('|')]
+        modules.append((name, int(self_us)))
+        if name == 'bot':
+            total = int(cumulative_us)
+    pil_loaded = any(name.strip() == 'PIL' for name, _ in modules)
+    modules.sort(key=lambda item: item[1], reverse=True)
+    return total / 1000, modules[:10], pil_loaded
+
+
+def time_to_first_update(workdir: str, timeout: float = 30.0) -> Dict[str, float]:
+    """Запускает бота на фейковом API и измеряет время до готовности и первого ответа"""
+    api = FakeBotAPI().start()
+    api.push_command(1, '/start')
+    env = dict(
+        os.environ,
+        BOT_TOKEN=FAKE_TOKEN,
+        BOT_API_BASE_URL=api.base_url,
+        WINNER_TABLE_PATH=os.path.join(workdir, 'winner_table.bin'),
+        CONTENT_SNAPSHOT_PATH=os.path.join(workdir, 'quiz_content.snapshot'),
+        EVENT_JOURNAL_DIR=os.path.join(workdir, 'journal'),
+        SESSION_SNAPSHOT_PATH=os.path.join(workdir, 'sessions.snapshot'),
+        REFERRAL_DB_PATH=os.path.join(workdir, 'referrals.db'),
+    )
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, 'bot.py'], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        ready = api.wait_for('getUpdates', timeout=timeout)[0]['time']
+        answered = api.wait_for('sendMessage', timeout=timeout)[0]['time']
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        api.stop()
+    return {'ready': ready - started, 'first_update': answered - started}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк холодного старта бота")
+    parser.add_argument('--runs', type=int, default=5, help="число теплых прогонов")
+    args = parser.parse_args(argv)
+
+    total_ms, top_modules, pil_loaded = import_times()
+    print(f"import bot: {total_ms:.1f} ms (Pillow imported: {'yes' if pil_loaded else 'no'})")
+    for name, self_us in top_modules:
+        print(f"  {self_us / 1000:>7.1f} ms  {name.strip()}")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cold = time_to_first_update(workdir)
+        warm = [time_to_first_update(workdir) for _ in range(args.runs)]
+
+    print()
+    print(f"{'':<8} {'ready':>10} {'first update':>14}")
+    print(f"{'cold':<8} {cold['ready'] * 1000:>8.0f}ms {cold['first_update'] * 1000:>12.0f}ms")
+    print(f"{'warm':<8} {statistics.median(r['ready'] for r in warm) * 1000:>8.0f}ms "
+          f"{statistics.median(r['first_update'] for r in warm) * 1000:>12.0f}ms  (median of {args.runs})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+Бенчмарк трассировки: сколько стоит трасса апдейта
+
+Имитация обработки апдейта - несколько записей лога и отрезков - без
+трассировки и внутри трассы FlightRecorder (с сохранением записей лога в
+трассу), а также время выгрузки полного буфера.
+
+    python benchmarks/tracing.py --updates 100000
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Модули бота должны находиться раньше одноименных бенчмарков
+sys.path[0:0] = [ROOT, os.path.dirname(os.path.abspath(__file__))]
+
+from tracing import FlightRecorder, install_log_records, span  # noqa: E402
+
+SPANS = ('session_load', 'scoring', 'render', 'api', 'api')
+LOG_RECORDS = 5
+
+
+def handle(log: logging.Logger, user_id: int):
+    for name in SPANS:
+        with span(name, user_id=user_id):
+            pass
+    for i in range(LOG_RECORDS):
+        log.info(f"Step {i} for user {user_id}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Стоимость трассировки апдейта")
+    parser.add_argument('--updates', type=int, default=100_000)
+    parser.add_argument('--buffer', type=int, default=1000, help="емкость буфера трасс")
+    args = parser.parse_args(argv)
+
+    install_log_records()
+    log = logging.getLogger('bench')
+    log.setLevel(logging.INFO)
+    log.addHandler(logging.NullHandler())
+    log.propagate = False
+
+    started = time.perf_counter()
+    for user_id in range(args.updates):
+        handle(log, user_id)
+    plain = time.perf_counter() - started
+
+    with tempfile.TemporaryDirectory() as dump_dir:
+        recorder = FlightRecorder(capacity=args.buffer, slow_threshold=float('inf'), dump_dir=dump_dir, dump_interval=0)
+        started = time.perf_counter()
+        for user_id in range(args.updates):
+            with recorder.trace('callback answer_0_0', user_id):
+                handle(log, user_id)
+        traced = time.perf_counter() - started
+
+        started = time.perf_counter()
+        recorder._write(os.path.join(dump_dir, 'flight.jsonl'), list(recorder.traces))
+        dumped = time.perf_counter() - started
+        size = os.path.getsize(os.path.join(dump_dir, 'flight.jsonl'))
+
+    print(f"{args.updates} updates, {len(SPANS)} spans and {LOG_RECORDS} log records each")
+    print(f"  without trace  {plain / args.updates * 1e6:>7.2f} us/update")
+    print(f"  traced         {traced / args.updates * 1e6:>7.2f} us/update "
+          f"(+{(traced - plain) / args.updates * 1e6:.2f} us)")
+    print(f"  dump of {len(recorder.traces)} traces: {dumped * 1000:.0f} ms, {size / 1024:.0f} KiB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,84 +3,262 @@ Telegram-бот "Какое у вас тотемное животное?"
 Бот для популяризации программы опеки Московского зоопарка
 """
 
+import asyncio
 import logging
 import json
+import os
+import re
+import signal
+import sys
+import time
 from datetime import datetime
-from typing import Dict, Any, Optional
+from urllib.parse import urlencode
+from typing import Dict, Any, List, MutableMapping, Optional, Sequence
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultsButton
+from telegram.error import NetworkError
+from telegram.helpers import escape_markdown
 from telegram.ext import (
-    Application, CommandHandler, CallbackQueryHandler, 
-    ContextTypes, ConversationHandler, MessageHandler, filters
+    Application, CommandHandler, CallbackQueryHandler, InlineQueryHandler,
+    ContextTypes, MessageHandler, TypeHandler, filters
 )
 
-from config import BOT_TOKEN, ZOO_CONTACT_EMAIL, ZOO_CONTACT_PHONE
-from quiz_data import QUIZ_QUESTIONS, ANIMALS, GUARDIANSHIP_INFO
+from config import (
+    ZOO_CONTACT_EMAIL, ZOO_CONTACT_PHONE, ADAPTIVE_QUIZ, BOT_API_BASE_URL,
+    SESSION_DB_PATH, SESSION_SNAPSHOT_PATH, EVENT_JOURNAL_DIR, REMINDER_DELAY, INLINE_CACHE_TIME,
+    ADMIN_USER_IDS, PROFILE_DURATION, PROFILE_MAX_DURATION, RESULT_PROFILE_SIZE, RESULT_CARD, EXPORT_DIR,
+    CONTENT_SNAPSHOT_PATH, WINNER_TABLE_PATH, INLINE_MEDIA_CACHE_PATH, FUNNEL_STATS_DIR, REFERRAL_DB_PATH,
+    TRACE_DUMP_DIR, ABUSE_USER_RATE
+)
+from quiz_content import ContentStore
+from abuse_guard import AbuseGuard
+from session_store import SessionStore
+from session_snapshot import SessionSnapshots
+from event_journal import EventJournal
+from reminders import ReminderScheduler
+from inline_share import InlineShare, DEFAULT_BOT_USERNAME, share_text
+from api_client import CircuitOpen, ResilientRequest, build_requests, non_essential
+from priority import (
+    INTERACTIVE, NORMAL, BACKGROUND, Overloaded, PriorityScheduler, PriorityUpdateProcessor
+)
+from tracing import FlightRecorder, current_trace, detach, install_log_records, span
+from profiling import Profiler
+from funnel import QuestionFunnel, format_stats, load_funnels, merge_funnels
+from group_quiz import ACCEPTED, CHANGED, CLOSED, GroupQuizzes
+from ranking import Match, profile_lines
+from referrals import Referral, ReferralCounters, decode_payload, format_stats as format_referral_stats, referral_link
+from quiz_host import DEFAULT_QUIZ, QuizDefinition
+from export import JOURNAL, MAX_UPLOAD_BYTES, STORE, Filters as ExportFilters, build_parser as export_parser, journal_rows
+from conversation import (
+    IDLE, QUIZ, DONE, STATE_NAMES, EVENT_NAMES, START, CONTINUE, ANSWER, FINISH, FEEDBACK, MENU_EVENTS,
+    compile_transitions, new_session, session_state
+)
 
-# Настройка логирования
+# Настройка логирования (в каждой записи - идентификатор трассы апдейта, см. tracing.py)
+install_log_records()
 logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    format='%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s',
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
 
-# Состояния разговора
-START, QUIZ, FEEDBACK = range(3)
+# Хранилище данных пользователей (в памяти или в SQLite, если задан SESSION_DB_PATH)
+user_data = SessionStore(SESSION_DB_PATH, track_changes=bool(SESSION_SNAPSHOT_PATH))
 
-# Хранилище данных пользователей (в продакшене лучше использовать базу данных)
-user_data = {}
+# Группа обработчика, который сохраняет сессию после основных обработчиков
+PERSIST_GROUP = 100
+
+# Ответ на кнопку, недопустимую в состоянии разговора (старые кнопки вопросов)
+REJECTED = {
+    IDLE: "Викторина еще не начата - нажми «Начать викторину»",
+    DONE: "Викторина уже завершена - можно пройти ее еще раз",
+}
 
 class QuizBot:
-    def __init__(self):
-        logger.info("Creating bot application...")
-        logger.info(f"Bot token length: {len(BOT_TOKEN)}")
-        logger.info(f"Bot token starts with: {BOT_TOKEN[:20]}...")
-        self.application = Application.builder().token(BOT_TOKEN).build()
-        logger.info("Bot application created")
+    def __init__(self, quiz: QuizDefinition = DEFAULT_QUIZ, sessions: Optional[MutableMapping] = None,
+                 request: Optional[ResilientRequest] = None, primary: Optional['QuizBot'] = None,
+                 load: Optional[PriorityScheduler] = None, snapshots: Optional[SessionSnapshots] = None):
+        """
+        Args:
+            quiz: Викторина (по умолчанию - единственная викторина процесса из config.py)
+            sessions: Сессии этой викторины (по умолчанию user_data)
+            request: Клиент Bot API, общий для ботов процесса (см. quiz_host.py)
+            primary: Основная викторина бота, если эта делит с ней токен: Application, очереди
+                и команды у них общие, кнопки этой викторины различаются префиксом callback_data
+            load: Очереди апдейтов, общие для ботов процесса (запускает и останавливает владелец)
+            snapshots: Снимок общего хранилища сессий (запускает и останавливает владелец)
+        """
+        self.quiz = quiz
+        self.sessions = user_data if sessions is None else sessions
+        self.primary = primary
+        self.callback_prefix = quiz.callback_prefix
+        # Викторины, которые делят этого бота (открываются диплинком /start <имя>)
+        self.attached: Dict[str, 'QuizBot'] = {}
+        logger.debug(f"Bot token length: {len(quiz.token)}")
+        # Сессии в памяти переживают перезапуск через снимок (см. session_snapshot.py);
+        # снимком общего хранилища нескольких викторин управляет quiz_host.py
+        self.snapshots = snapshots or (SessionSnapshots(user_data) if sessions is None and SESSION_SNAPSHOT_PATH
+                                       and not user_data.path else None)
+        self.owns_snapshots = snapshots is None
+        # Доменные события викторины (см. event_journal.py)
+        self.journal = EventJournal(quiz.path(EVENT_JOURNAL_DIR)) if EVENT_JOURNAL_DIR else None
+        # Напоминания о брошенных викторинах (см. reminders.py)
+        self.reminders = ReminderScheduler(self.send_reminder) if REMINDER_DELAY > 0 else None
+        # Готовые ответы inline-режима (см. inline_share.py)
+        self.inline_share = InlineShare(cache_path=quiz.path(INLINE_MEDIA_CACHE_PATH))
+        # Время на вопрос и отсев по вопросам (см. funnel.py)
+        self.funnel = QuestionFunnel(directory=quiz.path(FUNNEL_STATS_DIR))
+        # Викторины в групповых чатах с общим сообщением (см. group_quiz.py)
+        self.group_quizzes = GroupQuizzes(self.group_score)
+        # Переходы по реферальным ссылкам, записываются в базу пачками (см. referrals.py);
+        # у викторины, делящей бота, реферальных ссылок нет
+        self.referrals = ReferralCounters(quiz.path(REFERRAL_DB_PATH) if primary is None else None)
+        # Карточки результата, которые еще рисуются или отправляются (по пользователю)
+        self.result_cards: Dict[int, asyncio.Task] = {}
+        # Идущая выгрузка /export (одна за раз, в отдельном процессе)
+        self.exporting = False
+        if primary is None:
+            # Отдельные пулы соединений для getUpdates и остальных вызовов, повторы и предохранитель (см. api_client.py)
+            request, get_updates_request = build_requests(request)
+            builder = Application.builder().token(quiz.token).request(request).get_updates_request(get_updates_request)
+            if BOT_API_BASE_URL:
+                builder = builder.base_url(BOT_API_BASE_URL)
+            # Ответы на вопросы обрабатываются раньше команд, отзывов и фоновых задач (см. priority.py)
+            self.load = load or PriorityScheduler()
+            self.owns_load = load is None
+            # Последние трассы апдейтов в памяти, выгрузка на диск при ошибках и медленных апдейтах
+            self.recorder = FlightRecorder(dump_dir=quiz.path(TRACE_DUMP_DIR))
+            # Лимиты частоты апдейтов перед всеми обработчиками (см. abuse_guard.py)
+            self.guard = AbuseGuard() if ABUSE_USER_RATE > 0 else None
+            self.update_processor = PriorityUpdateProcessor(self.load, self.update_priority, self.answer_busy,
+                                                            recorder=self.recorder, guard=self.guard)
+            # Профилирование и снимки памяти по команде администратора или сигналу (см. profiling.py)
+            self.profiler = Profiler(self.recorder)
+            builder = builder.concurrent_updates(self.update_processor)
+            builder = builder.post_init(self.post_init).post_shutdown(self.post_shutdown)
+            self.application = builder.build()
+        else:
+            # Бот, очереди апдейтов и профилировщик - основной викторины
+            self.application = primary.application
+            self.load, self.recorder, self.profiler = primary.load, primary.recorder, primary.profiler
+            self.guard = primary.guard
+            self.owns_load = False
+            primary.attached[quiz.name] = self
+        # Контент читается из снимка (см. quiz_content.py), генератор изображений создается лениво
+        self.content = ContentStore(quiz.content_path, snapshot_path=quiz.path(CONTENT_SNAPSHOT_PATH),
+                                    winner_table_path=quiz.path(WINNER_TABLE_PATH),
+                                    callback_prefix=self.callback_prefix)
+        self._image_generator = None
+        # Переходы разговора в личном чате; противоречивая таблица останавливает запуск (см. conversation.py)
+        self.transitions = compile_transitions(self)
         self.setup_handlers()
+        logger.info(f"Bot application created (quiz {quiz.name or 'default'}, content {self.content.current.version}, "
+                    f"adaptive mode: {ADAPTIVE_QUIZ})")
+    
+    @property
+    def image_generator(self):
+        """Генератор изображений (Pillow загружается только при первом обращении)
+
+        Описания животных вызовы берут из своей версии контента, а не из той, что была текущей при создании.
+        """
+        if self._image_generator is None:
+            from image_generator import ResultImageGenerator
+            self._image_generator = ResultImageGenerator(self.content.current.animals,
+                                                         self.quiz.path('generated_images'))
+        return self._image_generator
+    
+    def menu_button(self, text: str, action: str) -> InlineKeyboardButton:
+        """Кнопка меню этой викторины (callback_data "menu_<действие>" с префиксом викторины)"""
+        return InlineKeyboardButton(text, callback_data=f"{self.callback_prefix}menu_{action}")
     
     def setup_handlers(self):
         """Настройка обработчиков команд и сообщений"""
-        logger.info("Setting up bot handlers...")
-        
-        # Основные команды
-        self.application.add_handler(CommandHandler("start", self.start_command))
-        logger.info("Added start command handler")
-        self.application.add_handler(CommandHandler("help", self.help_command))
-        logger.info("Added help command handler")
-        self.application.add_handler(CommandHandler("restart", self.restart_command))
-        logger.info("Added restart command handler")
-        
-        # Обработчики викторины
-        self.application.add_handler(CallbackQueryHandler(self.handle_quiz_answer, pattern="^answer_"))
-        logger.info("Added quiz answer handler")
-        self.application.add_handler(CallbackQueryHandler(self.handle_menu_action, pattern="^menu_"))
-        logger.info("Added menu action handler")
-        
-        # Обработчик обратной связи
-        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_feedback))
-        logger.info("Added feedback handler")
+        logger.debug("Setting up bot handlers...")
+        
+        # Обработчики викторины (кнопки викторины, которая делит бота с основной, - с ее префиксом)
+        prefix = re.escape(self.callback_prefix)
+        self.application.add_handler(CallbackQueryHandler(self.handle_quiz_answer, pattern=f"^{prefix}answer_"))
+        logger.debug("Added quiz answer handler")
+        self.application.add_handler(CallbackQueryHandler(self.handle_menu_action, pattern=f"^{prefix}menu_"))
+        logger.debug("Added menu action handler")
+        if self.primary is not None:
+            # Команды, inline-режим, отзывы и запись сессий - у основной викторины бота
+            logger.debug(f"Quiz {self.quiz.name} attached to the bot of quiz {self.primary.quiz.name}")
+            return
+        
+        # Основные команды (разговор викторины идет только в личном чате)
+        private = filters.ChatType.PRIVATE
+        self.application.add_handler(CommandHandler("start", self.start_command, filters=private))
+        logger.debug("Added start command handler")
+        self.application.add_handler(CommandHandler("help", self.help_command, filters=private))
+        logger.debug("Added help command handler")
+        self.application.add_handler(CommandHandler("restart", self.restart_command, filters=private))
+        logger.debug("Added restart command handler")
+        self.application.add_handler(CommandHandler("groupquiz", self.group_quiz_command))
+        logger.debug("Added group quiz command handler")
+        
+        # Команды администраторов
+        self.application.add_handler(CommandHandler("profile", self.profile_command))
+        self.application.add_handler(CommandHandler("memory", self.memory_command))
+        self.application.add_handler(CommandHandler("stats", self.stats_command))
+        self.application.add_handler(CommandHandler("referrals", self.referrals_command))
+        self.application.add_handler(CommandHandler("export", self.export_command))
+        logger.debug("Added admin command handlers")
+        
+        # Групповая викторина
+        self.application.add_handler(CallbackQueryHandler(self.handle_group_answer, pattern=r"^group_\d"))
+        self.application.add_handler(CallbackQueryHandler(self.handle_group_next, pattern="^groupnext$"))
+        logger.debug("Added group quiz handlers")
+        
+        # Inline-режим: публикация результата в любом чате
+        self.application.add_handler(InlineQueryHandler(self.handle_inline_query))
+        logger.debug("Added inline query handler")
+        
+        # Обработчик обратной связи (текст из групп - не отзыв)
+        self.application.add_handler(MessageHandler(private & filters.TEXT & ~filters.COMMAND, self.handle_feedback))
+        logger.debug("Added feedback handler")
+        
+        # Сохранение сессии после обработки апдейта
+        if self.sessions.path:
+            self.application.add_handler(TypeHandler(Update, self.persist_session), group=PERSIST_GROUP)
+            logger.debug("Added session persistence handler")
         
         # Обработчик ошибок
         self.application.add_error_handler(self.error_handler)
-        logger.info("Added error handler")
+        logger.debug("Added error handler")
         
-        logger.info("Bot handlers setup completed")
+        logger.debug("Bot handlers setup completed")
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик команды /start"""
+        """Обработчик команды /start (/start <имя> открывает викторину, которая делит этого бота)"""
         user = update.effective_user
         logger.info(f"Start command from user {user.id} ({user.username})")
+        attached = self.attached.get(context.args[0]) if context.args else None
+        if attached is not None:
+            await attached.start_command(update, context)
+            return
+        await self.dispatch(update, context, START)
+    
+    async def show_welcome(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Приветствие с главным меню; сессия пользователя начинается заново"""
+        user = update.effective_user
+        await self.content.refresh()
+        content = self.content.current
+        
+        # Переход по реферальной ссылке (/start r<автор>-<животное>): только счетчик в памяти
+        referral = decode_payload(context.args[0]) if context.args else None
+        if referral and referral.referrer != user.id:
+            if referral.animal not in content.animals:
+                referral = Referral(referral.referrer, '')
+            self.referrals.visited(referral, joined=user.id not in self.sessions)
+        else:
+            referral = None
         
         # Инициализация данных пользователя
-        user_id = user.id
-        user_data[user_id] = {
-            'current_question': 0,
-            'answers': {},
-            'start_time': datetime.now().isoformat(),
-            'quiz_completed': False
-        }
-        logger.info(f"User data initialized for user {user_id}")
+        self.sessions[user.id] = new_session()
+        if referral:
+            self.sessions[user.id]['referral'] = list(referral)
+        logger.info(f"User data initialized for user {user.id}")
         
         welcome_text = f"""
 🦁 Добро пожаловать в викторину "Какое у вас тотемное животное?"
@@ -90,7 +268,7 @@ class QuizBot:
 Я помогу тебе узнать, какое животное из Московского зоопарка больше всего подходит твоему характеру! 
 
 🎯 Как это работает:
-• Ответь на {len(QUIZ_QUESTIONS)} интересных вопросов
+• Ответь на {len(content.questions)} интересных вопросов
 • Узнай свое тотемное животное
 • Познакомься с программой опеки зоопарка
 • Поделись результатом с друзьями
@@ -99,14 +277,13 @@ class QuizBot:
         """
         
         keyboard = [
-            [InlineKeyboardButton("🎮 Начать викторину", callback_data="menu_start_quiz")],
-            [InlineKeyboardButton("ℹ️ О программе опеки", callback_data="menu_guardianship")],
-            [InlineKeyboardButton("📞 Связаться с зоопарком", callback_data="menu_contact")]
+            [self.menu_button("🎮 Начать викторину", "start_quiz")],
+            [self.menu_button("ℹ️ О программе опеки", "guardianship")],
+            [self.menu_button("📞 Связаться с зоопарком", "contact")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         await update.message.reply_text(welcome_text, reply_markup=reply_markup, parse_mode='Markdown')
-        return START
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /help"""
@@ -119,6 +296,7 @@ class QuizBot:
 📋 Доступные команды:
 /start - Начать викторину
 /restart - Перезапустить викторину
+/groupquiz - Викторина для всей группы (в групповом чате)
 /help - Показать эту справку
 
 🎯 Как пройти викторину:
@@ -135,107 +313,144 @@ class QuizBot:
         """
         
         keyboard = [
-            [InlineKeyboardButton("🔙 Вернуться к началу", callback_data="menu_back_to_start")]
+            [self.menu_button("🔙 Вернуться к началу", "back_to_start")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         await update.message.reply_text(help_text, reply_markup=reply_markup, parse_mode='Markdown')
-        return START
     
     async def restart_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /restart"""
-        user_id = update.effective_user.id
-        logger.info(f"Restart command from user {user_id}")
-        
-        # Сброс данных пользователя
-        if user_id in user_data:
-            user_data[user_id] = {
-                'current_question': 0,
-                'answers': {},
-                'start_time': datetime.now().isoformat(),
-                'quiz_completed': False
-            }
-            logger.info(f"User data reset for user {user_id}")
-        
-        await self.start_command(update, context)
-        return START
+        logger.info(f"Restart command from user {update.effective_user.id}")
+        # Сессия сбрасывается переходом START, как и по /start
+        await self.dispatch(update, context, START)
     
     async def handle_menu_action(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик действий в главном меню"""
         query = update.callback_query
-        await query.answer()
         
         # Логирование для отладки
         logger.info(f"Menu action received: {query.data}")
         
         try:
-            action = query.data.split('_', 1)[1]
-            logger.info(f"Parsed action: {action}")
-            
-            if action == "start_quiz":
-                logger.info("Starting quiz...")
-                await self.start_quiz(query)
-            elif action == "guardianship":
-                logger.info("Showing guardianship info...")
-                await self.show_guardianship_info(query)
-            elif action == "contact":
-                logger.info("Showing contact info...")
-                await self.show_contact_info(query)
-            elif action == "back_to_start":
-                logger.info("Going back to start...")
-                await self.show_start_menu(query)
-            elif action == "share_result":
-                logger.info("Sharing result...")
-                await self.show_share_result(query)
-            else:
+            action = query.data[len(self.callback_prefix):].split('_', 1)[1]
+            event = MENU_EVENTS.get(action)
+            if event is None:
                 logger.warning(f"Unknown action: {action}")
                 await query.answer(f"Неизвестное действие: {action}")
+                return
+            await self.dispatch(update, context, event)
         except Exception as e:
             logger.error(f"Error in handle_menu_action: {e}")
             await query.answer("Произошла ошибка при обработке действия")
     
-    async def start_quiz(self, query):
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE, event: int):
+        """
+        Обработка события разговора по таблице переходов (см. conversation.py)
+        
+        Недопустимое в текущем состоянии событие отклоняется до вызова действия.
+        Следующее состояние записывается в сессию после действия; если действие
+        вернуло событие, оно обрабатывается следующим.
+        
+        Args:
+            update: Апдейт личного чата
+            context: Контекст обработчика
+            event: Событие (START, ANSWER, ...)
+        """
+        user_id = update.effective_user.id
+        # Пользователь ушел с экрана результата: недорисованная карточка уже не нужна
+        card = self.result_cards.pop(user_id, None)
+        if card is not None:
+            card.cancel()
+        # На нажатие кнопки отвечаем один раз: при отказе - с пояснением
+        query = update.callback_query
+        if event in (CONTINUE, ANSWER) and self.is_outdated(self.sessions.get(user_id)):
+            await self.restart_outdated(query, user_id)
+            return
+        while event is not None:
+            state = session_state(self.sessions.get(user_id))
+            transition = self.transitions[state * len(EVENT_NAMES) + event]
+            if transition is None:
+                logger.info(f"Rejected {EVENT_NAMES[event]} from user {user_id} in state {STATE_NAMES[state]}")
+                if query:
+                    await query.answer(REJECTED.get(state, "Это действие сейчас недоступно"))
+                return
+            action, next_state = transition
+            if query:
+                await query.answer()
+                query = None
+            event = await action(update, context)
+            if next_state is not None and next_state != state:
+                self.sessions[user_id]['state'] = next_state
+    
+    def is_outdated(self, session: Optional[Dict[str, Any]]) -> bool:
+        """Викторина начата на версии контента, которая уже не хранится"""
+        return session_state(session) == QUIZ and not self.content.has(session.get('content_version'))
+    
+    async def restart_outdated(self, query, user_id: int):
+        """Сброс викторины, вопросы которой больше недоступны, с предложением начать заново"""
+        logger.warning(f"Quiz content version of user {user_id} is no longer retained, session reset")
+        previous = self.sessions[user_id]
+        self.sessions[user_id] = new_session()
+        if previous.get('referral'):
+            self.sessions[user_id]['referral'] = previous['referral']
+        if self.reminders:
+            self.reminders.cancel(user_id)
+        await query.answer()
+        keyboard = [[self.menu_button("🎮 Начать викторину", "start_quiz")]]
+        await query.message.edit_text(
+            "🔄 Пока ты проходил викторину, вопросы обновились. Начни, пожалуйста, заново!",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+    
+    async def start_quiz(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Начало викторины"""
+        query = update.callback_query
         user_id = query.from_user.id
         logger.info(f"Starting quiz for user {user_id}")
         
-        # Сброс данных для новой викторины
-        user_data[user_id] = {
-            'current_question': 0,
-            'answers': {},
-            'start_time': datetime.now().isoformat(),
-            'quiz_completed': False
-        }
+        # Сброс данных для новой викторины (сессия доигрывается на версии контента, на которой началась)
+        await self.content.refresh()
+        previous = self.sessions.get(user_id)
+        self.sessions[user_id] = new_session(QUIZ, self.content.current.version)
+        # Приглашение засчитывается при первом завершении викторины
+        if previous and previous.get('referral'):
+            self.sessions[user_id]['referral'] = previous['referral']
+        if self.journal:
+            self.journal.quiz_started(user_id, self.content.current.version)
+        self.funnel.quiz_started()
         
         logger.info(f"User data reset for user {user_id}")
-        logger.info(f"User data: {user_data[user_id]}")
+        logger.info(f"User data: {self.sessions[user_id]}")
         await self.show_question(query, user_id)
     
+    async def resume_quiz(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> Optional[int]:
+        """Продолжение викторины с сохраненного вопроса (кнопка из напоминания)"""
+        query = update.callback_query
+        user_id = query.from_user.id
+        session = self.sessions[user_id]
+        content = self.content.get(session.get('content_version'))
+        if session['current_question'] >= len(content.questions):
+            return FINISH
+        logger.info(f"Resuming quiz for user {user_id} at question {session['current_question'] + 1}")
+        await self.show_question(query, user_id)
+        return None
+    
     async def show_question(self, query, user_id: int):
         """Показать текущий вопрос викторины"""
-        current_q = user_data[user_id]['current_question']
+        current_q = self.sessions[user_id]['current_question']
+        content = self.content.get(self.sessions[user_id].get('content_version'))
         logger.info(f"Showing question {current_q + 1} for user {user_id}")
         
-        if current_q >= len(QUIZ_QUESTIONS):
-            logger.info(f"Quiz completed for user {user_id}, showing results")
-            await self.show_results(query, user_id)
-            return
-        
-        question_data = QUIZ_QUESTIONS[current_q]
-        logger.info(f"Question data: {question_data['question'][:50]}...")
-        question_text = f"❓ **Вопрос {current_q + 1} из {len(QUIZ_QUESTIONS)}**\n\n{question_data['question']}"
-        
-        # Создание клавиатуры с вариантами ответов
-        keyboard = []
-        for i, option in enumerate(question_data['options']):
-            keyboard.append([InlineKeyboardButton(
-                option['text'], 
-                callback_data=f"answer_{current_q}_{i}"
-            )])
-            logger.info(f"Added option {i}: {option['text'][:30]}...")
+        # Текст и клавиатура собраны заранее при компиляции контента
+        question_text = content.question_texts[current_q]
+        reply_markup = content.keyboards[current_q]
         
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        logger.info(f"Created keyboard with {len(keyboard)} options")
+        # Время показа - для времени на ответ; повторный показ того же вопроса его не сбрасывает
+        shown = self.sessions[user_id].get('question_shown')
+        if not shown or shown[0] != current_q:
+            self.sessions[user_id]['question_shown'] = [current_q, time.time()]
+            self.funnel.question_shown(current_q)
         
         try:
             if query.message:
@@ -251,86 +466,101 @@ class QuizBot:
     async def handle_quiz_answer(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик ответов на вопросы викторины"""
         query = update.callback_query
-        await query.answer()
-        
         user_id = query.from_user.id
         logger.info(f"Quiz answer from user {user_id}: {query.data}")
         
         try:
-            _, question_id, answer_id = query.data.split('_')
-            question_id, answer_id = int(question_id), int(answer_id)
-            logger.info(f"Parsed answer: question {question_id}, option {answer_id}")
-            
-            # Сохранение ответа
-            if user_id not in user_data:
-                user_data[user_id] = {
-                    'current_question': 0,
-                    'answers': {},
-                    'start_time': datetime.now().isoformat(),
-                    'quiz_completed': False
-                }
-                logger.info(f"User data initialized for user {user_id}")
-            
-            user_data[user_id]['answers'][question_id] = answer_id
-            user_data[user_id]['current_question'] = question_id + 1
-            logger.info(f"Answer saved for user {user_id}, current question: {user_data[user_id]['current_question']}")
-            
-            # Показ следующего вопроса или результатов
-            if user_data[user_id]['current_question'] < len(QUIZ_QUESTIONS):
-                await self.show_question(query, user_id)
-            else:
-                logger.info(f"Quiz completed for user {user_id}, showing results")
-                await self.show_results(query, user_id)
+            await self.dispatch(update, context, ANSWER)
         except Exception as e:
             logger.error(f"Error handling quiz answer for user {user_id}: {e}")
             await query.answer("Произошла ошибка при обработке ответа")
     
-    async def show_results(self, query, user_id: int):
+    async def record_answer(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> Optional[int]:
+        """Сохранение ответа и показ следующего вопроса (FINISH, если викторина окончена)"""
+        query = update.callback_query
+        user_id = query.from_user.id
+        _, question_id, answer_id = query.data[len(self.callback_prefix):].split('_')
+        question_id, answer_id = int(question_id), int(answer_id)
+        logger.info(f"Parsed answer: question {question_id}, option {answer_id}")
+        
+        # Сохранение ответа
+        session = self.sessions[user_id]
+        content = self.content.get(session.get('content_version'))
+        shown = session.get('question_shown')
+        if shown and shown[0] == question_id:
+            self.funnel.question_answered(question_id, time.time() - shown[1])
+        session['answers'][question_id] = answer_id
+        session['current_question'] = question_id + 1
+        if self.journal:
+            self.journal.answer_given(user_id, question_id, answer_id)
+        if self.reminders and not session.get('reminder_sent'):
+            self.reminders.schedule(user_id)
+        logger.info(f"Answer saved for user {user_id}, current question: {session['current_question']}")
+        
+        # В адаптивном режиме завершаем викторину, как только результат определен
+        if ADAPTIVE_QUIZ and session['current_question'] < len(content.questions):
+            decided = content.early_termination.decided_winner(session['answers'])
+            if decided:
+                logger.info(f"Result for user {user_id} is decided after {len(session['answers'])} answers: {decided}")
+                return FINISH
+        
+        # Показ следующего вопроса или результатов
+        if session['current_question'] < len(content.questions):
+            await self.show_question(query, user_id)
+            return None
+        logger.info(f"Quiz completed for user {user_id}, showing results")
+        return FINISH
+    
+    async def show_results(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать результаты викторины"""
+        query = update.callback_query
+        user_id = query.from_user.id
         logger.info(f"Showing results for user {user_id}")
         
-        if user_id not in user_data or not user_data[user_id]['answers']:
+        if user_id not in self.sessions or not self.sessions[user_id]['answers']:
             logger.warning(f"No user data or answers for user {user_id}")
             await query.message.edit_text("❌ Произошла ошибка. Попробуйте начать викторину заново.")
             return
         
-        # Подсчет результатов
-        animal_scores = {}
-        logger.info(f"Calculating results for user {user_id}")
-        logger.info(f"User answers: {user_data[user_id]['answers']}")
+        # Определение победителя: полный набор ответов - одно обращение к таблице
+        content = self.content.get(self.sessions[user_id].get('content_version'))
+        answers = self.sessions[user_id]['answers']
+        logger.info(f"User answers: {answers}")
+        with span('scoring'):
+            winner_animal = content.winner_table.lookup(answers)
+            if winner_animal is None:
+                winner_animal = self.calculate_winner(answers, content.questions)
         
-        for question_id, answer_id in user_data[user_id]['answers'].items():
-            question = QUIZ_QUESTIONS[question_id]
-            option = question['options'][answer_id]
-            logger.info(f"Question {question_id}, answer {answer_id}: {option['text'][:30]}...")
+        if winner_animal:
+            animal_info = content.animals[winner_animal]
+            logger.info(f"Winner animal for user {user_id}: {winner_animal}")
             
-            for animal, weight in option['weight'].items():
-                if animal not in animal_scores:
-                    animal_scores[animal] = 0
-                animal_scores[animal] += weight
-                logger.info(f"Added {weight} points for {animal}, total: {animal_scores[animal]}")
-        
-        logger.info(f"Final animal scores: {animal_scores}")
-        
-        # Определение победителя
-        if animal_scores:
-            winner_animal = max(animal_scores, key=animal_scores.get)
-            animal_info = ANIMALS[winner_animal]
-            logger.info(f"Winner animal for user {user_id}: {winner_animal} with {animal_scores[winner_animal]} points")
-            
-            # Отметка завершения викторины
-            user_data[user_id]['quiz_completed'] = True
-            user_data[user_id]['result_animal'] = winner_animal
-            user_data[user_id]['completion_time'] = datetime.now().isoformat()
+            # Отметка завершения викторины (состояние DONE запишет переход)
+            self.sessions[user_id]['result_animal'] = winner_animal
+            self.sessions[user_id]['completion_time'] = datetime.now().isoformat()
+            self.sessions[user_id].pop('question_shown', None)
+            if self.journal:
+                self.journal.result_computed(user_id, winner_animal)
+            self.funnel.quiz_completed()
+            referral = self.sessions[user_id].pop('referral', None)
+            if referral:
+                self.referrals.completed(Referral(*referral))
+            if self.reminders:
+                self.reminders.cancel(user_id)
             logger.info(f"Quiz completed for user {user_id}, result saved")
             
-            # Формирование результата
-            result_text = f"""
+            # Формирование результата: победитель и следующие за ним по баллам животные
+            with span('render'):
+                matches = content.ranking.top(answers, RESULT_PROFILE_SIZE)
+                profile = "\n".join(profile_lines(matches, content.animals))
+                if profile:
+                    profile = f"📊 Совместимость:\n{profile}\n\n"
+                result_text = f"""
 🎉 Викторина завершена! 🎉
 
 {animal_info['emoji']} Твое тотемное животное: {animal_info['name']} {animal_info['emoji']}
 
-📝 Описание:
+{profile}📝 Описание:
 {animal_info['description']}
 
 🐾 Интересные факты о {animal_info['name'].lower()}е:
@@ -341,19 +571,22 @@ class QuizBot:
 
 🎯 Хочешь узнать больше о программе опеки или поделиться результатом?
             """
-            
-            keyboard = [
-                [InlineKeyboardButton("🐾 Узнать о программе опеки", callback_data="menu_guardianship")],
-                [InlineKeyboardButton("📤 Поделиться результатом", callback_data="menu_share_result")],
-                [InlineKeyboardButton("📞 Связаться с зоопарком", callback_data="menu_contact")],
-                [InlineKeyboardButton("🔄 Пройти викторину еще раз", callback_data="menu_start_quiz")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+                
+                keyboard = [
+                    [self.menu_button("🐾 Узнать о программе опеки", "guardianship")],
+                    [self.menu_button("📤 Поделиться результатом", "share_result")],
+                    [self.menu_button("📞 Связаться с зоопарком", "contact")],
+                    [self.menu_button("🔄 Пройти викторину еще раз", "start_quiz")]
+                ]
+                reply_markup = InlineKeyboardMarkup(keyboard)
             
             logger.info(f"Showing results for user {user_id}: {animal_info['name']}")
             try:
                 await query.message.edit_text(result_text, reply_markup=reply_markup, parse_mode='Markdown')
                 logger.info(f"Results displayed for user {user_id}")
+                if RESULT_CARD:
+                    # Текст уже у пользователя, карточка рисуется в фоне и приходит следом
+                    self.start_result_card(context, query.message, query.from_user, content, winner_animal, matches)
             except Exception as e:
                 logger.error(f"Error displaying results for user {user_id}: {e}")
                 await query.answer("Произошла ошибка при показе результатов")
@@ -361,20 +594,130 @@ class QuizBot:
             logger.warning(f"No animal scores for user {user_id}")
             await query.message.edit_text("❌ Не удалось определить результат. Попробуйте пройти викторину еще раз.")
     
-    async def show_start_menu(self, query):
-        """Показать главное меню (для callback queries)"""
+    def start_result_card(self, context: ContextTypes.DEFAULT_TYPE, message, user, content, animal_key: str,
+                          profile: Sequence[Match]):
+        """Запускает отправку карточки результата; ее отменит следующее действие пользователя"""
+        async def deliver():
+            # Корутина карточки создается при запуске задачи: отмененная до старта задача ее не оставит
+            await self.run_background(
+                self.send_result_card(context.bot, message.chat_id, message.message_id, user, content, animal_key,
+                                      profile)
+            )
+        
+        task = context.application.create_task(deliver())
+        self.result_cards[user.id] = task
+        
+        def forget(finished: asyncio.Task):
+            if self.result_cards.get(user.id) is finished:
+                del self.result_cards[user.id]
+        
+        task.add_done_callback(forget)
+    
+    async def send_result_card(self, bot, chat_id: int, reply_to: int, user, content, animal_key: str,
+                               profile: Sequence[Match]):
+        """
+        Рисует карточку результата в пуле потоков и отправляет ее ответом на текст результата
+        
+        Args:
+            bot: Бот, от имени которого отправляется карточка
+            chat_id: Личный чат пользователя
+            reply_to: Сообщение с текстом результата
+            user: Пользователь (имя - в подписи карточки)
+            content: Версия контента, на которой прошла викторина (описание животного на карточке)
+            animal_key: Результат викторины
+            profile: Профиль совместимости (рисуется диаграммой)
+        """
+        try:
+            started = time.perf_counter()
+            # Отмена, пока карточка ждет поток, снимает ее и из очереди пула
+            card = await asyncio.get_running_loop().run_in_executor(
+                None, self.image_generator.render_result_image, animal_key, user.first_name, profile, content
+            )
+            animal_info = content.animals[animal_key]
+            with non_essential():
+                await bot.send_photo(chat_id=chat_id, photo=card, caption=f"{animal_info['emoji']} {animal_info['name']}",
+                                     reply_to_message_id=reply_to, disable_notification=True)
+            logger.info(f"Result card sent to user {user.id} in {(time.perf_counter() - started) * 1000:.0f} ms")
+        except asyncio.CancelledError:
+            logger.info(f"Result card for user {user.id} cancelled")
+            raise
+        except Exception as e:
+            logger.error(f"Failed to send result card to user {user.id}: {e}")
+    
+    def calculate_winner(self, answers: Dict[int, int], questions: List[Dict[str, Any]]) -> Optional[str]:
+        """
+        Подсчет победителя по баллам (для неполного набора ответов)
+        
+        Args:
+            answers: Ответы пользователя {номер вопроса: номер варианта}
+            questions: Вопросы версии контента, на которой шла викторина
+            
+        Returns:
+            Ключ животного или None, если баллов нет
+        """
+        animal_scores = {}
+        for question_id, answer_id in answers.items():
+            option = questions[question_id]['options'][answer_id]
+            for animal, weight in option['weight'].items():
+                animal_scores[animal] = animal_scores.get(animal, 0) + weight
+        
+        logger.info(f"Final animal scores: {animal_scores}")
+        if not animal_scores:
+            return None
+        return max(animal_scores, key=animal_scores.get)
+    
+    def group_score(self, content, answers: Dict[int, int]) -> Optional[str]:
+        """Животное участника групповой викторины (на пропущенные вопросы он мог не ответить)"""
+        return content.winner_table.lookup(answers) or self.calculate_winner(answers, content.questions)
+    
+    async def group_quiz_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /groupquiz: общая викторина в групповом чате"""
+        chat = update.effective_chat
+        user = update.effective_user
+        if chat.type not in (chat.GROUP, chat.SUPERGROUP):
+            await update.message.reply_text("👥 Добавь меня в групповой чат и отправь там /groupquiz - "
+                                            "ответим на вопросы всей компанией!")
+            return
+        logger.info(f"Group quiz requested in chat {chat.id} by user {user.id}")
+        quiz = await self.group_quizzes.start(context.bot, chat.id, self.content.current, user.id)
+        if quiz is None:
+            await update.message.reply_text("☝️ Викторина в этом чате уже идет")
+    
+    async def handle_group_answer(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Голос участника групповой викторины (сообщение перерисуется с очередным обновлением)"""
+        query = update.callback_query
+        if query.message is None:
+            await query.answer("Викторина уже закончилась")
+            return
+        _, question, option = query.data.split('_')
+        user = query.from_user
+        status = self.group_quizzes.vote(query.message.chat.id, query.message.message_id, user.id,
+                                         user.full_name, int(question), int(option))
+        await query.answer({
+            ACCEPTED: "✅ Ответ принят",
+            CHANGED: "🔄 Ответ изменен",
+            CLOSED: "⌛ Этот вопрос уже закрыт",
+        }[status])
+    
+    async def handle_group_next(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Кнопка «Дальше»: ведущий закрывает вопрос досрочно"""
+        query = update.callback_query
+        quiz = self.group_quizzes.active.get(query.message.chat.id) if query.message else None
+        if quiz is None or quiz.message_id != query.message.message_id:
+            await query.answer("Викторина уже закончилась")
+        elif query.from_user.id != quiz.host_id:
+            await query.answer("Перейти к следующему вопросу может только тот, кто начал викторину")
+        else:
+            quiz.close_question()
+            await query.answer("➡️ Следующий вопрос")
+    
+    async def show_start_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Показать главное меню (для callback queries); сессия не сбрасывается"""
+        query = update.callback_query
         user = query.from_user
         user_id = user.id
         logger.info(f"Showing start menu for user {user_id}")
-        
-        # Инициализация данных пользователя
-        user_data[user_id] = {
-            'current_question': 0,
-            'answers': {},
-            'start_time': datetime.now().isoformat(),
-            'quiz_completed': False
-        }
-        logger.info(f"User data initialized for user {user_id}")
+        content = self.content.current
         
         welcome_text = f"""
 🦁 Добро пожаловать в викторину "Какое у вас тотемное животное?" 🦁
@@ -384,7 +727,7 @@ class QuizBot:
 Я помогу тебе узнать, какое животное из Московского зоопарка больше всего подходит твоему характеру! 
 
 🎯 Как это работает:
-• Ответь на {len(QUIZ_QUESTIONS)} интересных вопросов
+• Ответь на {len(content.questions)} интересных вопросов
 • Узнай свое тотемное животное
 • Познакомься с программой опеки зоопарка
 • Поделись результатом с друзьями
@@ -393,9 +736,9 @@ class QuizBot:
         """
         
         keyboard = [
-            [InlineKeyboardButton("🎮 Начать викторину", callback_data="menu_start_quiz")],
-            [InlineKeyboardButton("ℹ️ О программе опеки", callback_data="menu_guardianship")],
-            [InlineKeyboardButton("📞 Связаться с зоопарком", callback_data="menu_contact")]
+            [self.menu_button("🎮 Начать викторину", "start_quiz")],
+            [self.menu_button("ℹ️ О программе опеки", "guardianship")],
+            [self.menu_button("📞 Связаться с зоопарком", "contact")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
@@ -406,19 +749,20 @@ class QuizBot:
             logger.error(f"Error showing start menu for user {user_id}: {e}")
             await query.answer("Произошла ошибка при показе главного меню")
     
-    async def show_guardianship_info(self, query):
+    async def show_guardianship_info(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать информацию о программе опеки"""
+        query = update.callback_query
         user_id = query.from_user.id
         logger.info(f"Showing guardianship info for user {user_id}")
         
-        guardianship_text = GUARDIANSHIP_INFO.format(
+        guardianship_text = self.content.current.guardianship_info.format(
             email=ZOO_CONTACT_EMAIL,
             phone=ZOO_CONTACT_PHONE
         )
         
         keyboard = [
-            [InlineKeyboardButton("📞 Связаться с зоопарком", callback_data="menu_contact")],
-            [InlineKeyboardButton("🔙 Вернуться к началу", callback_data="menu_back_to_start")]
+            [self.menu_button("📞 Связаться с зоопарком", "contact")],
+            [self.menu_button("🔙 Вернуться к началу", "back_to_start")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
@@ -433,8 +777,9 @@ class QuizBot:
             logger.error(f"Error showing guardianship info for user {user_id}: {e}")
             await query.answer("Произошла ошибка при показе информации о программе опеки")
     
-    async def show_contact_info(self, query):
+    async def show_contact_info(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать контактную информацию"""
+        query = update.callback_query
         user_id = query.from_user.id
         logger.info(f"Showing contact info for user {user_id}")
         
@@ -462,8 +807,8 @@ class QuizBot:
         """
         
         keyboard = [
-            [InlineKeyboardButton("🐾 Узнать о программе опеки", callback_data="menu_guardianship")],
-            [InlineKeyboardButton("🔙 Вернуться к началу", callback_data="menu_back_to_start")]
+            [self.menu_button("🐾 Узнать о программе опеки", "guardianship")],
+            [self.menu_button("🔙 Вернуться к началу", "back_to_start")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
@@ -478,14 +823,16 @@ class QuizBot:
             logger.error(f"Error showing contact info for user {user_id}: {e}")
             await query.answer("Произошла ошибка при показе контактной информации")
     
-    async def show_share_result(self, query):
+    async def show_share_result(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать информацию о том, как поделиться результатом"""
+        query = update.callback_query
         user_id = query.from_user.id
         logger.info(f"Showing share result info for user {user_id}")
         
         # Проверяем, есть ли результат викторины
-        if user_id not in user_data or not user_data[user_id].get('quiz_completed'):
-            share_text = """
+        completed = session_state(self.sessions.get(user_id)) == DONE
+        if not completed:
+            message_text = """
 ❌ Нет результата для публикации
 
 Сначала пройди викторину, чтобы узнать свое тотемное животное!
@@ -497,25 +844,32 @@ class QuizBot:
 • Тогда сможешь поделиться результатом
             """
         else:
-            animal_name = user_data[user_id].get('result_animal', 'неизвестное животное')
-            animal_info = ANIMALS.get(animal_name, {})
+            animal_name = self.sessions[user_id].get('result_animal', 'неизвестное животное')
+            content = self.content.get(self.sessions[user_id].get('content_version'))
+            animal_info = content.animals.get(animal_name, {})
             animal_emoji = animal_info.get('emoji', '🐾')
             animal_display_name = animal_info.get('name', animal_name)
+            bot_username = query.get_bot().username or DEFAULT_BOT_USERNAME
+            if self.primary is None:
+                # Личная ссылка: переходы по ней засчитываются пользователю и его животному
+                link = referral_link(bot_username, user_id, animal_name)
+            else:
+                # Параметр /start занят именем викторины, делящей бота: ссылка без атрибуции
+                link = f"https://t.me/{bot_username}?start={self.quiz.name}"
+            text = share_text(animal_info, bot_username, link) if animal_info else ''
             
-            share_text = f"""
+            message_text = f"""
 📤 Поделись своим результатом!
 
 {animal_emoji} Твое тотемное животное: {animal_display_name} {animal_emoji}
 
-💬 Как поделиться:
-• Скопируй текст ниже
-• Вставь в любой мессенджер или соцсеть
-• Добавь ссылку на бота: @moszooprojectbot
+💬 Как поделиться в Telegram:
+• Нажми "Поделиться в чате" и выбери чат
+• Или набери в любом чате @{escape_markdown(bot_username)} и выбери карточку
+• Или отправь другу свою ссылку - кнопка "Отправить ссылку"
 
-📝 Текст для публикации:
-"Я прошел викторину Московского зоопарка и узнал, что мое тотемное животное - {animal_display_name}! {animal_emoji}
-
-Попробуй и ты: @moszooprojectbot"
+📝 Текст для других соцсетей:
+"{escape_markdown(text)}"
 
 🌍 Где поделиться:
 • Telegram
@@ -526,19 +880,50 @@ class QuizBot:
             """
         
         keyboard = [
-            [InlineKeyboardButton("🔄 Пройти викторину еще раз", callback_data="menu_start_quiz")],
-            [InlineKeyboardButton("🐾 О программе опеки", callback_data="menu_guardianship")],
-            [InlineKeyboardButton("🔙 Вернуться к началу", callback_data="menu_back_to_start")]
+            [self.menu_button("🔄 Пройти викторину еще раз", "start_quiz")],
+            [self.menu_button("🐾 О программе опеки", "guardianship")],
+            [self.menu_button("🔙 Вернуться к началу", "back_to_start")]
         ]
+        if completed:
+            keyboard.insert(0, [InlineKeyboardButton(
+                "🔗 Отправить ссылку", url="https://t.me/share/url?" + urlencode({
+                    'url': link, 'text': f"Мое тотемное животное - {animal_display_name} {animal_emoji}. А какое твое?"
+                })
+            )])
+            if self.primary is None:
+                # Открывает выбор чата с @ботом в поле ввода: карточку отдаст handle_inline_query
+                keyboard.insert(0, [InlineKeyboardButton("📤 Поделиться в чате", switch_inline_query="")])
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         try:
-            await query.message.edit_text(share_text, reply_markup=reply_markup, parse_mode='Markdown')
+            await query.message.edit_text(message_text, reply_markup=reply_markup, parse_mode='Markdown')
             logger.info(f"Share result info displayed for user {user_id}")
         except Exception as e:
             logger.error(f"Error showing share result info for user {user_id}: {e}")
             await query.answer("Произошла ошибка при показе информации о публикации")
     
+    async def handle_inline_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Inline-режим: карточка результата пользователя для публикации в любом чате"""
+        query = update.inline_query
+        user_id = query.from_user.id
+        session = self.sessions.get(user_id)
+        
+        if session_state(session) != DONE or not session.get('result_animal'):
+            button = InlineQueryResultsButton(text="🎯 Пройти викторину", start_parameter="quiz")
+            await query.answer([], cache_time=INLINE_CACHE_TIME, is_personal=True, button=button)
+            return
+        
+        content = self.content.get(session.get('content_version'))
+        animal_key = session['result_animal']
+        results = self.inline_share.results_for(content, animal_key, context.bot.username)
+        if self.inline_share.needs_upload(content, animal_key):
+            # Карточка появится в следующих ответах, этот уходит без нее
+            context.application.create_task(self.run_background(
+                self.inline_share.upload_cards(context.bot, content, self.image_generator, [animal_key])
+            ))
+        await query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True)
+        logger.debug(f"Inline query answered for user {user_id}")
+    
     async def handle_feedback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик обратной связи от пользователей"""
         user = update.effective_user
@@ -547,18 +932,26 @@ class QuizBot:
         # Логирование обратной связи
         logger.info(f"Feedback from {user.id} ({user.username}): {feedback_text}")
         logger.info(f"Feedback text: {feedback_text[:100]}...")
+        await self.dispatch(update, context, FEEDBACK)
+    
+    async def save_feedback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Сохранение отзыва и ответ с меню (состояние разговора не меняется)"""
+        user = update.effective_user
+        feedback_text = update.message.text
         
         # Сохранение обратной связи (в продакшене лучше использовать базу данных)
-        if user.id not in user_data:
-            user_data[user.id] = {}
+        if user.id not in self.sessions:
+            self.sessions[user.id] = new_session()
         
-        if 'feedback' not in user_data[user.id]:
-            user_data[user.id]['feedback'] = []
+        if 'feedback' not in self.sessions[user.id]:
+            self.sessions[user.id]['feedback'] = []
         
-        user_data[user.id]['feedback'].append({
+        self.sessions[user.id]['feedback'].append({
             'text': feedback_text,
             'timestamp': datetime.now().isoformat()
         })
+        if self.journal:
+            self.journal.feedback_received(user.id, feedback_text)
         
         # Ответ пользователю
         response_text = """
@@ -573,18 +966,317 @@ class QuizBot:
         """
         
         keyboard = [
-            [InlineKeyboardButton("🔄 Пройти викторину", callback_data="menu_start_quiz")],
-            [InlineKeyboardButton("🐾 О программе опеки", callback_data="menu_guardianship")],
-            [InlineKeyboardButton("🔙 В главное меню", callback_data="menu_back_to_start")]
+            [self.menu_button("🔄 Пройти викторину", "start_quiz")],
+            [self.menu_button("🐾 О программе опеки", "guardianship")],
+            [self.menu_button("🔙 В главное меню", "back_to_start")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         await update.message.reply_text(response_text, reply_markup=reply_markup, parse_mode='Markdown')
-        return START
+    
+    async def persist_session(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Запись сессии пользователя в хранилище после обработки апдейта (и в викторинах, делящих бота)"""
+        if update.effective_user:
+            for quiz_bot in (self, *self.attached.values()):
+                quiz_bot.sessions.flush([update.effective_user.id])
+    
+    def update_priority(self, update: Update) -> int:
+        """Класс приоритета апдейта: ответы и кнопки меню важнее команд, отзывы - в последнюю очередь"""
+        if update.callback_query:
+            return INTERACTIVE
+        if update.inline_query:
+            return NORMAL
+        text = update.message.text if update.message else None
+        if text and text.startswith('/'):
+            # Команды администраторов нужны как раз под нагрузкой
+            if text.startswith('/start') or self.is_admin(update):
+                return INTERACTIVE
+            return NORMAL
+        return BACKGROUND
+    
+    async def answer_busy(self, update: Update):
+        """Короткий ответ на апдейт, отклоненный под нагрузкой"""
+        if update.callback_query:
+            await update.callback_query.answer("⏳ Бот сейчас перегружен, попробуй через минуту")
+    
+    async def run_background(self, coroutine):
+        """Фоновая задача с низким приоритетом (под нагрузкой откладывается или пропускается)"""
+        # Задача создана из обработчика, но к трассе его апдейта не относится
+        detach()
+        try:
+            await self.load.run(BACKGROUND, coroutine)
+        except Overloaded as e:
+            logger.info(f"Background task skipped: {e}")
+    
+    def is_admin(self, update: Update) -> bool:
+        """Апдейт от администратора бота (ADMIN_USER_IDS)"""
+        return bool(update.effective_user) and update.effective_user.id in ADMIN_USER_IDS
+    
+    async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /profile [секунды|stop] (только для администраторов)"""
+        if not self.is_admin(update):
+            return
+        if context.args and context.args[0] == 'stop':
+            self.profiler.stop_profile()
+            return
+        try:
+            seconds = float(context.args[0]) if context.args else PROFILE_DURATION
+        except ValueError:
+            await update.message.reply_text("Использование: /profile [секунды|stop]")
+            return
+        seconds = min(max(seconds, 1.0), PROFILE_MAX_DURATION)
+        if self.profiler.running:
+            await update.message.reply_text("⏱ Профилирование уже идет")
+            return
+        logger.warning(f"Profiling requested by user {update.effective_user.id} for {seconds:.0f}s")
+        await update.message.reply_text(f"⏱ Профилирование на {seconds:.0f} с...")
+        # Профиль снимается в отдельной задаче: апдейты администратора не ждут его окончания
+        context.application.create_task(self.run_profile(seconds, update.effective_chat.id))
+    
+    async def run_profile(self, seconds: float, chat_id: Optional[int] = None):
+        """Снимает профиль и отправляет краткий отчет в чат (если задан)"""
+        detach()
+        try:
+            report = await self.profiler.profile(seconds)
+        except Exception as e:
+            logger.error(f"Profiling failed: {e}", exc_info=e)
+            return
+        if chat_id is None:
+            return
+        lines = [f"{name}: {count} × p95 {p95 * 1000:.0f} мс, всего {total:.1f} с"
+                 for name, count, total, p95, _ in report.handlers[:10]]
+        text = (f"⏱ Профиль готов: {report.samples} сэмплов\n{report.stacks_path}\n{report.handlers_path}\n\n"
+                + ("\n".join(lines) or "Апдейтов за это время не было"))
+        await self.application.bot.send_message(chat_id=chat_id, text=text)
+    
+    async def memory_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /memory [stop] (только для администраторов)"""
+        if not self.is_admin(update):
+            return
+        if context.args and context.args[0] == 'stop':
+            self.profiler.stop_memory()
+            await update.message.reply_text("🧠 tracemalloc выключен")
+            return
+        report = await self.profiler.memory_snapshot()
+        if report is None:
+            await update.message.reply_text("🧠 tracemalloc включен. Повтори /memory позже, чтобы получить снимок")
+            return
+        await update.message.reply_text(
+            f"🧠 {report.traced / 1024 / 1024:.1f} МиБ под наблюдением\n{report.path}\n\n" + "\n".join(report.top)
+        )
+    
+    async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /stats: воронка викторины всех процессов (только для администраторов)"""
+        if not self.is_admin(update):
+            return
+        others = await asyncio.get_running_loop().run_in_executor(
+            None, load_funnels, self.funnel.directory, self.funnel.name
+        )
+        text = format_stats(merge_funnels([self.funnel, *others]))
+        if self.guard:
+            guard = self.guard.stats()
+            text += (f"\n\n🛡 Отброшено апдейтов: {guard['dropped']}, банов: {guard['bans']} "
+                     f"(сейчас {guard['banned']}), корзин: {guard['buckets']}")
+        await update.message.reply_text(text)
+    
+    async def referrals_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /referrals: переходы по ссылкам по авторам и животным (только для администраторов)"""
+        if not self.is_admin(update):
+            return
+        # Счетчики этого процесса попадают в сводку сразу, остальных - в пределах интервала записи
+        await self.referrals.flush()
+        stats = await asyncio.get_running_loop().run_in_executor(None, self.referrals.stats)
+        await update.message.reply_text(format_referral_stats(stats, self.content.current.animals))
+    
+    async def export_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /export <sessions|results|feedback> [параметры export.py] (только для администраторов)"""
+        if not self.is_admin(update):
+            return
+        
+        def reject(message: str):
+            raise ValueError(message)
+        
+        try:
+            args = export_parser(error=reject).parse_args(context.args)
+            if args.source == JOURNAL:
+                journal_rows((), args.kind, ExportFilters(animal=args.animal))
+        except ValueError as e:
+            await update.message.reply_text(f"Использование: /export sessions|results|feedback [--format csv] "
+                                            f"[--since 2026-10-01] [--until ...] [--animal tiger] "
+                                            f"[--source journal]\n\n{e}")
+            return
+        if args.source == STORE and not self.sessions.path and not self.snapshots:
+            await update.message.reply_text("Сессии только в памяти: задайте SESSION_DB_PATH или SESSION_SNAPSHOT_PATH")
+            return
+        if args.source == JOURNAL and not self.journal:
+            await update.message.reply_text("Журнал событий отключен (EVENT_JOURNAL_DIR)")
+            return
+        if self.exporting:
+            await update.message.reply_text("📦 Выгрузка уже идет")
+            return
+        filename = f"{args.kind}-{datetime.now():%Y%m%d-%H%M%S}.{args.format}.gz"
+        path = os.path.join(self.quiz.path(EXPORT_DIR), filename)
+        logger.warning(f"Export of {args.kind} requested by user {update.effective_user.id}: {path}")
+        # Только данные этой викторины: ее диапазон ключей в общем хранилище и ее журнал
+        argv = [*context.args, '--gzip', '--output', path, '--namespace', str(self.quiz.namespace)]
+        if self.journal:
+            argv += ['--journal', self.journal.directory]
+        # Флаг снимает run_export при любом исходе
+        self.exporting = True
+        context.application.create_task(self.run_export(args.source, args.kind, argv, path, update.effective_chat.id))
+    
+    async def run_export(self, source: str, kind: str, argv: List[str], path: str, chat_id: int):
+        """Выгрузка отдельным процессом (export.py) и отправка файла в чат"""
+        detach()
+        try:
+            # Процесс выгрузки читает базу, снимок или журнал: дописываем то, что еще в памяти
+            if source == JOURNAL:
+                await self.journal.flush()
+            elif self.snapshots:
+                await self.snapshots.save_changes()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            await self.application.bot.send_message(chat_id=chat_id, text=f"📦 Выгрузка {kind} началась")
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'export.py'), *argv,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+            )
+            _, stderr = await process.communicate()
+            lines = stderr.decode('utf-8', 'replace').strip().splitlines()
+            summary = lines[-1] if lines else ''
+            if process.returncode != 0:
+                logger.error(f"Export failed with code {process.returncode}: {summary}")
+                await self.application.bot.send_message(chat_id=chat_id, text=f"❌ Выгрузка не удалась: {summary}")
+                return
+            size = os.path.getsize(path)
+            logger.info(f"Export finished: {path}, {size} bytes, {summary}")
+            if size > MAX_UPLOAD_BYTES:
+                await self.application.bot.send_message(
+                    chat_id=chat_id, text=f"📦 {summary}\nФайл {size / 1024 / 1024:.0f} МиБ - больше лимита "
+                                          f"Telegram, он на сервере: {path}"
+                )
+                return
+            with open(path, 'rb') as f:
+                await self.application.bot.send_document(chat_id=chat_id, document=f,
+                                                         filename=os.path.basename(path), caption=f"📦 {summary}")
+        except Exception as e:
+            logger.error(f"Export failed: {e}", exc_info=e)
+        finally:
+            self.exporting = False
+    
+    async def run_memory_snapshot(self):
+        """Снимок памяти по сигналу"""
+        try:
+            await self.profiler.memory_snapshot()
+        except Exception as e:
+            logger.error(f"Memory snapshot failed: {e}", exc_info=e)
+    
+    def install_profiling_signals(self, loop: asyncio.AbstractEventLoop):
+        """SIGUSR1 - профиль на PROFILE_DURATION секунд, SIGUSR2 - снимок памяти"""
+        try:
+            loop.add_signal_handler(signal.SIGUSR1, lambda: None if self.profiler.running else
+                                    loop.create_task(self.run_profile(PROFILE_DURATION)))
+            loop.add_signal_handler(signal.SIGUSR2, lambda: loop.create_task(self.run_memory_snapshot()))
+        except (AttributeError, NotImplementedError, RuntimeError) as e:
+            # Windows или цикл событий не в основном потоке
+            logger.debug(f"Profiling signals unavailable: {e}")
+    
+    async def post_init(self, application: Application):
+        """Восстановление сессий из снимка и запуск фоновых записей до начала обработки апдейтов"""
+        if self.primary is None:
+            # Очереди и профилировщик викторин, делящих бота, запускает основная
+            if self.owns_load:
+                self.load.start()
+            self.install_profiling_signals(asyncio.get_running_loop())
+        self.funnel.restore()
+        self.funnel.start()
+        self.referrals.start()
+        if self.snapshots and self.owns_snapshots:
+            self.snapshots.restore()
+            self.snapshots.start()
+        if self.journal:
+            self.journal.start()
+        if self.reminders:
+            self.reminders.start()
+            # Сроки напоминаний не переживают перезапуск: для восстановленных сессий отсчет начинается заново
+            self.reminders.schedule_many(
+                user_id for user_id, session in self.sessions.cached_items() if self.needs_reminder(session)
+            )
+        if self.inline_share.media_chat_id and self.primary is None:
+            # Карточки животных загружаются в фоне, чтобы inline-ответы сразу шли с картинкой
+            application.create_task(self.run_background(
+                self.inline_share.upload_cards(application.bot, self.content.current, self.image_generator)
+            ))
+    
+    async def post_shutdown(self, application: Application):
+        """Запись снимка сессий и остатка журнала при остановке бота"""
+        if self.primary is None:
+            if self.owns_load:
+                await self.load.stop()
+            for signum in (signal.SIGUSR1, signal.SIGUSR2):
+                try:
+                    asyncio.get_running_loop().remove_signal_handler(signum)
+                except (AttributeError, NotImplementedError, RuntimeError):
+                    pass
+        await self.funnel.stop()
+        await self.referrals.stop()
+        await self.group_quizzes.stop()
+        if self.reminders:
+            await self.reminders.stop()
+        if self.snapshots and self.owns_snapshots:
+            await self.snapshots.stop()
+        if self.journal:
+            await self.journal.stop()
+    
+    def needs_reminder(self, session: Dict[str, Any]) -> bool:
+        """Викторина брошена на середине и напоминание еще не отправлялось"""
+        if session_state(session) != QUIZ or not session.get('answers') or session.get('reminder_sent'):
+            return False
+        if self.is_outdated(session):
+            return False
+        content = self.content.get(session.get('content_version'))
+        return session['current_question'] < len(content.questions)
+    
+    async def send_reminder(self, user_id: int):
+        """Напоминание о незавершенной викторине с кнопкой продолжения"""
+        session = self.sessions.get(user_id)
+        if not session or not self.needs_reminder(session):
+            return
+        session['reminder_sent'] = True
+        self.sessions.flush([user_id])
+        
+        content = self.content.get(session.get('content_version'))
+        reminder_text = f"""
+🐾 Твое тотемное животное все еще ждет!
+
+Ты ответил на {session['current_question']} из {len(content.questions)} вопросов. Продолжим с того же места?
+        """
+        keyboard = [
+            [self.menu_button("▶️ Продолжить викторину", "continue_quiz")],
+            [self.menu_button("🔄 Начать заново", "start_quiz")]
+        ]
+        try:
+            async with self.load.slot(BACKGROUND):
+                with non_essential():
+                    await self.application.bot.send_message(chat_id=user_id, text=reminder_text,
+                                                            reply_markup=InlineKeyboardMarkup(keyboard))
+        except (CircuitOpen, Overloaded) as e:
+            # API деградировал или бот перегружен: напоминание откладывается, а не теряется
+            session.pop('reminder_sent', None)
+            self.reminders.schedule(user_id, delay=e.retry_after + 1)
+            return
+        logger.info(f"Reminder sent to user {user_id}")
     
     async def error_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик ошибок"""
-        logger.error(f"Exception while handling an update: {context.error}")
+        # Трасса с ошибкой выгружает бортовой самописец: видно, где шла обработка и сколько заняла
+        trace = current_trace()
+        if trace is not None and context.error is not None:
+            trace.fail(context.error)
+        if isinstance(context.error, NetworkError):
+            # Повторы в api_client.py уже исчерпаны: сообщение об ошибке тоже не дойдет до пользователя
+            logger.warning(f"Bot API unavailable while handling an update: {context.error}")
+            return
+        logger.error(f"Exception while handling an update: {context.error}", exc_info=context.error)
         
         if update and update.effective_user:
             user_id = update.effective_user.id
@@ -603,8 +1295,8 @@ class QuizBot:
             """
             
             keyboard = [
-                [InlineKeyboardButton("🔄 Перезапустить", callback_data="menu_start_quiz")],
-                [InlineKeyboardButton("📞 Связаться с зоопарком", callback_data="menu_contact")]
+                [self.menu_button("🔄 Перезапустить", "start_quiz")],
+                [self.menu_button("📞 Связаться с зоопарком", "contact")]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
@@ -623,9 +1315,9 @@ class QuizBot:
     def run(self):
         """Запуск бота"""
         logger.info("Starting bot...")
-        logger.info(f"Bot token: {BOT_TOKEN[:10]}...")
-        logger.info(f"Quiz questions count: {len(QUIZ_QUESTIONS)}")
-        logger.info(f"Animals count: {len(ANIMALS)}")
+        logger.info(f"Bot token: {self.quiz.token[:10]}...")
+        logger.info(f"Quiz questions count: {len(self.content.current.questions)}")
+        logger.info(f"Animals count: {len(self.content.current.animals)}")
         logger.info("Starting polling...")
         self.application.run_polling(allowed_updates=Update.ALL_TYPES)
 
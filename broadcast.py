@@ -0,0 +1,229 @@
+"""
+Рассылка новостей программы опеки
+
+Получатели - пользователи, завершившие викторину (по желанию - только с
+определенным результатом). С SESSION_DB_PATH они читаются из базы сессий
+порциями по возрастанию user_id, поэтому база целиком в память не
+загружается; без базы - из снимка сессий работающего бота.
+
+Сообщения уходят пачками не более BROADCAST_RATE в секунду. После каждой
+пачки курсор (последний обработанный user_id) атомарно записывается в файл
+кампании, и прерванная рассылка при повторном запуске продолжается с того
+же места (пачка, на которой процесс упал, может уйти повторно).
+Пользователи, заблокировавшие бота, удаляются из базы сессий.
+
+    python broadcast.py guardianship-2026-10                # всем завершившим викторину
+    python broadcast.py tigers --animal tiger --text news.txt
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from datetime import timedelta
+from typing import Dict, Any, List, Optional
+
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from api_client import CircuitOpen, ResilientRequest, non_essential
+
+from config import (
+    BOT_TOKEN, BOT_API_BASE_URL, ZOO_CONTACT_EMAIL, ZOO_CONTACT_PHONE, QUIZ_CONTENT_PATH,
+    SESSION_DB_PATH, SESSION_SNAPSHOT_PATH, BROADCAST_RATE, BROADCAST_STATE_DIR
+)
+from session_store import SessionStore
+
+logger = logging.getLogger(__name__)
+
+SENT, DROPPED, FAILED = 'sent', 'dropped', 'failed'
+# Попыток отправки одному пользователю при сетевых ошибках и флуд-контроле
+MAX_ATTEMPTS = 3
+# Как часто писать в лог прогресс рассылки, секунды
+PROGRESS_INTERVAL = 5.0
+
+
+def _seconds(delay) -> float:
+    # retry_after - int или timedelta в зависимости от версии python-telegram-bot
+    return delay.total_seconds() if isinstance(delay, timedelta) else float(delay)
+
+
+class Broadcast:
+    """Возобновляемая рассылка одной кампании"""
+
+    def __init__(self, bot: Bot, store: SessionStore, campaign: str, text: str,
+                 result_animal: Optional[str] = None, rate: int = BROADCAST_RATE,
+                 state_dir: str = BROADCAST_STATE_DIR, reply_markup: Optional[InlineKeyboardMarkup] = None,
+                 drop_blocked: bool = True):
+        self.bot = bot
+        self.store = store
+        self.campaign = campaign
+        self.text = text
+        self.result_animal = result_animal
+        self.rate = max(1, rate)
+        self.reply_markup = reply_markup
+        self.drop_blocked = drop_blocked
+        os.makedirs(state_dir, exist_ok=True)
+        self.state_path = os.path.join(state_dir, f"{campaign}.json")
+        self.state = self._load_state()
+
+    def _load_state(self) -> Dict[str, Any]:
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return {'campaign': self.campaign, 'result_animal': self.result_animal, 'cursor': 0,
+                    SENT: 0, DROPPED: 0, FAILED: 0, 'done': False}
+        if state.get('result_animal') != self.result_animal:
+            raise ValueError(f"Campaign {self.campaign} was started for result_animal={state.get('result_animal')}")
+        logger.info(f"Resuming campaign {self.campaign} after user {state['cursor']} ({state[SENT]} sent)")
+        return state
+
+    def _save_state(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.state_path)
+
+    async def _send(self, user_id: int) -> str:
+        attempt = 0
+        while attempt < MAX_ATTEMPTS:
+            try:
+                with non_essential():
+                    await self.bot.send_message(chat_id=user_id, text=self.text, reply_markup=self.reply_markup)
+                return SENT
+            except CircuitOpen as e:
+                # API деградировал: рассылка ждет, попытка не засчитывается
+                await asyncio.sleep(max(1.0, e.retry_after))
+                continue
+            except RetryAfter as e:
+                logger.warning(f"Flood control, retrying user {user_id} in {e.retry_after}")
+                await asyncio.sleep(_seconds(e.retry_after))
+            except Forbidden:
+                return DROPPED
+            except BadRequest as e:
+                if 'chat not found' in str(e).lower():
+                    return DROPPED
+                logger.warning(f"Failed to send to user {user_id}: {e}")
+                return FAILED
+            except NetworkError as e:
+                logger.warning(f"Network error for user {user_id} (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(2 ** attempt)
+            attempt += 1
+        return FAILED
+
+    def _drop(self, user_ids: List[int]):
+        if not self.drop_blocked or not user_ids:
+            return
+        for user_id in user_ids:
+            self.store.pop(user_id, None)
+        self.store.flush(user_ids)
+
+    async def run(self) -> Dict[str, Any]:
+        """
+        Отправляет сообщение всем оставшимся получателям
+
+        Returns:
+            Состояние кампании: курсор и счетчики sent/dropped/failed
+        """
+        if self.state['done']:
+            logger.info(f"Campaign {self.campaign} is already finished")
+            return self.state
+
+        total = self.store.count_finished(self.result_animal, after=self.state['cursor'])
+        logger.info(f"Campaign {self.campaign}: {total} recipients")
+        recipients = self.store.iter_finished(self.result_animal, after=self.state['cursor'])
+        started = reported = time.monotonic()
+        processed = 0
+
+        while True:
+            batch = [user_id for _, user_id in zip(range(self.rate), recipients)]
+            if not batch:
+                break
+            batch_started = time.monotonic()
+            results = await asyncio.gather(*(self._send(user_id) for user_id in batch))
+            for result in results:
+                self.state[result] += 1
+            self._drop([user_id for user_id, result in zip(batch, results) if result == DROPPED])
+            self.state['cursor'] = batch[-1]
+            self._save_state()
+
+            processed += len(batch)
+            now = time.monotonic()
+            if now - reported >= PROGRESS_INTERVAL:
+                reported = now
+                speed = processed / (now - started)
+                eta = timedelta(seconds=round((total - processed) / speed)) if speed else '?'
+                logger.info(f"Campaign {self.campaign}: {processed}/{total}, {speed:.1f} sends/s, ETA {eta}")
+            # Не больше rate сообщений в секунду
+            await asyncio.sleep(max(0.0, batch_started + len(batch) / self.rate - time.monotonic()))
+
+        self.state['done'] = True
+        self._save_state()
+        elapsed = time.monotonic() - started
+        logger.info(f"Campaign {self.campaign} finished in {elapsed:.1f}s: {self.state[SENT]} sent, "
+                    f"{self.state[DROPPED]} dropped, {self.state[FAILED]} failed")
+        return self.state
+
+
+def guardianship_text() -> str:
+    """Текст о программе опеки из текущего контента"""
+    from quiz_content import builtin_content, load_content_file
+    content = load_content_file(QUIZ_CONTENT_PATH) if QUIZ_CONTENT_PATH else builtin_content()
+    return content['guardianship_info'].format(email=ZOO_CONTACT_EMAIL, phone=ZOO_CONTACT_PHONE)
+
+
+def open_store() -> SessionStore:
+    """Хранилище сессий: база, а без нее - снимок сессий бота (только чтение)"""
+    if SESSION_DB_PATH:
+        return SessionStore(SESSION_DB_PATH)
+    from session_snapshot import SessionSnapshots
+    logger.warning("SESSION_DB_PATH is not set: reading the session snapshot, blocked users will not be dropped")
+    store = SessionStore()
+    SessionSnapshots(store, SESSION_SNAPSHOT_PATH).restore(truncate=False)
+    return store
+
+
+async def run_campaign(args) -> Dict[str, Any]:
+    if args.text:
+        with open(args.text, 'r', encoding='utf-8') as f:
+            text = f.read()
+    else:
+        text = guardianship_text()
+    reply_markup = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🐾 О программе опеки", callback_data="menu_guardianship")],
+        [InlineKeyboardButton("📞 Связаться с зоопарком", callback_data="menu_contact")]
+    ])
+    store = open_store()
+    # Пул соединений на всю пачку, иначе запросы ждут друг друга
+    request = ResilientRequest(connection_pool_size=args.rate)
+    bot = Bot(BOT_TOKEN, base_url=BOT_API_BASE_URL or 'https://api.telegram.org/bot', request=request)
+    async with bot:
+        broadcast = Broadcast(bot, store, args.campaign, text, result_animal=args.animal, rate=args.rate,
+                              reply_markup=reply_markup, drop_blocked=bool(store.path))
+        try:
+            return await broadcast.run()
+        finally:
+            store.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Рассылка новостей программы опеки")
+    parser.add_argument('campaign', help="идентификатор кампании (имя файла курсора)")
+    parser.add_argument('--animal', help="только пользователям с этим результатом (ключ животного)")
+    parser.add_argument('--text', help="файл с текстом сообщения (по умолчанию - о программе опеки)")
+    parser.add_argument('--rate', type=int, default=BROADCAST_RATE, help="сообщений в секунду")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    state = asyncio.run(run_campaign(args))
+    print(json.dumps(state, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
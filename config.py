@@ -17,3 +17,160 @@ LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
 # Настройки викторины
 MAX_QUESTIONS = 10
 MIN_QUESTIONS = 5
+
+# Файл предвычисленной таблицы победителей (собирается при деплое)
+WINNER_TABLE_PATH = os.getenv('WINNER_TABLE_PATH', 'winner_table.bin')
+
+# Адаптивный режим: завершать викторину, как только результат определен
+ADAPTIVE_QUIZ = os.getenv('ADAPTIVE_QUIZ', 'false').lower() in ('1', 'true', 'yes')
+# Сколько животных показывать в профиле совместимости на экране результата (ranking.py)
+RESULT_PROFILE_SIZE = int(os.getenv('RESULT_PROFILE_SIZE', '3'))
+# Карточка результата вдогонку к тексту: текст отправляется сразу, картинка - когда нарисуется
+RESULT_CARD = os.getenv('RESULT_CARD', 'true').lower() in ('1', 'true', 'yes')
+
+# Файл с контентом викторины (JSON/YAML); если не задан, используется quiz_data.py
+QUIZ_CONTENT_PATH = os.getenv('QUIZ_CONTENT_PATH') or None
+# Как часто проверять изменение файла контента, секунды
+CONTENT_RELOAD_INTERVAL = float(os.getenv('CONTENT_RELOAD_INTERVAL', '5'))
+
+# Адрес Bot API (для локального Bot API сервера или фейкового API в бенчмарках)
+BOT_API_BASE_URL = os.getenv('BOT_API_BASE_URL') or None
+# Файл со снимком скомпилированного контента для быстрого старта
+CONTENT_SNAPSHOT_PATH = os.getenv('CONTENT_SNAPSHOT_PATH', 'quiz_content.snapshot')
+
+# Файл SQLite для хранения сессий (если не задан, сессии хранятся только в памяти)
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH') or None
+# Снимок сессий в памяти для теплого перезапуска (без SESSION_DB_PATH; пустое значение отключает)
+SESSION_SNAPSHOT_PATH = os.getenv('SESSION_SNAPSHOT_PATH', 'sessions.snapshot') or None
+# Как часто дописывать в снимок изменившиеся сессии, секунды
+SESSION_SNAPSHOT_INTERVAL = float(os.getenv('SESSION_SNAPSHOT_INTERVAL', '5'))
+
+# Режим нескольких процессов (scale_out.py): приемник вебхука и рабочие процессы
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL') or None
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+WORKER_COUNT = int(os.getenv('WORKER_COUNT', str(os.cpu_count() or 1)))
+WORKER_SOCKET_DIR = os.getenv('WORKER_SOCKET_DIR', '/tmp/telegrambot-workers')
+# Сколько апдейтов разных пользователей рабочий процесс обрабатывает одновременно
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', '64'))
+
+# Журнал событий викторины (пустое значение отключает)
+EVENT_JOURNAL_DIR = os.getenv('EVENT_JOURNAL_DIR', 'journal') or None
+# Размер сегмента журнала, после которого начинается новый
+EVENT_JOURNAL_SEGMENT_BYTES = int(os.getenv('EVENT_JOURNAL_SEGMENT_BYTES', str(64 * 1024 * 1024)))
+# Как часто буфер событий дописывается на диск, секунды
+EVENT_JOURNAL_FLUSH_INTERVAL = float(os.getenv('EVENT_JOURNAL_FLUSH_INTERVAL', '1'))
+
+# Напоминание о брошенной викторине через столько секунд бездействия (0 отключает)
+REMINDER_DELAY = float(os.getenv('REMINDER_DELAY', '3600'))
+# Сколько напоминаний отправлять в секунду
+REMINDER_RATE = int(os.getenv('REMINDER_RATE', '20'))
+
+# Рассылки (broadcast.py): сообщений в секунду и каталог с курсорами кампаний
+BROADCAST_RATE = int(os.getenv('BROADCAST_RATE', '25'))
+BROADCAST_STATE_DIR = os.getenv('BROADCAST_STATE_DIR', 'broadcasts')
+
+# Inline-режим: сколько секунд Telegram кеширует ответ на inline-запрос пользователя
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', '300'))
+# Служебный чат, куда загружаются карточки животных для получения file_id (без него - только текст)
+INLINE_MEDIA_CHAT_ID = int(os.getenv('INLINE_MEDIA_CHAT_ID')) if os.getenv('INLINE_MEDIA_CHAT_ID') else None
+# Файл с file_id загруженных карточек
+INLINE_MEDIA_CACHE_PATH = os.getenv('INLINE_MEDIA_CACHE_PATH', 'inline_media.json') or None
+
+# Клиент Bot API (api_client.py): пул соединений для обычных вызовов (getUpdates - отдельное соединение)
+BOT_API_POOL_SIZE = int(os.getenv('BOT_API_POOL_SIZE', '128'))
+# Сколько ждать свободного соединения из пула, секунды
+BOT_API_POOL_TIMEOUT = float(os.getenv('BOT_API_POOL_TIMEOUT', '3'))
+BOT_API_CONNECT_TIMEOUT = float(os.getenv('BOT_API_CONNECT_TIMEOUT', '5'))
+BOT_API_READ_TIMEOUT = float(os.getenv('BOT_API_READ_TIMEOUT', '10'))
+BOT_API_WRITE_TIMEOUT = float(os.getenv('BOT_API_WRITE_TIMEOUT', '10'))
+# Сколько секунд держать простаивающее соединение открытым
+BOT_API_KEEPALIVE_EXPIRY = float(os.getenv('BOT_API_KEEPALIVE_EXPIRY', '60'))
+# HTTP/2 (нужен пакет h2: pip install httpx[http2])
+BOT_API_HTTP2 = os.getenv('BOT_API_HTTP2', '').lower() in ('1', 'true', 'yes')
+# Таймауты чтения по методам: "метод=секунды,..."
+BOT_API_METHOD_TIMEOUTS = {
+    method.strip(): float(seconds)
+    for method, seconds in (
+        item.split('=') for item in
+        os.getenv('BOT_API_METHOD_TIMEOUTS', 'answerCallbackQuery=3,answerInlineQuery=5,sendPhoto=30').split(',')
+        if item.strip()
+    )
+}
+# Сколько раз повторять временную ошибку вызова
+BOT_API_RETRIES = int(os.getenv('BOT_API_RETRIES', '3'))
+# Предохранитель: доля ошибок среди последних вызовов, после которой необязательные отправки
+# отклоняются, и на сколько секунд
+BOT_API_BREAKER_THRESHOLD = float(os.getenv('BOT_API_BREAKER_THRESHOLD', '0.5'))
+BOT_API_BREAKER_COOLDOWN = float(os.getenv('BOT_API_BREAKER_COOLDOWN', '10'))
+
+# Приоритеты обработки (priority.py): сколько апдейтов и фоновых задач выполняется одновременно
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '32'))
+# Емкость очередей классов interactive, normal, background
+UPDATE_QUEUE_SIZES = tuple(int(size) for size in os.getenv('UPDATE_QUEUE_SIZES', '2000,200,500').split(','))
+# Задержка цикла событий (секунды), выше которой команды отклоняются, а фоновые задачи откладываются
+LOAD_SHED_LAG = float(os.getenv('LOAD_SHED_LAG', '0.25'))
+# Как часто писать в лог состояние очередей под нагрузкой, секунды
+LOAD_REPORT_INTERVAL = float(os.getenv('LOAD_REPORT_INTERVAL', '30'))
+
+# Защита от злоупотреблений (abuse_guard.py): апдейтов в секунду и запас на всплеск для пользователя
+# (0 отключает защиту) и для группового чата
+ABUSE_USER_RATE = float(os.getenv('ABUSE_USER_RATE', '2'))
+ABUSE_USER_BURST = int(os.getenv('ABUSE_USER_BURST', '20'))
+ABUSE_CHAT_RATE = float(os.getenv('ABUSE_CHAT_RATE', '50'))
+ABUSE_CHAT_BURST = int(os.getenv('ABUSE_CHAT_BURST', '600'))
+# Сколько отброшенных апдейтов пользователя (за время восполнения корзины) ведут к бану и на сколько секунд
+ABUSE_BAN_STRIKES = int(os.getenv('ABUSE_BAN_STRIKES', '30'))
+ABUSE_BAN_DURATION = float(os.getenv('ABUSE_BAN_DURATION', '600'))
+
+# Трассировка (tracing.py): сколько последних трасс держать в памяти
+TRACE_BUFFER_SIZE = int(os.getenv('TRACE_BUFFER_SIZE', '1000'))
+# Апдейт, обработка которого дольше стольких секунд, выгружает буфер трасс на диск
+TRACE_SLOW_THRESHOLD = float(os.getenv('TRACE_SLOW_THRESHOLD', '2'))
+# Каталог выгрузок буфера трасс (пустое значение отключает) и минимальный интервал между ними, секунды
+TRACE_DUMP_DIR = os.getenv('TRACE_DUMP_DIR', 'traces') or None
+TRACE_DUMP_INTERVAL = float(os.getenv('TRACE_DUMP_INTERVAL', '30'))
+
+# Администраторы бота (id пользователей через запятую): команды /profile и /memory
+ADMIN_USER_IDS = frozenset(int(user_id) for user_id in os.getenv('ADMIN_USER_IDS', '').split(',') if user_id.strip())
+
+# Профилирование по запросу (profiling.py): каталог отчетов и длительность профиля по умолчанию, секунды
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_DURATION = float(os.getenv('PROFILE_DURATION', '30'))
+PROFILE_MAX_DURATION = float(os.getenv('PROFILE_MAX_DURATION', '600'))
+# Интервал снятия стека, секунды
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.01'))
+# Сколько обработчиков и мест выделения памяти попадает в отчет
+PROFILE_TOP = int(os.getenv('PROFILE_TOP', '30'))
+# Глубина стека, запоминаемая tracemalloc для каждого выделения (больше - подробнее, но медленнее)
+PROFILE_MEMORY_FRAMES = int(os.getenv('PROFILE_MEMORY_FRAMES', '1'))
+
+# Воронка викторины (funnel.py): каталог состояния процессов (пустое значение - без сохранения)
+FUNNEL_STATS_DIR = os.getenv('FUNNEL_STATS_DIR', 'stats') or None
+# Как часто процесс записывает свое состояние, секунды
+FUNNEL_SAVE_INTERVAL = float(os.getenv('FUNNEL_SAVE_INTERVAL', '30'))
+# Относительная погрешность квантилей времени на вопрос
+FUNNEL_SKETCH_ACCURACY = float(os.getenv('FUNNEL_SKETCH_ACCURACY', '0.01'))
+
+# Викторина в групповом чате (group_quiz.py): минимальный интервал между правками общего сообщения, секунды
+# (Telegram допускает около 20 сообщений в минуту в одну группу)
+GROUP_REFRESH_INTERVAL = float(os.getenv('GROUP_REFRESH_INTERVAL', '3'))
+# Сколько секунд открыт каждый вопрос
+GROUP_QUESTION_TIME = float(os.getenv('GROUP_QUESTION_TIME', '30'))
+# Сколько участников перечислять в итоге
+GROUP_RESULT_LINES = int(os.getenv('GROUP_RESULT_LINES', '50'))
+
+# Реферальные ссылки (referrals.py): база счетчиков переходов (пустое значение - только в памяти процесса)
+REFERRAL_DB_PATH = os.getenv('REFERRAL_DB_PATH', 'referrals.db') or None
+# Как часто процесс дописывает накопленные счетчики в базу, секунды
+REFERRAL_FLUSH_INTERVAL = float(os.getenv('REFERRAL_FLUSH_INTERVAL', '2'))
+
+# Каталог выгрузок команды /export (export.py)
+EXPORT_DIR = os.getenv('EXPORT_DIR', 'exports')
+
+# Несколько викторин в одном процессе (quiz_host.py): файл со списком викторин (JSON или YAML)
+QUIZ_HOST_CONFIG = os.getenv('QUIZ_HOST_CONFIG', 'quizzes.json')
+# Потоки общего пула процесса: карточки результатов, компиляция контента, запись в SQLite
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', str(min(32, (os.cpu_count() or 1) + 4))))
@@ -0,0 +1,149 @@
+"""
+Состояния разговора с пользователем и таблица переходов
+
+Состояние сессии - одно небольшое число в поле 'state': IDLE (меню, викторина
+не начата), QUIZ (идут вопросы) или DONE (результат получен). Каждый апдейт
+личного чата превращается в событие (команда /start, кнопка меню, ответ на
+вопрос, текст отзыва), а что делать с событием, решает таблица
+TRANSITIONS: (состояния, событие) -> (действие бота, следующее состояние).
+
+При запуске бота таблица компилируется в плоский список на
+len(STATE_NAMES) × len(EVENT_NAMES) ячеек со связанными методами бота и
+проверяется: у каждого действия есть метод-корутина, ни одна пара
+(состояние, событие) не задана дважды, все состояния достижимы из IDLE.
+Ошибка в таблице останавливает запуск, а не всплывает на апдейте. Выбор
+перехода - одно обращение к списку по индексу; пустая ячейка означает
+недопустимое событие, и апдейт отклоняется до какой-либо работы.
+
+Действие может вернуть следующее событие (например, ответ на последний
+вопрос возвращает FINISH) - оно обрабатывается той же таблицей.
+"""
+
+import inspect
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Состояния сессии
+IDLE, QUIZ, DONE = range(3)
+STATE_NAMES = ('idle', 'quiz', 'done')
+
+# События
+(START, BEGIN, CONTINUE, ANSWER, FINISH, BACK, GUARDIANSHIP, CONTACT, SHARE, FEEDBACK) = range(10)
+EVENT_NAMES = ('start', 'begin', 'continue', 'answer', 'finish', 'back', 'guardianship', 'contact', 'share',
+               'feedback')
+
+# Следующее состояние «без изменений»
+KEEP = None
+ALL = (IDLE, QUIZ, DONE)
+
+# Кнопки меню (callback_data "menu_<действие>") -> событие
+MENU_EVENTS = {
+    'start_quiz': BEGIN,
+    'continue_quiz': CONTINUE,
+    'back_to_start': BACK,
+    'guardianship': GUARDIANSHIP,
+    'contact': CONTACT,
+    'share_result': SHARE,
+}
+
+# (состояния, событие, метод бота, следующее состояние)
+TRANSITIONS = (
+    (ALL, START, 'show_welcome', IDLE),
+    (ALL, BACK, 'show_start_menu', KEEP),
+    (ALL, BEGIN, 'start_quiz', QUIZ),
+    ((IDLE, DONE), CONTINUE, 'start_quiz', QUIZ),
+    (QUIZ, CONTINUE, 'resume_quiz', KEEP),
+    (QUIZ, ANSWER, 'record_answer', KEEP),
+    (QUIZ, FINISH, 'show_results', DONE),
+    (ALL, GUARDIANSHIP, 'show_guardianship_info', KEEP),
+    (ALL, CONTACT, 'show_contact_info', KEEP),
+    (ALL, SHARE, 'show_share_result', KEEP),
+    (ALL, FEEDBACK, 'save_feedback', KEEP),
+)
+
+Transition = Tuple[Callable[..., Any], Optional[int]]
+
+
+def new_session(state: int = IDLE, content_version: Optional[str] = None,
+                start_time: Optional[str] = None) -> Dict[str, Any]:
+    """Пустая сессия пользователя в состоянии state"""
+    session = {
+        'current_question': 0,
+        'answers': {},
+        'start_time': start_time or datetime.now().isoformat(),
+        'state': state,
+    }
+    if content_version is not None:
+        session['content_version'] = content_version
+    return session
+
+
+def session_state(session: Optional[Dict[str, Any]]) -> int:
+    """Состояние сессии (нет сессии или поля - IDLE)"""
+    return session.get('state', IDLE) if session else IDLE
+
+
+def legacy_state(session: Dict[str, Any]) -> int:
+    """Состояние сессии старого формата (флаг quiz_completed вместо поля state)"""
+    if session.get('quiz_completed'):
+        return DONE
+    if session.get('answers') or 'content_version' in session:
+        return QUIZ
+    return IDLE
+
+
+def upgrade_session(session: Dict[str, Any]) -> Dict[str, Any]:
+    """Переводит сессию старого формата на поле state (на месте)"""
+    if 'quiz_completed' in session:
+        session.setdefault('state', legacy_state(session))
+        del session['quiz_completed']
+    return session
+
+
+def compile_transitions(target: object, transitions=TRANSITIONS) -> List[Optional[Transition]]:
+    """
+    Компилирует и проверяет таблицу переходов
+
+    Args:
+        target: Объект, методы которого выполняют действия (бот)
+        transitions: Таблица (состояния, событие, метод, следующее состояние)
+
+    Returns:
+        Список ячеек по индексу state * len(EVENT_NAMES) + event: (метод, следующее состояние) или None
+
+    Raises:
+        ValueError: Таблица противоречива
+    """
+    events = len(EVENT_NAMES)
+    table: List[Optional[Transition]] = [None] * (len(STATE_NAMES) * events)
+    edges = {state: set() for state in range(len(STATE_NAMES))}
+    for states, event, name, next_state in transitions:
+        if isinstance(states, int):
+            states = (states,)
+        if not 0 <= event < events:
+            raise ValueError(f"Unknown event {event} for action {name}")
+        if next_state is not KEEP and not 0 <= next_state < len(STATE_NAMES):
+            raise ValueError(f"Unknown next state {next_state} for action {name}")
+        action = getattr(target, name, None)
+        if action is None or not inspect.iscoroutinefunction(action):
+            raise ValueError(f"Action {name} is not a coroutine method of {type(target).__name__}")
+        for state in states:
+            index = state * events + event
+            if table[index] is not None:
+                raise ValueError(f"Duplicate transition for ({STATE_NAMES[state]}, {EVENT_NAMES[event]})")
+            table[index] = (action, next_state)
+            edges[state].add(state if next_state is KEEP else next_state)
+
+    reachable, frontier = {IDLE}, [IDLE]
+    while frontier:
+        for state in edges[frontier.pop()] - reachable:
+            reachable.add(state)
+            frontier.append(state)
+    unreachable = [STATE_NAMES[state] for state in edges if state not in reachable]
+    if unreachable:
+        raise ValueError(f"States unreachable from {STATE_NAMES[IDLE]}: {', '.join(unreachable)}")
+    unused = [EVENT_NAMES[event] for event in range(events)
+              if all(table[state * events + event] is None for state in edges)]
+    if unused:
+        raise ValueError(f"Events without transitions: {', '.join(unused)}")
+    return table
@@ -0,0 +1,210 @@
+"""
+Журнал событий викторины
+
+Обработчики бота записывают доменные события (викторина начата, ответ дан,
+результат определен, отзыв получен) в буфер в памяти; фоновая задача раз в
+EVENT_JOURNAL_FLUSH_INTERVAL секунд дописывает буфер в файл в пуле потоков,
+поэтому запись события не блокирует обработчик.
+
+Журнал - каталог сегментов, которые только дописываются. Сегмент заменяется
+новым, когда превышает EVENT_JOURNAL_SEGMENT_BYTES, и при каждом запуске
+(каждый процесс пишет в свои сегменты). Сегмент начинается с заголовка
+(магическое число и версия формата), за ним идут записи: длина данных,
+тип события, время, user_id и данные. Чтение - iter_events(), разбор
+журнала - journal_replay.py.
+"""
+
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import time
+from typing import Any, Iterable, Iterator, List, NamedTuple, Optional
+
+from config import EVENT_JOURNAL_DIR, EVENT_JOURNAL_SEGMENT_BYTES, EVENT_JOURNAL_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_MAGIC = b'QEVJ'
+SEGMENT_FORMAT = 1
+SEGMENT_HEADER = struct.Struct('<4sH')
+SEGMENT_SUFFIX = '.evj'
+# Длина данных, тип события, время (unix), user_id
+RECORD = struct.Struct('<HBdq')
+# Номер вопроса и номер варианта
+ANSWER = struct.Struct('<HH')
+
+QUIZ_STARTED, ANSWER_GIVEN, RESULT_COMPUTED, FEEDBACK_RECEIVED = 1, 2, 3, 4
+EVENT_NAMES = {
+    QUIZ_STARTED: 'quiz_started',
+    ANSWER_GIVEN: 'answer_given',
+    RESULT_COMPUTED: 'result_computed',
+    FEEDBACK_RECEIVED: 'feedback_received',
+}
+
+# Буфер дописывается раньше срока, если вырос до этого размера
+FLUSH_BYTES = 1 << 20
+# Если диск не успевает, события сверх этого размера буфера отбрасываются
+MAX_BUFFER_BYTES = 64 << 20
+MAX_DATA_BYTES = 0xFFFF
+
+
+class Event(NamedTuple):
+    """Событие журнала; data - версия контента, (вопрос, вариант), ключ животного или текст отзыва"""
+    kind: int
+    timestamp: float
+    user_id: int
+    data: Any
+
+
+class EventJournal:
+    """Буферизованная запись событий в сегменты журнала"""
+
+    def __init__(self, directory: str = EVENT_JOURNAL_DIR, segment_bytes: int = EVENT_JOURNAL_SEGMENT_BYTES,
+                 flush_interval: float = EVENT_JOURNAL_FLUSH_INTERVAL):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._buffer = bytearray()
+        self._file = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        # Периодическая запись и /export не пишут в сегмент одновременно
+        self._lock = asyncio.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    # События
+
+    def record(self, kind: int, user_id: int, data: bytes = b''):
+        """Добавляет событие в буфер"""
+        if len(self._buffer) >= MAX_BUFFER_BYTES:
+            self.dropped += 1
+            return
+        data = data[:MAX_DATA_BYTES]
+        self._buffer += RECORD.pack(len(data), kind, time.time(), user_id)
+        self._buffer += data
+        if len(self._buffer) >= FLUSH_BYTES and self._wakeup is not None:
+            self._wakeup.set()
+
+    def quiz_started(self, user_id: int, content_version: str):
+        self.record(QUIZ_STARTED, user_id, content_version.encode('utf-8'))
+
+    def answer_given(self, user_id: int, question_id: int, answer_id: int):
+        self.record(ANSWER_GIVEN, user_id, ANSWER.pack(question_id, answer_id))
+
+    def result_computed(self, user_id: int, animal_key: str):
+        self.record(RESULT_COMPUTED, user_id, animal_key.encode('utf-8'))
+
+    def feedback_received(self, user_id: int, text: str):
+        self.record(FEEDBACK_RECEIVED, user_id, text.encode('utf-8'))
+
+    # Запись
+
+    def _open_segment(self):
+        # Имя начинается со времени создания: сегменты сортируются по имени
+        path = os.path.join(self.directory, f"{time.time_ns():020d}-{os.getpid()}{SEGMENT_SUFFIX}")
+        self._file = open(path, 'ab')
+        self._file.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_FORMAT))
+        logger.debug(f"Event journal segment: {path}")
+
+    def _write(self, data: bytes):
+        if self._file is None or self._file.tell() >= self.segment_bytes:
+            if self._file is not None:
+                self._file.close()
+            self._open_segment()
+        self._file.write(data)
+        self._file.flush()
+
+    async def flush(self):
+        """Дописывает накопленные события в сегмент (в пуле потоков)"""
+        async with self._lock:
+            if not self._buffer:
+                return
+            data, self._buffer = bytes(self._buffer), bytearray()
+            if self.dropped:
+                logger.warning(f"Event journal dropped {self.dropped} events: disk is too slow")
+                self.dropped = 0
+            await asyncio.get_running_loop().run_in_executor(None, self._write, data)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except OSError as e:
+                logger.error(f"Failed to write event journal: {e}")
+
+    def start(self):
+        """Запускает периодическую запись буфера"""
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Останавливает периодическую запись, дописывает буфер и закрывает сегмент"""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        async with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+# Чтение
+
+def list_segments(directory: str = EVENT_JOURNAL_DIR) -> List[str]:
+    """Сегменты журнала в порядке создания"""
+    names = sorted(name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+    return [os.path.join(directory, name) for name in names]
+
+
+def iter_segment(path: str) -> Iterator[Event]:
+    """
+    События одного сегмента
+
+    Недописанная последняя запись (падение процесса во время записи) пропускается.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < SEGMENT_HEADER.size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, version = SEGMENT_HEADER.unpack_from(data, 0)
+            if magic != SEGMENT_MAGIC or version != SEGMENT_FORMAT:
+                logger.warning(f"Skipping {path}: unknown journal format {magic!r} v{version}")
+                return
+
+            unpack, header_size, answer = RECORD.unpack_from, RECORD.size, ANSWER.unpack
+            size = len(data)
+            offset = SEGMENT_HEADER.size
+            while offset + header_size <= size:
+                length, kind, timestamp, user_id = unpack(data, offset)
+                start = offset + header_size
+                offset = start + length
+                if offset > size:
+                    logger.warning(f"{path}: truncated record at {start - header_size}")
+                    return
+                raw = data[start:offset]
+                yield Event(kind, timestamp, user_id, answer(raw) if kind == ANSWER_GIVEN else raw.decode('utf-8'))
+
+
+def iter_events(paths: Optional[Iterable[str]] = None, directory: str = EVENT_JOURNAL_DIR) -> Iterator[Event]:
+    """
+    Поток событий журнала по сегментам
+
+    Args:
+        paths: Сегменты (по умолчанию все сегменты каталога по порядку)
+        directory: Каталог журнала
+    """
+    for path in (list_segments(directory) if paths is None else paths):
+        yield from iter_segment(path)
@@ -0,0 +1,304 @@
+"""
+Выгрузка сессий, результатов и отзывов в CSV или JSON Lines
+
+Строки собираются генераторами и сразу пишутся в файл (по желанию - через
+gzip), поэтому память не зависит от числа строк. База сессий
+(SESSION_DB_PATH) читается порциями по первичному ключу: каждая порция -
+отдельный короткий запрос, и выгрузка не держит открытую транзакцию
+чтения, пока бот пишет в базу. Без базы читается снимок сессий
+работающего бота, он загружается целиком (как и сессии в памяти бота).
+Викторины quiz_host.py делят хранилище: выгружается диапазон ключей одной
+викторины (--namespace), а в user_id остается id пользователя Telegram.
+Результаты и отзывы можно выгрузить и из журнала событий - он читается
+потоком по сегментам.
+
+Команда /export бота запускает этот же модуль отдельным процессом: выгрузка
+не занимает ни цикл событий, ни GIL бота.
+
+    python export.py results --format csv --gzip --since 2026-10-01 --animal tiger -o tigers.csv.gz
+    python export.py feedback --source journal -o -       # JSON Lines в stdout
+    python export.py sessions --until 2026-10-01 -o old-sessions.jsonl
+    python export.py results --namespace 1 -o birds.jsonl  # вторая викторина quiz_host.py
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import logging
+import operator
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, Optional, Sequence
+
+from config import EVENT_JOURNAL_DIR, SESSION_DB_PATH, SESSION_SNAPSHOT_PATH
+from conversation import DONE, STATE_NAMES, session_state
+from session_store import MAX_NAMESPACES, USER_ID_BITS, USER_ID_LIMIT, SessionStore
+
+logger = logging.getLogger(__name__)
+
+SESSIONS, RESULTS, FEEDBACK = 'sessions', 'results', 'feedback'
+CSV, JSONL = 'csv', 'jsonl'
+STORE, JOURNAL = 'store', 'journal'
+COLUMNS = {
+    SESSIONS: ('user_id', 'state', 'start_time', 'content_version', 'current_question', 'answers',
+               'result_animal', 'completion_time', 'feedback'),
+    RESULTS: ('user_id', 'result_animal', 'completion_time', 'content_version', 'answers'),
+    FEEDBACK: ('user_id', 'timestamp', 'result_animal', 'text'),
+}
+# Колонки со вложенными объектами (в CSV - JSON в ячейке)
+JSON_COLUMNS = frozenset({'answers'})
+# Сессий за один запрос к базе
+CHUNK_ROWS = 5000
+# Уровень сжатия: 6 почти не уступает 9 по размеру и в несколько раз быстрее
+GZIP_LEVEL = 6
+# Предел размера файла, который бот может отправить документом
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+
+# Предварительный отбор в базе; точный фильтр - Filters.sessions
+SQL_FILTERS = {
+    SESSIONS: "(:animal IS NULL OR json_extract(data, '$.result_animal') = :animal)",
+    RESULTS: f"json_extract(data, '$.state') = {DONE} "
+             "AND (:animal IS NULL OR json_extract(data, '$.result_animal') = :animal)",
+    FEEDBACK: "json_extract(data, '$.feedback') IS NOT NULL "
+              "AND (:animal IS NULL OR json_extract(data, '$.result_animal') = :animal)",
+}
+
+
+class Filters:
+    """Отбор строк по дате (ISO, since включительно, until - нет) и животному"""
+
+    def __init__(self, since: Optional[str] = None, until: Optional[str] = None, animal: Optional[str] = None):
+        self.since = since
+        self.until = until
+        self.animal = animal
+
+    def in_range(self, timestamp: Optional[str]) -> bool:
+        """Время (ISO-строка) в интервале; без ограничений по дате подходит и пустое"""
+        if self.since is None and self.until is None:
+            return True
+        if not timestamp:
+            return False
+        # ISO-строки сравниваются как даты
+        return (self.since is None or timestamp >= self.since) and (self.until is None or timestamp < self.until)
+
+    def sessions(self, kind: str, session: Dict[str, Any]) -> bool:
+        """Сессия подходит для выгрузки kind (отзывы дополнительно фильтруются по дате)"""
+        if self.animal is not None and session.get('result_animal') != self.animal:
+            return False
+        if kind == RESULTS:
+            return session_state(session) == DONE and self.in_range(session.get('completion_time'))
+        if kind == FEEDBACK:
+            return bool(session.get('feedback'))
+        return self.in_range(session.get('start_time'))
+
+
+# Строки из хранилища сессий
+
+def store_rows(store: SessionStore, kind: str, filters: Filters, chunk_rows: int = CHUNK_ROWS,
+               namespace: int = 0) -> Iterator[Dict[str, Any]]:
+    """Строки выгрузки kind из хранилища сессий (только викторины namespace, см. SessionNamespace)"""
+    offset = namespace << USER_ID_BITS
+    # Номера вопросов остаются строками: в выгрузке они все равно ключи JSON
+    sessions = store.iter_sessions(f"user_id >= :low AND user_id < :high AND {SQL_FILTERS[kind]}",
+                                   {'animal': filters.animal, 'low': offset, 'high': offset + USER_ID_LIMIT},
+                                   chunk_rows, decode=json.loads)
+    columns = COLUMNS[kind][1:]
+    for key, session in sessions:
+        # Без базы условие SQL не применяется: диапазон ключей проверяется и здесь
+        if not offset <= key < offset + USER_ID_LIMIT or not filters.sessions(kind, session):
+            continue
+        user_id = key - offset
+        if kind == FEEDBACK:
+            for item in session['feedback']:
+                if filters.in_range(item.get('timestamp')):
+                    yield {'user_id': user_id, 'timestamp': item.get('timestamp'),
+                           'result_animal': session.get('result_animal'), 'text': item.get('text')}
+            continue
+        row = {'user_id': user_id}
+        for column in columns:
+            row[column] = session.get(column)
+        if kind == SESSIONS:
+            row['state'] = STATE_NAMES[session_state(session)]
+            row['feedback'] = len(session.get('feedback') or ())
+        yield row
+
+
+# Строки из журнала событий
+
+def journal_rows(events: Iterable, kind: str, filters: Filters) -> Iterator[Dict[str, Any]]:
+    """
+    Строки выгрузки kind из журнала событий
+
+    В журнале нет сессий целиком: выгружаются только результаты (без ответов)
+    и отзывы (без результата автора).
+
+    Raises:
+        ValueError: Такую выгрузку из журнала не собрать
+    """
+    if kind == SESSIONS or (kind == FEEDBACK and filters.animal is not None):
+        raise ValueError("Sessions and feedback by animal are exported from the session store only")
+    return _journal_rows(events, kind, filters)
+
+
+def _journal_rows(events: Iterable, kind: str, filters: Filters) -> Iterator[Dict[str, Any]]:
+    from event_journal import FEEDBACK_RECEIVED, RESULT_COMPUTED
+    wanted = RESULT_COMPUTED if kind == RESULTS else FEEDBACK_RECEIVED
+    for event_kind, timestamp, user_id, data in events:
+        if event_kind != wanted:
+            continue
+        moment = datetime.fromtimestamp(timestamp).isoformat()
+        if not filters.in_range(moment):
+            continue
+        if kind == RESULTS:
+            if filters.animal is None or data == filters.animal:
+                yield {'user_id': user_id, 'result_animal': data, 'completion_time': moment,
+                       'content_version': None, 'answers': None}
+        else:
+            yield {'user_id': user_id, 'timestamp': moment, 'result_animal': None, 'text': data}
+
+
+# Запись
+
+def write_rows(rows: Iterable[Dict[str, Any]], columns: Sequence[str], out: BinaryIO, fmt: str = JSONL,
+               compress: bool = False) -> int:
+    """
+    Пишет строки в поток по мере поступления
+
+    Args:
+        rows: Строки (словари с ключами columns)
+        columns: Порядок колонок CSV
+        out: Двоичный поток (файл или stdout.buffer)
+        fmt: CSV или JSONL
+        compress: Сжимать gzip на лету
+
+    Returns:
+        Число записанных строк
+    """
+    raw = gzip.GzipFile(fileobj=out, mode='wb', compresslevel=GZIP_LEVEL) if compress else out
+    text = io.TextIOWrapper(raw, encoding='utf-8', newline='', write_through=False)
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    count = 0
+    try:
+        if fmt == CSV:
+            # Ответы - объект JSON в одной ячейке; None csv пишет пустой строкой
+            writer = csv.writer(text)
+            writer.writerow(columns)
+            values = operator.itemgetter(*columns)
+            nested = [i for i, column in enumerate(columns) if column in JSON_COLUMNS]
+            for row in rows:
+                cells = list(values(row))
+                for i in nested:
+                    if cells[i] is not None:
+                        cells[i] = dumps(cells[i])
+                writer.writerow(cells)
+                count += 1
+        else:
+            for row in rows:
+                text.write(dumps(row))
+                text.write('\n')
+                count += 1
+        text.flush()
+    finally:
+        # Закрывается сжатие, а не сам поток: stdout остается открытым
+        text.detach()
+        if compress:
+            raw.close()
+    return count
+
+
+def export(rows: Iterable[Dict[str, Any]], kind: str, output: str, fmt: str = JSONL, compress: bool = False) -> int:
+    """
+    Выгрузка в файл (атомарно: файл появляется целиком) или в stdout ('-')
+
+    Returns:
+        Число строк
+    """
+    if output == '-':
+        return write_rows(rows, COLUMNS[kind], sys.stdout.buffer, fmt, compress)
+    tmp_path = f"{output}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            count = write_rows(rows, COLUMNS[kind], f, fmt, compress)
+        os.replace(tmp_path, output)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return count
+
+
+def open_store() -> SessionStore:
+    """Хранилище сессий: база, а без нее - снимок сессий бота"""
+    if SESSION_DB_PATH:
+        return SessionStore(SESSION_DB_PATH)
+    from session_snapshot import SessionSnapshots
+    store = SessionStore()
+    SessionSnapshots(store, SESSION_SNAPSHOT_PATH).restore(truncate=False)
+    return store
+
+
+def _namespace(value: str) -> int:
+    namespace = int(value)
+    if not 0 <= namespace < MAX_NAMESPACES:
+        raise argparse.ArgumentTypeError(f"must be in [0, {MAX_NAMESPACES})")
+    return namespace
+
+
+def _date(value: str) -> str:
+    # Дата или дата со временем в виде ISO-строки, как время в сессиях
+    return datetime.fromisoformat(value).isoformat()
+
+
+def build_parser(error: Optional[Callable[[str], None]] = None) -> argparse.ArgumentParser:
+    """Разбор аргументов CLI (и /export бота: error вызывается вместо выхода из процесса)"""
+    parser = argparse.ArgumentParser(prog='export.py', description="Выгрузка сессий, результатов и отзывов",
+                                     add_help=error is None)
+    if error is not None:
+        parser.error = error
+    parser.add_argument('kind', choices=(SESSIONS, RESULTS, FEEDBACK))
+    parser.add_argument('--source', choices=(STORE, JOURNAL), default=STORE,
+                        help="хранилище сессий или журнал событий")
+    parser.add_argument('--format', choices=(CSV, JSONL), default=JSONL)
+    parser.add_argument('--gzip', action='store_true', help="сжимать на лету")
+    parser.add_argument('--since', type=_date, help="с даты (включительно), например 2026-10-01")
+    parser.add_argument('--until', type=_date, help="до даты (не включая)")
+    parser.add_argument('--animal', help="только с этим результатом (ключ животного)")
+    parser.add_argument('--journal', default=EVENT_JOURNAL_DIR, help="каталог журнала")
+    parser.add_argument('--namespace', type=_namespace, default=0,
+                        help="номер викторины в общем хранилище сессий (см. quiz_host.py)")
+    parser.add_argument('-o', '--output', default='-', help="файл (по умолчанию stdout)")
+    return parser
+
+
+def main(argv: Sequence[str] = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.WARNING)
+    filters = Filters(args.since, args.until, args.animal)
+    started = time.perf_counter()
+
+    if args.source == JOURNAL:
+        from event_journal import iter_events, list_segments
+        try:
+            rows = journal_rows(iter_events(list_segments(args.journal)), args.kind, filters)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+        count = export(rows, args.kind, args.output, args.format, args.gzip)
+    else:
+        store = open_store()
+        try:
+            rows = store_rows(store, args.kind, filters, namespace=args.namespace)
+            count = export(rows, args.kind, args.output, args.format, args.gzip)
+        finally:
+            store.close()
+
+    print(f"{count} rows in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,364 @@
+"""
+Воронка викторины: время на вопрос и отсев
+
+Для каждого вопроса считается, сколько раз он показан и сколько раз на
+него ответили, а время от показа до ответа попадает в потоковый скетч
+квантилей (DDSketch): значения раскладываются по логарифмическим
+корзинам, поэтому любой квантиль известен с относительной погрешностью
+FUNNEL_SKETCH_ACCURACY, а память не зависит от числа ответов. Скетчи
+сливаются сложением корзин - так объединяются данные нескольких
+процессов.
+
+Каждый процесс раз в FUNNEL_SAVE_INTERVAL секунд записывает свое
+состояние в FUNNEL_STATS_DIR/funnel-<имя>.json и при запуске продолжает
+счет с него. Команда /stats и /metrics приемника scale_out.py сливают
+файлы всех процессов (load_funnels, merge_funnels).
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+from config import FUNNEL_STATS_DIR, FUNNEL_SAVE_INTERVAL, FUNNEL_SKETCH_ACCURACY
+
+logger = logging.getLogger(__name__)
+
+# Значения меньше этого (секунды) попадают в нулевую корзину
+MIN_VALUE = 1e-3
+# Больше корзин не бывает: самые нижние сливаются (от 1 мс до года при 1% - около 1100 корзин)
+MAX_BINS = 2048
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class QuantileSketch:
+    """Скетч квантилей с относительной погрешностью (DDSketch)"""
+
+    __slots__ = ('relative_accuracy', 'gamma', '_log_gamma', 'max_bins', 'bins', 'zero_count',
+                 'count', 'sum', 'min', 'max')
+
+    def __init__(self, relative_accuracy: float = FUNNEL_SKETCH_ACCURACY, max_bins: int = MAX_BINS):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.max_bins = max_bins
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float, count: int = 1):
+        """Добавляет значение"""
+        self.count += count
+        self.sum += value * count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if value < MIN_VALUE:
+            self.zero_count += count
+            return
+        key = math.ceil(math.log(value) / self._log_gamma)
+        self.bins[key] = self.bins.get(key, 0) + count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def _collapse(self):
+        # Сливаются самые нижние корзины: точность теряют только малые квантили
+        keys = sorted(self.bins)
+        excess = keys[:len(keys) - self.max_bins + 1]
+        self.bins[excess[-1]] += sum(self.bins.pop(key) for key in excess[:-1])
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Квантиль q (0..1)
+
+        Returns:
+            Значение с относительной погрешностью relative_accuracy или None, если скетч пуст
+        """
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return max(self.min, 0.0)
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                value = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def merge(self, other: 'QuantileSketch'):
+        """Добавляет значения другого скетча с той же точностью"""
+        if not math.isclose(self.gamma, other.gamma):
+            raise ValueError(f"Cannot merge sketches with accuracy {self.relative_accuracy} and {other.relative_accuracy}")
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        while len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'accuracy': self.relative_accuracy,
+            'zero': self.zero_count,
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+            'bins': sorted(self.bins.items()),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'QuantileSketch':
+        sketch = cls(data['accuracy'])
+        sketch.bins = {int(key): int(count) for key, count in data['bins']}
+        sketch.zero_count = data['zero']
+        sketch.count = data['count']
+        sketch.sum = data['sum']
+        if sketch.count:
+            sketch.min, sketch.max = data['min'], data['max']
+        return sketch
+
+
+class QuestionStats:
+    """Показы, ответы и время на ответ для одного вопроса"""
+
+    __slots__ = ('shown', 'answered', 'dwell')
+
+    def __init__(self, shown: int = 0, answered: int = 0, dwell: Optional[QuantileSketch] = None):
+        self.shown = shown
+        self.answered = answered
+        self.dwell = dwell if dwell is not None else QuantileSketch()
+
+    @property
+    def dropped(self) -> int:
+        """Показан, но ответа нет (ушли или еще думают)"""
+        return max(0, self.shown - self.answered)
+
+
+class QuestionFunnel:
+    """Воронка викторины одного процесса с сохранением и слиянием"""
+
+    def __init__(self, name: str = 'bot', directory: Optional[str] = FUNNEL_STATS_DIR,
+                 interval: float = FUNNEL_SAVE_INTERVAL):
+        """
+        Args:
+            name: Имя процесса (имя файла состояния)
+            directory: Каталог файлов состояния всех процессов (None - без сохранения)
+            interval: Как часто записывать состояние, секунды
+        """
+        self.name = name
+        self.directory = directory
+        self.interval = interval
+        self.started = 0
+        self.completed = 0
+        self.questions: Dict[int, QuestionStats] = {}
+        self._stopping: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _question(self, index: int) -> QuestionStats:
+        stats = self.questions.get(index)
+        if stats is None:
+            stats = self.questions[index] = QuestionStats()
+        return stats
+
+    # События викторины
+
+    def quiz_started(self):
+        self.started += 1
+
+    def question_shown(self, index: int):
+        self._question(index).shown += 1
+
+    def question_answered(self, index: int, dwell: Optional[float]):
+        """Ответ на вопрос; dwell - секунды с показа (None, если показ не отмечен)"""
+        stats = self._question(index)
+        stats.answered += 1
+        if dwell is not None:
+            stats.dwell.add(max(0.0, dwell))
+
+    def quiz_completed(self):
+        self.completed += 1
+
+    # Слияние и сохранение
+
+    def merge(self, other: 'QuestionFunnel'):
+        """Добавляет счетчики и скетчи другой воронки"""
+        self.started += other.started
+        self.completed += other.completed
+        for index, theirs in other.questions.items():
+            ours = self._question(index)
+            ours.shown += theirs.shown
+            ours.answered += theirs.answered
+            ours.dwell.merge(theirs.dwell)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'started': self.started,
+            'completed': self.completed,
+            'questions': {
+                str(index): {'shown': stats.shown, 'answered': stats.answered, 'dwell': stats.dwell.to_dict()}
+                for index, stats in sorted(self.questions.items())
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], **kwargs) -> 'QuestionFunnel':
+        funnel = cls(data.get('name', 'bot'), **kwargs)
+        funnel.started = data['started']
+        funnel.completed = data['completed']
+        for index, stats in data['questions'].items():
+            funnel.questions[int(index)] = QuestionStats(
+                stats['shown'], stats['answered'], QuantileSketch.from_dict(stats['dwell'])
+            )
+        return funnel
+
+    @property
+    def path(self) -> Optional[str]:
+        return os.path.join(self.directory, f"funnel-{self.name}.json") if self.directory else None
+
+    def restore(self) -> bool:
+        """Продолжает счет с сохраненного состояния этого процесса"""
+        if not self.path:
+            return False
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self.merge(QuestionFunnel.from_dict(json.load(f)))
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Failed to restore funnel stats from {self.path}: {e}")
+            return False
+        logger.info(f"Restored funnel stats from {self.path}: {self.started} quizzes started")
+        return True
+
+    def save(self):
+        """Атомарно записывает состояние"""
+        if self.path:
+            self._write(self._encode())
+
+    def _encode(self) -> str:
+        return json.dumps(self.to_dict(), separators=(',', ':'))
+
+    def _write(self, data: str):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                # Кодирование - в цикле событий, пока счетчики никто не меняет; запись - в потоке
+                await loop.run_in_executor(None, self._write, self._encode())
+            except OSError as e:
+                logger.error(f"Failed to save funnel stats: {e}")
+
+    def start(self):
+        """Запускает периодическую запись состояния"""
+        if not self.directory:
+            return
+        self._stopping = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Останавливает периодическую запись и записывает состояние"""
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+        try:
+            self.save()
+        except OSError as e:
+            logger.error(f"Failed to save funnel stats: {e}")
+
+
+def load_funnels(directory: Optional[str], exclude: Optional[str] = None) -> List[QuestionFunnel]:
+    """Сохраненные воронки всех процессов из каталога"""
+    if not directory or not os.path.isdir(directory):
+        return []
+    funnels = []
+    for filename in sorted(os.listdir(directory)):
+        if not (filename.startswith('funnel-') and filename.endswith('.json')):
+            continue
+        if exclude is not None and filename == f"funnel-{exclude}.json":
+            continue
+        try:
+            with open(os.path.join(directory, filename), encoding='utf-8') as f:
+                funnels.append(QuestionFunnel.from_dict(json.load(f), directory=None))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Skipping funnel stats {filename}: {e}")
+    return funnels
+
+
+def merge_funnels(funnels: Iterable[QuestionFunnel]) -> QuestionFunnel:
+    """Сумма воронок нескольких процессов"""
+    total = QuestionFunnel('total', directory=None)
+    for funnel in funnels:
+        total.merge(funnel)
+    return total
+
+
+def format_stats(funnel: QuestionFunnel) -> str:
+    """Текст для /stats: отсев и квантили времени по вопросам"""
+    lines = [f"📊 Начали викторину: {funnel.started}, завершили: {funnel.completed}"]
+    for index, stats in sorted(funnel.questions.items()):
+        quantiles = ', '.join(
+            f"p{round(q * 100)} {_format_seconds(stats.dwell.quantile(q))}" for q in QUANTILES
+        ) if stats.dwell.count else "нет данных"
+        drop = f" (−{stats.dropped / stats.shown:.0%})" if stats.dropped else ""
+        lines.append(f"{index + 1}. показан {stats.shown}, ответили {stats.answered}{drop}; {quantiles}")
+    return '\n'.join(lines)
+
+
+def _format_seconds(value: float) -> str:
+    return f"{value:.1f} с" if value < 60 else f"{value / 60:.1f} мин"
+
+
+def render_metrics(funnel: QuestionFunnel) -> str:
+    """Воронка в текстовом формате Prometheus"""
+    lines = [
+        "# HELP quiz_started_total Quizzes started",
+        "# TYPE quiz_started_total counter",
+        f"quiz_started_total {funnel.started}",
+        "# HELP quiz_completed_total Quizzes completed",
+        "# TYPE quiz_completed_total counter",
+        f"quiz_completed_total {funnel.completed}",
+        "# HELP quiz_question_shown_total Times a question was shown",
+        "# TYPE quiz_question_shown_total counter",
+    ]
+    questions = sorted(funnel.questions.items())
+    lines += [f'quiz_question_shown_total{{question="{index + 1}"}} {stats.shown}' for index, stats in questions]
+    lines += [
+        "# HELP quiz_question_answered_total Times a question was answered",
+        "# TYPE quiz_question_answered_total counter",
+    ]
+    lines += [f'quiz_question_answered_total{{question="{index + 1}"}} {stats.answered}' for index, stats in questions]
+    lines += [
+        "# HELP quiz_question_dwell_seconds Time from showing a question to its answer",
+        "# TYPE quiz_question_dwell_seconds summary",
+    ]
+    for index, stats in questions:
+        label = f'question="{index + 1}"'
+        if stats.dwell.count:
+            lines += [f'quiz_question_dwell_seconds{{{label},quantile="{q}"}} {stats.dwell.quantile(q):.3f}'
+                      for q in QUANTILES]
+        lines.append(f'quiz_question_dwell_seconds_sum{{{label}}} {stats.dwell.sum:.3f}')
+        lines.append(f'quiz_question_dwell_seconds_count{{{label}}} {stats.dwell.count}')
+    return '\n'.join(lines) + '\n'
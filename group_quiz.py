@@ -0,0 +1,294 @@
+"""
+Викторина в групповом чате
+
+Команда /groupquiz в группе публикует одно общее сообщение с вопросом,
+участники отвечают кнопками под ним. Голоса копятся в памяти (GroupQuiz),
+а сообщение перерисовывается не на каждое нажатие: не чаще раза в
+GROUP_REFRESH_INTERVAL секунд и только если что-то изменилось. Десятки
+нажатий за секунду дают одну правку editMessageText, и частота правок
+остается в пределах лимита Telegram для группы (около 20 сообщений в
+минуту). Каждое нажатие подтверждается answerCallbackQuery, на этот
+вызов лимит группы не распространяется.
+
+Вопрос закрывается через GROUP_QUESTION_TIME секунд или кнопкой «Дальше»
+(ее может нажать только тот, кто начал викторину). После последнего
+вопроса сообщение превращается в итог: сколько участников получили
+каждое животное и животное каждого участника.
+
+Состояние хранится только в памяти процесса, в котором идет викторина
+(scale_out.py направляет апдейты группового чата в один процесс по id чата).
+"""
+
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from config import GROUP_REFRESH_INTERVAL, GROUP_QUESTION_TIME, GROUP_RESULT_LINES
+
+logger = logging.getLogger(__name__)
+
+ACCEPTED, CHANGED, CLOSED = 'accepted', 'changed', 'closed'
+# Ширина полосы с долей голосов, символов
+BAR_WIDTH = 10
+# Ограничение Telegram на длину текста сообщения
+MAX_TEXT_LENGTH = 4096
+
+
+def _seconds(delay) -> float:
+    # retry_after - int или timedelta в зависимости от версии python-telegram-bot
+    return delay.total_seconds() if isinstance(delay, timedelta) else float(delay)
+
+
+class GroupQuiz:
+    """Состояние викторины одного группового чата"""
+
+    def __init__(self, chat_id: int, message_id: Optional[int], content, host_id: int, question_time: float):
+        """
+        Args:
+            chat_id: Групповой чат
+            message_id: Общее сообщение викторины
+            content: Версия контента (CompiledContent), на которой идет викторина
+            host_id: Кто начал викторину (может закрыть вопрос досрочно)
+            question_time: Сколько секунд открыт каждый вопрос
+        """
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.content = content
+        self.host_id = host_id
+        self.question_time = question_time
+        self.question = 0
+        self.deadline = time.monotonic() + question_time
+        self.answers: Dict[int, Dict[int, int]] = {}
+        self.names: Dict[int, str] = {}
+        self.tallies: List[List[int]] = [[0] * len(question['options']) for question in content.questions]
+        self.finished = False
+        # Сообщение отстает от голосов; первое сообщение отправлено уже отрисованным
+        self.dirty = False
+        self.wakeup = asyncio.Event()
+
+    def vote(self, user_id: int, name: str, question: int, option: int) -> str:
+        """
+        Голос участника за вариант текущего вопроса
+
+        Returns:
+            ACCEPTED (новый голос или тот же), CHANGED (голос изменен) или CLOSED (вопрос уже закрыт)
+        """
+        if self.finished or question != self.question or not 0 <= option < len(self.tallies[question]):
+            return CLOSED
+        answers = self.answers.setdefault(user_id, {})
+        previous = answers.get(question)
+        self.names[user_id] = name
+        if previous == option:
+            return ACCEPTED
+        if previous is not None:
+            self.tallies[question][previous] -= 1
+        self.tallies[question][option] += 1
+        answers[question] = option
+        self._changed()
+        return ACCEPTED if previous is None else CHANGED
+
+    def close_question(self):
+        """Досрочно закрывает текущий вопрос"""
+        self.deadline = 0.0
+        self.wakeup.set()
+
+    def advance(self) -> bool:
+        """
+        Переход к следующему вопросу
+
+        Returns:
+            False, если вопросы закончились
+        """
+        self.question += 1
+        if self.question >= len(self.content.questions):
+            self.finished = True
+            return False
+        self.deadline = time.monotonic() + self.question_time
+        self._changed()
+        return True
+
+    def _changed(self):
+        if not self.dirty:
+            self.dirty = True
+            self.wakeup.set()
+
+    def render(self) -> Tuple[str, InlineKeyboardMarkup]:
+        """Текст и кнопки текущего вопроса с голосами"""
+        q = self.question
+        question = self.content.questions[q]
+        tally = self.tallies[q]
+        total = sum(tally)
+        lines = [
+            f"👥 Викторина группы: вопрос {q + 1} из {len(self.content.questions)}",
+            "",
+            question['question'],
+            "",
+        ]
+        for i, (option, count) in enumerate(zip(question['options'], tally)):
+            filled = round(BAR_WIDTH * count / total) if total else 0
+            lines.append(f"{i + 1}. {option['text']}")
+            lines.append(f"   {'▓' * filled}{'░' * (BAR_WIDTH - filled)} {count}")
+        lines += ["", f"Ответили: {total} · на вопрос {self.question_time:.0f} с"]
+        keyboard = [
+            [InlineKeyboardButton(f"{i + 1}. {option['text']}", callback_data=f"group_{q}_{i}")]
+            for i, option in enumerate(question['options'])
+        ]
+        keyboard.append([InlineKeyboardButton("➡️ Дальше", callback_data="groupnext")])
+        return '\n'.join(lines), InlineKeyboardMarkup(keyboard)
+
+    def render_results(self, results: Dict[int, Optional[str]], max_lines: int = GROUP_RESULT_LINES) -> str:
+        """Итог: распределение животных и животное каждого участника"""
+        animals = self.content.animals
+        counts: Dict[str, int] = {}
+        for animal in results.values():
+            if animal:
+                counts[animal] = counts.get(animal, 0) + 1
+        lines = [f"🎉 Викторина группы завершена! Участников: {len(results)}", ""]
+        for animal, count in sorted(counts.items(), key=lambda item: -item[1]):
+            lines.append(f"{animals[animal]['emoji']} {animals[animal]['name']}: {count}")
+        lines.append("")
+        members = sorted((user_id for user_id in results if results[user_id]), key=lambda user_id: self.names[user_id])
+        for user_id in members[:max_lines]:
+            animal = animals[results[user_id]]
+            lines.append(f"{self.names[user_id]} - {animal['emoji']} {animal['name']}")
+        if len(members) > max_lines:
+            lines.append(f"... и еще {len(members) - max_lines}")
+        text = '\n'.join(lines)
+        return text if len(text) <= MAX_TEXT_LENGTH else text[:MAX_TEXT_LENGTH - 1] + '…'
+
+
+class GroupQuizzes:
+    """Идущие групповые викторины и перерисовка их сообщений"""
+
+    def __init__(self, score: Callable[[object, Dict[int, int]], Optional[str]],
+                 refresh_interval: float = GROUP_REFRESH_INTERVAL, question_time: float = GROUP_QUESTION_TIME):
+        """
+        Args:
+            score: Животное участника по версии контента и его ответам
+            refresh_interval: Минимальный интервал между правками сообщения, секунды
+            question_time: Сколько секунд открыт каждый вопрос
+        """
+        self.score = score
+        self.refresh_interval = refresh_interval
+        self.question_time = question_time
+        self.active: Dict[int, GroupQuiz] = {}
+        self.votes = 0
+        self.edits = 0
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    async def start(self, bot, chat_id: int, content, host_id: int) -> Optional[GroupQuiz]:
+        """
+        Начинает викторину в чате: отправляет общее сообщение с первым вопросом
+
+        Returns:
+            Викторина или None, если в чате уже идет другая
+        """
+        if chat_id in self.active:
+            return None
+        quiz = GroupQuiz(chat_id, None, content, host_id, self.question_time)
+        # Чат занят еще до отправки сообщения: вторая /groupquiz не начнет параллельную викторину
+        self.active[chat_id] = quiz
+        try:
+            text, reply_markup = quiz.render()
+            message = await bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+        except BaseException:
+            del self.active[chat_id]
+            raise
+        quiz.message_id = message.message_id
+        quiz.deadline = time.monotonic() + self.question_time
+        self._tasks[chat_id] = asyncio.get_running_loop().create_task(self._run(bot, quiz))
+        logger.info(f"Group quiz started in chat {chat_id} by user {host_id}")
+        return quiz
+
+    def vote(self, chat_id: int, message_id: int, user_id: int, name: str, question: int, option: int) -> str:
+        """Голос участника (CLOSED, если в этом сообщении викторина не идет)"""
+        quiz = self.active.get(chat_id)
+        if quiz is None or quiz.message_id != message_id:
+            return CLOSED
+        status = quiz.vote(user_id, name, question, option)
+        if status != CLOSED:
+            self.votes += 1
+        return status
+
+    async def _run(self, bot, quiz: GroupQuiz):
+        # Сообщение правится не чаще раза в refresh_interval и только если отстает от голосов
+        last_edit = time.monotonic()
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= quiz.deadline and not quiz.advance():
+                    break
+                allowed = last_edit + self.refresh_interval
+                if quiz.dirty and now >= allowed:
+                    if not await self._edit(bot, quiz, *quiz.render()):
+                        return
+                    last_edit = time.monotonic()
+                    continue
+                timeout = quiz.deadline - now
+                if quiz.dirty:
+                    timeout = min(timeout, allowed - now)
+                quiz.wakeup.clear()
+                try:
+                    await asyncio.wait_for(quiz.wakeup.wait(), max(0.0, timeout))
+                except asyncio.TimeoutError:
+                    pass
+
+            results = {user_id: self.score(quiz.content, answers) for user_id, answers in quiz.answers.items()}
+            text = quiz.render_results(results)
+            # Итог больше никто не перерисует: правка повторяется, пока не пройдет или сообщение не исчезнет
+            while True:
+                await asyncio.sleep(max(0.0, last_edit + self.refresh_interval - time.monotonic()))
+                if not await self._edit(bot, quiz, text, None) or not quiz.dirty:
+                    break
+                last_edit = time.monotonic()
+            logger.info(f"Group quiz finished in chat {quiz.chat_id}: {len(results)} members, "
+                        f"{self.edits} edits for {self.votes} votes so far")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Group quiz in chat {quiz.chat_id} failed: {e}", exc_info=e)
+        finally:
+            quiz.finished = True
+            if self.active.get(quiz.chat_id) is quiz:
+                del self.active[quiz.chat_id]
+                del self._tasks[quiz.chat_id]
+
+    async def _edit(self, bot, quiz: GroupQuiz, text: str, reply_markup: Optional[InlineKeyboardMarkup]) -> bool:
+        """
+        Правка общего сообщения; при ошибке сообщение остается устаревшим до следующей попытки
+
+        Returns:
+            False, если сообщение удалено и викторину некуда показывать
+        """
+        # Голоса, пришедшие во время правки, снова отметят сообщение устаревшим
+        quiz.dirty = False
+        try:
+            await bot.edit_message_text(chat_id=quiz.chat_id, message_id=quiz.message_id, text=text,
+                                        reply_markup=reply_markup)
+            self.edits += 1
+        except RetryAfter as e:
+            logger.warning(f"Flood control in group chat {quiz.chat_id}, pausing edits for {e.retry_after}")
+            quiz.dirty = True
+            await asyncio.sleep(_seconds(e.retry_after))
+        except BadRequest as e:
+            if 'not found' in str(e).lower():
+                logger.info(f"Group quiz message in chat {quiz.chat_id} is gone, stopping")
+                return False
+            if 'not modified' not in str(e).lower():
+                logger.warning(f"Failed to edit group quiz in chat {quiz.chat_id}: {e}")
+        except NetworkError as e:
+            logger.warning(f"Failed to edit group quiz in chat {quiz.chat_id}: {e}")
+            quiz.dirty = True
+        return True
+
+    async def stop(self):
+        """Останавливает перерисовку всех викторин (при остановке бота)"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -2,17 +2,36 @@
 Модуль для генерации изображений с результатами викторины
 """
 
-from PIL import Image, ImageDraw, ImageFont
+import io
 import os
-from typing import Dict, Any
+import threading
+from typing import Dict, Any, Optional, Sequence
 from quiz_data import ANIMALS
+from ranking import Match
+
+
+def _load_pil():
+    """Pillow импортируется при первой генерации изображения, а не при старте бота"""
+    from PIL import Image, ImageDraw, ImageFont
+    return Image, ImageDraw, ImageFont
 
 class ResultImageGenerator:
-    def __init__(self):
+    def __init__(self, animals: Optional[Dict[str, Dict[str, Any]]] = None, output_dir: str = "generated_images"):
+        # Животные викторины (по умолчанию из quiz_data.py) и каталог готовых изображений
+        self.animals = ANIMALS if animals is None else animals
+        self.output_dir = output_dir
         self.font_path = "arial.ttf"  # В продакшене лучше использовать системные шрифты
         self.default_font_size = 24
         self.title_font_size = 36
         self.subtitle_font_size = 28
+        self.result_width = 800
+        self.result_height = 1000
+        
+        # Шрифты и неизменные части карточек результата (по животному) переиспользуются между вызовами;
+        # генерация идет в пуле потоков, а объекты шрифтов FreeType не потокобезопасны
+        self._fonts = {}
+        self._layers = {}
+        self._lock = threading.Lock()
         
         # Цвета для оформления
         self.colors = {
@@ -23,97 +42,202 @@ class ResultImageGenerator:
             'accent': (255, 140, 0)
         }
     
-    def generate_result_image(self, animal_key: str, user_name: str = "Пользователь") -> str:
+    def _font(self, size: int):
+        """Шрифт нужного размера (загружается один раз)"""
+        font = self._fonts.get(size)
+        if font is None:
+            _, _, ImageFont = _load_pil()
+            try:
+                font = ImageFont.truetype(self.font_path, size)
+            except OSError:
+                # Fallback на стандартный шрифт
+                font = ImageFont.load_default()
+            self._fonts[size] = font
+        return font
+    
+    def _result_layer(self, animal_key: str, animals: Dict[str, Dict[str, Any]], version: Optional[str]):
+        """
+        Неизменная часть карточки результата: заголовок, описание, факты и опека
+        
+        Returns:
+            Изображение высотой по содержимому и координата y, с которой продолжается карточка
+        """
+        # После перезагрузки контента описание того же животного может быть другим
+        layer = self._layers.get((version, animal_key))
+        if layer is not None:
+            return layer
+        
+        animal_info = animals[animal_key]
+        Image, ImageDraw, _ = _load_pil()
+        title_font = self._font(self.title_font_size)
+        subtitle_font = self._font(self.subtitle_font_size)
+        body_font = self._font(self.default_font_size)
+        
+        img = Image.new('RGB', (self.result_width, self.result_height * 2), self.colors['background'])
+        draw = ImageDraw.Draw(img)
+        
+        # Заголовок
+        title_text = f"Твое тотемное животное:"
+        title_bbox = draw.textbbox((0, 0), title_text, font=title_font)
+        title_width = title_bbox[2] - title_bbox[0]
+        title_x = (self.result_width - title_width) // 2
+        draw.text((title_x, 50), title_text, font=title_font, fill=self.colors['title'])
+        
+        # Название животного с эмодзи
+        animal_title = f"{animal_info['emoji']} {animal_info['name']} {animal_info['emoji']}"
+        animal_bbox = draw.textbbox((0, 0), animal_title, font=subtitle_font)
+        animal_width = animal_bbox[2] - animal_bbox[0]
+        animal_x = (self.result_width - animal_width) // 2
+        draw.text((animal_x, 120), animal_title, font=subtitle_font, fill=self.colors['subtitle'])
+        
+        # Описание животного
+        description = animal_info['description']
+        description_lines = self._wrap_text(description, body_font, self.result_width - 100)
+        
+        y_position = 200
+        for line in description_lines:
+            draw.text((50, y_position), line, font=body_font, fill=self.colors['text'])
+            y_position += 30
+        
+        # Интересные факты
+        y_position += 20
+        facts_title = "🐾 Интересные факты:"
+        draw.text((50, y_position), facts_title, font=subtitle_font, fill=self.colors['accent'])
+        y_position += 40
+        
+        facts = animal_info['zoo_facts']
+        facts_lines = self._wrap_text(facts, body_font, self.result_width - 100)
+        
+        for line in facts_lines:
+            draw.text((50, y_position), line, font=body_font, fill=self.colors['text'])
+            y_position += 25
+        
+        # Информация об опеке
+        y_position += 20
+        guardian_title = "💝 О программе опеки:"
+        draw.text((50, y_position), guardian_title, font=subtitle_font, fill=self.colors['accent'])
+        y_position += 40
+        
+        guardian_info = animal_info['guardian_info']
+        guardian_lines = self._wrap_text(guardian_info, body_font, self.result_width - 100)
+        
+        for line in guardian_lines:
+            draw.text((50, y_position), line, font=body_font, fill=self.colors['text'])
+            y_position += 25
+        
+        layer = (img.crop((0, 0, self.result_width, y_position)), y_position)
+        self._layers[(version, animal_key)] = layer
+        return layer
+    
+    def _draw_profile(self, draw, y_position: int, profile: Sequence[Match],
+                      animals: Dict[str, Dict[str, Any]]) -> int:
+        """
+        Столбчатая диаграмма профиля совместимости
+        
+        Returns:
+            Координата y под диаграммой
+        """
+        subtitle_font = self._font(self.subtitle_font_size)
+        body_font = self._font(self.default_font_size)
+        y_position += 20
+        draw.text((50, y_position), "📊 Совместимость:", font=subtitle_font, fill=self.colors['accent'])
+        y_position += 40
+        
+        bar_left, bar_right = 300, self.result_width - 130
+        best = profile[0].score
+        for place, match in enumerate(profile):
+            animal_info = animals.get(match.animal, {'name': match.animal})
+            draw.text((50, y_position), animal_info['name'], font=body_font, fill=self.colors['text'])
+            bar_width = max(1, round((bar_right - bar_left) * match.score / best))
+            color = self.colors['title'] if place == 0 else self.colors['subtitle']
+            draw.rectangle((bar_left, y_position + 4, bar_left + bar_width, y_position + 24), fill=color)
+            draw.text((bar_right + 15, y_position), f"{match.percent:.0f}%", font=body_font, fill=self.colors['text'])
+            y_position += 34
+        return y_position
+    
+    def generate_result_image(self, animal_key: str, user_name: str = "Пользователь",
+                              profile: Optional[Sequence[Match]] = None, content=None) -> str:
         """
         Генерирует изображение с результатом викторины
         
+        Описание животного рисуется один раз и берется из кеша, для каждого
+        пользователя дорисовываются только профиль и подпись.
+        
         Args:
-            animal_key: Ключ животного из ANIMALS
+            animal_key: Ключ животного
             user_name: Имя пользователя
+            profile: Профиль совместимости (AnimalRanking.top), рисуется диаграммой
+            content: Версия контента (CompiledContent), из которой берутся описания (по умолчанию self.animals)
             
         Returns:
             Путь к сгенерированному изображению
         """
-        if animal_key not in ANIMALS:
+        animals = self.animals if content is None else content.animals
+        if animal_key not in animals:
             raise ValueError(f"Unknown animal: {animal_key}")
         
-        animal_info = ANIMALS[animal_key]
-        
-        # Создание изображения
-        img_width = 800
-        img_height = 1000
-        
-        # Создаем новое изображение
-        img = Image.new('RGB', (img_width, img_height), self.colors['background'])
-        draw = ImageDraw.Draw(img)
-        
         try:
-            # Загружаем шрифты (используем стандартные, если custom не найден)
-            try:
-                title_font = ImageFont.truetype(self.font_path, self.title_font_size)
-                subtitle_font = ImageFont.truetype(self.font_path, self.subtitle_font_size)
-                body_font = ImageFont.truetype(self.font_path, self.default_font_size)
-            except:
-                # Fallback на стандартные шрифты
-                title_font = ImageFont.load_default()
-                subtitle_font = ImageFont.load_default()
-                body_font = ImageFont.load_default()
-            
-            # Заголовок
-            title_text = f"Твое тотемное животное:"
-            title_bbox = draw.textbbox((0, 0), title_text, font=title_font)
-            title_width = title_bbox[2] - title_bbox[0]
-            title_x = (img_width - title_width) // 2
-            draw.text((title_x, 50), title_text, font=title_font, fill=self.colors['title'])
-            
-            # Название животного с эмодзи
-            animal_title = f"{animal_info['emoji']} {animal_info['name']} {animal_info['emoji']}"
-            animal_bbox = draw.textbbox((0, 0), animal_title, font=subtitle_font)
-            animal_width = animal_bbox[2] - animal_bbox[0]
-            animal_x = (img_width - animal_width) // 2
-            draw.text((animal_x, 120), animal_title, font=subtitle_font, fill=self.colors['subtitle'])
+            img = self._draw_result(animal_key, user_name, profile, content)
             
-            # Описание животного
-            description = animal_info['description']
-            description_lines = self._wrap_text(description, body_font, img_width - 100)
-            
-            y_position = 200
-            for line in description_lines:
-                draw.text((50, y_position), line, font=body_font, fill=self.colors['text'])
-                y_position += 30
-            
-            # Интересные факты
-            y_position += 20
-            facts_title = "🐾 Интересные факты:"
-            draw.text((50, y_position), facts_title, font=subtitle_font, fill=self.colors['accent'])
-            y_position += 40
+            # Сохранение изображения
+            filename = f"result_{animal_key}_{user_name.lower().replace(' ', '_')}.png"
+            filepath = os.path.join(self.output_dir, filename)
             
-            facts = animal_info['zoo_facts']
-            facts_lines = self._wrap_text(facts, body_font, img_width - 100)
+            # Создаем папку, если её нет
+            os.makedirs(self.output_dir, exist_ok=True)
             
-            for line in facts_lines:
-                draw.text((50, y_position), line, font=body_font, fill=self.colors['text'])
-                y_position += 25
+            img.save(filepath, "PNG")
+            return filepath
             
-            # Информация об опеке
-            y_position += 20
-            guardian_title = "💝 О программе опеки:"
-            draw.text((50, y_position), guardian_title, font=subtitle_font, fill=self.colors['accent'])
-            y_position += 40
+        except Exception as e:
+            print(f"Error generating image: {e}")
+            # Возвращаем пустое изображение в случае ошибки
+            return None
+    
+    def render_result_image(self, animal_key: str, user_name: str = "Пользователь",
+                            profile: Optional[Sequence[Match]] = None, content=None) -> bytes:
+        """
+        Карточка результата в памяти (PNG) - для отправки без временного файла
+        
+        Args:
+            content: Версия контента (CompiledContent), на которой прошла викторина (по умолчанию self.animals)
+        
+        Raises:
+            ValueError: Неизвестное животное
+        """
+        animals = self.animals if content is None else content.animals
+        if animal_key not in animals:
+            raise ValueError(f"Unknown animal: {animal_key}")
+        buffer = io.BytesIO()
+        self._draw_result(animal_key, user_name, profile, content).save(buffer, "PNG")
+        return buffer.getvalue()
+    
+    def _draw_result(self, animal_key: str, user_name: str, profile: Optional[Sequence[Match]], content=None):
+        """Карточка результата (PIL.Image): кешированная часть, профиль и подпись"""
+        Image, ImageDraw, _ = _load_pil()
+        animals = self.animals if content is None else content.animals
+        version = None if content is None else content.version
+        
+        with self._lock:
+            layer, y_position = self._result_layer(animal_key, animals, version)
+            body_font = self._font(self.default_font_size)
             
-            guardian_info = animal_info['guardian_info']
-            guardian_lines = self._wrap_text(guardian_info, body_font, img_width - 100)
+            # Профиль и подпись - под неизменной частью, высота не меньше прежних 1000 px
+            profile_height = 60 + 34 * len(profile) if profile else 0
+            img_height = max(self.result_height, y_position + profile_height + 120)
+            img = Image.new('RGB', (self.result_width, img_height), self.colors['background'])
+            img.paste(layer, (0, 0))
+            draw = ImageDraw.Draw(img)
             
-            for line in guardian_lines:
-                draw.text((50, y_position), line, font=body_font, fill=self.colors['text'])
-                y_position += 25
+            if profile:
+                y_position = self._draw_profile(draw, y_position, profile, animals)
             
             # Подпись
             y_position += 30
             signature = f"Сгенерировано для {user_name}"
             signature_bbox = draw.textbbox((0, 0), signature, font=body_font)
             signature_width = signature_bbox[2] - signature_bbox[0]
-            signature_x = (img_width - signature_width) // 2
+            signature_x = (self.result_width - signature_width) // 2
             draw.text((signature_x, y_position), signature, font=body_font, fill=self.colors['subtitle'])
             
             # Логотип зоопарка (текстовый)
@@ -121,23 +245,10 @@ class ResultImageGenerator:
             logo_text = "🐾 Московский зоопарк 🐾"
             logo_bbox = draw.textbbox((0, 0), logo_text, font=body_font)
             logo_width = logo_bbox[2] - logo_bbox[0]
-            logo_x = (img_width - logo_width) // 2
+            logo_x = (self.result_width - logo_width) // 2
             draw.text((logo_x, y_position), logo_text, font=body_font, fill=self.colors['title'])
-            
-            # Сохранение изображения
-            filename = f"result_{animal_key}_{user_name.lower().replace(' ', '_')}.png"
-            filepath = os.path.join("generated_images", filename)
-            
-            # Создаем папку, если её нет
-            os.makedirs("generated_images", exist_ok=True)
-            
-            img.save(filepath, "PNG")
-            return filepath
-            
-        except Exception as e:
-            print(f"Error generating image: {e}")
-            # Возвращаем пустое изображение в случае ошибки
-            return None
+        
+        return img
     
     def _wrap_text(self, text: str, font, max_width: int) -> list:
         """
@@ -172,21 +283,24 @@ class ResultImageGenerator:
         
         return lines
     
-    def create_shareable_image(self, animal_key: str, user_name: str = "Пользователь") -> str:
+    def create_shareable_image(self, animal_key: str, user_name: str = "Пользователь", content=None) -> str:
         """
         Создает изображение для публикации в социальных сетях
         
         Args:
             animal_key: Ключ животного
             user_name: Имя пользователя
+            content: Версия контента (CompiledContent), из которой берется описание (по умолчанию self.animals)
             
         Returns:
             Путь к изображению
         """
-        if animal_key not in ANIMALS:
+        animals = self.animals if content is None else content.animals
+        if animal_key not in animals:
             raise ValueError(f"Unknown animal: {animal_key}")
         
-        animal_info = ANIMALS[animal_key]
+        animal_info = animals[animal_key]
+        Image, ImageDraw, _ = _load_pil()
         
         # Создание изображения для соцсетей (квадратное)
         img_size = 1080
@@ -194,64 +308,62 @@ class ResultImageGenerator:
         draw = ImageDraw.Draw(img)
         
         try:
-            # Загружаем шрифты
-            try:
-                title_font = ImageFont.truetype(self.font_path, 48)
-                subtitle_font = ImageFont.truetype(self.font_path, 36)
-                body_font = ImageFont.truetype(self.font_path, 24)
-            except:
-                title_font = ImageFont.load_default()
-                subtitle_font = ImageFont.load_default()
-                body_font = ImageFont.load_default()
+            with self._lock:
+                # Загружаем шрифты
+                title_font = self._font(48)
+                subtitle_font = self._font(36)
+                body_font = self._font(24)
             
-            # Центральный эмодзи животного
-            emoji_size = 200
-            emoji_x = (img_size - emoji_size) // 2
-            emoji_y = 100
+                # Центральный эмодзи животного
+                emoji_size = 200
+                emoji_x = (img_size - emoji_size) // 2
+                emoji_y = 100
             
-            # Рисуем большой эмодзи (используем текст как эмодзи)
-            draw.text((emoji_x, emoji_y), animal_info['emoji'], font=title_font, fill=self.colors['accent'])
+                # Рисуем большой эмодзи (используем текст как эмодзи)
+                draw.text((emoji_x, emoji_y), animal_info['emoji'], font=title_font, fill=self.colors['accent'])
             
-            # Название животного
-            animal_name = animal_info['name']
-            name_bbox = draw.textbbox((0, 0), animal_name, font=subtitle_font)
-            name_width = name_bbox[2] - name_bbox[0]
-            name_x = (img_size - name_width) // 2
-            draw.text((name_x, emoji_y + 120), animal_name, font=subtitle_font, fill=self.colors['title'])
+                # Название животного
+                animal_name = animal_info['name']
+                name_bbox = draw.textbbox((0, 0), animal_name, font=subtitle_font)
+                name_width = name_bbox[2] - name_bbox[0]
+                name_x = (img_size - name_width) // 2
+                draw.text((name_x, emoji_y + 120), animal_name, font=subtitle_font, fill=self.colors['title'])
             
-            # Краткое описание
-            description = animal_info['description'][:100] + "..." if len(animal_info['description']) > 100 else animal_info['description']
-            desc_lines = self._wrap_text(description, body_font, img_size - 100)
+                # Краткое описание
+                description = animal_info['description'][:100] + "..." if len(animal_info['description']) > 100 else animal_info['description']
+                desc_lines = self._wrap_text(description, body_font, img_size - 100)
             
-            y_position = emoji_y + 200
-            for line in desc_lines:
-                line_bbox = draw.textbbox((0, 0), line, font=body_font)
-                line_width = line_bbox[2] - line_bbox[0]
-                line_x = (img_size - line_width) // 2
-                draw.text((line_x, y_position), line, font=body_font, fill=self.colors['text'])
-                y_position += 30
+                y_position = emoji_y + 200
+                for line in desc_lines:
+                    line_bbox = draw.textbbox((0, 0), line, font=body_font)
+                    line_width = line_bbox[2] - line_bbox[0]
+                    line_x = (img_size - line_width) // 2
+                    draw.text((line_x, y_position), line, font=body_font, fill=self.colors['text'])
+                    y_position += 30
             
-            # Призыв к действию
-            y_position += 40
-            cta_text = "🐾 Узнай больше о программе опеки!"
-            cta_bbox = draw.textbbox((0, 0), cta_text, font=body_font)
-            cta_width = cta_bbox[2] - cta_bbox[0]
-            cta_x = (img_size - cta_width) // 2
-            draw.text((cta_x, y_position), cta_text, font=body_font, fill=self.colors['accent'])
+                # Призыв к действию
+                y_position += 40
+                cta_text = "🐾 Узнай больше о программе опеки!"
+                cta_bbox = draw.textbbox((0, 0), cta_text, font=body_font)
+                cta_width = cta_bbox[2] - cta_bbox[0]
+                cta_x = (img_size - cta_width) // 2
+                draw.text((cta_x, y_position), cta_text, font=body_font, fill=self.colors['accent'])
             
-            # Логотип и ссылка
-            y_position += 60
-            logo_text = "Московский зоопарк"
-            logo_bbox = draw.textbbox((0, 0), logo_text, font=body_font)
-            logo_width = logo_bbox[2] - logo_bbox[0]
-            logo_x = (img_size - logo_width) // 2
-            draw.text((logo_x, y_position), logo_text, font=body_font, fill=self.colors['subtitle'])
+                # Логотип и ссылка
+                y_position += 60
+                logo_text = "Московский зоопарк"
+                logo_bbox = draw.textbbox((0, 0), logo_text, font=body_font)
+                logo_width = logo_bbox[2] - logo_bbox[0]
+                logo_x = (img_size - logo_width) // 2
+                draw.text((logo_x, y_position), logo_text, font=body_font, fill=self.colors['subtitle'])
             
             # Сохранение
-            filename = f"share_{animal_key}_{user_name.lower().replace(' ', '_')}.png"
-            filepath = os.path.join("generated_images", filename)
+            # Карточки разных версий контента не перезаписывают друг друга
+            version = f"{content.version}_" if content is not None else ''
+            filename = f"share_{animal_key}_{version}{user_name.lower().replace(' ', '_')}.png"
+            filepath = os.path.join(self.output_dir, filename)
             
-            os.makedirs("generated_images", exist_ok=True)
+            os.makedirs(self.output_dir, exist_ok=True)
             img.save(filepath, "PNG")
             return filepath
             
@@ -265,7 +377,10 @@ if __name__ == "__main__":
     
     # Генерируем изображение для теста
     try:
-        result_path = generator.generate_result_image("lion", "Тестовый пользователь")
+        from quiz_data import QUIZ_QUESTIONS
+        from ranking import AnimalRanking
+        profile = AnimalRanking(QUIZ_QUESTIONS, list(ANIMALS)).top({q: 0 for q in range(len(QUIZ_QUESTIONS))}, 3)
+        result_path = generator.generate_result_image(profile[0].animal, "Тестовый пользователь", profile)
         print(f"Generated result image: {result_path}")
         
         share_path = generator.create_shareable_image("lion", "Тестовый пользователь")
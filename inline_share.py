@@ -0,0 +1,165 @@
+"""
+Публикация результата через inline-режим
+
+Пользователь набирает @бота в любом чате и отправляет карточку своего
+результата. Ответы на inline-запросы собираются один раз для каждого
+животного и версии контента (текст, кнопка и file_id карточки) и дальше
+отдаются из памяти, поэтому всплеск запросов не приводит ни к рендерингу,
+ни к повторной загрузке картинок. Telegram кеширует ответ для каждого
+пользователя на INLINE_CACHE_TIME секунд.
+
+file_id появляются после первой загрузки карточки животного в служебный
+чат INLINE_MEDIA_CHAT_ID (при запуске и в фоне для новых карточек) и
+сохраняются в INLINE_MEDIA_CACHE_PATH. Пока file_id нет, отдается только
+текстовый результат.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
+
+from telegram import (
+    Bot, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResult,
+    InlineQueryResultArticle, InlineQueryResultCachedPhoto, InputTextMessageContent
+)
+
+from api_client import non_essential
+from config import INLINE_MEDIA_CHAT_ID, INLINE_MEDIA_CACHE_PATH
+from referrals import referral_link
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BOT_USERNAME = 'moszooprojectbot'
+
+
+def share_text(animal: Dict[str, Any], bot_username: Optional[str] = None, link: Optional[str] = None) -> str:
+    """Текст для публикации результата (link - реферальная ссылка вместо @бота)"""
+    return (
+        f"Я прошел викторину Московского зоопарка и узнал, что мое тотемное животное - "
+        f"{animal['name']}! {animal['emoji']}\n\n"
+        f"Попробуй и ты: {link or '@' + (bot_username or DEFAULT_BOT_USERNAME)}"
+    )
+
+
+def card_key(animal_key: str, animal: Dict[str, Any]) -> str:
+    """Ключ карточки: меняется вместе с описанием животного"""
+    digest = hashlib.sha1(json.dumps(animal, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+    return f"{animal_key}:{digest[:12]}"
+
+
+class InlineShare:
+    """Готовые ответы на inline-запросы по животным"""
+
+    def __init__(self, media_chat_id: Optional[int] = INLINE_MEDIA_CHAT_ID,
+                 cache_path: Optional[str] = INLINE_MEDIA_CACHE_PATH):
+        self.media_chat_id = media_chat_id
+        self.cache_path = cache_path
+        self.file_ids: Dict[str, str] = self._load_file_ids()
+        self._results: Dict[Tuple[str, str], List[InlineQueryResult]] = {}
+        self._uploading: Set[str] = set()
+
+    def _load_file_ids(self) -> Dict[str, str]:
+        if not self.cache_path:
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Inline media cache {self.cache_path} is unreadable: {e}")
+            return {}
+
+    def _save_file_ids(self):
+        if not self.cache_path:
+            return
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.file_ids, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.cache_path)
+
+    def results_for(self, content, animal_key: str, bot_username: Optional[str] = None) -> List[InlineQueryResult]:
+        """
+        Ответ на inline-запрос пользователя с результатом animal_key
+
+        Args:
+            content: CompiledContent, на котором пользователь прошел викторину
+            animal_key: Ключ животного
+            bot_username: Имя бота для ссылки
+
+        Returns:
+            Карточка (если загружена) и текстовый результат
+        """
+        key = (content.version, animal_key)
+        results = self._results.get(key)
+        if results is None:
+            results = self._results[key] = self.build_results(content.animals[animal_key], animal_key, bot_username)
+        return results
+
+    def build_results(self, animal: Dict[str, Any], animal_key: str,
+                      bot_username: Optional[str] = None) -> List[InlineQueryResult]:
+        """Собирает ответ для животного (results_for кеширует его)"""
+        text = share_text(animal, bot_username)
+        reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton(
+            "🐾 Узнать свое тотемное животное",
+            # Ответ кешируется по животному, поэтому автор в ссылке не указан
+            url=referral_link(bot_username or DEFAULT_BOT_USERNAME, None, animal_key)
+        )]])
+        results: List[InlineQueryResult] = []
+        file_id = self.file_ids.get(card_key(animal_key, animal))
+        if file_id:
+            results.append(InlineQueryResultCachedPhoto(
+                id=f"card-{animal_key}", photo_file_id=file_id, caption=text, reply_markup=reply_markup
+            ))
+        results.append(InlineQueryResultArticle(
+            id=f"text-{animal_key}",
+            title=f"{animal['emoji']} Мое тотемное животное: {animal['name']}",
+            description="Поделиться результатом викторины Московского зоопарка",
+            input_message_content=InputTextMessageContent(text),
+            reply_markup=reply_markup,
+        ))
+        return results
+
+    def needs_upload(self, content, animal_key: str) -> bool:
+        """Карточку животного нужно загрузить (и есть куда)"""
+        return bool(self.media_chat_id) and card_key(animal_key, content.animals[animal_key]) not in self.file_ids
+
+    async def upload_cards(self, bot: Bot, content, image_generator, animal_keys: Optional[Iterable[str]] = None):
+        """
+        Рендерит и загружает карточки животных в служебный чат, запоминая file_id
+
+        Args:
+            bot: Бот, от имени которого загружаются карточки
+            content: CompiledContent с описаниями животных
+            image_generator: ResultImageGenerator
+            animal_keys: Какие карточки загрузить (по умолчанию все недостающие)
+        """
+        if not self.media_chat_id:
+            return
+        loop = asyncio.get_running_loop()
+        for animal_key in (content.animals if animal_keys is None else animal_keys):
+            key = card_key(animal_key, content.animals[animal_key])
+            if key in self.file_ids or key in self._uploading:
+                continue
+            self._uploading.add(key)
+            try:
+                # Карточка рисуется из той же версии контента, по которой вычислен ключ кеша
+                path = await loop.run_in_executor(None, image_generator.create_shareable_image, animal_key, 'share',
+                                                  content)
+                if not path:
+                    continue
+                with open(path, 'rb') as f, non_essential():
+                    message = await bot.send_photo(chat_id=self.media_chat_id, photo=f, disable_notification=True)
+                self.file_ids[key] = message.photo[-1].file_id
+                self._save_file_ids()
+                # Ответы с этим животным пересобираются уже с карточкой
+                for result_key in [result_key for result_key in self._results if result_key[1] == animal_key]:
+                    del self._results[result_key]
+                logger.info(f"Inline card uploaded for {animal_key}")
+            except Exception as e:
+                logger.error(f"Failed to upload inline card for {animal_key}: {e}")
+            finally:
+                self._uploading.discard(key)
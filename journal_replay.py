@@ -0,0 +1,220 @@
+"""
+Разбор журнала событий викторины (см. event_journal.py)
+
+События читаются потоком по сегментам, поэтому журнал любого размера
+разбирается без загрузки в память.
+
+    python journal_replay.py stats                       # сводка: старты, завершения, отсев, результаты
+    python journal_replay.py sessions sessions.snapshot  # восстановить сессии в снимок (session_snapshot.py)
+    python journal_replay.py rescore --content quiz_content.json  # пересчитать результаты на другом контенте
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Any, Iterable, Optional, Sequence
+
+from config import EVENT_JOURNAL_DIR
+from conversation import QUIZ, DONE, new_session
+from event_journal import Event, iter_events, list_segments, QUIZ_STARTED, ANSWER_GIVEN, RESULT_COMPUTED, FEEDBACK_RECEIVED
+
+
+def rebuild_sessions(events: Iterable[Event]) -> Dict[int, Dict[str, Any]]:
+    """
+    Сессии пользователей в том виде, в каком их держит бот
+
+    Returns:
+        Словарь {user_id: сессия}
+    """
+    sessions: Dict[int, Dict[str, Any]] = {}
+    for kind, timestamp, user_id, data in events:
+        if kind == ANSWER_GIVEN:
+            session = sessions.get(user_id)
+            if session is None:
+                session = sessions[user_id] = new_session(QUIZ, start_time=datetime.fromtimestamp(timestamp).isoformat())
+            question_id, answer_id = data
+            session['answers'][question_id] = answer_id
+            session['current_question'] = question_id + 1
+        elif kind == QUIZ_STARTED:
+            previous = sessions.get(user_id)
+            sessions[user_id] = session = new_session(QUIZ, data, datetime.fromtimestamp(timestamp).isoformat())
+            if previous and 'feedback' in previous:
+                session['feedback'] = previous['feedback']
+        elif kind == RESULT_COMPUTED:
+            session = sessions.get(user_id)
+            if session is None:
+                session = sessions[user_id] = new_session(start_time=datetime.fromtimestamp(timestamp).isoformat())
+            session['state'] = DONE
+            session['result_animal'] = data
+            session['completion_time'] = datetime.fromtimestamp(timestamp).isoformat()
+        elif kind == FEEDBACK_RECEIVED:
+            session = sessions.setdefault(user_id, {})
+            session.setdefault('feedback', []).append(
+                {'text': data, 'timestamp': datetime.fromtimestamp(timestamp).isoformat()}
+            )
+    return sessions
+
+
+def journal_stats(events: Iterable[Event]) -> Dict[str, Any]:
+    """
+    Сводка по журналу
+
+    Returns:
+        Число событий, стартов, завершений, отзывов, распределение
+        результатов и номер вопроса, на котором остановились незавершенные
+        викторины
+    """
+    counts: Counter = Counter()
+    results: Counter = Counter()
+    progress: Dict[int, int] = {}
+    users = set()
+    first = last = None
+    for kind, timestamp, user_id, data in events:
+        counts[kind] += 1
+        if first is None:
+            first = timestamp
+        last = timestamp
+        if kind == ANSWER_GIVEN:
+            progress[user_id] = data[0] + 1
+        elif kind == QUIZ_STARTED:
+            users.add(user_id)
+            progress[user_id] = 0
+        elif kind == RESULT_COMPUTED:
+            results[data] += 1
+            progress.pop(user_id, None)
+
+    started, completed = counts[QUIZ_STARTED], counts[RESULT_COMPUTED]
+    return {
+        'events': sum(counts.values()),
+        'from': datetime.fromtimestamp(first).isoformat() if first is not None else None,
+        'to': datetime.fromtimestamp(last).isoformat() if last is not None else None,
+        'users': len(users),
+        'quizzes_started': started,
+        'answers': counts[ANSWER_GIVEN],
+        'quizzes_completed': completed,
+        'completion_rate': completed / started if started else 0.0,
+        'feedback': counts[FEEDBACK_RECEIVED],
+        'results': dict(results.most_common()),
+        'abandoned_at_question': dict(sorted(Counter(progress.values()).items())),
+    }
+
+
+def score_winner(answers: Dict[int, int], questions: Sequence[Dict[str, Any]]) -> Optional[str]:
+    """Победитель по баллам с тем же правилом ничьих, что и в боте (первое набравшее максимум)"""
+    animal_scores: Dict[str, int] = {}
+    for question_id, answer_id in answers.items():
+        for animal, weight in questions[question_id]['options'][answer_id]['weight'].items():
+            animal_scores[animal] = animal_scores.get(animal, 0) + weight
+    if not animal_scores:
+        return None
+    return max(animal_scores, key=animal_scores.get)
+
+
+def rescore(events: Iterable[Event], content) -> Dict[str, Any]:
+    """
+    Пересчитывает результаты завершенных викторин на другом контенте
+
+    Args:
+        events: События журнала
+        content: CompiledContent, на котором пересчитываются результаты
+
+    Returns:
+        Сколько результатов пересчитано, изменилось и не подходит к контенту
+        (ответы на несуществующие вопросы), и самые частые замены
+    """
+    answers: Dict[int, Dict[int, int]] = {}
+    changes: Counter = Counter()
+    rescored = changed = incompatible = 0
+    for kind, timestamp, user_id, data in events:
+        if kind == ANSWER_GIVEN:
+            answers.setdefault(user_id, {})[data[0]] = data[1]
+        elif kind == QUIZ_STARTED:
+            answers[user_id] = {}
+        elif kind == RESULT_COMPUTED:
+            user_answers = answers.pop(user_id, {})
+            try:
+                if user_answers and max(user_answers) >= len(content.questions):
+                    raise IndexError
+                winner = content.winner_table.lookup(user_answers)
+                if winner is None:
+                    winner = score_winner(user_answers, content.questions)
+            except (IndexError, KeyError):
+                incompatible += 1
+                continue
+            rescored += 1
+            if winner != data:
+                changed += 1
+                changes[(data, winner)] += 1
+    return {
+        'rescored': rescored,
+        'changed': changed,
+        'incompatible': incompatible,
+        'changes': [{'from': old, 'to': new, 'count': count} for (old, new), count in changes.most_common(10)],
+    }
+
+
+def format_stats(stats: Dict[str, Any]) -> str:
+    lines = [
+        f"Events: {stats['events']} ({stats['from']} .. {stats['to']})",
+        f"Users: {stats['users']}, quizzes started: {stats['quizzes_started']}, "
+        f"completed: {stats['quizzes_completed']} ({stats['completion_rate']:.1%})",
+        f"Answers: {stats['answers']}, feedback: {stats['feedback']}",
+        "Results:",
+    ]
+    lines += [f"  {animal:<20} {count}" for animal, count in stats['results'].items()]
+    lines.append("Abandoned at question:")
+    lines += [f"  {question:<20} {count}" for question, count in stats['abandoned_at_question'].items()]
+    return '\n'.join(lines)
+
+
+def main(argv: Sequence[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Разбор журнала событий викторины")
+    parser.add_argument('--journal', default=EVENT_JOURNAL_DIR, help="каталог журнала")
+    parser.add_argument('--json', action='store_true', help="вывод в JSON")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('stats', help="сводка по журналу")
+    sessions_parser = commands.add_parser('sessions', help="восстановить сессии в снимок")
+    sessions_parser.add_argument('snapshot', help="файл снимка сессий")
+    rescore_parser = commands.add_parser('rescore', help="пересчитать результаты на другом контенте")
+    rescore_parser.add_argument('--content', help="файл контента (по умолчанию quiz_data.py)")
+    args = parser.parse_args(argv)
+
+    segments = list_segments(args.journal)
+    events = iter_events(segments)
+    started = time.perf_counter()
+
+    if args.command == 'stats':
+        report: Dict[str, Any] = journal_stats(events)
+    elif args.command == 'sessions':
+        from session_snapshot import SessionSnapshots
+        from session_store import SessionStore
+        store = SessionStore(track_changes=True)
+        store.restore(rebuild_sessions(events))
+        SessionSnapshots(store, args.snapshot).save()
+        report = {'sessions': len(store), 'snapshot': args.snapshot}
+    else:
+        from quiz_content import CompiledContent, builtin_content, load_content_file
+        data = load_content_file(args.content) if args.content else builtin_content()
+        # Своя таблица победителей: таблицу работающего бота (WINNER_TABLE_PATH) пересчет не трогает
+        with tempfile.TemporaryDirectory() as workdir:
+            content = CompiledContent(data, source=args.content or 'quiz_data.py',
+                                      winner_table_path=os.path.join(workdir, 'winner_table.bin'))
+            report = rescore(events, content)
+
+    elapsed = time.perf_counter() - started
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(format_stats(report) if args.command == 'stats'
+              else '\n'.join(f"{key}: {value}" for key, value in report.items()))
+    print(f"{len(segments)} segments in {elapsed:.2f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
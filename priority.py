@@ -0,0 +1,282 @@
+"""
+Приоритеты обработки апдейтов и сброс нагрузки
+
+Апдейты и фоновые задачи делятся на классы: INTERACTIVE (ответы на
+вопросы и кнопки меню - пользователь ждет следующий экран), NORMAL
+(команды, inline-запросы) и BACKGROUND (отзывы, рендеринг и загрузка
+карточек, напоминания). Одновременно обрабатывается не больше
+UPDATE_CONCURRENCY задач; остальные ждут в ограниченной очереди своего
+класса, и освободившееся место получает задача самого важного класса.
+
+Отдельная задача измеряет задержку цикла событий (на сколько позже
+срока просыпается sleep). Пока задержка выше LOAD_SHED_LAG, задачи
+NORMAL сразу отклоняются (пользователь получает короткое «бот перегружен»),
+а BACKGROUND откладываются в очереди до снижения нагрузки. Задача, для
+которой нет места в очереди класса, отклоняется всегда.
+
+Глубина очередей и число отклоненных задач - PriorityScheduler.stats();
+при нагрузке они периодически пишутся в лог.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextlib import nullcontext
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from telegram.ext import BaseUpdateProcessor
+
+from abuse_guard import AbuseGuard
+from config import UPDATE_CONCURRENCY, UPDATE_QUEUE_SIZES, LOAD_SHED_LAG, LOAD_REPORT_INTERVAL
+from tracing import FlightRecorder, span, update_name
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, NORMAL, BACKGROUND = 0, 1, 2
+PRIORITY_NAMES = ('interactive', 'normal', 'background')
+# Как часто измеряется задержка цикла событий, секунды
+LAG_SAMPLE_INTERVAL = 0.05
+UNBOUNDED = 1 << 20
+
+
+class Overloaded(Exception):
+    """Задача отклонена: бот перегружен"""
+
+    def __init__(self, priority: int, retry_after: float = 5.0):
+        super().__init__(f"Overloaded, {PRIORITY_NAMES[priority]} work shed")
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+class PriorityScheduler:
+    """Ограничение одновременных задач с очередями по классам приоритета"""
+
+    def __init__(self, concurrency: int = UPDATE_CONCURRENCY, queue_sizes=UPDATE_QUEUE_SIZES,
+                 lag_threshold: float = LOAD_SHED_LAG):
+        """
+        Args:
+            concurrency: Сколько задач выполняется одновременно
+            queue_sizes: Емкость очереди для каждого класса
+            lag_threshold: Задержка цикла событий, выше которой сбрасывается нагрузка
+        """
+        self.concurrency = concurrency
+        self.queue_sizes = tuple(queue_sizes)
+        self.lag_threshold = lag_threshold
+        self.active = 0
+        self.lag = 0.0
+        self.shed = [0] * len(PRIORITY_NAMES)
+        self.completed = [0] * len(PRIORITY_NAMES)
+        self._queues: List[Deque[asyncio.Future]] = [deque() for _ in PRIORITY_NAMES]
+        self._monitor: Optional[asyncio.Task] = None
+
+    @property
+    def lagging(self) -> bool:
+        """Цикл событий не успевает"""
+        return self.lag > self.lag_threshold
+
+    def _runnable(self, priority: int) -> bool:
+        return priority != BACKGROUND or not self.lagging
+
+    async def acquire(self, priority: int):
+        """
+        Ждет места для задачи класса priority
+
+        Raises:
+            Overloaded: Очередь класса заполнена или задача NORMAL при высокой задержке
+        """
+        if (self.active < self.concurrency and self._runnable(priority)
+                and not any(self._queues[p] for p in range(priority + 1))):
+            self.active += 1
+            return
+        if (priority == NORMAL and self.lagging) or len(self._queues[priority]) >= self.queue_sizes[priority]:
+            self.shed[priority] += 1
+            raise Overloaded(priority)
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues[priority].append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Место уже выдано: возвращаем его следующей задаче
+                self.release()
+            else:
+                self._queues[priority].remove(waiter)
+            raise
+
+    def release(self, priority: Optional[int] = None):
+        """Освобождает место и передает его следующей задаче"""
+        self.active -= 1
+        if priority is not None:
+            self.completed[priority] += 1
+        self._dispatch()
+
+    def _dispatch(self):
+        for priority, queue in enumerate(self._queues):
+            if not self._runnable(priority):
+                continue
+            while queue and self.active < self.concurrency:
+                waiter = queue.popleft()
+                if not waiter.done():
+                    self.active += 1
+                    waiter.set_result(None)
+            if self.active >= self.concurrency:
+                return
+
+    @asynccontextmanager
+    async def slot(self, priority: int):
+        """Место для задачи на время блока"""
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    async def run(self, priority: int, coroutine: Awaitable) -> Any:
+        """Выполняет фоновую корутину в своем классе (отклоненная или отмененная в очереди закрывается без запуска)"""
+        try:
+            await self.acquire(priority)
+        except (Overloaded, asyncio.CancelledError):
+            coroutine.close()
+            raise
+        try:
+            return await coroutine
+        finally:
+            self.release(priority)
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очередей, отклоненные и выполненные задачи по классам, задержка цикла событий"""
+        return {
+            'active': self.active,
+            'lag_ms': round(self.lag * 1000, 1),
+            'queued': {name: len(queue) for name, queue in zip(PRIORITY_NAMES, self._queues)},
+            'shed': dict(zip(PRIORITY_NAMES, self.shed)),
+            'completed': dict(zip(PRIORITY_NAMES, self.completed)),
+        }
+
+    async def _measure_lag(self):
+        loop = asyncio.get_running_loop()
+        reported = time.monotonic()
+        reported_shed = 0
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+            lag = max(0.0, loop.time() - started - LAG_SAMPLE_INTERVAL)
+            # Рост задержки учитывается сразу, спад - плавно, чтобы не раскачивать сброс
+            self.lag = lag if lag > self.lag else 0.8 * self.lag + 0.2 * lag
+            # Отложенные фоновые задачи запускаются, когда задержка спала
+            self._dispatch()
+
+            now = time.monotonic()
+            if now - reported >= LOAD_REPORT_INTERVAL:
+                shed = sum(self.shed)
+                if shed != reported_shed or any(self._queues) or self.lagging:
+                    logger.warning(f"Load: {self.stats()}")
+                reported, reported_shed = now, shed
+
+    def start(self):
+        """Запускает измерение задержки цикла событий"""
+        self._monitor = asyncio.get_running_loop().create_task(self._measure_lag())
+
+    async def stop(self):
+        """Останавливает измерение задержки"""
+        if self._monitor is not None:
+            self._monitor.cancel()
+            try:
+                await self._monitor
+            except asyncio.CancelledError:
+                pass
+            self._monitor = None
+
+
+class PriorityUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обработка апдейтов через PriorityScheduler
+
+    Апдейты одного пользователя обрабатываются по порядку, разных -
+    параллельно в пределах мест планировщика. Фоновые апдейты пользователя
+    (отзывы) выстраиваются в свою очередь: они ждут его предыдущие апдейты,
+    но следующие ответы и команды не ждут отложенный при нагрузке отзыв и
+    не получают его приоритет. Каждый апдейт обрабатывается
+    в своей трассе (см. tracing.py). Апдейты сверх лимитов AbuseGuard
+    отбрасываются до всего этого.
+
+    BaseUpdateProcessor есть в python-telegram-bot с 20.4 (requirements.txt
+    требует 21.6).
+    """
+
+    def __init__(self, scheduler: PriorityScheduler, classify: Callable[[Any], int],
+                 on_shed: Callable[[Any], Awaitable[None]], recorder: Optional[FlightRecorder] = None,
+                 guard: Optional[AbuseGuard] = None):
+        """
+        Args:
+            scheduler: Планировщик
+            classify: Класс приоритета апдейта
+            on_shed: Короткий ответ на отклоненный апдейт
+            recorder: Бортовой самописец для трасс апдейтов
+            guard: Ограничение частоты апдейтов пользователей и чатов
+        """
+        # Ограничивает планировщик, семафор BaseUpdateProcessor не должен срабатывать раньше
+        super().__init__(max_concurrent_updates=UNBOUNDED)
+        self.scheduler = scheduler
+        self.classify = classify
+        self.on_shed = on_shed
+        self.recorder = recorder
+        self.guard = guard
+        # Последний апдейт пользователя в очереди: (user_id, фоновый ли) -> завершение
+        self._tails: Dict[Tuple[int, bool], asyncio.Future] = {}
+
+    async def do_process_update(self, update: Any, coroutine: Awaitable[Any]):
+        user = getattr(update, 'effective_user', None)
+        if self.guard is not None and user is not None:
+            chat = update.effective_chat
+            if not self.guard.allow(user.id, chat and chat.id):
+                # Молча: ни трассы, ни очереди, ни ответа
+                coroutine.close()
+                return
+        trace = self.recorder.trace(update_name(update), user.id if user else None) if self.recorder else nullcontext()
+        with trace:
+            priority = self.classify(update)
+            if user is None:
+                await self._run(update, coroutine, priority)
+                return
+            background = priority == BACKGROUND
+            keys = [(user.id, False), (user.id, True)] if background else [(user.id, False)]
+            previous = [self._tails[key] for key in keys if key in self._tails]
+            key = keys[-1]
+            done = asyncio.get_running_loop().create_future()
+            self._tails[key] = done
+            try:
+                if previous:
+                    with span('wait_user'):
+                        for tail in previous:
+                            await tail
+                await self._run(update, coroutine, priority)
+            finally:
+                done.set_result(None)
+                if self._tails.get(key) is done:
+                    del self._tails[key]
+
+    async def _run(self, update: Any, coroutine: Awaitable[Any], priority: int):
+        try:
+            with span('queue', priority=PRIORITY_NAMES[priority]):
+                await self.scheduler.acquire(priority)
+        except Overloaded as e:
+            coroutine.close()
+            logger.debug(f"{e}: update {getattr(update, 'update_id', None)}")
+            try:
+                await self.on_shed(update)
+            except Exception as error:
+                logger.debug(f"Failed to answer shed update: {error}")
+            return
+        try:
+            await coroutine
+        finally:
+            self.scheduler.release(priority)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
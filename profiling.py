@@ -0,0 +1,239 @@
+"""
+Профилирование работающего бота без перезапуска
+
+Профиль (команда /profile или SIGUSR1): на заданное время включается
+сэмплирующий профайлер - отдельный поток раз в PROFILE_SAMPLE_INTERVAL
+секунд снимает стек основного потока. Результат записывается в
+PROFILE_DIR:
+
+- profile-*.collapsed - свернутые стеки (по строке на стек с числом
+  сэмплов), вход для flamegraph.pl, speedscope или inferno;
+- profile-*-handlers.txt - самые медленные обработчики за это время по
+  трассам апдейтов (см. tracing.py): число, суммарное время, p95 и
+  максимум; ожидание в очереди и за предыдущим апдейтом не считается.
+
+Память (команда /memory или SIGUSR2): первый вызов включает tracemalloc,
+следующие сохраняют снимок и пишут в memory-*.txt крупнейшие места
+выделения памяти и их рост с прошлого снимка. /memory stop выключает
+tracemalloc (он заметно замедляет бота, особенно при PROFILE_MEMORY_FRAMES
+больше 1).
+"""
+
+import asyncio
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from config import PROFILE_DIR, PROFILE_SAMPLE_INTERVAL, PROFILE_TOP, PROFILE_MEMORY_FRAMES
+from tracing import FlightRecorder, Trace
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileReport(NamedTuple):
+    """Результат профилирования"""
+    stacks_path: str
+    handlers_path: str
+    samples: int
+    handlers: List[Tuple[str, int, float, float, float]]
+
+
+class MemoryReport(NamedTuple):
+    """Результат снимка памяти"""
+    path: str
+    traced: int
+    top: List[str]
+
+
+class StackSampler(threading.Thread):
+    """Поток, снимающий стек другого потока через равные промежутки времени"""
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_SAMPLE_INTERVAL):
+        super().__init__(name='stack-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._labels: Dict[object, str] = {}
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            del frame
+            stack.reverse()
+            self.stacks[';'.join(stack)] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+# Отрезки трассы, в которые апдейт ждет, а не обрабатывается
+WAIT_SPANS = ('wait_user', 'queue')
+
+
+def _handler_name(name: str) -> str:
+    # answer_3_1 и answer_4_0 - один обработчик
+    return re.sub(r'\d+', 'N', name)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Profiler:
+    """Профилирование по запросу: стеки, медленные обработчики, память"""
+
+    def __init__(self, recorder: Optional[FlightRecorder] = None, output_dir: str = PROFILE_DIR,
+                 interval: float = PROFILE_SAMPLE_INTERVAL, top: int = PROFILE_TOP):
+        self.recorder = recorder
+        self.output_dir = output_dir
+        self.interval = interval
+        self.top = top
+        self.running = False
+        self._stopped: Optional[asyncio.Event] = None
+        self._memory_snapshot: Optional[tracemalloc.Snapshot] = None
+
+    def _path(self, kind: str, suffix: str) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        return os.path.join(self.output_dir, f"{kind}-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}{suffix}")
+
+    async def profile(self, seconds: float) -> ProfileReport:
+        """
+        Профилирует цикл событий в течение seconds секунд (или до stop_profile)
+
+        Returns:
+            Пути к файлам стеков и обработчиков, число сэмплов и топ обработчиков
+        """
+        if self.running:
+            raise RuntimeError("Profiling is already running")
+        self.running = True
+        self._stopped = asyncio.Event()
+        durations: Dict[str, List[float]] = defaultdict(list)
+
+        def observe(trace: Trace):
+            waited = sum(duration for name, _, duration, _ in trace.spans if name in WAIT_SPANS)
+            durations[_handler_name(trace.name)].append(trace.duration - waited)
+
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        if self.recorder is not None:
+            self.recorder.listeners.append(observe)
+        logger.warning(f"Profiling for {seconds:.0f}s")
+        sampler.start()
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._stopped.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            await asyncio.get_running_loop().run_in_executor(None, sampler.stop)
+            if self.recorder is not None:
+                self.recorder.listeners.remove(observe)
+            self.running = False
+        seconds = time.monotonic() - started
+
+        handlers = sorted(
+            ((name, len(values), sum(values), _percentile(values, 0.95), max(values))
+             for name, values in durations.items()),
+            key=lambda row: row[2], reverse=True
+        )[:self.top]
+        stacks_path = self._path('profile', '.collapsed')
+        handlers_path = self._path('profile', '-handlers.txt')
+        await asyncio.get_running_loop().run_in_executor(
+            None, self._write_profile, stacks_path, handlers_path, sampler.stacks, handlers, seconds
+        )
+        logger.warning(f"Profile written: {stacks_path} ({sampler.samples} samples), {handlers_path}")
+        return ProfileReport(stacks_path, handlers_path, sampler.samples, handlers)
+
+    def stop_profile(self):
+        """Досрочно завершает профилирование (отчет все равно записывается)"""
+        if self._stopped is not None:
+            self._stopped.set()
+
+    def _write_profile(self, stacks_path: str, handlers_path: str, stacks: Counter,
+                       handlers: List[Tuple[str, int, float, float, float]], seconds: float):
+        with open(stacks_path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(handlers_path, 'w', encoding='utf-8') as f:
+            f.write(f"Slowest handlers over {seconds:.0f}s (by total time)\n")
+            f.write(f"{'handler':<40} {'count':>7} {'total s':>9} {'p95 ms':>9} {'max ms':>9}\n")
+            for name, count, total, p95, longest in handlers:
+                f.write(f"{name:<40} {count:>7} {total:>9.2f} {p95 * 1000:>9.1f} {longest * 1000:>9.1f}\n")
+
+    async def memory_snapshot(self) -> Optional[MemoryReport]:
+        """
+        Снимок памяти по местам выделения
+
+        Returns:
+            Отчет или None, если tracemalloc только что включен (снимать нечего)
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_MEMORY_FRAMES)
+            self._memory_snapshot = None
+            logger.warning(f"tracemalloc started ({PROFILE_MEMORY_FRAMES} frames)")
+            return None
+        loop = asyncio.get_running_loop()
+        snapshot = await loop.run_in_executor(None, self._take_snapshot)
+        path = self._path('memory', '.txt')
+        top = await loop.run_in_executor(None, self._write_memory, path, snapshot, self._memory_snapshot)
+        self._memory_snapshot = snapshot
+        traced, _ = tracemalloc.get_traced_memory()
+        logger.warning(f"Memory snapshot written: {path} ({traced / 1024 / 1024:.1f} MiB traced)")
+        return MemoryReport(path, traced, top)
+
+    @staticmethod
+    def _take_snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+
+    def _write_memory(self, path: str, snapshot: tracemalloc.Snapshot,
+                      previous: Optional[tracemalloc.Snapshot]) -> List[str]:
+        by_site = snapshot.statistics('lineno')
+        top = [str(stat) for stat in by_site[:10]]
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"Top {self.top} allocation sites\n")
+            for stat in by_site[:self.top]:
+                f.write(f"{stat}\n")
+            if previous is not None:
+                f.write(f"\nGrowth since previous snapshot\n")
+                for stat in snapshot.compare_to(previous, 'lineno')[:self.top]:
+                    f.write(f"{stat}\n")
+            if tracemalloc.get_traceback_limit() > 1:
+                f.write(f"\nTop {min(self.top, 10)} allocation tracebacks\n")
+                for stat in snapshot.statistics('traceback')[:min(self.top, 10)]:
+                    f.write(f"\n{stat.count} blocks, {stat.size / 1024:.1f} KiB\n")
+                    f.write('\n'.join(stat.traceback.format()))
+                    f.write('\n')
+        return top
+
+    def stop_memory(self):
+        """Выключает tracemalloc"""
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            self._memory_snapshot = None
+            logger.warning("tracemalloc stopped")
@@ -0,0 +1,284 @@
+"""
+Анализатор баланса викторины
+
+Перебирает все возможные комбинации ответов на QUIZ_QUESTIONS и считает,
+как часто побеждает каждое животное, как часто случаются ничьи и какие
+животные недостижимы. Запускается как проверка контента после каждого
+изменения quiz_data.py:
+
+    python quiz_analyzer.py --strict
+"""
+
+import argparse
+import json
+import sys
+import time
+from typing import Dict, Any, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+from quiz_data import QUIZ_QUESTIONS, ANIMALS
+
+# Ранг для животных, которые не получили ни одного балла
+NO_RANK = np.iinfo(np.int32).max
+
+# Максимальное число элементов в промежуточном блоке (ограничивает память)
+DEFAULT_CHUNK_ELEMENTS = 4_000_000
+
+
+def option_counts(questions: Sequence[Dict[str, Any]]) -> List[int]:
+    """Количество вариантов ответа для каждого вопроса"""
+    return [len(question['options']) for question in questions]
+
+
+def answer_space_size(questions: Sequence[Dict[str, Any]]) -> int:
+    """Общее количество возможных комбинаций ответов"""
+    total = 1
+    for count in option_counts(questions):
+        total *= count
+    return total
+
+
+def build_weight_tables(questions: Sequence[Dict[str, Any]],
+                        animal_keys: Sequence[str]) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    """
+    Компилирует веса вопросов в матрицы для векторного подсчета
+
+    Кроме весов строится матрица рангов первого появления: бот выбирает
+    победителя через max() по словарю, который заполняется в порядке
+    ответов, поэтому при равенстве баллов побеждает животное, встретившееся
+    раньше всех. Ранг = номер вопроса * ширина + позиция в словаре весов.
+
+    Args:
+        questions: Вопросы в формате QUIZ_QUESTIONS
+        animal_keys: Ключи животных в фиксированном порядке
+
+    Returns:
+        Списки матриц весов и рангов, по одной (options x animals) на вопрос
+    """
+    animal_index = {key: i for i, key in enumerate(animal_keys)}
+    width = max(len(option['weight']) for question in questions for option in question['options']) + 1
+
+    weights, ranks = [], []
+    for q, question in enumerate(questions):
+        w = np.zeros((len(question['options']), len(animal_keys)), dtype=np.int16)
+        r = np.full(w.shape, NO_RANK, dtype=np.int32)
+        for o, option in enumerate(question['options']):
+            for pos, (animal, weight) in enumerate(option['weight'].items()):
+                if animal not in animal_index:
+                    raise ValueError(f"Unknown animal '{animal}' in question {question.get('id', q + 1)}")
+                w[o, animal_index[animal]] = weight
+                r[o, animal_index[animal]] = q * width + pos
+        weights.append(w)
+        ranks.append(r)
+    return weights, ranks
+
+
+def _combine(weights: Sequence[np.ndarray], ranks: Sequence[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """Баллы и ранги для всех комбинаций ответов на группу вопросов"""
+    num_animals = weights[0].shape[1]
+    scores = np.zeros((1, num_animals), dtype=np.int16)
+    first_seen = np.full((1, num_animals), NO_RANK, dtype=np.int32)
+    for w, r in zip(weights, ranks):
+        scores = (scores[:, None, :] + w[None, :, :]).reshape(-1, num_animals)
+        first_seen = np.minimum(first_seen[:, None, :], r[None, :, :]).reshape(-1, num_animals)
+    return scores, first_seen
+
+
+def iter_winner_blocks(questions: Sequence[Dict[str, Any]], animal_keys: Sequence[str],
+                       chunk_elements: int = DEFAULT_CHUNK_ELEMENTS) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Перебирает все комбинации ответов блоками ограниченного размера
+
+    Вопросы делятся на две половины, для каждой заранее считаются баллы
+    всех ее комбинаций; полные суммы получаются сложением строк. Блоки
+    идут в порядке индекса комбинации: ответ на первый вопрос - старший
+    разряд в смешанной системе счисления с основаниями option_counts().
+
+    Args:
+        questions: Вопросы в формате QUIZ_QUESTIONS
+        animal_keys: Ключи животных в фиксированном порядке
+        chunk_elements: Ограничение на размер промежуточного блока
+
+    Yields:
+        Пары (индексы победителей uint8, количество животных с максимальным баллом)
+    """
+    weights, ranks = build_weight_tables(questions, animal_keys)
+    split = len(questions) // 2
+    left_scores, left_ranks = _combine(weights[:split] or [np.zeros((1, len(animal_keys)), np.int16)],
+                                       ranks[:split] or [np.full((1, len(animal_keys)), NO_RANK, np.int32)])
+    right_scores, right_ranks = _combine(weights[split:], ranks[split:])
+
+    per_left = right_scores.shape[0] * len(animal_keys)
+    step = max(1, chunk_elements // per_left)
+    for start in range(0, left_scores.shape[0], step):
+        stop = min(start + step, left_scores.shape[0])
+        totals = left_scores[start:stop, None, :] + right_scores[None, :, :]
+        best = totals.max(axis=-1, keepdims=True)
+        is_top = totals == best
+        first_seen = np.minimum(left_ranks[start:stop, None, :], right_ranks[None, :, :])
+        winners = np.where(is_top, first_seen, NO_RANK).argmin(axis=-1)
+        yield winners.reshape(-1).astype(np.uint8), is_top.sum(axis=-1).reshape(-1)
+
+
+def analyze(questions: Sequence[Dict[str, Any]] = QUIZ_QUESTIONS,
+            animals: Dict[str, Dict[str, Any]] = ANIMALS,
+            chunk_elements: int = DEFAULT_CHUNK_ELEMENTS) -> Dict[str, Any]:
+    """
+    Считает статистику по всему пространству ответов
+
+    Args:
+        questions: Вопросы в формате QUIZ_QUESTIONS
+        animals: Словарь животных в формате ANIMALS
+        chunk_elements: Ограничение на размер промежуточного блока
+
+    Returns:
+        Словарь с вероятностями побед, частотой ничьих и недостижимыми животными
+    """
+    animal_keys = list(animals)
+    started = time.perf_counter()
+
+    wins = np.zeros(len(animal_keys), dtype=np.int64)
+    tie_wins = np.zeros(len(animal_keys), dtype=np.int64)
+    ties = 0
+    total = 0
+    for winners, top_counts in iter_winner_blocks(questions, animal_keys, chunk_elements):
+        tied = top_counts > 1
+        wins += np.bincount(winners, minlength=len(animal_keys))
+        tie_wins += np.bincount(winners[tied], minlength=len(animal_keys))
+        ties += int(tied.sum())
+        total += winners.size
+
+    return {
+        'combinations': total,
+        'tie_rate': ties / total,
+        'win_probability': {key: wins[i] / total for i, key in enumerate(animal_keys)},
+        'wins_by_tiebreak': {key: int(tie_wins[i]) for i, key in enumerate(animal_keys)},
+        'unreachable': [key for i, key in enumerate(animal_keys) if wins[i] == 0],
+        'elapsed': time.perf_counter() - started,
+    }
+
+
+def _decided(scores: np.ndarray, first_seen: np.ndarray, bounds: np.ndarray) -> np.ndarray:
+    """Векторная версия EarlyTermination.decided_winner для блока префиксов"""
+    rows = np.arange(scores.shape[0])
+    is_top = scores == scores.max(axis=-1, keepdims=True)
+    leaders = np.where(is_top, first_seen, NO_RANK).argmin(axis=-1)
+
+    lead = scores[rows, leaders][:, None].astype(np.int32) - scores
+    bound = bounds[:, leaders].T
+    earlier = first_seen[rows, leaders][:, None] < first_seen
+    safe = (lead > bound) | ((lead == bound) & earlier)
+    safe[rows, leaders] = True
+    return safe.all(axis=-1)
+
+
+def early_stop_report(questions: Sequence[Dict[str, Any]] = QUIZ_QUESTIONS,
+                      animals: Dict[str, Dict[str, Any]] = ANIMALS) -> Dict[str, Any]:
+    """
+    Экономия вопросов в адаптивном режиме (см. adaptive_quiz.py)
+
+    Для каждой длины префикса перебираются все префиксы ответов; при
+    равномерном распределении ответов вероятность показать вопрос k равна
+    доле префиксов длины k, на которых победитель еще не определен.
+
+    Returns:
+        Среднее число заданных и сэкономленных вопросов и распределение остановок
+    """
+    from adaptive_quiz import remaining_gain_bounds
+
+    animal_keys = list(animals)
+    weights, ranks = build_weight_tables(questions, animal_keys)
+    bounds = np.array(remaining_gain_bounds(questions, animal_keys), dtype=np.int32)
+
+    scores = np.zeros((1, len(animal_keys)), dtype=np.int16)
+    first_seen = np.full((1, len(animal_keys)), NO_RANK, dtype=np.int32)
+    decided = np.zeros(1, dtype=bool)
+    expected_asked = 0.0
+    stop_distribution = {}
+    for k, (w, r) in enumerate(zip(weights, ranks)):
+        expected_asked += 1.0 - decided.mean()
+        if k == len(questions) - 1:
+            stop_distribution[k + 1] = 1.0 - decided.mean()
+            break
+        scores = (scores[:, None, :] + w[None, :, :]).reshape(-1, len(animal_keys))
+        first_seen = np.minimum(first_seen[:, None, :], r[None, :, :]).reshape(-1, len(animal_keys))
+        previous = decided.mean()
+        decided = np.repeat(decided, w.shape[0]) | _decided(scores, first_seen, bounds[k + 1])
+        if decided.mean() > previous:
+            stop_distribution[k + 1] = decided.mean() - previous
+
+    saved = len(questions) - expected_asked
+    return {
+        'questions': len(questions),
+        'expected_questions': expected_asked,
+        'questions_saved': saved,
+        # Каждый вопрос - это edit_text и answerCallbackQuery
+        'api_calls_saved': saved * 2,
+        'stop_distribution': stop_distribution,
+    }
+
+
+def format_early_stop_report(report: Dict[str, Any]) -> str:
+    """Текстовый отчет об адаптивном режиме"""
+    lines = [
+        f"Адаптивный режим: в среднем {report['expected_questions']:.2f} из {report['questions']} вопросов",
+        f"Экономия: {report['questions_saved']:.2f} вопроса, {report['api_calls_saved']:.2f} запроса к API на прохождение",
+        "Остановка после ответа на вопрос:",
+    ]
+    for answered, probability in sorted(report['stop_distribution'].items()):
+        lines.append(f"  {answered:>2}: {probability:.2%}")
+    return "\n".join(lines)
+
+
+def format_report(report: Dict[str, Any], animals: Dict[str, Dict[str, Any]] = ANIMALS) -> str:
+    """Текстовый отчет для консоли"""
+    lines = [
+        f"Комбинаций ответов: {report['combinations']:,}",
+        f"Доля ничьих: {report['tie_rate']:.2%}",
+        "",
+        f"{'Животное':<14} {'Победы':>8} {'По ничьей':>10}",
+    ]
+    ranking = sorted(report['win_probability'].items(), key=lambda item: item[1], reverse=True)
+    for key, probability in ranking:
+        name = f"{animals[key]['emoji']} {key}"
+        lines.append(f"{name:<14} {probability:>8.2%} {report['wins_by_tiebreak'][key]:>10,}")
+    lines.append("")
+    if report['unreachable']:
+        lines.append(f"Недостижимые животные: {', '.join(report['unreachable'])}")
+    else:
+        lines.append("Все животные достижимы")
+    lines.append(f"Время анализа: {report['elapsed']:.2f} с")
+    return "\n".join(lines)
+
+
+def main(argv: Sequence[str] = None) -> int:
+    """Точка входа командной строки"""
+    parser = argparse.ArgumentParser(description="Анализ баланса викторины")
+    parser.add_argument('--json', action='store_true', help="вывести отчет в формате JSON")
+    parser.add_argument('--strict', action='store_true',
+                        help="вернуть ненулевой код, если есть недостижимые животные")
+    parser.add_argument('--adaptive', action='store_true',
+                        help="посчитать экономию вопросов в адаптивном режиме")
+    parser.add_argument('--chunk-elements', type=int, default=DEFAULT_CHUNK_ELEMENTS,
+                        help="размер промежуточного блока (память)")
+    args = parser.parse_args(argv)
+
+    report = analyze(chunk_elements=args.chunk_elements)
+    if args.adaptive:
+        report['adaptive'] = early_stop_report()
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(format_report(report))
+        if args.adaptive:
+            print()
+            print(format_early_stop_report(report['adaptive']))
+
+    if args.strict and report['unreachable']:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,410 @@
+"""
+Загрузка контента викторины из файлов с горячей перезагрузкой
+
+По умолчанию используется контент из quiz_data.py. Если задан путь
+QUIZ_CONTENT_PATH (JSON или YAML), контент читается из файла, проверяется
+и компилируется в готовые структуры: тексты вопросов, клавиатуры,
+таблицу победителей. При изменении файла новая версия собирается в
+фоне и подменяет текущую одним присваиванием; сессии, начатые на старой
+версии, доигрывают на ней. Старые версии хранятся только в памяти
+(последние RETAINED_VERSIONS): викторина, чья версия уже не хранится (после
+перезапуска или частых правок), начинается заново.
+
+Скомпилированный контент сохраняется в снимок (pickle), который при
+следующем запуске читается через mmap без повторной проверки и сборки,
+если исходный файл не менялся.
+
+У каждой викторины процесса (quiz_host.py) свой ContentStore: свой снимок,
+своя таблица победителей и свой префикс callback_data в клавиатурах.
+
+Выгрузить текущий контент в файл для редактирования:
+
+    python quiz_content.py quiz_content.json
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import mmap
+import os
+import pickle
+import struct
+import sys
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import QUIZ_CONTENT_PATH, CONTENT_RELOAD_INTERVAL, CONTENT_SNAPSHOT_PATH, WINNER_TABLE_PATH
+from adaptive_quiz import EarlyTermination
+from ranking import AnimalRanking
+from winner_table import WinnerTable, load_winner_table
+
+logger = logging.getLogger(__name__)
+
+# Ограничения Telegram
+CALLBACK_DATA_LIMIT = 64
+BUTTON_TEXT_LIMIT = 64
+MESSAGE_TEXT_LIMIT = 4096
+# Индекс животного в таблице победителей - uint8
+MAX_ANIMALS = 255
+
+REQUIRED_ANIMAL_FIELDS = ('name', 'emoji', 'description', 'zoo_facts', 'guardian_info')
+
+# Сколько старых версий держать для незавершенных сессий
+RETAINED_VERSIONS = 8
+
+SNAPSHOT_MAGIC = b'QCSN'
+SNAPSHOT_FORMAT = 3
+# Магическое число + длина JSON-ключа источника
+SNAPSHOT_PREFIX = struct.Struct('<4sI')
+
+BUILTIN_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'quiz_data.py')
+
+
+class ContentError(ValueError):
+    """Ошибка в контенте викторины"""
+
+
+def builtin_content() -> Dict[str, Any]:
+    """Контент из quiz_data.py"""
+    from quiz_data import QUIZ_QUESTIONS, ANIMALS, GUARDIANSHIP_INFO
+    return {
+        'questions': QUIZ_QUESTIONS,
+        'animals': ANIMALS,
+        'guardianship_info': GUARDIANSHIP_INFO,
+    }
+
+
+def load_content_file(path: str) -> Dict[str, Any]:
+    """
+    Читает контент из JSON или YAML файла
+
+    Args:
+        path: Путь к файлу (.json, .yaml или .yml)
+
+    Returns:
+        Словарь с ключами questions, animals, guardianship_info
+
+    Raises:
+        OSError: Файл не читается
+        ValueError: Файл не разбирается (ошибка YAML - ContentError)
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ContentError("PyYAML is required to load YAML content")
+            try:
+                return yaml.safe_load(f)
+            except yaml.YAMLError as e:
+                raise ContentError(f"Invalid YAML: {e}")
+        return json.load(f)
+
+
+def validate_content(data: Dict[str, Any], callback_prefix: str = '') -> None:
+    """
+    Проверяет контент викторины
+
+    Args:
+        data: Контент
+        callback_prefix: Префикс callback_data кнопок этой викторины
+
+    Raises:
+        ContentError: Со списком всех найденных ошибок
+    """
+    errors = []
+    if not isinstance(data, dict):
+        raise ContentError("Content must be a mapping")
+
+    animals = data.get('animals')
+    if not isinstance(animals, dict) or not animals:
+        errors.append("'animals' must be a non-empty mapping")
+        animals = {}
+    elif len(animals) > MAX_ANIMALS:
+        errors.append(f"Too many animals: {len(animals)} > {MAX_ANIMALS}")
+    for key, info in animals.items():
+        missing = [field for field in REQUIRED_ANIMAL_FIELDS if not isinstance(info, dict) or not info.get(field)]
+        if missing:
+            errors.append(f"Animal '{key}' is missing fields: {', '.join(missing)}")
+
+    questions = data.get('questions')
+    if not isinstance(questions, list) or not questions:
+        errors.append("'questions' must be a non-empty list")
+        questions = []
+    for q, question in enumerate(questions):
+        label = f"Question {q + 1}"
+        if not isinstance(question, dict):
+            errors.append(f"{label} must be a mapping")
+            continue
+        if not isinstance(question.get('question'), str) or not question['question']:
+            errors.append(f"{label} has no text")
+        elif len(question['question']) > MESSAGE_TEXT_LIMIT:
+            errors.append(f"{label} text is longer than {MESSAGE_TEXT_LIMIT} characters")
+        options = question.get('options') or []
+        if not isinstance(options, list):
+            errors.append(f"{label}: 'options' must be a list")
+            continue
+        if not options:
+            errors.append(f"{label} has no options")
+        # Самая длинная callback_data у последнего варианта
+        callback_data = f"{callback_prefix}answer_{q}_{len(options) - 1}"
+        if len(callback_data.encode('utf-8')) > CALLBACK_DATA_LIMIT:
+            errors.append(f"{label} has too many options for callback data")
+        for o, option in enumerate(options):
+            if not isinstance(option, dict):
+                errors.append(f"{label}, option {o + 1} must be a mapping")
+                continue
+            text = option.get('text')
+            if not isinstance(text, str) or not text or len(text) > BUTTON_TEXT_LIMIT:
+                errors.append(f"{label}, option {o + 1}: text must be 1-{BUTTON_TEXT_LIMIT} characters")
+            weights = option.get('weight') or {}
+            if not isinstance(weights, dict):
+                errors.append(f"{label}, option {o + 1}: 'weight' must be a mapping")
+                continue
+            if not weights:
+                errors.append(f"{label}, option {o + 1} has no weights")
+            for animal, weight in weights.items():
+                if animal not in animals:
+                    errors.append(f"{label}, option {o + 1}: unknown animal '{animal}'")
+                if not isinstance(weight, int) or isinstance(weight, bool) or weight < 0:
+                    errors.append(f"{label}, option {o + 1}: weight for '{animal}' must be a non-negative integer")
+
+    guardianship_info = data.get('guardianship_info')
+    if not isinstance(guardianship_info, str) or not guardianship_info.strip():
+        errors.append("'guardianship_info' must be a non-empty string")
+    else:
+        try:
+            guardianship_info.format(email='', phone='')
+        except (KeyError, IndexError, ValueError) as e:
+            errors.append(f"'guardianship_info' template is invalid: {e}")
+
+    if errors:
+        raise ContentError("; ".join(errors))
+
+
+def content_version(data: Dict[str, Any]) -> str:
+    """Хеш всего контента - идентификатор версии"""
+    payload = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+class CompiledContent:
+    """Проверенный контент викторины с заранее собранными структурами"""
+
+    def __init__(self, data: Dict[str, Any], source: str = 'quiz_data.py', callback_prefix: str = '',
+                 winner_table_path: str = WINNER_TABLE_PATH):
+        validate_content(data, callback_prefix)
+        self.source = source
+        self.callback_prefix = callback_prefix
+        self.version = content_version(data)
+        self.questions: List[Dict[str, Any]] = data['questions']
+        self.animals: Dict[str, Dict[str, Any]] = data['animals']
+        self.guardianship_info: str = data['guardianship_info']
+
+        total = len(self.questions)
+        self.question_texts = [
+            f"❓ **Вопрос {q + 1} из {total}**\n\n{question['question']}"
+            for q, question in enumerate(self.questions)
+        ]
+        self.keyboards = [
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton(option['text'], callback_data=f"{callback_prefix}answer_{q}_{i}")]
+                for i, option in enumerate(question['options'])
+            ])
+            for q, question in enumerate(self.questions)
+        ]
+        self.winner_table = load_winner_table(winner_table_path, self.questions, self.animals)
+        self.early_termination = EarlyTermination(self.questions, self.animals)
+        self.ranking = AnimalRanking(self.questions, list(self.animals))
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Таблица победителей отображена в память и в снимок не попадает
+        state = self.__dict__.copy()
+        table = state.pop('winner_table')
+        state['winner_table_path'] = table.path
+        state['winner_table_hash'] = table.hash
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        path = state.pop('winner_table_path')
+        table_hash = state.pop('winner_table_hash')
+        self.__dict__.update(state)
+        try:
+            table = WinnerTable(path)
+        except (OSError, ValueError, KeyError, struct.error):
+            table = None
+        if table is None or table.hash != table_hash:
+            table = load_winner_table(path, self.questions, self.animals)
+        self.winner_table = table
+
+
+def _source_key(path: str, callback_prefix: str = '') -> Dict[str, Any]:
+    """Ключ источника для снимка: путь, время изменения, размер и префикс кнопок"""
+    stat = os.stat(path)
+    return {'format': SNAPSHOT_FORMAT, 'path': os.path.abspath(path),
+            'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'callback_prefix': callback_prefix}
+
+
+def save_snapshot(content: CompiledContent, source_path: str, path: str = CONTENT_SNAPSHOT_PATH):
+    """Атомарно записывает снимок скомпилированного контента"""
+    key = json.dumps(_source_key(source_path, content.callback_prefix)).encode('utf-8')
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, len(key)))
+        f.write(key)
+        pickle.dump(content, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(source_path: str, path: str = CONTENT_SNAPSHOT_PATH,
+                  callback_prefix: str = '') -> Optional[CompiledContent]:
+    """
+    Загружает снимок, если он собран из текущей версии источника с тем же префиксом кнопок
+
+    Returns:
+        Скомпилированный контент или None, если снимка нет или он устарел
+    """
+    try:
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                magic, key_length = SNAPSHOT_PREFIX.unpack_from(mapped, 0)
+                start = SNAPSHOT_PREFIX.size
+                if magic != SNAPSHOT_MAGIC:
+                    return None
+                if json.loads(mapped[start:start + key_length]) != _source_key(source_path, callback_prefix):
+                    return None
+                with memoryview(mapped) as view:
+                    return pickle.loads(view[start + key_length:])
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, struct.error, pickle.UnpicklingError, EOFError, AttributeError) as e:
+        logger.warning(f"Content snapshot {path} is unreadable: {e}")
+        return None
+
+
+class ContentStore:
+    """Текущая версия контента и недавние версии для незавершенных сессий"""
+
+    def __init__(self, path: Optional[str] = QUIZ_CONTENT_PATH, reload_interval: float = CONTENT_RELOAD_INTERVAL,
+                 snapshot_path: str = CONTENT_SNAPSHOT_PATH, winner_table_path: str = WINNER_TABLE_PATH,
+                 callback_prefix: str = ''):
+        """
+        Args:
+            path: Файл контента (None - quiz_data.py)
+            reload_interval: Как часто проверять изменение файла, секунды
+            snapshot_path: Снимок скомпилированного контента
+            winner_table_path: Файл таблицы победителей
+            callback_prefix: Префикс callback_data кнопок (викторина делит бота с другой, см. quiz_host.py)
+        """
+        self.path = path
+        self.reload_interval = reload_interval
+        self.snapshot_path = snapshot_path
+        self.winner_table_path = winner_table_path
+        self.callback_prefix = callback_prefix
+        self._versions: 'OrderedDict[str, CompiledContent]' = OrderedDict()
+        self._mtime = None
+        self._checked_at = time.monotonic()
+        self._reloading = False
+
+        if path:
+            self._mtime = os.stat(path).st_mtime
+        source_path = path or BUILTIN_SOURCE
+        self.current = load_snapshot(source_path, snapshot_path, callback_prefix)
+        if self.current is None:
+            data = load_content_file(path) if path else builtin_content()
+            self.current = self._compile(data, path or 'quiz_data.py')
+            self._save_snapshot(self.current, source_path)
+        self._remember(self.current)
+        logger.info(f"Quiz content {self.current.version} loaded from {self.current.source}")
+
+    def _compile(self, data: Dict[str, Any], source: str) -> CompiledContent:
+        return CompiledContent(data, source, self.callback_prefix, self.winner_table_path)
+
+    def _save_snapshot(self, content: CompiledContent, source_path: str):
+        try:
+            save_snapshot(content, source_path, self.snapshot_path)
+        except (OSError, pickle.PicklingError) as e:
+            logger.warning(f"Cannot save content snapshot: {e}")
+
+    def _remember(self, content: CompiledContent):
+        self._versions[content.version] = content
+        self._versions.move_to_end(content.version)
+        while len(self._versions) > RETAINED_VERSIONS:
+            self._versions.popitem(last=False)
+
+    def has(self, version: Optional[str]) -> bool:
+        """Хранится ли версия, на которой началась сессия (None - текущая)"""
+        return version is None or version in self._versions
+
+    def get(self, version: Optional[str] = None) -> CompiledContent:
+        """
+        Контент нужной версии
+
+        Args:
+            version: Версия, на которой началась сессия
+
+        Returns:
+            Эта версия, если она еще хранится, иначе текущая
+        """
+        if version is None:
+            return self.current
+        return self._versions.get(version, self.current)
+
+    def _load(self, mtime: float) -> Optional[CompiledContent]:
+        try:
+            content = self._compile(load_content_file(self.path), self.path)
+        except (OSError, ValueError) as e:
+            # Некорректный файл не ломает бота: продолжаем на текущей версии
+            logger.error(f"Quiz content reload from {self.path} failed: {e}")
+            return None
+        except Exception as e:
+            # Ошибка сборки, которую проверка не предусмотрела, тоже не должна ронять /start
+            logger.error(f"Quiz content reload from {self.path} failed: {e}", exc_info=e)
+            return None
+        logger.info(f"Quiz content {content.version} compiled from {self.path} (mtime {mtime})")
+        self._save_snapshot(content, self.path)
+        return content
+
+    async def refresh(self):
+        """Проверяет mtime файла (не чаще reload_interval) и подменяет контент"""
+        if not self.path or self._reloading:
+            return
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            logger.error(f"Cannot stat quiz content {self.path}: {e}")
+            return
+        if mtime == self._mtime:
+            return
+
+        self._reloading = True
+        try:
+            # Компиляция (включая таблицу победителей) не блокирует цикл событий
+            loop = asyncio.get_running_loop()
+            content = await loop.run_in_executor(None, self._load, mtime)
+        finally:
+            # Неудачная версия файла пробуется один раз: следующая попытка - после его изменения
+            self._mtime = mtime
+            self._reloading = False
+        if content is not None and content.version != self.current.version:
+            self._remember(content)
+            self.current = content
+            logger.info(f"Quiz content switched to version {content.version}")
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else 'quiz_content.json'
+    data = builtin_content()
+    validate_content(data)
+    with open(target, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    print(f"Quiz content exported to {target} (version {content_version(data)})")
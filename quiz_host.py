@@ -0,0 +1,221 @@
+"""
+Несколько викторин в одном процессе
+
+Другие программы зоопарка заводят свои викторины (свои вопросы и
+животные, иногда свой бот). Отдельный процесс на каждую викторину держит
+свою копию интерпретатора, библиотек и пулов соединений, поэтому здесь
+викторины - объекты QuizBot одного процесса, и общими у них остаются:
+
+- цикл событий и очереди апдейтов (PriorityScheduler, см. priority.py):
+  все боты вместе обрабатывают не больше UPDATE_CONCURRENCY апдейтов, иначе
+  одновременных вызовов Bot API и соединений общего пула становится в
+  несколько раз больше, а учет соединений в httpcore растет с их числом
+  квадратично;
+- пул соединений Bot API для обычных вызовов и его предохранитель
+  (SharedRequest, см. api_client.py); у каждого токена только свое
+  соединение для getUpdates;
+- пул потоков, в котором рисуются карточки результатов, компилируется
+  контент и пишутся файлы статистики (RENDER_WORKERS потоков);
+- хранилище сессий (SESSION_DB_PATH или память со снимком): сессия
+  викторины с номером n хранится под ключом (n << 52) | user_id (см.
+  SessionNamespace в session_store.py).
+
+У каждой викторины свои скомпилированный контент, снимок контента,
+таблица победителей, журнал, воронка и счетчики ссылок: у первой викторины
+списка - файлы одиночного бота, у остальных - с именем викторины
+(quiz_content.birds.snapshot, journal/birds, ...). Поэтому бот можно
+перевести в этот режим, сделав его викторину первой.
+
+Викторины с одним токеном делят бота. Первая из них - основная: у нее
+команды, inline-режим, отзывы и групповая викторина. Остальные
+открываются диплинком t.me/<бот>?start=<имя>, их callback_data
+начинается с "<имя>:", поэтому кнопки викторин не пересекаются.
+
+Список викторин - файл QUIZ_HOST_CONFIG (JSON или YAML), token по
+умолчанию - BOT_TOKEN, content по умолчанию - quiz_data.py:
+
+    [
+      {"name": "zoo"},
+      {"name": "birds", "token": "123456:ABC...", "content": "birds.json"},
+      {"name": "night", "content": "night.yaml"}
+    ]
+
+    python quiz_host.py --config quizzes.json
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import re
+import signal
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional
+
+from config import (
+    BOT_TOKEN, QUIZ_CONTENT_PATH, QUIZ_HOST_CONFIG, RENDER_WORKERS, SESSION_SNAPSHOT_PATH
+)
+
+logger = logging.getLogger(__name__)
+
+# Имя - параметр диплинка и префикс callback_data, поэтому только латиница, цифры и _
+NAME_PATTERN = re.compile(r'[a-z][a-z0-9_]{0,31}')
+# Параметры /start, которые уже заняты (кнопка inline-режима, старые ссылки публикаций)
+RESERVED_NAMES = frozenset({'quiz', 'share'})
+
+
+class QuizDefinition(NamedTuple):
+    """Викторина процесса"""
+    name: str
+    token: str
+    content_path: Optional[str]  # None - контент из quiz_data.py
+    namespace: int  # номер викторины в общем хранилище сессий
+    callback_prefix: str  # '' у основной викторины бота
+
+    def path(self, base: Optional[str]) -> Optional[str]:
+        """
+        Файл или каталог этой викторины
+
+        Args:
+            base: Путь одиночного бота из config.py (None - файл отключен)
+
+        Returns:
+            У викторины 0 - base, у остальных - с именем викторины перед
+            расширением файла или подкаталог каталога
+        """
+        if not base or not self.namespace:
+            return base
+        root, extension = os.path.splitext(base)
+        if extension:
+            return f"{root}.{self.name}{extension}"
+        return os.path.join(base, self.name)
+
+
+# Единственная викторина обычного запуска bot.py
+DEFAULT_QUIZ = QuizDefinition('', BOT_TOKEN, QUIZ_CONTENT_PATH, 0, '')
+
+
+def load_quizzes(path: str = QUIZ_HOST_CONFIG) -> List[QuizDefinition]:
+    """
+    Викторины из файла QUIZ_HOST_CONFIG
+
+    Raises:
+        ValueError: Ошибка в списке викторин
+    """
+    from quiz_content import load_content_file
+    from session_store import MAX_NAMESPACES
+    entries = load_content_file(path)
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("Quiz list must be a non-empty list")
+    if len(entries) > MAX_NAMESPACES:
+        raise ValueError(f"Too many quizzes: {len(entries)} > {MAX_NAMESPACES}")
+
+    quizzes = []
+    names, tokens = set(), set()
+    for namespace, entry in enumerate(entries):
+        name = entry.get('name') if isinstance(entry, dict) else None
+        if not isinstance(name, str) or not NAME_PATTERN.fullmatch(name) or name in RESERVED_NAMES:
+            raise ValueError(f"Quiz {namespace + 1}: name must match {NAME_PATTERN.pattern} "
+                             f"and not be one of {', '.join(sorted(RESERVED_NAMES))}")
+        if name in names:
+            raise ValueError(f"Quiz '{name}' is listed twice")
+        token = entry.get('token') or BOT_TOKEN
+        if not token:
+            raise ValueError(f"Quiz '{name}' has no token and BOT_TOKEN is not set")
+        # Первая викторина бота - основная, кнопки остальных различаются префиксом
+        prefix = f"{name}:" if token in tokens else ''
+        names.add(name)
+        tokens.add(token)
+        quizzes.append(QuizDefinition(name, token, entry.get('content') or None, namespace, prefix))
+    return quizzes
+
+
+class QuizHost:
+    """Викторины процесса и общая для них инфраструктура"""
+
+    def __init__(self, quizzes: List[QuizDefinition]):
+        import bot
+        from api_client import SharedRequest
+        from priority import PriorityScheduler
+        from session_snapshot import SessionSnapshots
+        from session_store import SessionNamespace
+
+        self.quizzes = quizzes
+        # Один пул соединений для обычных вызовов всех ботов
+        self.request = SharedRequest()
+        # Одни очереди апдейтов и одна оценка задержки общего цикла событий
+        self.load = PriorityScheduler()
+        # Одно хранилище сессий: у каждой викторины свой диапазон ключей
+        self.store = bot.user_data
+        self.snapshots = SessionSnapshots(self.store) if SESSION_SNAPSHOT_PATH and not self.store.path else None
+        self.bots = []
+        primaries: Dict[str, bot.QuizBot] = {}
+        for quiz in quizzes:
+            quiz_bot = bot.QuizBot(quiz, SessionNamespace(self.store, quiz.namespace), self.request,
+                                   primaries.get(quiz.token), self.load, self.snapshots)
+            primaries.setdefault(quiz.token, quiz_bot)
+            self.bots.append(quiz_bot)
+        self.applications = [quiz_bot.application for quiz_bot in primaries.values()]
+        logger.info(f"Hosting {len(quizzes)} quizzes on {len(self.applications)} bots")
+
+    async def run(self, stop: asyncio.Event):
+        """Запускает ботов и останавливает их после stop"""
+        from telegram import Update
+
+        loop = asyncio.get_running_loop()
+        # Общий пул потоков: карточки результатов, компиляция контента, запись статистики
+        loop.set_default_executor(ThreadPoolExecutor(RENDER_WORKERS, thread_name_prefix='quiz-host'))
+        # Сессии восстанавливаются до post_init: по ним планируются напоминания
+        if self.snapshots:
+            self.snapshots.restore()
+            self.snapshots.start()
+        self.load.start()
+        await asyncio.gather(*(application.initialize() for application in self.applications))
+        for quiz_bot in self.bots:
+            await quiz_bot.post_init(quiz_bot.application)
+        for application in self.applications:
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            await application.start()
+        logger.info("Quiz host started")
+
+        await stop.wait()
+
+        for application in self.applications:
+            await application.updater.stop()
+            await application.stop()
+        for quiz_bot in self.bots:
+            await quiz_bot.post_shutdown(quiz_bot.application)
+        for application in self.applications:
+            await application.shutdown()
+        await self.load.stop()
+        if self.snapshots:
+            await self.snapshots.stop()
+        self.store.close()
+        logger.info("Quiz host stopped")
+
+    async def serve(self):
+        """Работа до SIGINT или SIGTERM"""
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+        loop.add_signal_handler(signal.SIGINT, stop.set)
+        await self.run(stop)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Несколько викторин в одном процессе")
+    parser.add_argument('--config', default=QUIZ_HOST_CONFIG, help="список викторин (JSON или YAML)")
+    args = parser.parse_args(argv)
+
+    try:
+        quizzes = load_quizzes(args.config)
+    except (OSError, ValueError) as e:
+        print(f"Cannot load quizzes from {args.config}: {e}", file=sys.stderr)
+        return 2
+    asyncio.run(QuizHost(quizzes).serve())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""
+Профиль совместимости: животные по баллам пользователя
+
+Победитель - только первое место, а пользователи спрашивают и про второе.
+AnimalRanking считает баллы всех животных, получивших хоть один балл, и
+выбирает k лучших частичной сортировкой (heapq.nsmallest) - остальные
+животные не сортируются. Веса вариантов заранее собраны в кортежи
+(индекс животного, вес, ранг первого появления), поэтому подсчет - один
+проход по ответам без обращений к словарям контента.
+
+Порядок совпадает с выбором победителя: больше баллов, при равенстве -
+животное, раньше встретившееся в ответах (тот же ранг, что в
+quiz_analyzer.build_weight_tables: номер вопроса * ширина + позиция в
+словаре весов), затем порядок животных в контенте. Ключи сортировки
+уникальны, поэтому профиль детерминирован, а первое место совпадает с
+таблицей победителей.
+
+Процент совместимости - доля баллов животного среди всех набранных баллов.
+"""
+
+import heapq
+from typing import Any, Dict, List, NamedTuple, Sequence
+
+# Ширина полосы профиля в тексте сообщения, символов
+BAR_WIDTH = 10
+
+
+class Match(NamedTuple):
+    """Место в профиле совместимости"""
+    animal: str
+    score: int
+    percent: float
+
+
+class AnimalRanking:
+    """Ранжирование животных по ответам пользователя"""
+
+    def __init__(self, questions: Sequence[Dict[str, Any]], animal_keys: Sequence[str]):
+        """
+        Args:
+            questions: Вопросы в формате QUIZ_QUESTIONS
+            animal_keys: Ключи животных в фиксированном порядке
+        """
+        self.animal_keys = list(animal_keys)
+        animal_index = {key: i for i, key in enumerate(self.animal_keys)}
+        width = max(len(option['weight']) for question in questions for option in question['options']) + 1
+        # options[вопрос][вариант] = ((индекс животного, вес, ранг первого появления), ...)
+        self.options = [
+            [tuple((animal_index[animal], weight, q * width + position)
+                   for position, (animal, weight) in enumerate(option['weight'].items()))
+             for option in question['options']]
+            for q, question in enumerate(questions)
+        ]
+
+    def top(self, answers: Dict[int, int], k: int) -> List[Match]:
+        """
+        k лучших животных по ответам
+
+        Args:
+            answers: Ответы пользователя {номер вопроса: номер варианта}
+            k: Сколько мест вернуть
+
+        Returns:
+            Места по убыванию совместимости (животные без баллов не попадают)
+        """
+        # Ключ сортировки [-баллы, ранг первого появления, индекс животного]
+        keys: Dict[int, List[int]] = {}
+        total = 0
+        for question_id, answer_id in answers.items():
+            if not 0 <= question_id < len(self.options) or not 0 <= answer_id < len(self.options[question_id]):
+                continue
+            for animal, weight, rank in self.options[question_id][answer_id]:
+                total += weight
+                key = keys.get(animal)
+                if key is None:
+                    keys[animal] = [-weight, rank, animal]
+                else:
+                    key[0] -= weight
+        if total <= 0 or k <= 0:
+            return []
+        return [Match(self.animal_keys[animal], -score, -score * 100 / total)
+                for score, _, animal in heapq.nsmallest(k, keys.values()) if score < 0]
+
+
+def profile_lines(matches: Sequence[Match], animals: Dict[str, Dict[str, Any]], width: int = BAR_WIDTH) -> List[str]:
+    """Строки профиля для сообщения: полоса длиной относительно первого места и процент"""
+    if not matches:
+        return []
+    best = matches[0].score
+    lines = []
+    for match in matches:
+        filled = round(width * match.score / best)
+        animal = animals[match.animal]
+        lines.append(f"{animal['emoji']} {animal['name']}: {'▓' * filled}{'░' * (width - filled)} {match.percent:.0f}%")
+    return lines
@@ -0,0 +1,238 @@
+"""
+Реферальные ссылки и счетчики виральности
+
+Ссылка на бота из публикации результата - диплинк
+t.me/<бот>?start=r<id автора>-<животное>: /start с таким параметром
+показывает, кто поделился и с каким результатом. Счетчики по паре (автор,
+животное): переходы по ссылке, новые пользователи и завершившие викторину
+приглашенные. Ссылка из inline-карточки общая для всех (ответы кешируются
+по животному), ее автор - 0.
+
+/start ничего не пишет в базу: обработчик только увеличивает счетчик в
+словаре процесса. Раз в REFERRAL_FLUSH_INTERVAL секунд накопленное
+отделяется от словаря (новые переходы копятся уже в новом) и одной
+транзакцией дописывается в SQLite (REFERRAL_DB_PATH) прибавлением к
+строкам. Каждый процесс scale_out.py - отдельный шард со своими
+счетчиками, база складывает их; счетчики меняет только цикл событий
+процесса, поэтому блокировки не нужны. Статистика отстает от переходов
+не больше чем на интервал записи, /referrals перед чтением записывает
+счетчики своего процесса.
+"""
+
+import asyncio
+import logging
+import re
+import sqlite3
+from contextlib import closing
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from config import REFERRAL_DB_PATH, REFERRAL_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Параметр /start: латиница, цифры, _ и -, не длиннее 64 символов
+PAYLOAD_PATTERN = re.compile(r'r([0-9a-z]{1,13})-([A-Za-z0-9_]{0,48})')
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+# Счетчики пары (автор, животное)
+VISITS, JOINED, COMPLETED = range(3)
+
+UPSERT = (
+    "INSERT INTO referrals (referrer_id, animal, visits, joined, completed) VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT (referrer_id, animal) DO UPDATE SET visits = visits + excluded.visits, "
+    "joined = joined + excluded.joined, completed = completed + excluded.completed"
+)
+
+
+class Referral(NamedTuple):
+    """Откуда пришел пользователь"""
+    referrer: int  # 0 - автор неизвестен
+    animal: str  # '' - животное неизвестно
+
+
+class ReferralStats(NamedTuple):
+    """Сводка для /referrals"""
+    total: Tuple[int, int, int]
+    referrers: List[Tuple[int, int, int, int]]
+    animals: List[Tuple[str, int, int, int]]
+
+
+def encode_payload(referrer: Optional[int], animal: Optional[str] = None) -> str:
+    """Параметр диплинка для автора и животного"""
+    number, digits = referrer or 0, ''
+    while True:
+        number, digit = divmod(number, 36)
+        digits = DIGITS[digit] + digits
+        if not number:
+            break
+    return f"r{digits}-{animal or ''}"
+
+
+def decode_payload(payload: str) -> Optional[Referral]:
+    """Автор и животное из параметра /start (None, если это не реферальная ссылка)"""
+    match = PAYLOAD_PATTERN.fullmatch(payload)
+    if match is None:
+        return None
+    return Referral(int(match.group(1), 36), match.group(2))
+
+
+def referral_link(bot_username: str, referrer: Optional[int], animal: Optional[str] = None) -> str:
+    """Ссылка на бота с атрибуцией"""
+    return f"https://t.me/{bot_username}?start={encode_payload(referrer, animal)}"
+
+
+class ReferralCounters:
+    """Счетчики переходов процесса с периодической записью в базу"""
+
+    def __init__(self, path: Optional[str] = REFERRAL_DB_PATH, interval: float = REFERRAL_FLUSH_INTERVAL):
+        """
+        Args:
+            path: База SQLite всех процессов (None - счетчики только в памяти)
+            interval: Как часто записывать накопленное, секунды
+        """
+        self.path = path
+        self.interval = interval
+        # (автор, животное) -> [переходы, новые, завершили], еще не записанные в базу
+        self.pending: Dict[Referral, List[int]] = {}
+        self._stopping: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        if path:
+            with closing(self._connect()) as connection, connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS referrals (referrer_id INTEGER NOT NULL, animal TEXT NOT NULL, "
+                    "visits INTEGER NOT NULL, joined INTEGER NOT NULL, completed INTEGER NOT NULL, "
+                    "PRIMARY KEY (referrer_id, animal)) WITHOUT ROWID"
+                )
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _add(self, referral: Referral, counter: int):
+        counts = self.pending.get(referral)
+        if counts is None:
+            counts = self.pending[referral] = [0, 0, 0]
+        counts[counter] += 1
+
+    # События
+
+    def visited(self, referral: Referral, joined: bool):
+        """Переход по ссылке; joined - пользователь пришел в бота впервые"""
+        self._add(referral, VISITS)
+        if joined:
+            self._add(referral, JOINED)
+
+    def completed(self, referral: Referral):
+        """Приглашенный пользователь завершил викторину"""
+        self._add(referral, COMPLETED)
+
+    # Запись
+
+    def _write(self, batch: Dict[Referral, List[int]]):
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(UPSERT, [(*referral, *counts) for referral, counts in batch.items()])
+
+    async def flush(self):
+        """Записывает накопленные счетчики одной транзакцией (при ошибке они остаются до следующей записи)"""
+        if not self.path or not self.pending:
+            return
+        # Переходы во время записи копятся в новом словаре
+        batch, self.pending = self.pending, {}
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, batch)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to save {len(batch)} referral counters: {e}")
+            for referral, counts in batch.items():
+                pending = self.pending.setdefault(referral, [0, 0, 0])
+                for counter, count in enumerate(counts):
+                    pending[counter] += count
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    def start(self):
+        """Запускает периодическую запись счетчиков"""
+        if not self.path:
+            return
+        self._stopping = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Останавливает периодическую запись и записывает остаток"""
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    # Статистика
+
+    def stats(self, limit: int = 10) -> ReferralStats:
+        """
+        Переходы, новые пользователи и завершившие по авторам и животным
+
+        Без базы - счетчики этого процесса, с базой - все записанное (вызывается в потоке).
+
+        Args:
+            limit: Сколько лучших авторов вернуть
+        """
+        if not self.path:
+            return self._stats_in_memory(limit)
+        with closing(self._connect()) as connection:
+            total = connection.execute(
+                "SELECT COALESCE(SUM(visits), 0), COALESCE(SUM(joined), 0), COALESCE(SUM(completed), 0) "
+                "FROM referrals"
+            ).fetchone()
+            referrers = connection.execute(
+                "SELECT referrer_id, SUM(visits), SUM(joined), SUM(completed) FROM referrals "
+                "WHERE referrer_id != 0 GROUP BY referrer_id "
+                "ORDER BY SUM(joined) DESC, SUM(visits) DESC, referrer_id LIMIT ?", (limit,)
+            ).fetchall()
+            animals = connection.execute(
+                "SELECT animal, SUM(visits), SUM(joined), SUM(completed) FROM referrals "
+                "GROUP BY animal ORDER BY SUM(joined) DESC, SUM(visits) DESC, animal"
+            ).fetchall()
+        return ReferralStats(tuple(total), referrers, animals)
+
+    def _stats_in_memory(self, limit: int) -> ReferralStats:
+        referrers: Dict[int, List[int]] = {}
+        animals: Dict[str, List[int]] = {}
+        total = [0, 0, 0]
+        for (referrer, animal), counts in self.pending.items():
+            for group, key in ((referrers, referrer), (animals, animal)):
+                sums = group.setdefault(key, [0, 0, 0])
+                for counter, count in enumerate(counts):
+                    sums[counter] += count
+            for counter, count in enumerate(counts):
+                total[counter] += count
+        referrers.pop(0, None)
+        return ReferralStats(
+            tuple(total),
+            sorted(((key, *sums) for key, sums in referrers.items()), key=lambda row: (-row[2], -row[1], row[0]))[:limit],
+            sorted(((key, *sums) for key, sums in animals.items()), key=lambda row: (-row[2], -row[1], row[0])),
+        )
+
+
+def format_stats(stats: ReferralStats, animals: Dict[str, Dict[str, str]]) -> str:
+    """Текст для /referrals"""
+    visits, joined, completed = stats.total
+    lines = [f"🔗 Переходы по ссылкам: {visits}, новых пользователей: {joined}, завершили викторину: {completed}"]
+    if stats.referrers:
+        lines += ["", "Авторы:"]
+        lines += [f"{referrer}: переходов {visits}, новых {joined}, завершили {completed}"
+                  for referrer, visits, joined, completed in stats.referrers]
+    if stats.animals:
+        lines += ["", "Животные:"]
+        for animal, visits, joined, completed in stats.animals:
+            info = animals.get(animal)
+            name = f"{info['emoji']} {info['name']}" if info else (animal or "без животного")
+            lines.append(f"{name}: переходов {visits}, новых {joined}, завершили {completed}")
+    return '\n'.join(lines)
@@ -0,0 +1,135 @@
+"""
+Напоминания о брошенных викторинах
+
+Все напоминания живут в одной куче (due, user_id) с одной фоновой задачей,
+а не в отдельной задаче на пользователя. Перенос напоминания (пользователь
+ответил на вопрос) - O(log n): в кучу добавляется новая запись, а старая
+считается устаревшей, потому что не совпадает со сроком в словаре _due,
+и пропускается при извлечении. Когда устаревших записей становится больше,
+чем актуальных, куча пересобирается.
+
+Наступившие напоминания отправляются пачками не более REMINDER_RATE
+сообщений в секунду, чтобы не упереться в ограничения Telegram.
+"""
+
+import asyncio
+import heapq
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from config import REMINDER_DELAY, REMINDER_RATE
+
+logger = logging.getLogger(__name__)
+
+# Куча пересобирается, только если в ней хотя бы столько записей
+COMPACT_MIN_ENTRIES = 1024
+
+
+class ReminderScheduler:
+    """Планировщик напоминаний на одной куче"""
+
+    def __init__(self, send: Callable[[int], Awaitable[None]], delay: float = REMINDER_DELAY,
+                 rate: int = REMINDER_RATE):
+        """
+        Args:
+            send: Корутина отправки напоминания пользователю
+            delay: Через сколько секунд бездействия напоминать
+            rate: Сколько напоминаний отправлять в секунду
+        """
+        self.send = send
+        self.delay = delay
+        self.rate = max(1, rate)
+        self._heap: List[Tuple[float, int]] = []
+        self._due: Dict[int, float] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        """Число назначенных напоминаний"""
+        return len(self._due)
+
+    def _now(self) -> float:
+        return asyncio.get_running_loop().time()
+
+    def schedule(self, user_id: int, delay: Optional[float] = None):
+        """Назначает (или переносит) напоминание пользователю"""
+        due = self._now() + (self.delay if delay is None else delay)
+        self._due[user_id] = due
+        if self._wakeup is not None and (not self._heap or due < self._heap[0][0]):
+            # Новое напоминание раньше ближайшего: фоновая задача спит слишком долго
+            self._wakeup.set()
+        heapq.heappush(self._heap, (due, user_id))
+        if len(self._heap) > max(2 * len(self._due), COMPACT_MIN_ENTRIES):
+            self._compact()
+
+    def schedule_many(self, user_ids: Iterable[int], delay: Optional[float] = None):
+        """Назначает напоминания сразу многим пользователям (после перезапуска) за O(n)"""
+        due = self._now() + (self.delay if delay is None else delay)
+        for user_id in user_ids:
+            self._due[user_id] = due
+        self._compact()
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def cancel(self, user_id: int):
+        """Отменяет напоминание (запись в куче станет устаревшей)"""
+        self._due.pop(user_id, None)
+
+    def _compact(self):
+        self._heap = [(due, user_id) for user_id, due in self._due.items()]
+        heapq.heapify(self._heap)
+
+    def pop_due(self, now: float, limit: int) -> List[int]:
+        """Извлекает до limit наступивших напоминаний"""
+        heap, due_of = self._heap, self._due
+        user_ids = []
+        while heap and heap[0][0] <= now and len(user_ids) < limit:
+            due, user_id = heapq.heappop(heap)
+            if due_of.get(user_id) == due:
+                del due_of[user_id]
+                user_ids.append(user_id)
+        return user_ids
+
+    async def _send_batch(self, user_ids: List[int]):
+        results = await asyncio.gather(*(self.send(user_id) for user_id in user_ids), return_exceptions=True)
+        for user_id, result in zip(user_ids, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to send reminder to user {user_id}: {result}")
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            # Устаревшие записи на вершине кучи не должны будить задачу
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            timeout = self._heap[0][0] - self._now() if self._heap else None
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            started = self._now()
+            batch = self.pop_due(started, self.rate)
+            if batch:
+                await self._send_batch(batch)
+                logger.info(f"Sent {len(batch)} quiz reminders, {self.pending} pending")
+                # Не больше rate сообщений в секунду
+                await asyncio.sleep(max(0.0, started + len(batch) / self.rate - self._now()))
+
+    def start(self):
+        """Запускает фоновую задачу отправки"""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Останавливает фоновую задачу (неотправленные напоминания теряются)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,514 @@
+"""
+Горизонтальное масштабирование: несколько рабочих процессов
+
+Один процесс QuizBot работает на одном ядре. В этом режиме приемник
+вебхука (front) принимает апдейты от Telegram, по effective_user.id
+выбирает рабочий процесс и передает ему апдейт через Unix-сокет.
+Апдейты одного пользователя всегда попадают в один процесс и
+обрабатываются по порядку, разные пользователи - параллельно. Апдейты
+группового чата попадают в процесс этого чата (см. group_quiz.py).
+
+Рабочие процессы общих данных в памяти не имеют: сессии хранятся в
+SQLite (SESSION_DB_PATH) и после каждого апдейта записываются туда.
+Пользователи распределяются rendezvous-хешированием, поэтому при
+добавлении или удалении процесса переезжает только их доля ~1/N.
+Перед сменой набора процессов приемник дожидается обработки всех
+отправленных апдейтов, так что порядок апдейтов не нарушается. Без
+SESSION_DB_PATH процессы затерли бы сессии друг друга в общем снимке,
+поэтому тогда разрешен только один процесс.
+
+Упавший рабочий процесс (EOF на сокете) перезапускается под тем же
+именем, так что его пользователи остаются за ним. Новые апдейты его
+пользователей ждут перезапуска, а неподтвержденные отправляются заново
+первыми - один раз: апдейт, на котором процесс упал повторно,
+отбрасывается. Если процесс не запускается, он убирается из набора.
+
+    SESSION_DB_PATH=sessions.db python scale_out.py --workers 4
+
+SIGUSR1 добавляет рабочий процесс, SIGUSR2 убирает один. GET /metrics -
+воронка викторины всех процессов в формате Prometheus (см. funnel.py).
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import struct
+import sys
+import urllib.parse
+import urllib.request
+from typing import Dict, Any, Optional, Tuple
+
+from config import (
+    BOT_TOKEN, BOT_API_BASE_URL, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET,
+    WORKER_COUNT, WORKER_SOCKET_DIR, WORKER_CONCURRENCY, FUNNEL_STATS_DIR, SESSION_DB_PATH
+)
+from funnel import load_funnels, merge_funnels, render_metrics
+
+logger = logging.getLogger(__name__)
+
+# Кадр IPC: длина апдейта и user_id, затем JSON апдейта. Кадр нулевой длины - остановка
+FRAME = struct.Struct('<Iq')
+# Подтверждение обработки апдейта
+ACK = struct.Struct('<q')
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+# Сколько раз апдейт отправляется процессу, который на нем падает
+MAX_DELIVERIES = 2
+
+
+def extract_user_id(update: Dict[str, Any]) -> int:
+    """
+    user_id автора апдейта без разбора в объекты telegram
+
+    Returns:
+        id пользователя, иначе id чата, иначе 0
+    """
+    for key, value in update.items():
+        if key == 'update_id' or not isinstance(value, dict):
+            continue
+        user = value.get('from') or value.get('user')
+        if user:
+            return user['id']
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+    return 0
+
+
+def routing_key(update: Dict[str, Any], user_id: int) -> int:
+    """
+    По какому ключу выбирается рабочий процесс
+
+    Returns:
+        id группового чата для апдейтов из групп (общее состояние групповой
+        викторины живет в одном процессе), иначе user_id
+    """
+    for key in ('message', 'callback_query', 'edited_message'):
+        value = update.get(key)
+        if not isinstance(value, dict):
+            continue
+        chat = value.get('chat') or (value.get('message') or {}).get('chat') or {}
+        if chat.get('type') in ('group', 'supergroup'):
+            return chat['id']
+    return user_id
+
+
+def owner(user_id: int, workers) -> str:
+    """Рабочий процесс пользователя (rendezvous-хеширование)"""
+    def weight(worker: str) -> bytes:
+        return hashlib.blake2b(f"{worker}:{user_id}".encode(), digest_size=8).digest()
+    return max(workers, key=weight)
+
+
+# Рабочий процесс
+
+class Worker:
+    """Рабочий процесс: принимает апдейты от приемника и передает их в Application"""
+
+    def __init__(self, name: str, socket_path: str):
+        self.name = name
+        self.socket_path = socket_path
+        self.tails: Dict[int, asyncio.Task] = {}
+        self.stopped = asyncio.Event()
+
+    async def run(self):
+        import bot
+        from telegram import Update
+
+        if not bot.user_data.path:
+            logger.warning("SESSION_DB_PATH is not set: sessions are not shared between workers")
+        # Сессии не кешируются: пользователь может переехать в другой процесс
+        bot.user_data.keep_cache = False
+        self.Update = Update
+        self.quiz_bot = bot.QuizBot()
+        self.application = self.quiz_bot.application
+        self.quiz_bot.load.concurrency = WORKER_CONCURRENCY
+        # У каждого процесса свой файл воронки, /metrics приемника их сливает
+        self.quiz_bot.funnel.name = self.name
+        await self.application.initialize()
+        await self.quiz_bot.post_init(self.application)
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self.serve, self.socket_path)
+        logger.info(f"Worker {self.name} listening on {self.socket_path}")
+        async with server:
+            await self.stopped.wait()
+
+        await asyncio.gather(*self.tails.values(), return_exceptions=True)
+        bot.user_data.close()
+        await self.quiz_bot.post_shutdown(self.application)
+        await self.application.shutdown()
+        os.unlink(self.socket_path)
+        logger.info(f"Worker {self.name} stopped")
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                length, user_id = FRAME.unpack(await reader.readexactly(FRAME.size))
+                if length == 0:
+                    break
+                payload = await reader.readexactly(length)
+                # Апдейты одного пользователя выстраиваются в цепочку
+                previous = self.tails.get(user_id)
+                task = asyncio.create_task(self.process(previous, user_id, payload, writer))
+                self.tails[user_id] = task
+        except asyncio.IncompleteReadError:
+            pass
+        await asyncio.gather(*self.tails.values(), return_exceptions=True)
+        writer.close()
+        self.stopped.set()
+
+    async def process(self, previous: Optional[asyncio.Task], user_id: int, payload: bytes,
+                      writer: asyncio.StreamWriter):
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        data = json.loads(payload)
+        try:
+            update = self.Update.de_json(data, self.application.bot)
+            # Приоритеты и сброс нагрузки - как в режиме polling (см. priority.py)
+            await self.quiz_bot.update_processor.process_update(update, self.application.process_update(update))
+        except Exception as e:
+            logger.error(f"Worker {self.name} failed to process update {data.get('update_id')}: {e}")
+        finally:
+            writer.write(ACK.pack(data.get('update_id', 0)))
+            if self.tails.get(user_id) is asyncio.current_task():
+                del self.tails[user_id]
+
+
+def worker_main(name: str, socket_path: str):
+    """Точка входа рабочего процесса"""
+    from tracing import install_log_records
+    install_log_records()
+    logging.basicConfig(format=f'%(asctime)s - {name} - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s',
+                        level=logging.INFO)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(Worker(name, socket_path).run())
+
+
+# Приемник вебхука
+
+class WorkerHandle:
+    """Связь приемника с одним рабочим процессом"""
+
+    def __init__(self, name: str, socket_path: str, process):
+        self.name = name
+        self.socket_path = socket_path
+        self.process = process
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.outstanding = 0
+        # Неподтвержденные апдейты: update_id -> (user_id, JSON, сколько раз отправлен)
+        self.in_flight: Dict[int, Tuple[int, bytes, int]] = {}
+        self.ack_task: Optional[asyncio.Task] = None
+        self.stopping = False
+        self.failed = False
+        # Устанавливается, когда упавший процесс заменен или убран
+        self.replaced = asyncio.Event()
+
+
+class Dispatcher:
+    """Распределяет апдейты по рабочим процессам"""
+
+    def __init__(self, socket_dir: str = WORKER_SOCKET_DIR):
+        self.socket_dir = socket_dir
+        self.workers: Dict[str, WorkerHandle] = {}
+        self._next_index = 0
+        self._context = multiprocessing.get_context('spawn')
+        self._running = asyncio.Event()
+        self._running.set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._scale_lock = asyncio.Lock()
+        self.dispatched = 0
+        os.makedirs(socket_dir, exist_ok=True)
+
+    @property
+    def outstanding(self) -> int:
+        return sum(worker.outstanding for worker in self.workers.values())
+
+    async def _start_worker(self, name: Optional[str] = None) -> WorkerHandle:
+        if name is None:
+            name = f"worker-{self._next_index}"
+            self._next_index += 1
+        socket_path = os.path.join(self.socket_dir, f"{name}.sock")
+        process = self._context.Process(target=worker_main, args=(name, socket_path), name=name)
+        process.start()
+
+        handle = WorkerHandle(name, socket_path, process)
+        for _ in range(600):
+            try:
+                handle.reader, handle.writer = await asyncio.open_unix_connection(socket_path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if not process.is_alive():
+                    raise RuntimeError(f"Worker {name} exited with code {process.exitcode}")
+                await asyncio.sleep(0.05)
+        else:
+            process.terminate()
+            raise RuntimeError(f"Worker {name} did not start")
+        handle.ack_task = asyncio.create_task(self._read_acks(handle))
+        logger.info(f"Started {name} (pid {process.pid})")
+        return handle
+
+    async def _read_acks(self, handle: WorkerHandle):
+        try:
+            while True:
+                update_id, = ACK.unpack(await handle.reader.readexactly(ACK.size))
+                handle.in_flight.pop(update_id, None)
+                handle.outstanding -= 1
+                if self.outstanding == 0:
+                    self._idle.set()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        if handle.stopping:
+            if handle.outstanding:
+                logger.error(f"{handle.name} disconnected with {handle.outstanding} updates in flight")
+            return
+        # Процесс упал: его апдейты больше не ждут подтверждения, scale_to и close не зависают
+        handle.failed = True
+        handle.outstanding = 0
+        if self.outstanding == 0:
+            self._idle.set()
+        asyncio.create_task(self._replace_worker(handle))
+
+    async def _replace_worker(self, handle: WorkerHandle):
+        """Перезапускает упавший процесс и отправляет ему неподтвержденные апдейты"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, handle.process.join, 5)
+        logger.error(f"{handle.name} exited with code {handle.process.exitcode}, "
+                     f"{len(handle.in_flight)} updates in flight")
+        retry = {update_id: entry for update_id, entry in handle.in_flight.items() if entry[2] < MAX_DELIVERIES}
+        for update_id in handle.in_flight.keys() - retry.keys():
+            logger.error(f"Dropped update {update_id}: {handle.name} failed on it {MAX_DELIVERIES} times")
+        try:
+            async with self._scale_lock:
+                if self.workers.get(handle.name) is not handle:
+                    # Процесс уже убран из набора (scale_to или close)
+                    replacement = None
+                else:
+                    try:
+                        replacement = await self._start_worker(handle.name)
+                        self.workers[handle.name] = replacement
+                    except RuntimeError as e:
+                        logger.error(f"Cannot restart {handle.name}, its users move to other workers: {e}")
+                        del self.workers[handle.name]
+                        replacement = None
+                if replacement is not None:
+                    # До пробуждения ждущих апдейтов: неподтвержденные уходят первыми
+                    for update_id, (user_id, payload, deliveries) in retry.items():
+                        self._send(replacement, update_id, user_id, payload, deliveries)
+                    retry = {}
+        finally:
+            handle.replaced.set()
+        for update_id, (user_id, payload, deliveries) in retry.items():
+            if not await self.dispatch(payload, deliveries):
+                logger.error(f"Dropped update {update_id}: no workers left")
+
+    async def _stop_worker(self, handle: WorkerHandle):
+        handle.stopping = True
+        if not handle.failed:
+            try:
+                handle.writer.write(FRAME.pack(0, 0))
+                await handle.writer.drain()
+            except ConnectionError:
+                pass
+        await handle.ack_task
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, handle.process.join, 30)
+        logger.info(f"Stopped {handle.name}")
+
+    async def scale_to(self, count: int):
+        """
+        Меняет число рабочих процессов
+
+        Новые апдейты ждут, пока все отправленные апдейты не будут
+        обработаны и записаны в хранилище; затем меняется набор процессов.
+        """
+        count = max(1, count)
+        if count > 1 and not SESSION_DB_PATH:
+            logger.error("Several workers need SESSION_DB_PATH: without it they overwrite each other's sessions")
+            count = 1
+        async with self._scale_lock:
+            if count == len(self.workers):
+                return
+            self._running.clear()
+            try:
+                await self._idle.wait()
+                while len(self.workers) < count:
+                    handle = await self._start_worker()
+                    self.workers[handle.name] = handle
+                while len(self.workers) > count:
+                    name = list(self.workers)[-1]
+                    await self._stop_worker(self.workers.pop(name))
+            finally:
+                self._running.set()
+            logger.info(f"Workers: {len(self.workers)}")
+
+    def _send(self, handle: WorkerHandle, update_id: int, user_id: int, payload: bytes, deliveries: int):
+        handle.writer.write(FRAME.pack(len(payload), user_id) + payload)
+        handle.in_flight[update_id] = (user_id, payload, deliveries + 1)
+        handle.outstanding += 1
+        self._idle.clear()
+
+    async def dispatch(self, payload: bytes, deliveries: int = 0) -> bool:
+        """
+        Передает апдейт (JSON) рабочему процессу его пользователя
+
+        Args:
+            payload: JSON апдейта
+            deliveries: Сколько раз апдейт уже отправлялся (повтор после падения процесса)
+
+        Returns:
+            False, если рабочих процессов не осталось и апдейт не принят
+        """
+        update = json.loads(payload)
+        user_id = extract_user_id(update)
+        key = routing_key(update, user_id)
+        while True:
+            if not self._running.is_set():
+                await self._running.wait()
+            if not self.workers:
+                # Последний процесс не удалось перезапустить: Telegram повторит доставку позже
+                return False
+            # Апдейты одного пользователя в процессе выстраиваются по user_id, процесс группы выбирается по чату
+            handle = self.workers[owner(key, self.workers)]
+            if not handle.failed:
+                break
+            # Пользователи упавшего процесса ждут его замены
+            await handle.replaced.wait()
+        self._send(handle, update.get('update_id', 0), user_id, payload, deliveries)
+        self.dispatched += 1
+        try:
+            await handle.writer.drain()
+        except ConnectionError:
+            # Процесс упал: апдейт остался неподтвержденным и уйдет его замене
+            pass
+        return True
+
+    async def close(self):
+        async with self._scale_lock:
+            await self._idle.wait()
+            for handle in list(self.workers.values()):
+                await self._stop_worker(handle)
+            self.workers.clear()
+
+
+class WebhookServer:
+    """Минимальный HTTP-сервер для вебхука Telegram"""
+
+    def __init__(self, dispatcher: Dispatcher, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT,
+                 path: str = WEBHOOK_PATH, secret: Optional[str] = WEBHOOK_SECRET):
+        self.dispatcher = dispatcher
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"Webhook receiver on http://{self.host}:{self.port}{self.path}")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                response = b''
+                if method == 'GET' and path == '/healthz':
+                    status = '200 OK' if self.dispatcher.workers else '503 Service Unavailable'
+                elif method == 'GET' and path == '/metrics':
+                    response = await asyncio.get_running_loop().run_in_executor(None, self.metrics)
+                    status = '200 OK'
+                elif method != 'POST' or path != self.path:
+                    status = '404 Not Found'
+                elif self.secret and headers.get(SECRET_HEADER) != self.secret:
+                    status = '403 Forbidden'
+                elif await self.dispatcher.dispatch(body):
+                    status = '200 OK'
+                else:
+                    # Без подтверждения Telegram доставит апдейт еще раз
+                    status = '503 Service Unavailable'
+                head = f"HTTP/1.1 {status}\r\nContent-Length: {len(response)}\r\n"
+                if response:
+                    head += "Content-Type: text/plain; version=0.0.4\r\n"
+                writer.write(head.encode('latin-1') + b"\r\n" + response)
+                await writer.drain()
+        except (ConnectionResetError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def metrics(self) -> bytes:
+        """Воронка викторины всех рабочих процессов (по их последним записанным файлам)"""
+        return render_metrics(merge_funnels(load_funnels(FUNNEL_STATS_DIR))).encode()
+
+
+def set_webhook(url: str, secret: Optional[str] = WEBHOOK_SECRET):
+    """Регистрирует вебхук в Bot API"""
+    base_url = BOT_API_BASE_URL or 'https://api.telegram.org/bot'
+    params = {'url': url, 'max_connections': 100}
+    if secret:
+        params['secret_token'] = secret
+    data = urllib.parse.urlencode(params).encode()
+    with urllib.request.urlopen(f"{base_url}{BOT_TOKEN}/setWebhook", data=data, timeout=30) as response:
+        logger.info(f"setWebhook: {response.read().decode()}")
+
+
+async def run_front(workers: int, host: str, port: int):
+    dispatcher = Dispatcher()
+    await dispatcher.scale_to(workers)
+    server = WebhookServer(dispatcher, host, port)
+    await server.start()
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    loop.add_signal_handler(signal.SIGINT, stop.set)
+    loop.add_signal_handler(signal.SIGUSR1, lambda: asyncio.ensure_future(dispatcher.scale_to(len(dispatcher.workers) + 1)))
+    loop.add_signal_handler(signal.SIGUSR2, lambda: asyncio.ensure_future(dispatcher.scale_to(len(dispatcher.workers) - 1)))
+
+    await stop.wait()
+    server.server.close()
+    await server.server.wait_closed()
+    await dispatcher.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Приемник вебхука с несколькими рабочими процессами")
+    parser.add_argument('--workers', type=int, default=WORKER_COUNT, help="число рабочих процессов")
+    parser.add_argument('--host', default=WEBHOOK_HOST)
+    parser.add_argument('--port', type=int, default=WEBHOOK_PORT)
+    args = parser.parse_args(argv)
+    if args.workers > 1 and not SESSION_DB_PATH:
+        parser.error("--workers > 1 needs SESSION_DB_PATH: without a shared database "
+                     "the workers overwrite each other's session snapshots")
+
+    logging.basicConfig(format='%(asctime)s - front - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    if WEBHOOK_URL:
+        set_webhook(WEBHOOK_URL)
+    asyncio.run(run_front(args.workers, args.host, args.port))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
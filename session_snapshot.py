@@ -0,0 +1,353 @@
+"""
+Снимки сессий, которые хранятся только в памяти
+
+Если SESSION_DB_PATH не задан, при остановке бота все живые сессии
+записываются в файл снимка, а при запуске восстанавливаются до начала
+обработки апдейтов. Пока бот работает, раз в SESSION_SNAPSHOT_INTERVAL
+секунд в конец файла дописываются только изменившиеся сессии, поэтому
+при падении теряются лишь последние секунды.
+
+Файл - последовательность кадров: полный снимок и следующие за ним дельты.
+Кадр - заголовок (магическое число, версия формата, тип, CRC32 и длина
+тела) и сжатое zlib тело. Сессии обычного вида кодируются по столбцам
+(user_id, номер вопроса, ответы байтами, ...), нестандартные поля и
+сессии - через pickle.
+"""
+
+import asyncio
+import contextlib
+import gc
+import logging
+import os
+import pickle
+import struct
+import zlib
+from array import array
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+from config import SESSION_SNAPSHOT_PATH, SESSION_SNAPSHOT_INTERVAL
+from conversation import upgrade_session
+from session_store import SessionStore
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'SSNP'
+SNAPSHOT_FORMAT = 2
+# Формат 1: вместо состояния разговора (см. conversation.py) - флаг quiz_completed
+READABLE_FORMATS = (1, SNAPSHOT_FORMAT)
+# Магическое число, версия формата, тип кадра, CRC32 и длина тела
+FRAME = struct.Struct('<4sHBxII')
+FULL, DELTA = 0, 1
+
+# Поля сессии, которые кодируются по столбцам
+COLUMN_FIELDS = frozenset(('current_question', 'answers', 'start_time', 'state', 'content_version'))
+
+# Дельты переписываются полным снимком, когда их становится больше, чем он сам
+COMPACT_MIN_BYTES = 1 << 20
+
+
+def encode_sessions(sessions: Dict[int, Dict[str, Any]], deleted: Iterable[int] = ()) -> bytes:
+    """
+    Кодирует сессии в тело кадра (без сжатия)
+
+    Args:
+        sessions: Словарь {user_id: сессия}
+        deleted: Удаленные user_id (для дельты)
+
+    Returns:
+        Байты тела кадра
+    """
+    try:
+        return _encode_sessions(sessions, deleted, check_answers=False)
+    except (TypeError, ValueError):
+        # Номера вопросов или ответов не помещаются в байт: такие сессии уходят в pickle
+        return _encode_sessions(sessions, deleted, check_answers=True)
+
+
+def _encode_sessions(sessions: Dict[int, Dict[str, Any]], deleted: Iterable[int], check_answers: bool) -> bytes:
+    user_ids, questions, states, versions, answer_counts, keys, values, start_times = [], [], [], [], [], [], [], []
+    version_index: Dict[Optional[str], int] = {None: 0}
+    extras: Dict[int, Dict[str, Any]] = {}
+    irregular: Dict[int, Any] = {}
+
+    for user_id, session in sessions.items():
+        try:
+            # Копии берутся разом: при сжатии файла кодирование идет в потоке, пока обработчики меняют сессии
+            session = dict(session)
+            fields = session.keys()
+            answers = session['answers']
+            question = session['current_question']
+            state = session['state']
+            start_time = session['start_time']
+            if type(answers) is not dict or type(question) is not int or not 0 <= question < 0x8000 \
+                    or type(state) is not int or not 0 <= state < 0x100 \
+                    or type(start_time) is not str or '\n' in start_time:
+                raise TypeError
+            answers = dict(answers)
+            if check_answers:
+                # Бросает ValueError/TypeError, если ответы не помещаются в байты
+                bytes((len(answers), *answers, *answers.values()))
+            version = version_index.setdefault(session.get('content_version'), len(version_index))
+        except (TypeError, ValueError, KeyError, AttributeError):
+            irregular[user_id] = session
+            continue
+        if len(fields) > len(COLUMN_FIELDS) or 'content_version' not in fields:
+            extra = {field: session[field] for field in fields if field not in COLUMN_FIELDS}
+            if extra:
+                extras[user_id] = extra
+        user_ids.append(user_id)
+        questions.append(question)
+        states.append(state)
+        versions.append(version)
+        answer_counts.append(len(answers))
+        keys.extend(answers)
+        values.extend(answers.values())
+        start_times.append(start_time)
+
+    # bytes() принимает только int 0..255
+    columns = (
+        array('q', user_ids), array('h', questions), bytes(states), array('H', versions),
+        list(version_index), bytes(answer_counts), bytes(keys), bytes(values), '\n'.join(start_times),
+    )
+    return pickle.dumps((columns, extras, irregular, list(deleted)), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def decode_sessions(body: bytes, version: int = SNAPSHOT_FORMAT) -> Tuple[Dict[int, Dict[str, Any]], list]:
+    """
+    Декодирует тело кадра
+
+    Args:
+        body: Тело кадра
+        version: Версия формата кадра (сессии формата 1 переводятся на поле state)
+
+    Returns:
+        Словарь {user_id: сессия} и список удаленных user_id
+    """
+    columns, extras, irregular, deleted = pickle.loads(body)
+    user_ids, questions, states, versions, version_names, answer_counts, keys, values, start_times = columns
+    start_times = start_times.split('\n') if user_ids else []
+
+    sessions = {}
+    position = 0
+    for user_id, question, state, content_version, length, start_time in zip(
+            user_ids, questions, states, versions, answer_counts, start_times):
+        end = position + length
+        session = {
+            'current_question': question,
+            'answers': dict(zip(keys[position:end], values[position:end])),
+            'start_time': start_time,
+            'state': state,
+        }
+        if content_version:
+            session['content_version'] = version_names[content_version]
+        sessions[user_id] = session
+        position = end
+    for user_id, extra in extras.items():
+        sessions[user_id].update(extra)
+    sessions.update(irregular)
+    if version == 1:
+        for session in sessions.values():
+            if 'state' in session and 'quiz_completed' not in session:
+                # В столбце записан флаг завершения
+                session['quiz_completed'] = session.pop('state') == 1
+            upgrade_session(session)
+    return sessions, deleted
+
+
+@contextlib.contextmanager
+def gc_paused():
+    """Отключает сборщик мусора: на миллионе мелких словарей он только тратит время"""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def encode_frame(kind: int, body: bytes) -> bytes:
+    data = zlib.compress(body, 1)
+    return FRAME.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, kind, zlib.crc32(data), len(data)) + data
+
+
+def read_frames(data: bytes):
+    """
+    Читает кадры файла снимка по порядку
+
+    Yields:
+        (тип кадра, версия формата, тело, смещение конца кадра); на первом поврежденном или
+        недописанном кадре чтение останавливается с предупреждением
+    """
+    offset = 0
+    while offset < len(data):
+        if len(data) - offset < FRAME.size:
+            logger.warning(f"Session snapshot has a truncated frame header at {offset}")
+            return
+        magic, version, kind, checksum, length = FRAME.unpack_from(data, offset)
+        start = offset + FRAME.size
+        payload = data[start:start + length]
+        if magic != SNAPSHOT_MAGIC or version not in READABLE_FORMATS:
+            logger.warning(f"Session snapshot frame at {offset} has unknown format {magic!r} v{version}")
+            return
+        if len(payload) != length or zlib.crc32(payload) != checksum:
+            logger.warning(f"Session snapshot frame at {offset} is truncated or corrupted")
+            return
+        offset = start + length
+        yield kind, version, zlib.decompress(payload), offset
+
+
+class SessionSnapshots:
+    """Полные и инкрементальные снимки сессий SessionStore"""
+
+    def __init__(self, store: SessionStore, path: str = SESSION_SNAPSHOT_PATH,
+                 interval: float = SESSION_SNAPSHOT_INTERVAL):
+        self.store = store
+        self.path = path
+        self.interval = interval
+        self._full_bytes = 0
+        self._delta_bytes = 0
+        self._stopping: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # Периодическая запись и /export не пишут в файл одновременно
+        self._lock = asyncio.Lock()
+
+    def restore(self, truncate: bool = True) -> int:
+        """
+        Восстанавливает сессии из файла снимка
+
+        Недописанный хвост файла (падение во время записи дельты) отрезается,
+        чтобы следующие дельты дописывались после последнего целого кадра.
+
+        Args:
+            truncate: Отрезать хвост (False - только чтение, например, пока бот работает)
+
+        Returns:
+            Число восстановленных сессий
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+
+        sessions: Dict[int, Dict[str, Any]] = {}
+        valid_end = 0
+        with gc_paused():
+            for kind, version, body, end in read_frames(data):
+                changed, deleted = decode_sessions(body, version)
+                if kind == FULL:
+                    sessions = changed
+                    self._full_bytes, self._delta_bytes = end - valid_end, 0
+                else:
+                    sessions.update(changed)
+                    for user_id in deleted:
+                        sessions.pop(user_id, None)
+                    self._delta_bytes += end - valid_end
+                valid_end = end
+
+        if truncate and valid_end < len(data):
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_end)
+        self.store.restore(sessions)
+        # Восстановленное состояние уже в файле
+        self.store.take_changes()
+        logger.info(f"Restored {len(sessions)} sessions from {self.path}")
+        return len(sessions)
+
+    def save(self):
+        """Атомарно записывает полный снимок всех сессий"""
+        sessions, _ = self.store.take_changes(full=True)
+        with gc_paused():
+            frame = encode_frame(FULL, encode_sessions(sessions))
+        self._write_full(frame)
+        logger.info(f"Saved {len(sessions)} sessions to {self.path}")
+
+    def _write_full(self, frame: bytes):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(frame)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._full_bytes, self._delta_bytes = len(frame), 0
+
+    def _append(self, frame: bytes):
+        # Без буфера: после ошибки записи в файле не остается недописанных данных
+        with open(self.path, 'ab', buffering=0) as f:
+            end = f.seek(0, os.SEEK_END)
+            try:
+                f.write(frame)
+                os.fsync(f.fileno())
+            except OSError:
+                # Обрывок кадра остановил бы чтение и следующих дельт
+                with contextlib.suppress(OSError):
+                    f.truncate(end)
+                raise
+        self._delta_bytes += len(frame)
+
+    def _compact(self, sessions: Dict[int, Dict[str, Any]]):
+        with gc_paused():
+            frame = encode_frame(FULL, encode_sessions(sessions))
+        self._write_full(frame)
+
+    async def save_changes(self):
+        """
+        Дописывает дельту с изменениями с прошлого снимка (или переписывает файл целиком)
+
+        Raises:
+            OSError: Файл не записан; изменения остаются для следующей записи
+        """
+        async with self._lock:
+            await self._save_changes()
+
+    async def _save_changes(self):
+        loop = asyncio.get_running_loop()
+        if self._delta_bytes > max(self._full_bytes, COMPACT_MIN_BYTES):
+            sessions, deleted = self.store.take_changes(full=True)
+            try:
+                # Сессий много: кодирование вместе с записью - в потоке, цикл событий не стоит
+                await loop.run_in_executor(None, self._compact, sessions)
+            except OSError:
+                self.store.return_changes(sessions, deleted)
+                raise
+            logger.debug(f"Compacted session snapshot: {len(sessions)} sessions")
+            return
+        changed, deleted = self.store.take_changes()
+        if not changed and not deleted:
+            return
+        # Кодирование - в цикле событий, пока сессии никто не меняет; запись - в потоке
+        frame = encode_frame(DELTA, encode_sessions(changed, deleted))
+        try:
+            await loop.run_in_executor(None, self._append, frame)
+        except OSError:
+            self.store.return_changes(changed, deleted)
+            raise
+        logger.debug(f"Session snapshot delta: {len(changed)} changed, {len(deleted)} deleted")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.save_changes()
+            except OSError as e:
+                logger.error(f"Failed to write session snapshot: {e}")
+
+    def start(self):
+        """Запускает периодическую запись дельт"""
+        self._stopping = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Останавливает периодическую запись и записывает полный снимок"""
+        if self._task is not None:
+            # Дожидаемся текущей записи, чтобы она не попала в новый файл
+            self._stopping.set()
+            await self._task
+            self._task = None
+        async with self._lock:
+            self.save()
@@ -0,0 +1,380 @@
+"""
+Хранилище сессий пользователей
+
+SessionStore ведет себя как обычный словарь user_data ({user_id: сессия}),
+но может сохранять сессии в SQLite. Сессии кешируются в памяти; изменения
+записываются вызовом flush() после обработки апдейта. Если кеш отключен
+(keep_cache=False, режим нескольких процессов), после записи сессия
+вытесняется из памяти и при следующем апдейте читается из базы, поэтому
+пользователя можно безопасно передать другому процессу.
+
+Без базы хранилище может отслеживать изменения (track_changes=True), чтобы
+их периодически записывали снимки сессий (см. session_snapshot.py).
+
+Несколько викторин одного процесса (quiz_host.py) делят хранилище через
+SessionNamespace: сессия викторины с номером n хранится под ключом
+(n << 52) | user_id. id пользователей Telegram занимают не больше 52 бит,
+поэтому у викторины 0 ключ совпадает с user_id, а ключи всех викторин
+помещаются в INTEGER PRIMARY KEY SQLite.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+from typing import Callable, Dict, Any, Iterable, Iterator, Optional, Set, Tuple
+
+from conversation import DONE, upgrade_session
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# id пользователя Telegram занимает не больше стольких бит; старшие биты ключа - номер викторины
+USER_ID_BITS = 52
+USER_ID_LIMIT = 1 << USER_ID_BITS
+# Номер викторины - оставшиеся биты положительного int64
+MAX_NAMESPACES = 1 << (63 - USER_ID_BITS)
+
+# Завершившие викторину между курсорами :after и :before, с результатом :animal (если задан)
+FINISHED_FILTER = (
+    f"user_id > :after AND user_id < :before AND json_extract(data, '$.state') = {DONE} "
+    "AND (:animal IS NULL OR json_extract(data, '$.result_animal') = :animal)"
+)
+
+# Версия схемы сессий в базе (PRAGMA user_version); 1 - состояние разговора в поле state
+SCHEMA_VERSION = 1
+# Сессий за один шаг перевода базы на новую схему
+UPGRADE_BATCH = 10000
+
+
+def encode_session(session: Dict[str, Any]) -> str:
+    return json.dumps(session, ensure_ascii=False, separators=(',', ':'))
+
+
+def decode_session(data: str) -> Dict[str, Any]:
+    session = json.loads(data)
+    # JSON превращает ключи-номера вопросов в строки
+    if isinstance(session.get('answers'), dict):
+        session['answers'] = {int(question_id): answer_id for question_id, answer_id in session['answers'].items()}
+    return session
+
+
+class SessionStore(MutableMapping):
+    """Словарь сессий с необязательным хранением в SQLite"""
+
+    def __init__(self, path: Optional[str] = None, keep_cache: bool = True, track_changes: bool = False):
+        self.path = path
+        self.keep_cache = keep_cache
+        self._track = bool(path) or track_changes
+        self._cache: Dict[int, Dict[str, Any]] = {}
+        self._dirty = set()
+        self._deleted = set()
+        self._local = threading.local()
+        if path:
+            with self._connection() as connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS sessions (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL)"
+                )
+                self._upgrade(connection)
+            logger.info(f"Session store: {path}")
+
+    def _upgrade(self, connection: sqlite3.Connection):
+        """Переводит сессии старого формата (флаг quiz_completed) на поле state - один раз на базу"""
+        if connection.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        after, upgraded = -(1 << 63), 0
+        while True:
+            rows = connection.execute(
+                "SELECT user_id, data FROM sessions WHERE user_id > ? ORDER BY user_id LIMIT ?", (after, UPGRADE_BATCH)
+            ).fetchall()
+            if not rows:
+                break
+            changed = [(user_id, decode_session(data)) for user_id, data in rows if '"quiz_completed"' in data]
+            connection.executemany(
+                "UPDATE sessions SET data = ? WHERE user_id = ?",
+                [(encode_session(upgrade_session(session)), user_id) for user_id, session in changed],
+            )
+            upgraded += len(changed)
+            after = rows[-1][0]
+        connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        if upgraded:
+            logger.info(f"Upgraded {upgraded} sessions to schema {SCHEMA_VERSION}")
+
+    def _connection(self) -> sqlite3.Connection:
+        # Соединение на поток: выгрузки и снимки могут работать в пуле потоков
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _load(self, user_id: int) -> Optional[Dict[str, Any]]:
+        if not self.path or user_id in self._deleted:
+            return None
+        with span('session_load'):
+            row = self._connection().execute("SELECT data FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+            if row is None:
+                return None
+            session = decode_session(row[0])
+        self._cache[user_id] = session
+        return session
+
+    def __getitem__(self, user_id: int) -> Dict[str, Any]:
+        session = self._cache.get(user_id)
+        if session is None:
+            session = self._load(user_id)
+            if session is None:
+                raise KeyError(user_id)
+        # Сессию могут изменить по ссылке, поэтому она считается измененной
+        if self._track:
+            self._dirty.add(user_id)
+        return session
+
+    def __setitem__(self, user_id: int, session: Dict[str, Any]):
+        self._cache[user_id] = session
+        if self._track:
+            self._dirty.add(user_id)
+            self._deleted.discard(user_id)
+
+    def __delitem__(self, user_id: int):
+        if user_id not in self:
+            raise KeyError(user_id)
+        self._cache.pop(user_id, None)
+        if self._track:
+            self._dirty.discard(user_id)
+            self._deleted.add(user_id)
+
+    def __contains__(self, user_id: object) -> bool:
+        if user_id in self._cache:
+            return True
+        return isinstance(user_id, int) and self._load(user_id) is not None
+
+    def __iter__(self) -> Iterator[int]:
+        if not self.path:
+            return iter(list(self._cache))
+        self.flush()
+        return (user_id for (user_id,) in self._connection().execute("SELECT user_id FROM sessions"))
+
+    def __len__(self) -> int:
+        if not self.path:
+            return len(self._cache)
+        self.flush()
+        return self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def flush(self, user_ids: Optional[Iterable[int]] = None):
+        """
+        Записывает измененные сессии в базу
+
+        Args:
+            user_ids: Чьи сессии записать (по умолчанию все измененные)
+        """
+        if not self.path:
+            return
+        if user_ids is None:
+            dirty, deleted = set(self._dirty), set(self._deleted)
+        else:
+            user_ids = set(user_ids)
+            dirty, deleted = self._dirty & user_ids, self._deleted & user_ids
+        self._dirty -= dirty
+        self._deleted -= deleted
+
+        if dirty or deleted:
+            with self._connection() as connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO sessions (user_id, data) VALUES (?, ?)",
+                    [(user_id, encode_session(self._cache[user_id])) for user_id in dirty if user_id in self._cache],
+                )
+                connection.executemany("DELETE FROM sessions WHERE user_id = ?", [(user_id,) for user_id in deleted])
+
+        if not self.keep_cache:
+            # Вытесняем и прочитанные, но не измененные сессии
+            for user_id in (dirty if user_ids is None else user_ids):
+                self._cache.pop(user_id, None)
+
+    def iter_finished(self, result_animal: Optional[str] = None, after: int = 0,
+                      batch_size: int = 1000, before: int = USER_ID_LIMIT) -> Iterator[int]:
+        """
+        user_id завершивших викторину по возрастанию
+
+        С базой сессии читаются порциями по первичному ключу и фильтруются
+        в SQLite, поэтому в память не загружаются.
+
+        Args:
+            result_animal: Только пользователи с этим результатом
+            after: Начать после этого user_id (курсор рассылки)
+            batch_size: Размер порции запроса
+            before: Закончить перед этим ключом (по умолчанию - только викторина 0)
+        """
+        if not self.path:
+            yield from sorted(
+                user_id for user_id, session in list(self._cache.items())
+                if after < user_id < before and session.get('state') == DONE
+                and (result_animal is None or session.get('result_animal') == result_animal)
+            )
+            return
+        self.flush()
+        query = f"SELECT user_id FROM sessions WHERE {FINISHED_FILTER} ORDER BY user_id LIMIT :limit"
+        while True:
+            rows = self._connection().execute(
+                query, {'after': after, 'before': before, 'animal': result_animal, 'limit': batch_size}
+            ).fetchall()
+            for (user_id,) in rows:
+                yield user_id
+            if len(rows) < batch_size:
+                return
+            after = rows[-1][0]
+
+    def iter_sessions(self, where: str = '1', params: Optional[Dict[str, Any]] = None, batch_size: int = 1000,
+                      decode: Callable[[str], Dict[str, Any]] = decode_session) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """
+        (user_id, сессия) по возрастанию user_id
+
+        С базой сессии читаются порциями по первичному ключу (каждая порция -
+        отдельный запрос, транзакция чтения не держится между порциями), без
+        базы - из памяти. Сессии не кешируются и не помечаются измененными.
+
+        Args:
+            where: Условие SQL на сессии в базе (без базы не применяется)
+            params: Именованные параметры условия
+            batch_size: Размер порции запроса
+            decode: Разбор JSON сессии из базы (json.loads - без перевода номеров вопросов в int)
+        """
+        if not self.path:
+            for user_id in sorted(self._cache):
+                session = self._cache.get(user_id)
+                if session is not None:
+                    yield user_id, session
+            return
+        self.flush()
+        query = f"SELECT user_id, data FROM sessions WHERE user_id > :after AND ({where}) ORDER BY user_id LIMIT :limit"
+        params = dict(params or {}, after=-(1 << 63), limit=batch_size)
+        while True:
+            rows = self._connection().execute(query, params).fetchall()
+            for user_id, data in rows:
+                yield user_id, decode(data)
+            if len(rows) < batch_size:
+                return
+            params['after'] = rows[-1][0]
+
+    def count_finished(self, result_animal: Optional[str] = None, after: int = 0,
+                       before: int = USER_ID_LIMIT) -> int:
+        """Число завершивших викторину после user_id after (для оценки времени рассылки)"""
+        if not self.path:
+            return sum(1 for _ in self.iter_finished(result_animal, after, before=before))
+        self.flush()
+        return self._connection().execute(
+            f"SELECT COUNT(*) FROM sessions WHERE {FINISHED_FILTER}",
+            {'after': after, 'before': before, 'animal': result_animal}
+        ).fetchone()[0]
+
+    def take_changes(self, full: bool = False) -> Tuple[Dict[int, Dict[str, Any]], Set[int]]:
+        """
+        Сессии, измененные и удаленные с прошлого вызова (для хранилища без базы)
+
+        Args:
+            full: Вернуть все сессии в памяти, а не только измененные
+
+        Returns:
+            Словарь {user_id: сессия} и множество удаленных user_id (полному снимку они не нужны,
+            но понадобятся return_changes, если его не удастся записать)
+        """
+        dirty, deleted = self._dirty, self._deleted
+        self._dirty, self._deleted = set(), set()
+        if full:
+            return dict(self._cache), deleted
+        return {user_id: self._cache[user_id] for user_id in dirty if user_id in self._cache}, deleted
+
+    def return_changes(self, changed: Iterable[int], deleted: Iterable[int]):
+        """
+        Снова помечает измененными сессии из take_changes, которые не удалось записать
+
+        Изменения, сделанные после take_changes, новее и остаются как есть.
+
+        Args:
+            changed: user_id измененных сессий
+            deleted: Удаленные user_id
+        """
+        for user_id in changed:
+            if user_id not in self._deleted:
+                self._dirty.add(user_id)
+        for user_id in deleted:
+            if user_id not in self._dirty and user_id not in self._cache:
+                self._deleted.add(user_id)
+
+    def cached_items(self) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """Сессии в памяти (без чтения из базы и без пометки измененными)"""
+        return iter(list(self._cache.items()))
+
+    def restore(self, sessions: Dict[int, Dict[str, Any]]):
+        """Загружает сессии (например, из снимка) без пометки их измененными"""
+        self._cache.update(sessions)
+
+    def close(self):
+        self.flush()
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+class SessionNamespace(MutableMapping):
+    """Сессии одной викторины в общем хранилище процесса (ключи - user_id этой викторины)"""
+
+    def __init__(self, store: SessionStore, namespace: int):
+        """
+        Args:
+            store: Общее хранилище
+            namespace: Номер викторины (у викторины 0 ключи в хранилище совпадают с user_id)
+        """
+        if not 0 <= namespace < MAX_NAMESPACES:
+            raise ValueError(f"Session namespace must be in [0, {MAX_NAMESPACES})")
+        self.store = store
+        self.namespace = namespace
+        self.offset = namespace << USER_ID_BITS
+
+    @property
+    def path(self) -> Optional[str]:
+        return self.store.path
+
+    def _owns(self, key: int) -> bool:
+        return self.offset <= key < self.offset + USER_ID_LIMIT
+
+    def __getitem__(self, user_id: int) -> Dict[str, Any]:
+        return self.store[self.offset + user_id]
+
+    def __setitem__(self, user_id: int, session: Dict[str, Any]):
+        self.store[self.offset + user_id] = session
+
+    def __delitem__(self, user_id: int):
+        del self.store[self.offset + user_id]
+
+    def __contains__(self, user_id: object) -> bool:
+        return isinstance(user_id, int) and self.offset + user_id in self.store
+
+    def __iter__(self) -> Iterator[int]:
+        return (key - self.offset for key in self.store if self._owns(key))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def flush(self, user_ids: Optional[Iterable[int]] = None):
+        """Записывает измененные сессии (без user_ids - всех викторин хранилища)"""
+        self.store.flush(None if user_ids is None else [self.offset + user_id for user_id in user_ids])
+
+    def iter_finished(self, result_animal: Optional[str] = None, after: int = 0,
+                      batch_size: int = 1000, before: int = USER_ID_LIMIT) -> Iterator[int]:
+        """user_id завершивших эту викторину по возрастанию (см. SessionStore.iter_finished)"""
+        for key in self.store.iter_finished(result_animal, self.offset + after, batch_size, self.offset + before):
+            yield key - self.offset
+
+    def count_finished(self, result_animal: Optional[str] = None, after: int = 0,
+                       before: int = USER_ID_LIMIT) -> int:
+        """Число завершивших эту викторину после user_id after"""
+        return self.store.count_finished(result_animal, self.offset + after, self.offset + before)
+
+    def cached_items(self) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """Сессии этой викторины в памяти (без чтения из базы и без пометки измененными)"""
+        return ((key - self.offset, session) for key, session in self.store.cached_items() if self._owns(key))
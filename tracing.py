@@ -0,0 +1,217 @@
+"""
+Трассировка обработки апдейтов и бортовой самописец
+
+Каждый апдейт получает трассу с коротким идентификатором, который через
+contextvars попадает в каждую запись лога (%(trace_id)s в формате) и в
+заголовок X-Trace-Id каждого вызова Bot API. Трасса хранит отрезки
+(span): ожидание в очереди, загрузка сессии, подсчет результата,
+рендеринг, вызовы API - и записи лога, сделанные во время обработки.
+
+Законченные трассы складываются в кольцевой буфер на TRACE_BUFFER_SIZE
+трасс в памяти, без записи на диск на каждый апдейт. Если обработка
+завершилась ошибкой (или записью лога уровня ERROR) или заняла больше
+TRACE_SLOW_THRESHOLD секунд, буфер целиком выгружается в TRACE_DUMP_DIR
+(JSON Lines, не чаще раза в TRACE_DUMP_INTERVAL секунд) - видно, что
+происходило с этим и соседними апдейтами.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import time
+import traceback
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+from config import TRACE_BUFFER_SIZE, TRACE_SLOW_THRESHOLD, TRACE_DUMP_DIR, TRACE_DUMP_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Записей лога в одной трассе не больше этого (обработчики пишут в лог подробно)
+MAX_TRACE_RECORDS = 100
+
+_current: contextvars.ContextVar[Optional['Trace']] = contextvars.ContextVar('trace', default=None)
+
+
+class Trace:
+    """Трасса обработки одного апдейта"""
+
+    __slots__ = ('trace_id', 'name', 'user_id', 'wall_time', 'started', 'duration', 'spans', 'records', 'error')
+
+    def __init__(self, name: str, user_id: Optional[int] = None):
+        self.trace_id = os.urandom(6).hex()
+        self.name = name
+        self.user_id = user_id
+        self.wall_time = time.time()
+        self.started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.spans: List[tuple] = []
+        self.records: List[logging.LogRecord] = []
+        self.error: Optional[str] = None
+
+    def fail(self, error: BaseException):
+        """Отмечает трассу ошибкой с трассировкой стека"""
+        self.error = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'user_id': self.user_id,
+            'time': datetime.fromtimestamp(self.wall_time).isoformat(),
+            'duration_ms': round(self.duration * 1000, 2) if self.duration is not None else None,
+            'spans': [
+                {'name': name, 'start_ms': round(start * 1000, 2), 'duration_ms': round(duration * 1000, 2),
+                 **(attrs or {})}
+                for name, start, duration, attrs in self.spans
+            ],
+            'log': [
+                f"{record.created - self.wall_time:+.3f}s {record.levelname} {record.name}: {record.getMessage()}"
+                for record in self.records
+            ],
+            'error': self.error,
+        }
+
+
+def current_trace() -> Optional[Trace]:
+    """Трасса текущего апдейта (None вне обработки апдейта)"""
+    return _current.get()
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current.get()
+    return trace.trace_id if trace is not None else None
+
+
+def update_name(update: Any) -> str:
+    """Короткое описание апдейта для трассы"""
+    if update.callback_query:
+        return f"callback {update.callback_query.data}"
+    if update.inline_query:
+        return "inline_query"
+    text = update.message.text if update.message else None
+    if text and text.startswith('/'):
+        return text.split()[0]
+    return "message" if update.message else "update"
+
+
+def detach():
+    """Отвязывает текущую задачу от трассы (фоновая задача, созданная из обработчика)"""
+    _current.set(None)
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Dict[str, Any]]:
+    """
+    Отрезок трассы: время выполнения блока
+
+    Блок получает словарь атрибутов отрезка и может дополнить его.
+    """
+    trace = _current.get()
+    if trace is None:
+        yield attrs
+        return
+    started = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        trace.spans.append((name, started - trace.started, time.perf_counter() - started, attrs))
+
+
+class FlightRecorder:
+    """Кольцевой буфер последних трасс с выгрузкой при ошибках и медленных апдейтах"""
+
+    def __init__(self, capacity: int = TRACE_BUFFER_SIZE, slow_threshold: float = TRACE_SLOW_THRESHOLD,
+                 dump_dir: Optional[str] = TRACE_DUMP_DIR, dump_interval: float = TRACE_DUMP_INTERVAL):
+        self.traces: Deque[Trace] = deque(maxlen=capacity)
+        self.slow_threshold = slow_threshold
+        self.dump_dir = dump_dir
+        self.dump_interval = dump_interval
+        self.dumps = 0
+        # Вызываются с каждой законченной трассой (например, профайлер)
+        self.listeners: List[Callable[[Trace], None]] = []
+        self._last_dump = float('-inf')
+
+    @contextmanager
+    def trace(self, name: str, user_id: Optional[int] = None) -> Iterator[Trace]:
+        """Трасса на время блока; по завершении попадает в буфер"""
+        trace = Trace(name, user_id)
+        token = _current.set(trace)
+        try:
+            yield trace
+        except BaseException as e:
+            if not isinstance(e, asyncio.CancelledError):
+                trace.fail(e)
+            raise
+        finally:
+            _current.reset(token)
+            trace.duration = time.perf_counter() - trace.started
+            self.traces.append(trace)
+            for listener in self.listeners:
+                listener(trace)
+            if trace.error:
+                self.dump(f"error-{trace.trace_id}")
+            elif trace.duration > self.slow_threshold:
+                self.dump(f"slow-{trace.trace_id}")
+
+    def dump(self, reason: str) -> Optional[str]:
+        """
+        Выгружает буфер в файл (в пуле потоков)
+
+        Returns:
+            Путь к файлу или None, если выгрузка отключена или была недавно
+        """
+        now = time.monotonic()
+        if not self.dump_dir or now - self._last_dump < self.dump_interval:
+            return None
+        self._last_dump = now
+        self.dumps += 1
+        path = os.path.join(self.dump_dir, f"flight-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}-{reason}.jsonl")
+        traces = list(self.traces)
+        try:
+            asyncio.get_running_loop().run_in_executor(None, self._write, path, traces)
+        except RuntimeError:
+            self._write(path, traces)
+        logger.warning(f"Flight recorder: {len(traces)} traces dumped to {path}")
+        return path
+
+    def _write(self, path: str, traces: List[Trace]):
+        try:
+            os.makedirs(self.dump_dir, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                for trace in traces:
+                    f.write(json.dumps(trace.to_dict(), ensure_ascii=False, default=str))
+                    f.write('\n')
+        except OSError as e:
+            logger.error(f"Failed to dump flight recorder to {path}: {e}")
+
+
+def install_log_records():
+    """
+    Добавляет trace_id во все записи лога и сохраняет записи в трассу
+
+    Вызывается до настройки логирования: формат может ссылаться на %(trace_id)s.
+    """
+    factory = logging.getLogRecordFactory()
+    if getattr(factory, 'traced', False):
+        return
+
+    def record_factory(*args, **kwargs) -> logging.LogRecord:
+        record = factory(*args, **kwargs)
+        trace = _current.get()
+        if trace is None:
+            record.trace_id = '-'
+        else:
+            record.trace_id = trace.trace_id
+            if len(trace.records) < MAX_TRACE_RECORDS:
+                trace.records.append(record)
+            if record.levelno >= logging.ERROR and trace.error is None:
+                trace.error = record.getMessage()
+        return record
+
+    record_factory.traced = True
+    logging.setLogRecordFactory(record_factory)
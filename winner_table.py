@@ -0,0 +1,202 @@
+"""
+Предвычисленная таблица победителей викторины
+
+Пространство ответов QUIZ_QUESTIONS конечно и невелико, поэтому победителя
+для каждой полной комбинации ответов можно посчитать заранее. Таблица
+хранится в файле как массив uint8 (индекс животного) и отображается в
+память через mmap; поиск результата - одно обращение по индексу.
+
+Таблица версионируется хешем содержимого викторины и пересобирается
+автоматически, если quiz_data.py изменился. Сборка при деплое:
+
+    python winner_table.py
+"""
+
+import contextlib
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from typing import Dict, Any, Optional, Sequence
+
+from config import WINNER_TABLE_PATH
+from quiz_data import QUIZ_QUESTIONS, ANIMALS
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'WTBL'
+FORMAT_VERSION = 1
+# Магическое число + длина JSON-заголовка
+PREFIX = struct.Struct('<4sI')
+
+
+def content_hash(questions: Sequence[Dict[str, Any]], animals: Dict[str, Dict[str, Any]]) -> str:
+    """
+    Хеш той части контента, от которой зависит победитель
+
+    Тексты вопросов и описания животных на результат не влияют, поэтому
+    учитываются только веса вариантов (с их порядком) и список животных.
+    """
+    payload = {
+        'weights': [[list(option['weight'].items()) for option in question['options']]
+                    for question in questions],
+        'animals': list(animals),
+    }
+    data = json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def build_table(path: str = WINNER_TABLE_PATH,
+                questions: Sequence[Dict[str, Any]] = QUIZ_QUESTIONS,
+                animals: Dict[str, Dict[str, Any]] = ANIMALS) -> str:
+    """
+    Собирает таблицу победителей и атомарно записывает ее в файл
+
+    Args:
+        path: Путь к файлу таблицы
+        questions: Вопросы в формате QUIZ_QUESTIONS
+        animals: Словарь животных в формате ANIMALS
+
+    Returns:
+        Путь к собранной таблице
+    """
+    # numpy нужен только для сборки, рабочему процессу достаточно mmap
+    from quiz_analyzer import iter_winner_blocks, option_counts
+
+    animal_keys = list(animals)
+    if len(animal_keys) > 255:
+        raise ValueError("Winner table supports at most 255 animals")
+
+    header = json.dumps({
+        'version': FORMAT_VERSION,
+        'hash': content_hash(questions, animals),
+        'option_counts': option_counts(questions),
+        'animals': animal_keys,
+    }).encode('utf-8')
+
+    # Временный файл у каждой сборки свой: рабочие процессы scale_out.py пересобирают таблицу одновременно
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f"{name}.", suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(PREFIX.pack(MAGIC, len(header)))
+            f.write(header)
+            for winners, _ in iter_winner_blocks(questions, animal_keys):
+                f.write(winners.tobytes())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+        raise
+    logger.info(f"Winner table built: {path}")
+    return path
+
+
+class WinnerTable:
+    """Таблица победителей, отображенная в память"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, header_length = PREFIX.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Not a winner table: {path}")
+        header = json.loads(self._mmap[PREFIX.size:PREFIX.size + header_length])
+
+        self.version = header['version']
+        self.hash = header['hash']
+        self.option_counts = header['option_counts']
+        self.animals = header['animals']
+        self._offset = PREFIX.size + header_length
+
+        size = 1
+        for count in self.option_counts:
+            size *= count
+        if len(self) != size:
+            self.close()
+            raise ValueError(f"Winner table is truncated: {path}")
+
+    def __len__(self) -> int:
+        return len(self._mmap) - self._offset
+
+    def is_current(self, questions: Sequence[Dict[str, Any]], animals: Dict[str, Dict[str, Any]]) -> bool:
+        """Соответствует ли таблица текущему контенту викторины"""
+        return self.version == FORMAT_VERSION and self.hash == content_hash(questions, animals)
+
+    def index_of(self, answers: Dict[int, int]) -> Optional[int]:
+        """
+        Индекс комбинации ответов в таблице
+
+        Returns:
+            Индекс или None, если ответы неполные или вне диапазона
+        """
+        index = 0
+        for question_id, count in enumerate(self.option_counts):
+            answer_id = answers.get(question_id)
+            if answer_id is None or not 0 <= answer_id < count:
+                return None
+            index = index * count + answer_id
+        return index
+
+    def lookup(self, answers: Dict[int, int]) -> Optional[str]:
+        """
+        Победитель для полного набора ответов
+
+        Args:
+            answers: Ответы пользователя {номер вопроса: номер варианта}
+
+        Returns:
+            Ключ животного или None, если ответы неполные
+        """
+        index = self.index_of(answers)
+        if index is None:
+            return None
+        return self.animals[self._mmap[self._offset + index]]
+
+    def close(self):
+        self._mmap.close()
+
+
+def load_winner_table(path: str = WINNER_TABLE_PATH,
+                      questions: Sequence[Dict[str, Any]] = QUIZ_QUESTIONS,
+                      animals: Dict[str, Dict[str, Any]] = ANIMALS) -> WinnerTable:
+    """
+    Загружает таблицу победителей, пересобирая ее при изменении контента
+
+    Args:
+        path: Путь к файлу таблицы
+        questions: Вопросы в формате QUIZ_QUESTIONS
+        animals: Словарь животных в формате ANIMALS
+
+    Returns:
+        Актуальная таблица победителей
+    """
+    if os.path.exists(path):
+        try:
+            table = WinnerTable(path)
+            if table.is_current(questions, animals):
+                return table
+            table.close()
+            logger.info(f"Winner table {path} is stale, rebuilding")
+        except (ValueError, KeyError, struct.error) as e:
+            logger.warning(f"Winner table {path} is unreadable ({e}), rebuilding")
+    else:
+        logger.info(f"Winner table {path} not found, building")
+
+    build_table(path, questions, animals)
+    return WinnerTable(path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    target = sys.argv[1] if len(sys.argv) > 1 else WINNER_TABLE_PATH
+    build_table(target)
+    table = WinnerTable(target)
+    print(f"Winner table: {target}, {len(table):,} entries, hash {table.hash[:12]}")